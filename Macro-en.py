@@ -1,13 +1,76 @@
 #!/usr/bin/env python3
+import os
+import copy
 import time
+import datetime
+import collections
 import json
+import argparse
+import operator
+import math
+import array
+import mmap
+import asyncio
+import pickle
+import hashlib
+import base64
+import concurrent.futures
+import ctypes
+import ctypes.util
 import threading
+import signal
+import sys
+import importlib.util
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from pynput import keyboard, mouse
+# Optional: only the screen commands need these
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import mss
+except ImportError:
+    mss = None
 
 DRAG_THRESHOLD = 5  # Minimum movement in pixels before drag starts
 RECORD_WAIT_THRESHOLD = 0.1  # Minimum wait time (in seconds) between events
+KEY_TAP_GAP = 0.05  # Delay after each key tap (seconds)
+COMMAND_GAP = 0.1  # Delay after each command (seconds)
+TYPE_RATE = 20  # Default speed of the Type Text command (characters per second)
+WATCH_POLL_INTERVAL = 0.5  # Polling interval of the macro file watcher (seconds)
+IMAGE_POLL_INTERVAL = 0.05  # Default screen polling interval of the image wait command (seconds)
+MATCH_THRESHOLD = 0.9      # Default minimum normalized cross-correlation for an image click
+PYRAMID_MIN_SIZE = 8       # Templates are downsampled while their smaller side stays at least this large
+PYRAMID_CANDIDATES = 3     # Best coarse matches that are refined at full resolution
+LOCAL_SEARCH_MARGIN = 32   # Pixels around the last hit that are searched before the whole region
+HUMAN_MOVE_TIME = 0.1      # Base duration of a humanized pointer move (seconds)
+HUMAN_MOVE_SPEED = 2500    # Pixels per second added to that for longer moves
+HUMAN_CURVE = 0.15         # Largest sideways bend of a move, as a fraction of its length
+MOVE_RATE = 125            # Pointer updates per second along a move
+UI_FRAME_INTERVAL = 16  # How often queued GUI updates are applied (milliseconds)
+OVERLAP_POLICIES = ("queue", "restart", "ignore")  # What a trigger does while the macro is running
+RUN_LIMITS = ("none", "duration", "until")  # What else ends a run besides its loop count
+SPEEDS = {"0.1x": 0.1, "0.25x": 0.25, "0.5x": 0.5, "1x": 1.0, "2x": 2.0, "5x": 5.0, "10x": 10.0, "max": 0}  # Playback speeds; 0 = as fast as possible
+MAX_CALL_DEPTH = 16  # Deepest chain of Call Macro commands before a run is aborted
+ENGINE_STOP_TIMEOUT = 2.0  # How long closing waits for stopped runs and the engine thread (seconds)
+WINDOW_WIDTH = 820  # Leaves the rows their 800 pixels next to the window scrollbar
+WINDOW_HEIGHT = 900  # Initial height; the window can be resized vertically and its content scrolls
+
+# Session store (hotkeys, recent macros, window state, last macro cache)
+SESSION_DIR = os.path.join(os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config"), "blouplanet-macro")
+SESSION_FILE = os.path.join(SESSION_DIR, "session.json")
+LAST_MACRO_CACHE_FILE = os.path.join(SESSION_DIR, "last_macro.pickle")
+MAX_RECENT_MACROS = 10
+# Command plugins: every .py file here is loaded at startup and its register(macro) is called with this module,
+# so it can add command types through macro.register_command(macro.Opcode(...))
+PLUGIN_DIR = os.path.join(SESSION_DIR, "plugins")
+
+# Compiled macro cache, keyed by the SHA-256 of the macro file contents
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "blouplanet-macro", "compiled")
+MACRO_CACHE_VERSION = 4  # Bump when the compiled macro layout changes
+MAX_CACHED_MACROS = 50
 
 # Color and font settings
 BG_COLOR = "#2C2F33"
@@ -23,17 +86,948 @@ BUTTON_FG = "white"
 BUTTON_ACTIVE_BG = "#5b6eae"
 FONT = ("Helvetica", 12)
 
+MOUSE_BUTTONS = {
+    "left": mouse.Button.left,
+    "right": mouse.Button.right,
+    "middle": mouse.Button.middle,
+}
+
+# Keys the recorder turns into chord modifiers
+MODIFIER_NAMES = {
+    keyboard.Key.ctrl: "ctrl", keyboard.Key.ctrl_l: "ctrl", keyboard.Key.ctrl_r: "ctrl",
+    keyboard.Key.shift: "shift", keyboard.Key.shift_l: "shift", keyboard.Key.shift_r: "shift",
+    keyboard.Key.alt: "alt", keyboard.Key.alt_l: "alt", keyboard.Key.alt_r: "alt",
+    keyboard.Key.cmd: "cmd", keyboard.Key.cmd_l: "cmd", keyboard.Key.cmd_r: "cmd",
+}
+
+def resolve_key(key):
+    try:
+        return getattr(keyboard.Key, key.lower())
+    except AttributeError:
+        return key
+
+# Keys of the characters typed so far: character -> (key, shifted)
+TYPED_KEYS = {}
+TYPED_SPECIAL_KEYS = {"\n": keyboard.Key.enter, "\t": keyboard.Key.tab, " ": keyboard.Key.space}
+
+def resolve_character(char):
+    keystroke = TYPED_KEYS.get(char)
+    if keystroke is None:
+        if char in TYPED_SPECIAL_KEYS:
+            keystroke = (TYPED_SPECIAL_KEYS[char], False)
+        elif char != char.lower() and len(char.lower()) == 1:
+            # Capitals are their small letter on the shift level
+            keystroke = (keyboard.KeyCode.from_char(char.lower()), True)
+        else:
+            keystroke = (keyboard.KeyCode.from_char(char), False)
+        TYPED_KEYS[char] = keystroke
+    return keystroke
+
+def key_name(key):
+    # Listener key -> the name Key fields take, e.g. "space" or "a"
+    if isinstance(key, keyboard.Key):
+        return key.name
+    return key.char or str(key)
+
+def resolve_button(button_str):
+    return MOUSE_BUTTONS.get(button_str, mouse.Button.left)
+
+def parse_color(text):
+    # "#rrggbb" -> (r, g, b)
+    text = text.strip().lstrip("#")
+    if len(text) != 6:
+        raise ValueError("invalid color: " + text)
+    return tuple(int(text[i:i + 2], 16) for i in (0, 2, 4))
+
+# Operators of the If Variable and Set Variable commands
+COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+ASSIGNMENTS = {
+    "=": lambda old, value: value,
+    "+=": operator.add,
+    "-=": operator.sub,
+}
+
+class Opcode:
+    # Everything about one command type: its editor form, its text in the command list and how it runs
+    def __init__(self, name, label, fields, parse, format, execute=None, resolve=None, estimate=None):
+        self.name = name
+        self.label = label      # Command Type menu entry
+        self.fields = fields    # Editor fields: (key, label, default) or (key, label, default, choices)
+        self.parse = parse      # Entered text by field key -> command parameters; a ValueError carries the message for the user
+        self.format = format    # cmd -> display text
+        self.execute = execute  # Coroutine (gui, cmd, target, deadline, humanizer) -> deadline; None for control flow
+        self.resolve = resolve  # cmd -> target, worked out once at compile time
+        self.estimate = estimate  # cmd -> (seconds, of which fixed gaps) for the analyzer; None when it takes no time,
+                                  # and the function returns None when the time depends on the screen
+
+OPCODES = []           # Registered command types; the position of each is its opcode number
+OPCODE_NUMBERS = {}    # Command name -> opcode number
+OPCODE_EXECUTORS = []  # Executor of each opcode number, for the dispatch loop
+COMMAND_TYPES = {}     # Command Type menu entry -> Opcode
+
+def register_command(opcode):
+    # Built-in command types and plugins both come through here
+    if opcode.name in OPCODE_NUMBERS or opcode.label in COMMAND_TYPES:
+        raise ValueError("command type already registered: " + opcode.name)
+    OPCODE_NUMBERS[opcode.name] = len(OPCODES)
+    OPCODES.append(opcode)
+    OPCODE_EXECUTORS.append(opcode.execute)
+    COMMAND_TYPES[opcode.label] = opcode
+
+def load_plugins(log):
+    # Called once by the window and by --analyze, after the built-in command types are registered
+    try:
+        names = sorted(name for name in os.listdir(PLUGIN_DIR) if name.endswith(".py"))
+    except OSError:
+        return
+    for name in names:
+        try:
+            spec = importlib.util.spec_from_file_location("macro_plugin_" + name[:-3], os.path.join(PLUGIN_DIR, name))
+            plugin = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(plugin)
+            plugin.register(sys.modules[__name__])
+            log("Plugin loaded: " + name)
+        except Exception as e:
+            log(f"Plugin {name} failed to load: {e}")
+
+class Bytecode:
+    # A compiled command list: one opcode per command plus the operand tables the opcodes index
+    def __init__(self, ops=None, args=None, cmds=None, targets=None):
+        self.ops = ops if ops is not None else array.array("i")
+        self.args = args if args is not None else array.array("i")  # Jump destination, -1 when there is none
+        self.cmds = cmds if cmds is not None else []
+        self.targets = targets if targets is not None else []  # Keys, buttons and templates resolved at compile time
+        
+    def __len__(self):
+        return len(self.ops)
+        
+    def append(self, op, cmd, target=None, arg=-1):
+        self.ops.append(op)
+        self.args.append(arg)
+        self.cmds.append(cmd)
+        self.targets.append(target)
+        
+    def with_commands(self, cmds):
+        # The same program with other operands, e.g. coordinates scaled for this screen
+        return Bytecode(self.ops, self.args, cmds, self.targets)
+        
+    def disassemble(self):
+        lines = []
+        for index, op in enumerate(self.ops):
+            opcode = OPCODES[op]
+            jump = f"-> {self.args[index]}" if self.args[index] >= 0 else ""
+            lines.append(f"{index:4}  {op:3} {opcode.name:<13} {jump:<8} {opcode.format(self.cmds[index])}")
+        return lines
+
+class MacroEstimate:
+    # Expected time of one pass over a command list, worked out without running it
+    def __init__(self):
+        self.seconds = collections.Counter()  # Command name -> time spent in those commands, gaps included
+        self.counts = collections.Counter()   # Command name -> how often they run
+        self.dead_time = 0.0                  # Part of the time spent in fixed gaps (COMMAND_GAP, KEY_TAP_GAP)
+        self.notes = []                       # Why the real time may differ
+
+    def total(self):
+        return sum(self.seconds.values())
+
+    def add(self, other, factor=1):
+        for name, seconds in other.seconds.items():
+            self.seconds[name] += seconds * factor
+        for name, count in other.counts.items():
+            self.counts[name] += count * factor
+        self.dead_time += other.dead_time * factor
+        self.notes.extend(note for note in other.notes if note not in self.notes)
+
+def read_macro_commands(path):
+    # The command list and the loop counts by track of a macro file
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return data.get("commands", []), {int(track): count for track, count in data.get("track_loops", {}).items()}
+    return data, {}
+
+def estimate_duration(cmd):
+    return cmd.get("duration", 0), 0
+
+def estimate_commands(commands, depth=0, folder=""):
+    # Loops are multiplied out, the longer branch of an If is taken and called macros are read in
+    estimate, index = estimate_block(commands, 0, depth, folder)
+    while index < len(commands):
+        # A Loop End, Else or End If without its start; compile_code rejects it, the estimate goes on after it
+        cmd = commands[index]
+        estimate.notes.append(f"Command {index + 1} has no matching start, skipped: " + OPCODES[OPCODE_NUMBERS[cmd["command"]]].format(cmd))
+        rest, index = estimate_block(commands, index + 1, depth, folder)
+        estimate.add(rest)
+    return estimate
+
+def estimate_block(commands, index, depth, folder):
+    # Runs up to the Loop End, Else or End If closing the block and returns (estimate, index of that command)
+    estimate = MacroEstimate()
+    while index < len(commands):
+        cmd = commands[index]
+        name = cmd.get("command")
+        if name in ("loop_end", "else", "end_if"):
+            break
+        index += 1
+        number = OPCODE_NUMBERS.get(name)
+        if number is None:
+            estimate.notes.append(f"Unknown command not counted: {name}")
+            continue
+        opcode = OPCODES[number]
+        if name == "loop_start":
+            body, index = estimate_block(commands, index, depth, folder)
+            if index >= len(commands) or commands[index].get("command") != "loop_end":
+                estimate.notes.append("Loop Start without Loop End: " + opcode.format(cmd))
+            index += 1
+            count = cmd.get("count", 0)
+            if not count:
+                estimate.notes.append("Infinite loop counted once: " + opcode.format(cmd))
+            estimate.add(body, count or 1)
+        elif name in ("if_pixel", "if_variable"):
+            branch, index = estimate_block(commands, index, depth, folder)
+            other = MacroEstimate()
+            if index < len(commands) and commands[index].get("command") == "else":
+                other, index = estimate_block(commands, index + 1, depth, folder)
+            if index >= len(commands) or commands[index].get("command") != "end_if":
+                estimate.notes.append("If without matching End If: " + opcode.format(cmd))
+            index += 1
+            # Only one branch runs; the longer one is counted
+            estimate.add(max(branch, other, key=MacroEstimate.total))
+        elif name == "call":
+            estimate.add(estimate_call(cmd, depth, folder))
+        elif name in ("goto", "return"):
+            estimate.notes.append("Jump not followed: " + opcode.format(cmd))
+        elif opcode.execute is not None:
+            seconds = dead = 0
+            if opcode.estimate is not None:
+                result = opcode.estimate(cmd)
+                if result is None:
+                    estimate.notes.append("Depends on the screen, counted as instant: " + opcode.format(cmd))
+                else:
+                    seconds, dead = result
+            # The engine sleeps COMMAND_GAP after every command
+            estimate.seconds[name] += seconds + COMMAND_GAP
+            estimate.counts[name] += 1
+            estimate.dead_time += dead + COMMAND_GAP
+    return estimate, index
+
+def estimate_call(cmd, depth, folder):
+    path = os.path.abspath(os.path.join(folder, cmd.get("file", "")))
+    if depth >= MAX_CALL_DEPTH:
+        estimate = MacroEstimate()
+        estimate.notes.append(f"Macro calls are nested more than {MAX_CALL_DEPTH} deep: {path}")
+        return estimate
+    try:
+        commands, _ = read_macro_commands(path)
+    except (OSError, ValueError) as e:
+        estimate = MacroEstimate()
+        estimate.notes.append(f"Called macro not read: {path} ({e})")
+        return estimate
+    # The commands of every track of the called file run in order, as in call_macro
+    return estimate_commands(commands, depth + 1, os.path.dirname(path))
+
+def analyze_commands(commands, folder=""):
+    # Track number -> MacroEstimate of one iteration of that track
+    grouped = {}
+    for cmd in commands:
+        grouped.setdefault(cmd.get("track", 0), []).append(cmd)
+    return {track: estimate_commands(track_commands, 0, folder) for track, track_commands in grouped.items()}
+
+def describe_estimates(estimates, speed="1x", loop_count=1, track_loops=None):
+    # Loop counts as in run_macro: the main track runs loop_count times, the others their own count; 0 = forever
+    counts = {track: loop_count if track == 0 else (track_loops or {}).get(track, loop_count) for track in estimates}
+    lines = []
+    for track, estimate in sorted(estimates.items()):
+        total = estimate.total()
+        lines.append(f"Track {track}: {total:.3f} sec per iteration, {sum(estimate.counts.values())} commands")
+        if counts[track]:
+            lines.append(f"  Loops: {counts[track]}, {total * counts[track]:.3f} sec in total")
+        elif track == 0:
+            lines.append("  Loops: forever")
+        else:
+            lines.append("  Loops: forever, until the other tracks end")
+        for name, seconds in estimate.seconds.most_common():
+            share = seconds / total * 100 if total else 0
+            lines.append(f"  {OPCODES[OPCODE_NUMBERS[name]].label:<18} {estimate.counts[name]:>7} x {seconds:10.3f} sec {share:6.1f}%")
+        share = estimate.dead_time / total * 100 if total else 0
+        lines.append(f"  Dead time (fixed gaps after commands and key taps): {estimate.dead_time:.3f} sec ({share:.1f}%)")
+        for note in estimate.notes:
+            lines.append("  Note: " + note)
+        lines.append("")
+    if estimates:
+        # Tracks run side by side and the run ends with the last finite one; a main track that loops forever,
+        # or only endless tracks, never end
+        finite = [track for track in estimates if counts[track]]
+        if counts.get(0) == 0 or not finite:
+            lines.append("Run length: infinite (until Stop or the run limit)")
+        else:
+            length = max(estimates[track].total() * counts[track] for track in finite)
+            lines.append(f"Run length: {length:.3f} sec")
+            if SPEEDS[speed] and SPEEDS[speed] != 1:
+                lines.append(f"At {speed} speed: {length / SPEEDS[speed]:.3f} sec")
+    return lines
+
+def get_track_loop_count(program, track):
+    # The main track runs the loop count of the controls, the others their own count from the file; 0 = forever
+    loop_count = program["loop_count"]
+    return loop_count if track == 0 else program["track_loops"].get(track, loop_count)
+
+def get_file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+class HeldInputs:
+    # Keys and buttons that playback pressed and has not released yet
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.held = set()  # (controller, key or button)
+
+    def add(self, controller, key):
+        with self.lock:
+            self.held.add((controller, key))
+
+    def discard(self, controller, key):
+        with self.lock:
+            self.held.discard((controller, key))
+
+    def release_all(self):
+        # One batch, whatever state the runs that pressed them were left in
+        with self.lock:
+            held, self.held = self.held, set()
+        for controller, key in held:
+            try:
+                controller.release(key)
+            except Exception:
+                pass
+        return len(held)
+
+class TrackedInput:
+    # Controller mixin that records every press in a HeldInputs until it is released
+    def __init__(self, held):
+        super().__init__()
+        self.held = held
+
+    def press(self, key):
+        super().press(key)
+        self.held.add(self, key)
+
+    def release(self, key):
+        self.held.discard(self, key)
+        super().release(key)
+
+class TrackedKeyboardController(TrackedInput, keyboard.Controller):
+    pass
+
+class TrackedMouseController(TrackedInput, mouse.Controller):
+    pass
+
+class PlaybackEngine:
+    # One asyncio event loop thread shared by every macro run, timer and file watcher
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.held = HeldInputs()  # Pressed by any run on this engine
+        self.active_runs = 0
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        # Thread-safe; cancelling the returned future cancels the coroutine
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        # Called from another thread; returns once every run is cancelled, their inputs are released
+        # and the loop thread has ended
+        if not self.thread.is_alive():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(ENGINE_STOP_TIMEOUT)
+        except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError):
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(ENGINE_STOP_TIMEOUT)
+        # Only reached with inputs still held when a run ignored its cancellation
+        self.held.release_all()
+
+    async def shutdown(self):
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Released on the loop itself, so no run can press anything again afterwards
+        self.held.release_all()
+
+class PlaybackWorker:
+    # Long-lived task that runs queued run requests of one macro, one at a time
+    def __init__(self, engine, get_policy, log, on_done=None):
+        self.engine = engine
+        self.get_policy = get_policy
+        self.log = log
+        self.on_done = on_done
+        self.pending = collections.deque()  # Coroutine factories waiting to run
+        self.current = None
+        self.closed = False
+        self.wakeup = None  # Created by run() on the engine loop; before Python 3.10 an Event binds to the loop it is made on
+        self.future = engine.submit(self.run())
+
+    def request(self, factory):
+        self.engine.loop.call_soon_threadsafe(self.enqueue, factory)
+
+    def cancel(self):
+        self.engine.loop.call_soon_threadsafe(self.cancel_all)
+
+    def close(self):
+        self.closed = True
+        self.cancel()
+        self.future.cancel()
+
+    def is_busy(self):
+        return bool(self.pending) or (self.current is not None and not self.current.done())
+
+    def enqueue(self, factory):
+        # A request that is queued but not started yet counts as running too
+        if self.is_busy():
+            policy = self.get_policy()
+            if policy == "ignore":
+                self.log("Macro is already running; trigger ignored.")
+                return
+            if policy == "restart":
+                self.cancel_all()
+        self.pending.append(factory)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def cancel_all(self):
+        self.pending.clear()
+        if self.current is not None:
+            self.current.cancel()
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            while not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            factory = self.pending.popleft()
+            if self.closed:
+                return
+            self.current = asyncio.ensure_future(factory())
+            self.engine.active_runs += 1
+            try:
+                # asyncio.wait does not raise when only the run itself was cancelled
+                await asyncio.wait([self.current])
+            finally:
+                # Also when close() cancels this worker in the middle of a run
+                self.engine.active_runs -= 1
+            interrupted = self.current.cancelled()
+            if not interrupted and self.current.exception() is not None:
+                self.log("Macro execution failed: " + str(self.current.exception()))
+                interrupted = True
+            if interrupted and not self.engine.active_runs:
+                # Nothing else is running, so whatever is still held was left behind by this run
+                released = self.engine.held.release_all()
+                if released:
+                    self.log(f"Released {released} held keys and buttons.")
+            if self.on_done:
+                self.on_done()
+
+class UIDispatcher:
+    # Collects GUI updates from other threads; the Tk main loop applies them once per frame
+    def __init__(self, root, write_log):
+        self.root = root
+        self.write_log = write_log
+        self.lock = threading.Lock()
+        self.lines = []
+        self.calls = {}  # key -> callback; a newer update replaces a pending one with the same key
+        self.after_id = None
+
+    def start(self):
+        self.after_id = self.root.after(UI_FRAME_INTERVAL, self.drain)
+
+    def stop(self):
+        if self.after_id:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+    def log(self, message):
+        with self.lock:
+            self.lines.append(message)
+
+    def post(self, callback, key=None):
+        with self.lock:
+            self.calls[key or callback] = callback
+
+    def drain(self):
+        with self.lock:
+            lines, self.lines = self.lines, []
+            calls, self.calls = self.calls, {}
+        if lines:
+            self.write_log("\n".join(lines) + "\n")
+        for callback in calls.values():
+            try:
+                callback()
+            except Exception as e:
+                self.root.report_callback_exception(type(e), e, e.__traceback__)
+        self.after_id = self.root.after(UI_FRAME_INTERVAL, self.drain)
+
+class ClickCapture:
+    # One shared mouse listener that hands the next left click position to whoever asked for it
+    def __init__(self, post):
+        self.post = post  # Callbacks are delivered through this, on the Tk thread
+        self.lock = threading.Lock()
+        self.listener = None
+        self.waiting = None
+
+    def capture(self, callback):
+        with self.lock:
+            previous, self.waiting = self.waiting, callback
+            if self.listener is None:
+                # Started on first use and kept running so later picks are instant
+                self.listener = mouse.Listener(on_click=self.on_click)
+                self.listener.start()
+        if previous:
+            # Only the latest request gets the click
+            self.post(lambda: previous(None))
+
+    def stop(self):
+        with self.lock:
+            self.waiting = None
+            if self.listener:
+                self.listener.stop()
+                self.listener = None
+
+    def on_click(self, x, y, button, pressed):
+        if button != mouse.Button.left or not pressed:
+            return
+        with self.lock:
+            callback, self.waiting = self.waiting, None
+        if callback:
+            self.post(lambda: callback((int(x), int(y))))
+
+# Coordinate fields that follow the screen size, per command
+POSITION_COMMANDS = {
+    "mouse_click": (("x", "y"),),
+    "mouse_hold": (("x", "y"),),
+    "mouse_move": (("x", "y"),),
+    "mouse_drag": (("x", "y"), ("to_x", "to_y")),
+    "if_pixel": (("x", "y"),),
+}
+
+def screen_transform(reference, current):
+    # Scale from the screen a macro was made on to the current one
+    return (current[0] / reference[0], current[1] / reference[1])
+
+def transform_tracks(tracks, transform):
+    # Applied once per run, so playback itself never touches the coordinates
+    if transform == (1.0, 1.0):
+        return tracks
+    scale_x, scale_y = transform
+    def scale(cmd):
+        cmd = dict(cmd)
+        for field_x, field_y in POSITION_COMMANDS[cmd["command"]]:
+            cmd[field_x] = round(cmd[field_x] * scale_x)
+            cmd[field_y] = round(cmd[field_y] * scale_y)
+        return cmd
+    return {track: code.with_commands([scale(cmd) if cmd["command"] in POSITION_COMMANDS else cmd for cmd in code.cmds])
+            for track, code in tracks.items()}
+
+# Each maps progress 0..1 to eased progress and works on floats and numpy arrays alike
+EASINGS = {
+    "linear": lambda t: t,
+    "ease-in": lambda t: t * t,
+    "ease-out": lambda t: t * (2 - t),
+    "ease-in-out": lambda t: t * t * (3 - 2 * t),
+}
+
+def interpolate_path(start, end, duration, easing):
+    # Returns every point of a straight move and the time between them
+    count = max(2, int(duration * MOVE_RATE) + 1)
+    ease = EASINGS[easing]
+    if np is None:
+        steps = [ease(i / (count - 1)) for i in range(count)]
+        points = [(round(start[0] + (end[0] - start[0]) * t), round(start[1] + (end[1] - start[1]) * t)) for t in steps]
+    else:
+        steps = ease(np.linspace(0, 1, count))[:, None]
+        start = np.asarray(start, dtype=float)
+        points = np.rint(start + (np.asarray(end, dtype=float) - start) * steps).astype(int).tolist()
+        points = [tuple(point) for point in points]
+    return points, duration / (count - 1)
+
+class Humanizer:
+    # Seeded timing jitter and curved pointer paths; each track draws from its own stream
+    def __init__(self, jitter, seed, stream=0):
+        self.jitter = jitter  # Largest relative change of a wait, e.g. 0.1 for +-10%
+        self.seed = seed
+        self.rng = np.random.default_rng([seed, stream])
+
+    def for_track(self, track):
+        return Humanizer(self.jitter, self.seed, track)
+
+    def vary(self, duration):
+        return duration * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+    def path(self, start, end, duration=0, easing="ease-in-out"):
+        # The whole move is sampled up front as one array, so emitting it is only position updates
+        start = np.asarray(start, dtype=float)
+        end = np.asarray(end, dtype=float)
+        delta = end - start
+        if not duration:
+            duration = HUMAN_MOVE_TIME + float(np.hypot(*delta)) / HUMAN_MOVE_SPEED
+        duration = self.vary(duration)
+        count = max(2, int(duration * MOVE_RATE) + 1)
+        # Cubic Bezier whose control points are pushed sideways by a random amount
+        normal = np.array([-delta[1], delta[0]])
+        bends = self.rng.uniform(-HUMAN_CURVE, HUMAN_CURVE, 2)
+        control1 = start + delta * 0.3 + normal * bends[0]
+        control2 = start + delta * 0.7 + normal * bends[1]
+        t = EASINGS[easing](np.linspace(0, 1, count))[:, None]
+        points = ((1 - t) ** 3 * start + 3 * (1 - t) ** 2 * t * control1
+                  + 3 * (1 - t) * t ** 2 * control2 + t ** 3 * end)
+        return [tuple(point) for point in np.rint(points).astype(int).tolist()], duration / (count - 1)
+
+def encode_template(image):
+    return base64.b64encode(np.ascontiguousarray(image, dtype=np.uint8).tobytes()).decode("ascii")
+
+def decode_template(cmd):
+    # Decoded once at compile time; int16 so differences do not wrap around
+    data = np.frombuffer(base64.b64decode(cmd["template"]), dtype=np.uint8)
+    return data.reshape(cmd["height"], cmd["width"], 3).astype(np.int16)
+
+def to_gray(image):
+    return image.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+def downsample(image):
+    # Halves both sides by averaging 2x2 blocks
+    height, width = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    image = image[:height, :width]
+    return (image[0::2, 0::2] + image[1::2, 0::2] + image[0::2, 1::2] + image[1::2, 1::2]) / 4
+
+def box_sums(image, height, width):
+    # Sum of every height x width window, from an integral image
+    integral = np.pad(image.cumsum(0, dtype=np.float64).cumsum(1), ((1, 0), (1, 0)))
+    return (integral[height:, width:] - integral[:-height, width:]
+            - integral[height:, :-width] + integral[:-height, :-width])
+
+def match_template(image, template):
+    # Normalized cross-correlation of the template at every position in the image
+    height, width = template.shape
+    if image.shape[0] < height or image.shape[1] < width:
+        return np.zeros((0, 0))
+    shade = float(template.mean())
+    template = template - shade
+    energy = float(np.square(template, dtype=np.float64).sum())
+    sums = box_sums(image, height, width)
+    squares = box_sums(np.square(image, dtype=np.float64), height, width)
+    if energy < 1e-6 * template.size:
+        # A flat template has no pattern to correlate with, so the score would stay 0; score how close
+        # each window comes to its one shade instead, 1 for an exact match
+        distance = squares - 2 * shade * sums + shade * shade * (height * width)
+        return 1 - np.sqrt(np.maximum(distance, 0) / (height * width)) / 255
+    # Correlation through the FFT; the valid part does not wrap around
+    spectrum = np.fft.rfft2(image) * np.fft.rfft2(template[::-1, ::-1], s=image.shape)
+    numerator = np.fft.irfft2(spectrum, s=image.shape)[height - 1:, width - 1:]
+    variance = squares - sums * sums / (height * width)
+    denominator = np.sqrt(np.maximum(variance, 0) * energy)
+    return np.where(denominator > 1e-6, numerator / np.maximum(denominator, 1e-6), 0.0)
+
+def best_match(image, template):
+    scores = match_template(image, template)
+    if scores.size == 0:
+        return 0, 0, -1.0
+    row, col = np.unravel_index(np.argmax(scores), scores.shape)
+    return int(row), int(col), float(scores[row, col])
+
+def refine_match(image, template, row, col, radius):
+    # Best match within radius pixels of (row, col)
+    height, width = template.shape
+    top, left = max(row - radius, 0), max(col - radius, 0)
+    row, col, score = best_match(image[top:row + height + radius, left:col + width + radius], template)
+    return top + row, left + col, score
+
+class TemplateMatcher:
+    # Grayscale pyramid of a template plus the last place it was found on screen
+    def __init__(self, template, x, y):
+        self.height, self.width = template.shape[:2]
+        self.pyramid = [to_gray(template)]
+        while min(self.pyramid[-1].shape) >= 2 * PYRAMID_MIN_SIZE:
+            self.pyramid.append(downsample(self.pyramid[-1]))
+        self.last_hit = (x, y)  # Starts where the template was captured
+
+    def search(self, image):
+        # Full search only on the coarsest level, then refine the best candidates level by level
+        levels = [image]
+        for _ in range(len(self.pyramid) - 1):
+            levels.append(downsample(levels[-1]))
+        top = len(self.pyramid) - 1
+        scores = match_template(levels[top], self.pyramid[top])
+        if scores.size == 0:
+            return None
+        count = min(PYRAMID_CANDIDATES, scores.size)
+        best = None
+        for index in np.argpartition(scores.ravel(), -count)[-count:]:
+            row, col = divmod(int(index), scores.shape[1])
+            score = float(scores[row, col])
+            for level in range(top - 1, -1, -1):
+                row, col, score = refine_match(levels[level], self.pyramid[level], row * 2, col * 2, 2)
+            if best is None or score > best[2]:
+                best = (col, row, score)
+        return best
+
+class ScreenSampler:
+    # Grabs only the requested screen region; mss uses XShm where the X server supports it
+    def __init__(self):
+        # One thread keeps one grabber (and its shared memory segment) alive for every grab
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.sct = None
+
+    @staticmethod
+    def available():
+        return np is not None and mss is not None
+
+    def get_grabber(self):
+        if self.sct is None:
+            self.sct = mss.mss()
+        return self.sct
+
+    def grab(self, x, y, width, height):
+        shot = self.get_grabber().grab({"left": x, "top": y, "width": width, "height": height})
+        # BGRA -> RGB
+        return np.frombuffer(shot.bgra, dtype=np.uint8).reshape(height, width, 4)[:, :, 2::-1]
+
+    def capture(self, x, y, width, height):
+        return self.executor.submit(self.grab, x, y, width, height).result()
+
+    def compare(self, x, y, template, tolerance):
+        region = self.grab(x, y, template.shape[1], template.shape[0])
+        return int(np.abs(region - template).max()) <= tolerance
+
+    async def matches(self, x, y, template, tolerance):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.compare, x, y, template, tolerance)
+
+    def locate(self, matcher, region, threshold):
+        x, y, width, height = region
+        if width <= 0 or height <= 0:
+            screen = self.get_grabber().monitors[0]  # Bounding box of all monitors
+            x, y, width, height = screen["left"], screen["top"], screen["width"], screen["height"]
+        # Look around the last hit first; the whole region is only searched when the target moved
+        last_x, last_y = matcher.last_hit
+        left = max(x, last_x - LOCAL_SEARCH_MARGIN)
+        top = max(y, last_y - LOCAL_SEARCH_MARGIN)
+        right = min(x + width, last_x + matcher.width + LOCAL_SEARCH_MARGIN)
+        bottom = min(y + height, last_y + matcher.height + LOCAL_SEARCH_MARGIN)
+        if right - left >= matcher.width and bottom - top >= matcher.height:
+            image = to_gray(self.grab(left, top, right - left, bottom - top))
+            row, col, score = best_match(image, matcher.pyramid[0])
+            if score >= threshold:
+                matcher.last_hit = (left + col, top + row)
+                return left + col, top + row, score
+        hit = matcher.search(to_gray(self.grab(x, y, width, height)))
+        if hit is None or hit[2] < threshold:
+            return None
+        matcher.last_hit = (x + hit[0], y + hit[1])
+        return x + hit[0], y + hit[1], hit[2]
+
+    async def find(self, matcher, region, threshold):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.locate, matcher, region, threshold)
+
+def wake_future(future):
+    if not future.done():
+        future.set_result(None)
+
+class PlaybackClock:
+    # Macro time: the loop clock (time.monotonic()) scaled by the playback speed.
+    # Deadlines stay in macro time, so a speed change applies to every pending and later duration
+    def __init__(self):
+        self.speed = 1.0      # One of SPEEDS; 0 = as fast as possible
+        self.base = 0.0       # Macro time at the last speed change
+        self.loop_base = 0.0  # Loop time at the last speed change
+        self.sleepers = set()
+
+    def now(self):
+        # As fast as possible keeps macro time running at 1x, so a later speed picks up from the present
+        return self.base + (asyncio.get_running_loop().time() - self.loop_base) * (self.speed or 1)
+
+    def set_speed(self, speed):
+        # Called on the engine thread; sleepers wake up and reschedule at the new speed
+        self.base = self.now()
+        self.loop_base = asyncio.get_running_loop().time()
+        self.speed = speed
+        for future in self.sleepers:
+            if not future.done():
+                future.set_result(True)
+
+    async def sleep_until(self, deadline):
+        # Returns the deadline the caller goes on from
+        loop = asyncio.get_running_loop()
+        while self.speed:
+            future = loop.create_future()
+            handle = loop.call_at(self.loop_base + (deadline - self.base) / self.speed, wake_future, future)
+            self.sleepers.add(future)
+            try:
+                if not await future:
+                    return deadline
+            finally:
+                handle.cancel()
+                self.sleepers.discard(future)
+        # As fast as possible: the caller's deadline is pulled to the present instead of running ahead of it,
+        # so each track keeps its own time and none has a backlog to replay at the next speed
+        await asyncio.sleep(0)
+        return self.now()
+
+CLOCK = PlaybackClock()  # Shared by every run, so one speed setting applies to all of them
+sleep_until = CLOCK.sleep_until
+
+def parse_run_duration(text):
+    # "90", "90s", "45m", "2h" or "1:30:00" -> seconds
+    text = text.strip().lower()
+    if ":" in text:
+        seconds = 0
+        for part in text.split(":"):
+            seconds = seconds * 60 + float(part)
+    else:
+        units = {"s": 1, "m": 60, "h": 3600}
+        scale = units.get(text[-1:])
+        seconds = float(text[:-1]) * scale if scale else float(text)
+    if not seconds > 0:
+        raise ValueError("invalid duration: " + text)
+    return seconds
+
+def next_clock_time(text):
+    # "17:00" or "17:00:30" -> epoch seconds of the next time the local clock shows it
+    text = text.strip()
+    clock = datetime.datetime.strptime(text, "%H:%M:%S" if text.count(":") == 2 else "%H:%M").time()
+    now = datetime.datetime.now()
+    target = datetime.datetime.combine(now.date(), clock)
+    if target <= now:
+        target += datetime.timedelta(days=1)
+    return target.timestamp()
+
+def run_stop_time(run_limit):
+    # Loop (monotonic) time at which a run ends, or None without a limit
+    if run_limit is None:
+        return None
+    mode, value = run_limit
+    now = asyncio.get_running_loop().time()
+    if mode == "duration":
+        return now + value
+    # The wall clock is read once, so later clock changes do not move the end
+    return now + value - time.time()
+
+class MacroFileWatcher:
+    # Watches one macro file with inotify, falling back to mtime polling
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+
+    def __init__(self, path, on_change, engine):
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.engine = engine
+        self.signature = self.get_signature()
+        self.future = None
+
+    def start(self):
+        self.future = self.engine.submit(self.run())
+
+    def stop(self):
+        if self.future:
+            self.future.cancel()
+
+    def get_signature(self):
+        return get_file_signature(self.path)
+
+    def mark_current(self):
+        self.signature = self.get_signature()
+
+    async def check(self):
+        signature = self.get_signature()
+        if signature is not None and signature != self.signature:
+            self.signature = signature
+            # Parse outside the event loop so running macros keep their timing
+            await asyncio.get_running_loop().run_in_executor(None, self.on_change, self.path)
+
+    def open_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        # Editors often save through a temporary file and a rename, so watch the directory
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(os.path.dirname(self.path)), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    async def run(self):
+        fd = self.open_inotify()
+        if fd is None:
+            while True:
+                await asyncio.sleep(WATCH_POLL_INTERVAL)
+                await self.check()
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        def on_readable():
+            try:
+                os.read(fd, 65536)
+            except BlockingIOError:
+                pass
+            changed.set()
+        loop.add_reader(fd, on_readable)
+        try:
+            while True:
+                await changed.wait()
+                changed.clear()
+                await self.check()
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
+
 class ManualMacroGUI(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("BLOUplanet's Macro - Keyboard/Mouse Macro Program")
-        self.geometry("800x900")
-        self.resizable(False, False)
+        self.geometry(f"{WINDOW_WIDTH}x{WINDOW_HEIGHT}")
+        self.resizable(False, True)
         self.configure(bg=BG_COLOR)
+        # Every update coming from another thread goes through here
+        self.ui = UIDispatcher(self, self.write_log)
+        self.click_capture = ClickCapture(self.ui.post)
+        self.screen = ScreenSampler()
+        load_plugins(self.log)
         
         # Variables related to macro commands
         self.commands = []  # List to store macro commands
+        self.compiled_tracks = None      # Compiled form of self.commands loaded from the cache
         self.macro_running = False
+        self.overlap_policy = "ignore"   # One of OVERLAP_POLICIES
+        self.editor_program = None       # Compiled program of the running editor macro
+        self.generated_code = {}         # Factories of generated track functions, by command list hash
+        self.macro_path = None           # Path of the last loaded or saved macro file
+        self.macro_watcher = None
+        self.recent_macros = []          # Most recently used macro files, newest first
+        self.screen_size = (self.winfo_screenwidth(), self.winfo_screenheight())  # Refreshed before each run
+        self.macro_screen = self.screen_size  # Screen size the editor macro's coordinates refer to
         self.drag_original_index = None  # Index of item when starting drag
         self.dragged_command = None      # Command object selected when dragging starts
         self.ghost = None                # Transparent ghost to display during drag
@@ -46,6 +1040,9 @@ class ManualMacroGUI(tk.Tk):
         self.action_recording = False
         self.recorded_commands = []      # Commands generated from action recording
         self.last_record_time = 0
+        self.record_modifiers = []       # Modifier names held down, in the order they were pressed
+        self.record_chord_modifiers = set()  # Modifiers already recorded as part of a chord; their release records nothing
+        self.record_chord_keys = set()       # Names of keys recorded at press; their release records nothing
         self.action_keyboard_listener = None
         self.action_mouse_listener = None
 
@@ -53,11 +1050,29 @@ class ManualMacroGUI(tk.Tk):
         self.action_start_hotkey_var = tk.StringVar(value="f4")
         self.action_stop_hotkey_var = tk.StringVar(value="f5")
         
+        # Macro library: name -> loaded macro with its own hotkey and run
+        self.macro_library = {}
+        self.library_names = []          # Library names in listbox order
+        
         # Clear focus when background is clicked
         self.bind_all("<Button-1>", self.clear_focus, add="+")
         
+        # Everything below sits in a scrolling canvas, so the tallest command form still fits on a short screen
+        self.canvas_main = tk.Canvas(self, bg=BG_COLOR, highlightthickness=0)
+        self.scrollbar_main = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.canvas_main.yview)
+        self.canvas_main.config(yscrollcommand=self.scrollbar_main.set)
+        self.scrollbar_main.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas_main.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.frame_main = tk.Frame(self.canvas_main, bg=BG_COLOR)
+        main_window = self.canvas_main.create_window(0, 0, window=self.frame_main, anchor="nw")
+        self.frame_main.bind("<Configure>", lambda event: self.canvas_main.config(scrollregion=self.canvas_main.bbox("all")))
+        self.canvas_main.bind("<Configure>", lambda event: self.canvas_main.itemconfigure(main_window, width=event.width))
+        self.bind_all("<MouseWheel>", self.on_main_wheel, add="+")
+        self.bind_all("<Button-4>", self.on_main_wheel, add="+")
+        self.bind_all("<Button-5>", self.on_main_wheel, add="+")
+        
         # --- Command list area ---
-        self.frame_list = tk.Frame(self, bg=FRAME_BG)
+        self.frame_list = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_list.pack(padx=10, pady=5, fill=tk.BOTH, expand=True)
         
         self.listbox = tk.Listbox(self.frame_list, width=80, height=10, bg=LISTBOX_BG, fg=LISTBOX_FG,
@@ -74,28 +1089,34 @@ class ManualMacroGUI(tk.Tk):
         self.listbox.config(yscrollcommand=self.scrollbar.set)
         
         # --- Editor area for adding commands ---
-        self.frame_editor = tk.Frame(self, bg=FRAME_BG)
+        self.frame_editor = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_editor.pack(padx=10, pady=5, fill=tk.X)
         tk.Label(self.frame_editor, text="Command Type:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
             .grid(row=0, column=0, padx=5, pady=5)
-        self.command_type_var = tk.StringVar(value="Key Tap")
+        self.command_type_var = tk.StringVar(value=OPCODES[0].label)
         self.option_menu = tk.OptionMenu(self.frame_editor, self.command_type_var,
-                                         "Key Tap", "Wait", "Mouse Click", "Key Hold", "Mouse Hold", "Mouse Scroll",
-                                         command=self.update_param_fields)
+                                         *COMMAND_TYPES, command=self.update_param_fields)
         self.option_menu.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
         self.option_menu["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
         self.option_menu.grid(row=0, column=1, padx=5, pady=5)
+        # The fields get a row of their own across the whole editor, so long forms are not clipped
+        self.frame_editor.columnconfigure(2, weight=1)
         self.frame_params = tk.Frame(self.frame_editor, bg=FRAME_BG)
-        self.frame_params.grid(row=0, column=2, padx=5, pady=5)
+        self.frame_params.grid(row=1, column=0, columnspan=3, padx=5, pady=5, sticky="w")
         self.param_entries = {}
-        self.update_param_fields("Key Tap")
+        self.update_param_fields(OPCODES[0].label)
+        tk.Label(self.frame_editor, text="Track:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .grid(row=2, column=0, padx=5, pady=5)
+        self.entry_track = tk.Entry(self.frame_editor, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_track.insert(0, "0")
+        self.entry_track.grid(row=2, column=1, padx=5, pady=5, sticky="w")
         self.button_add = tk.Button(self.frame_editor, text="Add Command", command=self.add_command,
                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
                                     activebackground=BUTTON_ACTIVE_BG)
-        self.button_add.grid(row=0, column=3, padx=5, pady=5)
+        self.button_add.grid(row=2, column=2, padx=5, pady=5, sticky="w")
         
         # --- Control buttons area ---
-        self.frame_controls = tk.Frame(self, bg=FRAME_BG)
+        self.frame_controls = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_controls.pack(padx=10, pady=5, fill=tk.X)
         # Top: Delete Selected Command, Run Macro, Stop Macro
         self.frame_controls_top = tk.Frame(self.frame_controls, bg=FRAME_BG)
@@ -112,6 +1133,14 @@ class ManualMacroGUI(tk.Tk):
                                      bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
                                      activebackground=BUTTON_ACTIVE_BG)
         self.button_stop.pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Label(self.frame_controls_top, text="While Running:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.overlap_policy_var = tk.StringVar(value=self.overlap_policy)
+        self.option_overlap_policy = tk.OptionMenu(self.frame_controls_top, self.overlap_policy_var, *OVERLAP_POLICIES,
+                                                   command=self.set_overlap_policy)
+        self.option_overlap_policy.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
+        self.option_overlap_policy["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+        self.option_overlap_policy.pack(side=tk.LEFT, padx=5, pady=5)
         # Bottom: Save Macro, Load Macro, Loop Count
         self.frame_controls_bottom = tk.Frame(self.frame_controls, bg=FRAME_BG)
         self.frame_controls_bottom.pack(fill=tk.X, pady=(5,0))
@@ -123,14 +1152,76 @@ class ManualMacroGUI(tk.Tk):
                                      bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
                                      activebackground=BUTTON_ACTIVE_BG)
         self.button_load.pack(side=tk.LEFT, padx=5, pady=5)
+        self.menubutton_recent = tk.Menubutton(self.frame_controls_bottom, text="Recent", bg=BUTTON_BG, fg=BUTTON_FG,
+                                               font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG)
+        self.menu_recent = tk.Menu(self.menubutton_recent, tearoff=0, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+        self.menubutton_recent.config(menu=self.menu_recent)
+        self.menubutton_recent.pack(side=tk.LEFT, padx=5, pady=5)
+        self.watch_file_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.frame_controls_bottom, text="Auto Reload", variable=self.watch_file_var,
+                       command=self.update_macro_watcher, bg=BG_COLOR, fg=LABEL_FG, font=FONT,
+                       selectcolor=ENTRY_BG, activebackground=BG_COLOR, activeforeground=LABEL_FG)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
         tk.Label(self.frame_controls_bottom, text="Loop Count (0: infinite):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
             .pack(side=tk.LEFT, padx=5, pady=5)
         self.entry_loop = tk.Entry(self.frame_controls_bottom, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
         self.entry_loop.insert(0, "1")
         self.entry_loop.pack(side=tk.LEFT, padx=5, pady=5)
+        self.frame_controls_run_limit = tk.Frame(self.frame_controls, bg=FRAME_BG)
+        self.frame_controls_run_limit.pack(fill=tk.X)
+        tk.Label(self.frame_controls_run_limit, text="Run Limit:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.run_limit_var = tk.StringVar(value="none")
+        self.option_run_limit = tk.OptionMenu(self.frame_controls_run_limit, self.run_limit_var, *RUN_LIMITS)
+        self.option_run_limit.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
+        self.option_run_limit["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+        self.option_run_limit.pack(side=tk.LEFT, padx=5, pady=5)
+        # A duration such as "2h" or "1:30:00", or a time of day such as "17:00"
+        self.entry_run_limit = tk.Entry(self.frame_controls_run_limit, width=8, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_run_limit.pack(side=tk.LEFT, padx=5, pady=5)
+        # Per-track loop counts, e.g. "1:0, 2:3" (tracks not listed use the loop count above)
+        self.frame_controls_tracks = tk.Frame(self.frame_controls, bg=FRAME_BG)
+        self.frame_controls_tracks.pack(fill=tk.X)
+        tk.Label(self.frame_controls_tracks, text="Track Loop Counts (track:count):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_track_loops = tk.Entry(self.frame_controls_tracks, width=20, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_track_loops.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_disassemble = tk.Button(self.frame_controls_tracks, text="Show Bytecode", command=self.show_disassembly,
+                                            bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                            activebackground=BUTTON_ACTIVE_BG)
+        self.button_disassemble.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_analyze = tk.Button(self.frame_controls_tracks, text="Analyze", command=self.show_analysis,
+                                        bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                        activebackground=BUTTON_ACTIVE_BG)
+        self.button_analyze.pack(side=tk.LEFT, padx=5, pady=5)
+        self.frame_controls_humanize = tk.Frame(self.frame_controls, bg=FRAME_BG)
+        self.frame_controls_humanize.pack(fill=tk.X)
+        self.humanize_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.frame_controls_humanize, text="Humanize", variable=self.humanize_var,
+                       bg=BG_COLOR, fg=LABEL_FG, font=FONT,
+                       selectcolor=ENTRY_BG, activebackground=BG_COLOR, activeforeground=LABEL_FG)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Label(self.frame_controls_humanize, text="Jitter (%):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_jitter = tk.Entry(self.frame_controls_humanize, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_jitter.insert(0, "10")
+        self.entry_jitter.pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Label(self.frame_controls_humanize, text="Seed (empty = random):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_seed = tk.Entry(self.frame_controls_humanize, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_seed.pack(side=tk.LEFT, padx=5, pady=5)
+        self.frame_controls_speed = tk.Frame(self.frame_controls, bg=FRAME_BG)
+        self.frame_controls_speed.pack(fill=tk.X)
+        tk.Label(self.frame_controls_speed, text="Speed:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.speed_var = tk.StringVar(value="1x")
+        self.option_speed = tk.OptionMenu(self.frame_controls_speed, self.speed_var, *SPEEDS, command=self.set_speed)
+        self.option_speed.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
+        self.option_speed["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+        self.option_speed.pack(side=tk.LEFT, padx=5, pady=5)
         
         # --- Existing hotkey settings area ---
-        self.frame_hotkeys = tk.Frame(self, bg=FRAME_BG)
+        self.frame_hotkeys = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_hotkeys.pack(padx=10, pady=5, fill=tk.X)
         tk.Label(self.frame_hotkeys, text="Macro Start Hotkey:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
             .pack(side=tk.LEFT, padx=5, pady=5)
@@ -148,9 +1239,22 @@ class ManualMacroGUI(tk.Tk):
                                               bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
                                               activebackground=BUTTON_ACTIVE_BG)
         self.button_apply_hotkeys.pack(side=tk.LEFT, padx=5, pady=5)
+        # Speed hotkeys get their own row; Apply Hotkeys above applies them too
+        self.frame_speed_hotkeys = tk.Frame(self.frame_main, bg=FRAME_BG)
+        self.frame_speed_hotkeys.pack(padx=10, pady=5, fill=tk.X)
+        tk.Label(self.frame_speed_hotkeys, text="Speed Hotkeys (Slower/Faster):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.slower_hotkey_var = tk.StringVar(value="f6")
+        self.entry_slower_hotkey = tk.Entry(self.frame_speed_hotkeys, textvariable=self.slower_hotkey_var,
+                                            width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_slower_hotkey.pack(side=tk.LEFT, padx=5, pady=5)
+        self.faster_hotkey_var = tk.StringVar(value="f7")
+        self.entry_faster_hotkey = tk.Entry(self.frame_speed_hotkeys, textvariable=self.faster_hotkey_var,
+                                            width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_faster_hotkey.pack(side=tk.LEFT, padx=5, pady=5)
         
         # --- Action recording area ---
-        self.frame_action_record = tk.Frame(self, bg=FRAME_BG)
+        self.frame_action_record = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_action_record.pack(padx=10, pady=5, fill=tk.X)
         tk.Label(self.frame_action_record, text="Action Recording Hotkeys (Start/Stop):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
             .pack(side=tk.LEFT, padx=5, pady=5)
@@ -165,15 +1269,68 @@ class ManualMacroGUI(tk.Tk):
                                                  activebackground=BUTTON_ACTIVE_BG)
         self.button_toggle_recording.pack(side=tk.LEFT, padx=5, pady=5)
         
+        # --- Macro library area ---
+        self.frame_library = tk.Frame(self.frame_main, bg=FRAME_BG)
+        self.frame_library.pack(padx=10, pady=5, fill=tk.X)
+        self.listbox_library = tk.Listbox(self.frame_library, width=80, height=4, bg=LISTBOX_BG, fg=LISTBOX_FG,
+                                          font=FONT, selectbackground=BUTTON_BG, selectforeground="white", relief=tk.FLAT,
+                                          exportselection=False)
+        self.listbox_library.pack(fill=tk.X)
+        self.frame_library_add = tk.Frame(self.frame_library, bg=FRAME_BG)
+        self.frame_library_add.pack(fill=tk.X)
+        tk.Label(self.frame_library_add, text="Library Name:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_library_name = tk.Entry(self.frame_library_add, width=12, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_library_name.pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Label(self.frame_library_add, text="Hotkey:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_library_hotkey = tk.Entry(self.frame_library_add, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_library_hotkey.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_add = tk.Button(self.frame_library_add, text="Add Current Macro", command=self.add_library_macro,
+                                            bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                            activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_add.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_add_file = tk.Button(self.frame_library_add, text="Add From File", command=self.add_library_file,
+                                                 bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                                 activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_add_file.pack(side=tk.LEFT, padx=5, pady=5)
+        self.frame_library_controls = tk.Frame(self.frame_library, bg=FRAME_BG)
+        self.frame_library_controls.pack(fill=tk.X)
+        self.button_library_run = tk.Button(self.frame_library_controls, text="Run", command=self.play_selected_library_macro,
+                                            bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                            activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_run.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_stop = tk.Button(self.frame_library_controls, text="Stop", command=self.stop_selected_library_macro,
+                                             bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                             activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_stop.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_open = tk.Button(self.frame_library_controls, text="Open in Editor", command=self.open_library_macro,
+                                             bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                             activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_open.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_remove = tk.Button(self.frame_library_controls, text="Remove", command=self.remove_library_macro,
+                                               bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                               activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_remove.pack(side=tk.LEFT, padx=5, pady=5)
+        
         # --- Log output area ---
-        self.text_log = tk.Text(self, height=10, width=90, state=tk.NORMAL, bg=LISTBOX_BG, fg=LISTBOX_FG,
+        self.text_log = tk.Text(self.frame_main, height=10, width=90, state=tk.NORMAL, bg=LISTBOX_BG, fg=LISTBOX_FG,
                                 font=FONT, relief=tk.FLAT)
         self.text_log.pack(padx=10, pady=5)
         
-        self.keyboard_controller = keyboard.Controller()
-        self.mouse_controller = mouse.Controller()
+        # Playback threads are set up once here; every run is a request to a worker
+        self.engine = PlaybackEngine()
+        self.engine.start()
+        self.keyboard_controller = TrackedKeyboardController(self.engine.held)
+        self.mouse_controller = TrackedMouseController(self.engine.held)
+        self.editor_worker = PlaybackWorker(self.engine, self.get_overlap_policy, self.log,
+                                            lambda: self.ui.post(self.finish_macro_run))
         
         self.hotkey_listener = None
+        self.restore_session()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.on_close())
+        self.ui.start()
         self.after(100, self.start_hotkey_listener)
         
     # Clear focus from entries/text when clicking outside
@@ -181,224 +1338,196 @@ class ManualMacroGUI(tk.Tk):
         if not isinstance(event.widget, (tk.Entry, tk.Text)):
             self.focus_set()
             
+    def on_main_wheel(self, event):
+        # Lists and the log scroll themselves, and other windows keep their own wheel
+        widget = event.widget
+        if not isinstance(widget, tk.Misc) or isinstance(widget, (tk.Listbox, tk.Text)) or widget.winfo_toplevel() is not self:
+            return
+        if event.num == 4 or event.delta > 0:
+            self.canvas_main.yview_scroll(-1, "units")
+        elif event.num == 5 or event.delta < 0:
+            self.canvas_main.yview_scroll(1, "units")
+            
     def log(self, message):
-        self.text_log.insert(tk.END, message + "\n")
-        self.text_log.see(tk.END)
+        # Safe to call from any thread
         print(message)
+        self.ui.log(message)
+        
+    def write_log(self, text):
+        self.text_log.insert(tk.END, text)
+        self.text_log.see(tk.END)
         
     def update_param_fields(self, command_type):
         for widget in self.frame_params.winfo_children():
             widget.destroy()
         self.param_entries.clear()
-        if command_type == "Key Tap":
-            tk.Label(self.frame_params, text="Key:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_key = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_key.grid(row=0, column=1, padx=5, pady=2)
-            def on_key_press(event):
-                entry_key.delete(0, tk.END)
-                entry_key.insert(0, event.keysym)
-                return "break"
-            entry_key.bind("<Key>", on_key_press)
-            self.param_entries["key"] = entry_key
-            tk.Label(self.frame_params, text="Repeat:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=2)
-            entry_repeat = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_repeat.insert(0, "1")
-            entry_repeat.grid(row=1, column=1, padx=5, pady=2)
-            self.param_entries["repeat"] = entry_repeat
-        elif command_type == "Wait":
-            tk.Label(self.frame_params, text="Wait Duration (seconds):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_duration = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.grid(row=0, column=1, padx=5, pady=2)
-            self.param_entries["duration"] = entry_duration
-        elif command_type == "Mouse Click":
-            tk.Label(self.frame_params, text="X:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_x = tk.Entry(self.frame_params, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_x.grid(row=0, column=1, padx=5, pady=2)
-            self.param_entries["x"] = entry_x
-            tk.Label(self.frame_params, text="Y:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=2)
-            entry_y = tk.Entry(self.frame_params, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_y.grid(row=0, column=3, padx=5, pady=2)
-            self.param_entries["y"] = entry_y
-            tk.Label(self.frame_params, text="Button:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=4, padx=5, pady=2)
-            self.mouse_button_var = tk.StringVar(value="left")
-            option_button = tk.OptionMenu(self.frame_params, self.mouse_button_var, "left", "right", "middle")
-            option_button.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
-            option_button["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
-            option_button.grid(row=0, column=5, padx=5, pady=2)
-            self.param_entries["button"] = self.mouse_button_var
-            # "Record Mouse Position" button on a new row
-            self.button_record_mouse = tk.Button(self.frame_params, text="Record Mouse Position", command=self.record_mouse_position,
-                                                 bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
-                                                 activebackground=BUTTON_ACTIVE_BG)
-            self.button_record_mouse.grid(row=1, column=0, columnspan=6, padx=5, pady=2, sticky="w")
-        elif command_type == "Key Hold":
-            tk.Label(self.frame_params, text="Key:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_key = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_key.grid(row=0, column=1, padx=5, pady=2)
-            def on_key_press(event):
-                entry_key.delete(0, tk.END)
-                entry_key.insert(0, event.keysym)
-                return "break"
-            entry_key.bind("<Key>", on_key_press)
-            self.param_entries["key"] = entry_key
-            tk.Label(self.frame_params, text="Hold Duration (seconds):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=2)
-            entry_duration = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, "1")
-            entry_duration.grid(row=1, column=1, padx=5, pady=2)
-            self.param_entries["duration"] = entry_duration
-        elif command_type == "Mouse Hold":
-            # First row: X, Y, Button
-            tk.Label(self.frame_params, text="X:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_x = tk.Entry(self.frame_params, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_x.grid(row=0, column=1, padx=5, pady=2)
-            self.param_entries["x"] = entry_x
-            tk.Label(self.frame_params, text="Y:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=2)
-            entry_y = tk.Entry(self.frame_params, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_y.grid(row=0, column=3, padx=5, pady=2)
-            self.param_entries["y"] = entry_y
-            tk.Label(self.frame_params, text="Button:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=4, padx=5, pady=2)
-            self.mouse_button_var = tk.StringVar(value="left")
-            option_button = tk.OptionMenu(self.frame_params, self.mouse_button_var, "left", "right", "middle")
-            option_button.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
-            option_button["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
-            option_button.grid(row=0, column=5, padx=5, pady=2)
-            self.param_entries["button"] = self.mouse_button_var
-            # Second row: Hold Duration and Record Mouse Position button
-            tk.Label(self.frame_params, text="Hold Duration (seconds):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=2)
-            entry_duration = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, "1")
-            entry_duration.grid(row=1, column=1, padx=5, pady=2)
-            self.param_entries["duration"] = entry_duration
-            self.button_record_mouse = tk.Button(self.frame_params, text="Record Mouse Position", command=self.record_mouse_position,
-                                                 bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
-                                                 activebackground=BUTTON_ACTIVE_BG)
-            self.button_record_mouse.grid(row=1, column=2, columnspan=4, padx=5, pady=2, sticky="w")
-        elif command_type == "Mouse Scroll":
-            tk.Label(self.frame_params, text="Horizontal Scroll:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_dx = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_dx.insert(0, "0")
-            entry_dx.grid(row=0, column=1, padx=5, pady=2)
-            self.param_entries["dx"] = entry_dx
-            tk.Label(self.frame_params, text="Vertical Scroll:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=2)
-            entry_dy = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_dy.insert(0, "0")
-            entry_dy.grid(row=0, column=3, padx=5, pady=2)
-            self.param_entries["dy"] = entry_dy
-
-    def record_mouse_position(self):
-        self.button_record_mouse.config(text="Left click to complete mouse position recording", state=tk.DISABLED)
+        self.param_entries.update(self.build_command_fields(self.frame_params, COMMAND_TYPES[command_type], {}, 2))
+            
+    def build_command_fields(self, parent, opcode, cmd, pady):
+        # Used by the editor panel and the edit window; returns the entries/variables by field key
+        entries = {}
+        for i, field in enumerate(opcode.fields):
+            key, text, default = field[:3]
+            # Two label and entry pairs per row keep the widest forms inside the window
+            row, column = divmod(i, 2)
+            tk.Label(parent, text=text, bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+                .grid(row=row, column=column * 2, padx=5, pady=pady)
+            value = str(cmd.get(key, default))
+            if len(field) > 3:
+                # A fixed set of choices, e.g. the mouse button or the easing
+                entries[key] = tk.StringVar(value=value)
+                option = tk.OptionMenu(parent, entries[key], *field[3])
+                option.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
+                option["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+                option.grid(row=row, column=column * 2 + 1, padx=5, pady=pady)
+            else:
+                entries[key] = tk.Entry(parent, width=30 if key in ("file", "text") else 8, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+                entries[key].insert(0, value)
+                entries[key].grid(row=row, column=column * 2 + 1, padx=5, pady=pady)
+                if key == "key":
+                    entries[key].bind("<Key>", lambda event, entry=entries[key]: self.capture_key(entry, event))
+        # Helper buttons go on the row below the fields, picked by the fields the command has
+        buttons = []
+        # Positions of screen commands are stored for the macro's screen, image regions as they are
+        scale = opcode.name in POSITION_COMMANDS
+        pairs = POSITION_COMMANDS.get(opcode.name, (("x", "y"),) if "x" in entries else ())
+        for fields, text in zip(pairs, ("Record Mouse Position", "Record End Position")):
+            button = tk.Button(parent, text=text, bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                               activebackground=BUTTON_ACTIVE_BG)
+            button.config(command=lambda button=button, fields=fields: self.record_position(button, entries, fields, scale))
+            buttons.append(button)
+        if "width" in entries and "height" in entries:
+            # Kept in a variable until Save, so Cancel leaves the command untouched
+            entries["template"] = tk.StringVar(value=cmd.get("template", ""))
+            buttons.append(tk.Button(parent, text="Capture Template", command=lambda: self.capture_template(entries, parent),
+                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG))
+        if "color" in entries:
+            buttons.append(tk.Button(parent, text="Capture Color", command=lambda: self.capture_color(entries, parent),
+                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG))
+        if "file" in entries:
+            buttons.append(tk.Button(parent, text="Browse", command=lambda: self.browse_macro_file(entries["file"]),
+                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG))
+        if "text" in entries:
+            # Long or multi-line text is easier to bring in from a file than to type into the entry
+            buttons.append(tk.Button(parent, text="Load Text File", command=lambda: self.load_text_file(entries["text"], parent),
+                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG))
+        row = (len(opcode.fields) + 1) // 2
+        for i, button in enumerate(buttons):
+            button.grid(row=row, column=i * 2, columnspan=2, padx=5, pady=pady, sticky="w")
+        return entries
+        
+    def capture_key(self, entry, event):
+        # Key fields take the name of the pressed key rather than the typed text
+        entry.delete(0, tk.END)
+        entry.insert(0, event.keysym)
+        return "break"
+        
+    def record_position(self, button, entries, fields, scale):
+        text = button.cget("text")
+        button.config(text="Left click to complete mouse position recording", state=tk.DISABLED)
         self.log("Waiting for mouse position recording... Left click to complete.")
-        def on_click(x, y, button, pressed):
-            if button == mouse.Button.left and pressed:
-                self.after(0, lambda: self.set_mouse_position(x, y))
-                return False
-        listener = mouse.Listener(on_click=on_click)
-        listener.start()
-        
-    def set_mouse_position(self, x, y):
-        if "x" in self.param_entries:
-            self.param_entries["x"].delete(0, tk.END)
-            self.param_entries["x"].insert(0, str(int(x)))
-        if "y" in self.param_entries:
-            self.param_entries["y"].delete(0, tk.END)
-            self.param_entries["y"].insert(0, str(int(y)))
-        self.log(f"Mouse position recorded: ({int(x)}, {int(y)})")
-        self.button_record_mouse.config(text="Record Mouse Position", state=tk.NORMAL)
+        def set_position(position):
+            # position is None when another capture request took over
+            if not button.winfo_exists():
+                return
+            if position is not None:
+                x, y = self.to_macro_position(*position) if scale else position
+                for name, value in zip(fields, (x, y)):
+                    entries[name].delete(0, tk.END)
+                    entries[name].insert(0, str(value))
+                self.log(f"Mouse position recorded: ({x}, {y})")
+            button.config(text=text, state=tk.NORMAL)
+        self.click_capture.capture(set_position)
+        
+    def capture_color(self, entries, parent):
+        if not self.screen.available():
+            messagebox.showerror("Error", "Image commands need the numpy and mss packages.", parent=parent)
+            return
+        try:
+            x = int(entries["x"].get().strip())
+            y = int(entries["y"].get().strip())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter valid integer X, Y values.", parent=parent)
+            return
+        try:
+            red, green, blue = (int(value) for value in self.screen.capture(x, y, 1, 1)[0, 0])
+        except Exception as e:
+            messagebox.showerror("Error", "Screen capture failed: " + str(e), parent=parent)
+            return
+        color = f"#{red:02x}{green:02x}{blue:02x}"
+        entries["color"].delete(0, tk.END)
+        entries["color"].insert(0, color)
+        self.log(f"Color captured: {color} at ({x}, {y})")
+        
+    def browse_macro_file(self, entry):
+        file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
+        if file_path:
+            entry.delete(0, tk.END)
+            entry.insert(0, file_path)
+            
+    def load_text_file(self, entry, parent):
+        file_path = filedialog.askopenfilename(filetypes=[("Text files", "*.txt"), ("All files", "*")])
+        if not file_path:
+            return
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror("Error", "Text file load failed: " + str(e), parent=parent)
+            return
+        entry.delete(0, tk.END)
+        entry.insert(0, text)
+        
+    def read_command_fields(self, entries):
+        # Entered text by field key; the text to type or paste keeps its leading and trailing spaces
+        return {key: widget.get() if key == "text" else widget.get().strip() for key, widget in entries.items()}
+        
+    def capture_template(self, entries, parent):
+        if not self.screen.available():
+            messagebox.showerror("Error", "Image commands need the numpy and mss packages.", parent=parent)
+            return
+        try:
+            x = int(entries["x"].get().strip())
+            y = int(entries["y"].get().strip())
+            width = int(entries["width"].get().strip())
+            height = int(entries["height"].get().strip())
+            if width <= 0 or height <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Please enter valid integer X, Y, width and height values.", parent=parent)
+            return
+        try:
+            image = self.screen.capture(x, y, width, height)
+        except Exception as e:
+            messagebox.showerror("Error", "Screen capture failed: " + str(e), parent=parent)
+            return
+        entries["template"].set(encode_template(image))
+        self.log(f"Template captured: {width}x{height} at ({x}, {y})")
+        if np.ptp(to_gray(image)) == 0:
+            self.log("The template is a single shade; it is found by its shade, not by a pattern.")
         
     def add_command(self):
         command_type = self.command_type_var.get()
-        if command_type == "Key Tap":
-            key = self.param_entries["key"].get().strip()
-            if key == "":
-                messagebox.showerror("Error", "Please enter a key value.")
-                return
-            try:
-                repeat = int(self.param_entries["repeat"].get().strip())
-            except ValueError:
-                messagebox.showerror("Error", "Please enter a valid repeat count.")
-                return
-            cmd = {"command": "key_tap", "key": key, "repeat": repeat}
-            display_text = f"Key tap: {key} x {repeat} times"
-        elif command_type == "Wait":
-            try:
-                duration = float(self.param_entries["duration"].get().strip())
-            except ValueError:
-                messagebox.showerror("Error", "Please enter a valid wait duration.")
-                return
-            cmd = {"command": "wait", "duration": duration}
-            display_text = f"Wait: {duration} sec"
-        elif command_type == "Mouse Click":
-            x_str = self.param_entries["x"].get().strip()
-            y_str = self.param_entries["y"].get().strip()
-            if not x_str or not y_str:
-                messagebox.showerror("Error", "Please enter X, Y values.")
-                return
-            try:
-                x = int(x_str)
-                y = int(y_str)
-            except ValueError:
-                messagebox.showerror("Error", "Please enter valid integer X, Y values.")
-                return
-            button = self.param_entries["button"].get()
-            cmd = {"command": "mouse_click", "x": x, "y": y, "button": button}
-            display_text = f"Mouse click: ({x}, {y}), button: {button}"
-        elif command_type == "Key Hold":
-            key = self.param_entries["key"].get().strip()
-            if key == "":
-                messagebox.showerror("Error", "Please enter a key value.")
-                return
-            try:
-                duration = float(self.param_entries["duration"].get().strip())
-            except ValueError:
-                messagebox.showerror("Error", "Please enter a valid hold duration.")
-                return
-            cmd = {"command": "key_hold", "key": key, "duration": duration}
-            display_text = f"Key hold: {key} (duration: {duration} sec)"
-        elif command_type == "Mouse Hold":
-            x_str = self.param_entries["x"].get().strip()
-            y_str = self.param_entries["y"].get().strip()
-            if not x_str or not y_str:
-                messagebox.showerror("Error", "Please enter X, Y values.")
-                return
-            try:
-                x = int(x_str)
-                y = int(y_str)
-            except ValueError:
-                messagebox.showerror("Error", "Please enter valid integer X, Y values.")
-                return
-            button = self.param_entries["button"].get()
-            try:
-                duration = float(self.param_entries["duration"].get().strip())
-            except ValueError:
-                messagebox.showerror("Error", "Please enter a valid hold duration.")
-                return
-            cmd = {"command": "mouse_hold", "x": x, "y": y, "button": button, "duration": duration}
-            display_text = f"Mouse hold: ({x}, {y}), button: {button} (duration: {duration} sec)"
-        elif command_type == "Mouse Scroll":
-            try:
-                dx = int(self.param_entries["dx"].get().strip())
-                dy = int(self.param_entries["dy"].get().strip())
-            except ValueError:
-                messagebox.showerror("Error", "Please enter valid scroll values.")
-                return
-            cmd = {"command": "mouse_scroll", "dx": dx, "dy": dy}
-            display_text = f"Mouse scroll: horizontal {dx}, vertical {dy}"
-        else:
+        try:
+            track = int(self.entry_track.get().strip())
+            if track < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a valid track number.")
+            return
+        opcode = COMMAND_TYPES.get(command_type)
+        if opcode is None:
+            return
+        values = self.read_command_fields(self.param_entries)
+        try:
+            cmd = {"command": opcode.name, **opcode.parse(values)}
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
             return
+        display_text = self.format_command(cmd)
+        if track:
+            cmd["track"] = track
+            display_text = self.get_display_text(cmd)
         
         selected = self.listbox.curselection()
         if selected:
@@ -408,6 +1537,7 @@ class ManualMacroGUI(tk.Tk):
         else:
             self.commands.append(cmd)
             self.listbox.insert(tk.END, display_text)
+        self.compiled_tracks = None
         self.log("Command added: " + display_text)
         
     def remove_command(self):
@@ -418,6 +1548,7 @@ class ManualMacroGUI(tk.Tk):
         index = selected[0]
         self.listbox.delete(index)
         removed = self.commands.pop(index)
+        self.compiled_tracks = None
         self.log("Command deleted: " + str(removed))
         
     def play_macro(self):
@@ -429,98 +1560,764 @@ class ManualMacroGUI(tk.Tk):
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid loop count.")
             return
-        self.log("Macro execution started.")
+        try:
+            track_loops = self.parse_track_loops(self.entry_track_loops.get())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter track loop counts as track:count pairs.")
+            return
+        try:
+            run_limit = self.parse_run_limit()
+        except ValueError:
+            return
+        try:
+            humanizer = self.create_humanizer()
+        except ValueError:
+            return
+        try:
+            self.compiled_tracks = self.compiled_tracks or self.compile_commands(self.commands, self.get_macro_folder())
+        except ValueError as e:
+            messagebox.showerror("Error", "Macro compile failed: " + str(e))
+            return
+        tracks = self.compiled_tracks
+        transform = screen_transform(self.macro_screen, self.update_screen_size())
         self.macro_running = True
-        self.button_stop.config(state=tk.NORMAL)
-        thread = threading.Thread(target=self.execute_macro, args=(loop_count,))
-        thread.daemon = True
-        thread.start()
+        self.refresh_run_state()
+        self.editor_worker.request(lambda: self.execute_macro(tracks, loop_count, track_loops, transform, humanizer, run_limit))
+        
+    def parse_run_limit(self):
+        # None, ("duration", seconds) or ("until", epoch seconds); raises ValueError after reporting a bad limit
+        mode = self.run_limit_var.get()
+        text = self.entry_run_limit.get()
+        try:
+            if mode == "duration":
+                return ("duration", parse_run_duration(text))
+            if mode == "until":
+                return ("until", next_clock_time(text))
+        except ValueError:
+            messagebox.showerror("Error", "Please enter the run limit as a duration (90, 45m, 2h, 1:30:00) or a time of day (17:00).")
+            raise
+        return None
+        
+    def create_humanizer(self):
+        # Returns None when humanizing is off; raises ValueError after reporting bad settings
+        if not self.humanize_var.get():
+            return None
+        if np is None:
+            messagebox.showerror("Error", "Humanize needs the numpy package.")
+            raise ValueError("numpy is missing")
+        try:
+            jitter = float(self.entry_jitter.get().strip()) / 100
+            seed_text = self.entry_seed.get().strip()
+            seed = int(seed_text) if seed_text else int(np.random.default_rng().integers(2 ** 31))
+            if not 0 <= jitter <= 1 or seed < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a jitter from 0 to 100 and a non-negative integer seed.")
+            raise
+        # Logged so a random run can be repeated by entering the same seed
+        self.log(f"Humanizer seed: {seed}")
+        return Humanizer(jitter, seed)
+        
+    def update_screen_size(self):
+        self.screen_size = (self.winfo_screenwidth(), self.winfo_screenheight())
+        return self.screen_size
+        
+    def to_macro_position(self, x, y):
+        # Maps a position on the current screen into the editor macro's coordinate space
+        return (round(x * self.macro_screen[0] / self.screen_size[0]),
+                round(y * self.macro_screen[1] / self.screen_size[1]))
+        
+    def get_overlap_policy(self):
+        return self.overlap_policy
         
-    def execute_macro(self, loop_count):
+    def set_overlap_policy(self, policy):
+        self.overlap_policy = policy
+        self.log("Overlap policy: " + policy)
+        
+    def set_speed(self, speed):
+        # Running macros pick the new speed up at once; nothing is recompiled
+        self.speed_var.set(speed)
+        self.engine.loop.call_soon_threadsafe(CLOCK.set_speed, SPEEDS[speed])
+        self.log("Playback speed: " + speed)
+        
+    def step_speed(self, step):
+        speeds = list(SPEEDS)
+        index = speeds.index(self.speed_var.get()) + step
+        if 0 <= index < len(speeds):
+            self.set_speed(speeds[index])
+        
+    def parse_track_loops(self, text):
+        track_loops = {}
+        for item in text.replace(";", ",").split(","):
+            if not item.strip():
+                continue
+            track, count = item.split(":")
+            track_loops[int(track)] = int(count)
+        if any(track < 0 or count < 0 for track, count in track_loops.items()):
+            raise ValueError("negative track or loop count")
+        return track_loops
+        
+    def format_track_loops(self, track_loops):
+        return ", ".join(f"{track}:{count}" for track, count in sorted(track_loops.items()))
+        
+    def show_disassembly(self):
+        if not self.commands:
+            messagebox.showinfo("Info", "No commands to execute.")
+            return
+        try:
+            self.compiled_tracks = self.compiled_tracks or self.compile_commands(self.commands, self.get_macro_folder())
+        except ValueError as e:
+            messagebox.showerror("Error", "Macro compile failed: " + str(e))
+            return
+        win = tk.Toplevel(self)
+        win.title("Bytecode")
+        win.configure(bg=BG_COLOR)
+        text = tk.Text(win, width=100, height=30, bg=LISTBOX_BG, fg=LISTBOX_FG, font=("Courier", 11), relief=tk.FLAT)
+        for track, code in sorted(self.compiled_tracks.items()):
+            text.insert(tk.END, f"Track {track}: {len(code)} instructions\n")
+            text.insert(tk.END, "\n".join(code.disassemble()) + "\n\n")
+        text.config(state=tk.DISABLED)
+        text.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+        
+    def show_analysis(self):
+        if not self.commands:
+            messagebox.showinfo("Info", "No commands to execute.")
+            return
+        try:
+            # Compiling first catches unbalanced blocks the estimate would otherwise guess around
+            self.compiled_tracks = self.compiled_tracks or self.compile_commands(self.commands, self.get_macro_folder())
+        except ValueError as e:
+            messagebox.showerror("Error", "Macro compile failed: " + str(e))
+            return
+        try:
+            loop_count = int(self.entry_loop.get().strip())
+            track_loops = self.parse_track_loops(self.entry_track_loops.get())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a valid loop count and track loop counts as track:count pairs.")
+            return
+        lines = describe_estimates(analyze_commands(self.commands, self.get_macro_folder()), self.speed_var.get(),
+                                   loop_count, track_loops)
+        win = tk.Toplevel(self)
+        win.title("Macro Analysis")
+        win.configure(bg=BG_COLOR)
+        text = tk.Text(win, width=100, height=30, bg=LISTBOX_BG, fg=LISTBOX_FG, font=("Courier", 11), relief=tk.FLAT)
+        text.insert(tk.END, "\n".join(lines) + "\n")
+        text.config(state=tk.DISABLED)
+        text.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+        
+    def compile_commands(self, commands, folder=""):
+        # Group commands by track and compile each track on its own
+        grouped = {}
+        for cmd in commands:
+            grouped.setdefault(cmd.get("track", 0), []).append(cmd)
+        tracks = {}
+        for track, track_commands in grouped.items():
+            try:
+                tracks[track] = self.compile_code(track_commands, folder)
+            except ValueError as e:
+                raise ValueError(f"track {track}: {e}") from None
+        return tracks
+        
+    def compile_code(self, commands, folder=""):
+        # Resolves keys/buttons once and turns blocks into jumps to absolute indices,
+        # so a jump costs the same however deeply the blocks are nested.
+        # A relative Call file is found in folder, the one of the calling macro; "" is the working directory
+        code = Bytecode()
+        blocks = []  # Indices of the open Loop Start / If / Else commands
+        labels = {}
+        gotos = []
+        for index, cmd in enumerate(commands):
+            name = cmd["command"]
+            number = OPCODE_NUMBERS.get(name)
+            if number is None:
+                raise ValueError(f"Unknown command {name} (command {index + 1})")
+            resolve = OPCODES[number].resolve
+            target = resolve(cmd) if resolve else None
+            jump = -1
+            if name == "if_pixel":
+                # The jump past the block is filled in by Else / End If
+                blocks.append(index)
+            elif name in ("loop_start", "if_variable"):
+                blocks.append(index)
+            elif name == "loop_end":
+                if not blocks or commands[blocks[-1]]["command"] != "loop_start":
+                    raise ValueError(f"Loop End without Loop Start (command {index + 1})")
+                jump = blocks.pop()  # Back to the Loop Start, which is skipped
+            elif name in ("else", "end_if"):
+                opener = commands[blocks[-1]]["command"] if blocks else None
+                if opener not in (("if_pixel", "if_variable") if name == "else" else ("if_pixel", "if_variable", "else")):
+                    raise ValueError(f"{'Else' if name == 'else' else 'End If'} without If (command {index + 1})")
+                # A false condition jumps past this command, and so does the end of an If part into its Else part
+                code.args[blocks.pop()] = index + 1
+                if name == "else":
+                    blocks.append(index)
+            elif name == "label":
+                if cmd["name"] in labels:
+                    raise ValueError(f"Duplicate Label {cmd['name']} (command {index + 1})")
+                labels[cmd["name"]] = index
+            elif name == "goto":
+                gotos.append(index)
+            elif name == "call":
+                target = os.path.abspath(os.path.join(folder, cmd["file"]))
+            code.append(number, cmd, target, jump)
+        if blocks:
+            start_name = commands[blocks[-1]]["command"]
+            raise ValueError(f"{'Loop Start' if start_name == 'loop_start' else 'If'} without end (command {blocks[-1] + 1})")
+        for index in gotos:
+            cmd = code.cmds[index]
+            if cmd["label"] not in labels:
+                raise ValueError(f"Go To unknown Label {cmd['label']} (command {index + 1})")
+            code.args[index] = labels[cmd["label"]]
+        return code
+        
+    async def execute_macro(self, tracks, loop_count, track_loops, transform, humanizer=None, run_limit=None):
+        self.log("Macro execution started.")
+        self.editor_program = {"tracks": transform_tracks(tracks, transform), "screen": self.screen_size,
+                               "humanizer": humanizer, "variables": {}, "subroutines": {},
+                               "stop_at": run_stop_time(run_limit),
+                               "loop_count": loop_count, "track_loops": track_loops}
+        try:
+            await self.run_macro(self.editor_program)
+        finally:
+            self.editor_program = None
+            self.log("Macro execution completed.")
+                
+    def finish_macro_run(self):
+        # Called after every editor run, also one cancelled by Stop; a request queued meanwhile keeps Stop enabled
+        if not self.editor_worker.is_busy():
+            self.macro_running = False
+            self.refresh_run_state()
+        
+    def refresh_run_state(self):
+        self.button_stop.config(state=tk.NORMAL if self.macro_running else tk.DISABLED)
+        
+    async def run_macro(self, program):
+        # All tracks are scheduled against the same start time
+        start_time = CLOCK.now()
+        tasks = []
+        awaited = []
+        for track in sorted(program["tracks"]):
+            task = asyncio.ensure_future(self.execute_track(track, program, start_time))
+            tasks.append(task)
+            if track == 0 or get_track_loop_count(program, track) != 0:
+                awaited.append(task)
+        try:
+            # Infinite tracks run alongside the main and finite ones and end with them
+            await asyncio.gather(*(awaited or tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+    async def execute_track(self, track, program, start_time):
+        deadline = start_time
         iteration = 0
-        while self.macro_running and (loop_count == 0 or iteration < loop_count):
-            self.log(f"Iteration {iteration+1} started.")
-            for cmd in self.commands:
-                if not self.macro_running:
+        humanizer = program.get("humanizer")
+        if humanizer:
+            humanizer = humanizer.for_track(track)
+        stop_at = program.get("stop_at")
+        loop = asyncio.get_running_loop()
+        while True:
+            # A reloaded macro file can change the loop count; it takes effect here
+            loop_count = get_track_loop_count(program, track)
+            if loop_count and iteration >= loop_count:
+                break
+            if stop_at is not None and loop.time() >= stop_at:
+                break
+            if track == 0:
+                self.log(f"Iteration {iteration+1} started.")
+            else:
+                self.log(f"Track {track}: iteration {iteration+1} started.")
+            # A reloaded macro file replaces program["tracks"]; it takes effect here
+            run = self.run_code(program["tracks"].get(track) or Bytecode(), program, deadline, humanizer)
+            if stop_at is None:
+                deadline = await run
+            else:
+                finished, deadline = await self.run_until(run, stop_at)
+                if not finished:
                     break
-                if cmd["command"] == "key_tap":
-                    key = cmd["key"]
-                    repeat = cmd.get("repeat", 1)
-                    for _ in range(repeat):
-                        if not self.macro_running:
-                            break
-                        try:
-                            key_obj = getattr(keyboard.Key, key.lower())
-                        except AttributeError:
-                            key_obj = key
-                        self.keyboard_controller.press(key_obj)
-                        self.keyboard_controller.release(key_obj)
-                        self.log(f"Key tap executed: {key}")
-                        time.sleep(0.05)
-                elif cmd["command"] == "key_hold":
+            iteration += 1
+            if track == 0:
+                self.log(f"Iteration {iteration} completed.")
+            else:
+                self.log(f"Track {track}: iteration {iteration} completed.")
+            # An iteration made only of control flow never waits; this keeps the engine thread
+            # free for Stop and the other macros
+            await asyncio.sleep(0)
+        if loop_count == 0 or iteration < loop_count:
+            # Only the run limit ends a track before its loop count
+            if track == 0:
+                self.log(f"Run limit reached after {iteration} completed iterations.")
+            else:
+                self.log(f"Track {track}: run limit reached after {iteration} completed iterations.")
+        return iteration
+        
+    async def run_until(self, coro, stop_at):
+        # Runs coro to its end, or cancels it at stop_at (loop time) even in the middle of a long wait.
+        # Returns (True, result) or (False, None)
+        task = asyncio.ensure_future(coro)
+        try:
+            await asyncio.wait([task], timeout=stop_at - asyncio.get_running_loop().time())
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.wait([task])
+        if task.cancelled():
+            return False, None
+        return True, task.result()
+        
+    async def run_code(self, code, program, deadline, humanizer, depth=0):
+        # Generated code is the fast path; the interpreter covers humanized runs and Go To
+        if humanizer is None:
+            run = self.get_generated_code(code, program)
+            if run is not None:
+                return await run(deadline, depth)
+        return await self.interpret_code(code, program, deadline, humanizer, depth)
+        
+    def get_generated_code(self, code, program):
+        # One function per command list and run, so the hash is only computed when a track is reloaded
+        generated = program.setdefault("generated", {})
+        entry = generated.get(id(code))
+        if entry is None or entry[0] is not code:
+            digest = hashlib.sha256(json.dumps(code.cmds, sort_keys=True).encode("utf-8")).hexdigest()
+            if digest not in self.generated_code:
+                if len(self.generated_code) >= MAX_CACHED_MACROS:
+                    self.generated_code.clear()
+                source = self.generate_source(code)
+                if source is None:
+                    self.generated_code[digest] = None
+                else:
+                    namespace = {"asyncio": asyncio, "sleep_until": sleep_until}
+                    exec(compile(source, f"<macro {digest[:12]}>", "exec"), namespace)
+                    self.generated_code[digest] = namespace["make"]
+            make = self.generated_code[digest]
+            run = None if make is None else make(self, program, code.targets, code.cmds)
+            entry = generated[id(code)] = (code, run)
+        return entry[1]
+        
+    def generate_source(self, code):
+        # Straight-line Python for one compiled command list, or None when it uses Go To.
+        # Values from the macro are only ever written with repr(), never as code
+        head = ["def make(gui, program, targets, cmds):",
+                "    press = gui.keyboard_controller.press",
+                "    release = gui.keyboard_controller.release",
+                "    mouse = gui.mouse_controller",
+                "    click = mouse.click",
+                "    mouse_press = mouse.press",
+                "    mouse_release = mouse.release",
+                "    scroll = mouse.scroll",
+                "    log = gui.log",
+                "    execute_command = gui.execute_command",
+                "    call_macro = gui.call_macro",
+                "    set_variable = gui.set_variable",
+                "    matches = gui.screen.matches",
+                "    variables = program['variables']"]
+        body = ["    async def run(deadline, depth):"]
+        indent = "        "
+        def emit(*statements):
+            body.extend(indent + statement for statement in statements)
+        def close_block():
+            if body[-1].endswith(":"):
+                emit("pass")
+        def number(value):
+            # repr() of inf and nan is a bare name, so those are bound once in make()
+            if isinstance(value, float) and not math.isfinite(value):
+                constant = f"n{len(head)}"
+                head.append(f"    {constant} = float({str(value)!r})")
+                return constant
+            return repr(value)
+        for index, op in enumerate(code.ops):
+            name = OPCODES[op].name
+            cmd = code.cmds[index]
+            target = code.targets[index]
+            if target is not None:
+                head.append(f"    t{index} = targets[{index}]")
+            if name == "key_tap":
+                key = cmd["key"]
+                message = f"Key tap executed: {key}"
+                repeat = int(cmd.get("repeat", 1))
+                if repeat != 1:
+                    emit(f"for _ in range({repeat}):")
+                    indent += "    "
+                emit(f"press(t{index})", f"release(t{index})", f"log({message!r})",
+                     f"deadline += {KEY_TAP_GAP!r}", "deadline = await sleep_until(deadline)")
+                if repeat != 1:
+                    close_block()
+                    indent = indent[:-4]
+            elif name == "key_chord":
+                message = f"Key chord executed: {cmd['keys']}"
+                emit(*(f"press(t{index}[{i}])" for i in range(len(target))),
+                     *(f"release(t{index}[{i}])" for i in reversed(range(len(target)))), f"log({message!r})")
+            elif name in ("key_hold", "mouse_hold"):
+                if name == "key_hold":
                     key = cmd["key"]
-                    duration = cmd["duration"]
-                    try:
-                        key_obj = getattr(keyboard.Key, key.lower())
-                    except AttributeError:
-                        key_obj = key
-                    self.keyboard_controller.press(key_obj)
-                    self.log(f"Key hold start: {key}")
-                    time.sleep(duration)
-                    self.keyboard_controller.release(key_obj)
-                    self.log(f"Key hold end: {key}")
-                elif cmd["command"] == "wait":
-                    duration = cmd["duration"]
-                    self.log(f"Wait start: {duration} seconds")
-                    time.sleep(duration)
-                    self.log("Wait end")
-                elif cmd["command"] == "mouse_click":
-                    x = cmd["x"]
-                    y = cmd["y"]
-                    button_str = cmd["button"]
-                    if button_str == "left":
-                        btn = mouse.Button.left
-                    elif button_str == "right":
-                        btn = mouse.Button.right
-                    elif button_str == "middle":
-                        btn = mouse.Button.middle
-                    else:
-                        btn = mouse.Button.left
-                    self.mouse_controller.position = (x, y)
-                    self.mouse_controller.click(btn)
-                    self.log(f"Mouse click executed: ({x}, {y}), button: {button_str}")
-                elif cmd["command"] == "mouse_hold":
-                    x = cmd["x"]
-                    y = cmd["y"]
+                    start = f"Key hold start: {key}"
+                    end = f"Key hold end: {key}"
+                    emit(f"press(t{index})", f"log({start!r})")
+                else:
+                    x = int(cmd["x"])
+                    y = int(cmd["y"])
                     button_str = cmd["button"]
-                    if button_str == "left":
-                        btn = mouse.Button.left
-                    elif button_str == "right":
-                        btn = mouse.Button.right
-                    elif button_str == "middle":
-                        btn = mouse.Button.middle
+                    start = f"Mouse hold start: ({x}, {y}), button: {button_str}"
+                    end = f"Mouse hold end: ({x}, {y}), button: {button_str}"
+                    emit(f"mouse.position = ({x}, {y})", f"mouse_press(t{index})", f"log({start!r})")
+                release = "release" if name == "key_hold" else "mouse_release"
+                emit(f"deadline += {number(float(cmd['duration']))}", "try:", "    deadline = await sleep_until(deadline)",
+                     "finally:", f"    {release}(t{index})", f"    log({end!r})")
+            elif name == "wait":
+                duration = cmd["duration"]
+                start = f"Wait start: {duration} seconds"
+                end = "Wait end"
+                emit(f"log({start!r})", f"deadline += {number(float(duration))}", "deadline = await sleep_until(deadline)", f"log({end!r})")
+            elif name == "mouse_click":
+                x = int(cmd["x"])
+                y = int(cmd["y"])
+                button_str = cmd["button"]
+                message = f"Mouse click executed: ({x}, {y}), button: {button_str}"
+                emit(f"mouse.position = ({x}, {y})", f"click(t{index})", f"log({message!r})")
+            elif name == "mouse_scroll":
+                dx = int(cmd["dx"])
+                dy = int(cmd["dy"])
+                message = f"Mouse scroll: horizontal {dx}, vertical {dy}"
+                emit(f"scroll({dx}, {dy})", f"log({message!r})")
+            elif name == "loop_start":
+                emit(f"for _ in range({int(cmd['count'])}):" if cmd["count"] else "while True:")
+                indent += "    "
+            elif name == "loop_end":
+                # Lets Stop through even when the loop body never waits
+                emit("await asyncio.sleep(0)")
+                indent = indent[:-4]
+            elif name == "if_pixel":
+                if target is None or not self.screen.available():
+                    message = "Image commands need the numpy and mss packages."
+                    emit(f"raise RuntimeError({message!r})")
+                emit(f"if await matches({int(cmd['x'])}, {int(cmd['y'])}, t{index}, {int(cmd.get('tolerance', 0))}):")
+                indent += "    "
+            elif name == "if_variable":
+                if cmd["op"] not in COMPARISONS or not isinstance(cmd["value"], (int, float)):
+                    raise ValueError(f"invalid condition: {cmd['op']} {cmd['value']!r}")
+                emit(f"if variables.get({str(cmd['name'])!r}, 0) {cmd['op']} {number(cmd['value'])}:")
+                indent += "    "
+            elif name == "else":
+                close_block()
+                indent = indent[:-4]
+                emit("else:")
+                indent += "    "
+            elif name == "end_if":
+                close_block()
+                indent = indent[:-4]
+            elif name == "set_variable":
+                head.append(f"    c{index} = cmds[{index}]")
+                emit(f"set_variable(c{index}, variables)")
+            elif name == "call":
+                emit(f"deadline = await call_macro(t{index}, program, deadline, None, depth)")
+            elif name == "return":
+                emit("return deadline")
+            elif name == "goto":
+                return None
+            elif OPCODES[op].execute is not None:
+                # Label and plugin commands without an executor do nothing, as in interpret_code
+                head.append(f"    c{index} = cmds[{index}]")
+                emit(f"deadline = await execute_command({name!r}, c{index}, {f't{index}' if target is not None else 'None'}, deadline)")
+            if OPCODES[op].execute is not None:
+                emit(f"deadline += {COMMAND_GAP!r}", "deadline = await sleep_until(deadline)")
+        emit("return deadline")
+        return "\n".join(head + body + ["    return run", ""])
+        
+    async def interpret_code(self, code, program, deadline, humanizer, depth=0):
+        # The bytecode VM: commands go to the executor of their opcode, control flow is handled here
+        # and jumps go straight to the index stored by compile_code
+        ops, args, cmds, targets = code.ops, code.args, code.cmds, code.targets
+        executors = OPCODE_EXECUTORS
+        counters = {}  # Passes left of each running loop, by the index of its Loop Start
+        variables = program["variables"]
+        pc = 0
+        end = len(ops)
+        while pc < end:
+            op = ops[pc]
+            execute = executors[op]
+            if execute is not None:
+                deadline = await execute(self, cmds[pc], targets[pc], deadline, humanizer)
+                deadline += humanizer.vary(COMMAND_GAP) if humanizer else COMMAND_GAP
+                deadline = await sleep_until(deadline)
+            elif op == OP_LOOP_START:
+                counters[pc] = cmds[pc]["count"]
+            elif op == OP_LOOP_END:
+                # An infinite loop (count 0) goes negative and never reaches zero
+                start = args[pc]
+                left = counters.get(start, 1) - 1
+                if left != 0:
+                    counters[start] = left
+                    pc = start + 1
+                    # Lets Stop through even when the loop body never waits
+                    await asyncio.sleep(0)
+                    continue
+            elif op == OP_IF_PIXEL:
+                cmd = cmds[pc]
+                if targets[pc] is None or not self.screen.available():
+                    raise RuntimeError("Image commands need the numpy and mss packages.")
+                if not await self.screen.matches(cmd["x"], cmd["y"], targets[pc], cmd.get("tolerance", 0)):
+                    pc = args[pc]
+                    continue
+            elif op == OP_IF_VARIABLE:
+                cmd = cmds[pc]
+                if not COMPARISONS[cmd["op"]](variables.get(cmd["name"], 0), cmd["value"]):
+                    pc = args[pc]
+                    continue
+            elif op == OP_ELSE:
+                pc = args[pc]
+                continue
+            elif op == OP_GOTO:
+                pc = args[pc]
+                await asyncio.sleep(0)
+                continue
+            elif op == OP_SET_VARIABLE:
+                self.set_variable(cmds[pc], variables)
+            elif op == OP_CALL:
+                deadline = await self.call_macro(targets[pc], program, deadline, humanizer, depth)
+            elif op == OP_RETURN:
+                break
+            pc += 1
+        return deadline
+        
+    def set_variable(self, cmd, variables):
+        variables[cmd["name"]] = ASSIGNMENTS[cmd["op"]](variables.get(cmd["name"], 0), cmd["value"])
+        self.log(f"Variable set: {cmd['name']} = {variables[cmd['name']]}")
+        
+    async def call_macro(self, path, program, deadline, humanizer, depth):
+        if depth >= MAX_CALL_DEPTH:
+            raise RuntimeError(f"Macro calls are nested more than {MAX_CALL_DEPTH} deep: {path}")
+        code = program["subroutines"].get(path)
+        if code is None:
+            # Compiled once per run, off the engine loop so the other tracks keep their timing meanwhile
+            loop = asyncio.get_running_loop()
+            code = await loop.run_in_executor(None, self.compile_subroutine, path, program["screen"])
+            program["subroutines"][path] = code
+        self.log("Macro call: " + path)
+        deadline = await self.run_code(code, program, deadline, humanizer, depth + 1)
+        self.log("Macro call returned: " + path)
+        return deadline
+        
+    def compile_subroutine(self, path, screen):
+        # The commands of every track of the called file run in order; its own calls are relative to its folder
+        commands, _, file_screen = self.read_macro_file(path)
+        transform = screen_transform(file_screen or screen, screen)
+        return transform_tracks({0: self.compile_code(commands, os.path.dirname(path))}, transform)[0]
+        
+    async def execute_command(self, name, cmd, target, deadline, humanizer=None):
+        # Runs one command starting at deadline and returns the time it ends
+        return await OPCODES[OPCODE_NUMBERS[name]].execute(self, cmd, target, deadline, humanizer)
+        
+    async def execute_key_tap(self, cmd, target, deadline, humanizer):
+        key = cmd["key"]
+        repeat = cmd.get("repeat", 1)
+        for _ in range(repeat):
+            self.keyboard_controller.press(target)
+            self.keyboard_controller.release(target)
+            self.log(f"Key tap executed: {key}")
+            deadline += KEY_TAP_GAP
+            deadline = await sleep_until(deadline)
+        return deadline
+        
+    async def execute_key_chord(self, cmd, target, deadline, humanizer):
+        # Pressed in order and released in reverse, with nothing in between
+        for key in target:
+            self.keyboard_controller.press(key)
+        for key in reversed(target):
+            self.keyboard_controller.release(key)
+        self.log(f"Key chord executed: {cmd['keys']}")
+        return deadline
+        
+    async def execute_key_hold(self, cmd, target, deadline, humanizer):
+        key = cmd["key"]
+        self.keyboard_controller.press(target)
+        self.log(f"Key hold start: {key}")
+        deadline += cmd["duration"]
+        try:
+            deadline = await sleep_until(deadline)
+        finally:
+            self.keyboard_controller.release(target)
+            self.log(f"Key hold end: {key}")
+        return deadline
+        
+    async def execute_wait(self, cmd, target, deadline, humanizer):
+        duration = cmd["duration"]
+        if humanizer:
+            duration = round(humanizer.vary(duration), 3)
+        self.log(f"Wait start: {duration} seconds")
+        deadline += duration
+        deadline = await sleep_until(deadline)
+        self.log("Wait end")
+        return deadline
+        
+    async def execute_mouse_click(self, cmd, target, deadline, humanizer):
+        x = cmd["x"]
+        y = cmd["y"]
+        button_str = cmd["button"]
+        deadline = await self.move_pointer(x, y, deadline, humanizer)
+        self.mouse_controller.click(target)
+        self.log(f"Mouse click executed: ({x}, {y}), button: {button_str}")
+        return deadline
+        
+    async def execute_mouse_hold(self, cmd, target, deadline, humanizer):
+        x = cmd["x"]
+        y = cmd["y"]
+        button_str = cmd["button"]
+        deadline = await self.move_pointer(x, y, deadline, humanizer)
+        self.mouse_controller.press(target)
+        self.log(f"Mouse hold start: ({x}, {y}), button: {button_str}")
+        deadline += cmd["duration"]
+        try:
+            deadline = await sleep_until(deadline)
+        finally:
+            self.mouse_controller.release(target)
+            self.log(f"Mouse hold end: ({x}, {y}), button: {button_str}")
+        return deadline
+        
+    async def execute_type_text(self, cmd, target, deadline, humanizer):
+        # One keystroke per character on a fixed grid; a rate of 0 sends the whole text at once
+        cps = cmd.get("cps", TYPE_RATE)
+        interval = 1 / cps if cps else 0
+        shifted = False
+        try:
+            for key, shift in target:
+                # Shift stays down across a run of capitals
+                if shift != shifted:
+                    if shift:
+                        self.keyboard_controller.press(keyboard.Key.shift)
                     else:
-                        btn = mouse.Button.left
-                    self.mouse_controller.position = (x, y)
-                    self.mouse_controller.press(btn)
-                    self.log(f"Mouse hold start: ({x}, {y}), button: {button_str}")
-                    time.sleep(cmd["duration"])
-                    self.mouse_controller.release(btn)
-                    self.log(f"Mouse hold end: ({x}, {y}), button: {button_str}")
-                elif cmd["command"] == "mouse_scroll":
-                    dx = cmd["dx"]
-                    dy = cmd["dy"]
-                    self.mouse_controller.scroll(dx, dy)
-                    self.log(f"Mouse scroll: horizontal {dx}, vertical {dy}")
-                time.sleep(0.1)
-            iteration += 1
-            self.log(f"Iteration {iteration} completed.")
-        self.log("Macro execution completed.")
-        self.macro_running = False
-        self.button_stop.config(state=tk.DISABLED)
+                        self.keyboard_controller.release(keyboard.Key.shift)
+                    shifted = shift
+                self.keyboard_controller.press(key)
+                self.keyboard_controller.release(key)
+                if interval:
+                    deadline += humanizer.vary(interval) if humanizer else interval
+                    deadline = await sleep_until(deadline)
+        finally:
+            if shifted:
+                self.keyboard_controller.release(keyboard.Key.shift)
+        self.log(f"Text typed: {len(target)} characters")
+        return deadline
+        
+    async def execute_paste_text(self, cmd, target, deadline, humanizer):
+        # The clipboard belongs to the Tk thread: the text is set there and the paste waits until it is
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        def set_clipboard():
+            self.clipboard_clear()
+            self.clipboard_append(cmd["text"])
+            loop.call_soon_threadsafe(wake_future, ready)
+        self.ui.post(set_clipboard)
+        await ready
+        self.keyboard_controller.press(keyboard.Key.ctrl)
+        try:
+            self.keyboard_controller.press(target)
+            self.keyboard_controller.release(target)
+        finally:
+            self.keyboard_controller.release(keyboard.Key.ctrl)
+        self.log(f"Text pasted: {len(cmd['text'])} characters")
+        # The rest of the macro is timed from the paste
+        deadline = CLOCK.now()
+        return deadline
+        
+    async def execute_mouse_scroll(self, cmd, target, deadline, humanizer):
+        dx = cmd["dx"]
+        dy = cmd["dy"]
+        self.mouse_controller.scroll(dx, dy)
+        self.log(f"Mouse scroll: horizontal {dx}, vertical {dy}")
+        return deadline
+        
+    async def execute_mouse_move(self, cmd, target, deadline, humanizer):
+        x = cmd["x"]
+        y = cmd["y"]
+        deadline = await self.move_pointer(x, y, deadline, humanizer, cmd.get("duration", 0), cmd.get("easing", "ease-in-out"))
+        self.log(f"Mouse moved: ({x}, {y})")
+        return deadline
+        
+    async def execute_mouse_drag(self, cmd, target, deadline, humanizer):
+        x = cmd["x"]
+        y = cmd["y"]
+        to_x = cmd["to_x"]
+        to_y = cmd["to_y"]
+        button_str = cmd["button"]
+        deadline = await self.move_pointer(x, y, deadline, humanizer)
+        self.mouse_controller.press(target)
+        self.log(f"Mouse drag start: ({x}, {y}), button: {button_str}")
+        try:
+            deadline = await self.move_pointer(to_x, to_y, deadline, humanizer,
+                                               cmd.get("duration", 0), cmd.get("easing", "ease-in-out"))
+        finally:
+            # The button is let go even when the run is stopped mid-drag
+            self.mouse_controller.release(target)
+            self.log(f"Mouse drag end: ({to_x}, {to_y}), button: {button_str}")
+        return deadline
+        
+    async def execute_wait_image(self, cmd, target, deadline, humanizer):
+        if target is None or not self.screen.available():
+            raise RuntimeError("Image commands need the numpy and mss packages.")
+        x = cmd["x"]
+        y = cmd["y"]
+        tolerance = cmd.get("tolerance", 0)
+        poll_interval = cmd.get("poll_interval", IMAGE_POLL_INTERVAL)
+        timeout = cmd.get("timeout", 0)
+        self.log(f"Wait for image start: ({x}, {y})")
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        poll_time = start
+        matched = await self.screen.matches(x, y, target, tolerance)
+        while not matched:
+            if timeout and loop.time() - start >= timeout:
+                break
+            # Polls stay on a fixed grid so the rate does not drift with the grab time
+            poll_time += poll_interval
+            await asyncio.sleep(poll_time - loop.time())
+            matched = await self.screen.matches(x, y, target, tolerance)
+        if matched:
+            self.log(f"Image matched after {loop.time() - start:.2f} seconds")
+        else:
+            self.log(f"Wait for image timed out after {timeout} seconds")
+        # The rest of the macro is timed from the moment the screen was ready
+        deadline = CLOCK.now()
+        return deadline
+        
+    async def execute_click_image(self, cmd, target, deadline, humanizer):
+        if target is None or not self.screen.available():
+            raise RuntimeError("Image commands need the numpy and mss packages.")
+        button, matcher = target
+        button_str = cmd["button"]
+        region = (cmd.get("search_x", 0), cmd.get("search_y", 0), cmd.get("search_width", 0), cmd.get("search_height", 0))
+        hit = await self.screen.find(matcher, region, cmd.get("threshold", MATCH_THRESHOLD))
+        if hit is None:
+            self.log("Image not found; click skipped")
+        else:
+            # Click the center of the match
+            x = hit[0] + matcher.width // 2
+            y = hit[1] + matcher.height // 2
+            self.mouse_controller.position = (x, y)
+            self.mouse_controller.click(button)
+            self.log(f"Image click executed: ({x}, {y}), score: {hit[2]:.2f}, button: {button_str}")
+        deadline = max(deadline, CLOCK.now())
+        return deadline
+        
+    async def move_pointer(self, x, y, deadline, humanizer, duration=0, easing="ease-in-out"):
+        if humanizer is not None:
+            points, interval = humanizer.path(self.mouse_controller.position, (x, y), duration, easing)
+        elif duration > 0:
+            points, interval = interpolate_path(self.mouse_controller.position, (x, y), duration, easing)
+        else:
+            self.mouse_controller.position = (x, y)
+            return deadline
+        # Points go out on a fixed grid of deadlines, nothing is computed in between
+        for point in points[1:]:
+            deadline += interval
+            deadline = await sleep_until(deadline)
+            self.mouse_controller.position = point
+        return deadline
         
     def stop_macro(self):
         self.macro_running = False
+        self.refresh_run_state()
+        self.editor_worker.cancel()
         self.log("Macro stop requested.")
         
     def save_macro(self):
@@ -529,9 +2326,23 @@ class ManualMacroGUI(tk.Tk):
         if not file_path:
             return
         try:
-            with open(file_path, "w") as f:
-                json.dump(self.commands, f, indent=4)
+            track_loops = self.parse_track_loops(self.entry_track_loops.get())
+            # The screen size makes the coordinates portable to other resolutions
+            data = {"screen": list(self.macro_screen), "commands": self.commands}
+            if track_loops:
+                data["track_loops"] = track_loops
+            content = json.dumps(data, indent=4).encode("utf-8")
+            with open(file_path, "wb") as f:
+                f.write(content)
             self.log("Macro saved: " + file_path)
+            digest = hashlib.sha256(content).hexdigest()
+            folder = os.path.dirname(os.path.abspath(file_path))
+            if self.load_compiled_macro(digest, folder) is None:
+                self.save_compiled_macro(digest, folder, self.compile_macro(self.commands, track_loops, self.macro_screen, folder))
+            self.save_last_macro_cache(file_path, get_file_signature(file_path), digest)
+            # Relative Call files now resolve against the folder it was saved to
+            self.compiled_tracks = None
+            self.set_macro_path(file_path)
         except Exception as e:
             messagebox.showerror("Error", "Macro save failed: " + str(e))
         
@@ -539,51 +2350,362 @@ class ManualMacroGUI(tk.Tk):
         file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
         if not file_path:
             return
+        self.load_macro_file(file_path)
+        
+    def load_macro_file(self, file_path):
         try:
-            with open(file_path, "r") as f:
-                self.commands = json.load(f)
+            compiled = self.read_macro_file_cached(file_path)
+            self.commands = compiled["commands"]
+            self.compiled_tracks = compiled["tracks"]
+            self.macro_screen = self.get_macro_screen(compiled["screen"])
+            self.entry_track_loops.delete(0, tk.END)
+            self.entry_track_loops.insert(0, self.format_track_loops(compiled["track_loops"]))
             self.listbox.delete(0, tk.END)
-            for cmd in self.commands:
-                disp = self.get_display_text(cmd)
+            for disp in compiled["display"]:
                 self.listbox.insert(tk.END, disp)
                 self.log("Loaded command: " + disp)
             self.log("Macro loaded: " + file_path)
+            self.set_macro_path(file_path)
         except Exception as e:
             messagebox.showerror("Error", "Macro load failed: " + str(e))
             
+    def read_macro_file_cached(self, file_path):
+        # The last macro cache maps an unchanged file (same mtime and size) to its content hash,
+        # so the file does not even have to be read and hashed again
+        signature = get_file_signature(file_path)
+        content = None
+        digest = None
+        try:
+            with open(LAST_MACRO_CACHE_FILE, "rb") as f:
+                cache = pickle.load(f)
+            if cache["path"] == os.path.abspath(file_path) and cache["signature"] == signature:
+                digest = cache["digest"]
+        except Exception:
+            pass
+        if digest is None:
+            with open(file_path, "rb") as f:
+                content = f.read()
+            digest = hashlib.sha256(content).hexdigest()
+        folder = os.path.dirname(os.path.abspath(file_path))
+        compiled = self.load_compiled_macro(digest, folder)
+        if compiled is None:
+            if content is None:
+                with open(file_path, "rb") as f:
+                    content = f.read()
+            commands, track_loops, screen = self.parse_macro_data(json.loads(content))
+            compiled = self.compile_macro(commands, track_loops, screen, folder)
+            self.save_compiled_macro(digest, folder, compiled)
+        self.save_last_macro_cache(file_path, signature, digest)
+        return compiled
+        
+    def compile_macro(self, commands, track_loops, screen, folder):
+        # Everything needed to show and run a macro without parsing it again
+        try:
+            tracks = self.compile_commands(commands, folder)
+        except ValueError:
+            tracks = None  # Unbalanced blocks are reported when the macro is played
+        return {
+            "commands": commands,
+            "track_loops": track_loops,
+            "screen": screen,
+            "display": [self.get_display_text(cmd) for cmd in commands],
+            "tracks": tracks,
+        }
+        
+    def get_compiled_cache_path(self, digest, folder):
+        # Display texts depend on the language of this script, opcode numbers on the loaded plugins
+        # and Call targets on the folder of the file
+        tag = os.path.splitext(os.path.basename(__file__))[0]
+        opcodes = hashlib.sha256(" ".join(OPCODE_NUMBERS).encode("utf-8")).hexdigest()[:8]
+        location = hashlib.sha256(folder.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(CACHE_DIR, f"{digest}.v{MACRO_CACHE_VERSION}.{tag}.{opcodes}.{location}.pickle")
+        
+    def load_compiled_macro(self, digest, folder):
+        try:
+            with open(self.get_compiled_cache_path(digest, folder), "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return pickle.loads(data)
+        except Exception:
+            return None
+        
+    def save_compiled_macro(self, digest, folder, compiled):
+        path = self.get_compiled_cache_path(digest, folder)
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(compiled, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+            # Keep only the most recently written entries; anything else in the folder is left alone
+            entries = sorted((os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR) if name.endswith(".pickle")),
+                             key=os.path.getmtime, reverse=True)
+            for old_path in entries[MAX_CACHED_MACROS:]:
+                os.remove(old_path)
+        except Exception as e:
+            # Plugin targets may not pickle at all, which raises more than PicklingError
+            self.log("Macro cache save failed: " + str(e))
+            try:
+                os.remove(path + ".tmp")
+            except OSError:
+                pass
+        
+    def save_last_macro_cache(self, file_path, signature, digest):
+        try:
+            os.makedirs(SESSION_DIR, exist_ok=True)
+            with open(LAST_MACRO_CACHE_FILE + ".tmp", "wb") as f:
+                pickle.dump({"path": os.path.abspath(file_path), "signature": signature, "digest": digest},
+                            f, pickle.HIGHEST_PROTOCOL)
+            os.replace(LAST_MACRO_CACHE_FILE + ".tmp", LAST_MACRO_CACHE_FILE)
+        except OSError as e:
+            self.log("Macro cache save failed: " + str(e))
+            
+    def get_macro_folder(self):
+        # Relative Call files are found next to the macro; an unsaved macro uses the working directory
+        return os.path.dirname(os.path.abspath(self.macro_path)) if self.macro_path else ""
+        
+    def set_macro_path(self, file_path):
+        self.add_recent_macro(file_path)
+        if self.macro_watcher and self.macro_watcher.path == os.path.abspath(file_path):
+            # Our own save must not be picked up as an external change
+            self.macro_watcher.mark_current()
+            return
+        self.macro_path = file_path
+        self.update_macro_watcher()
+        
+    def update_macro_watcher(self):
+        if self.macro_watcher:
+            self.macro_watcher.stop()
+            self.macro_watcher = None
+        if self.watch_file_var.get() and self.macro_path:
+            self.macro_watcher = MacroFileWatcher(self.macro_path, self.on_macro_file_changed, self.engine)
+            self.macro_watcher.start()
+            self.log("Watching macro file: " + self.macro_path)
+        
+    def on_macro_file_changed(self, file_path):
+        # Called from the watcher thread
+        try:
+            commands, track_loops, screen = self.read_macro_file(file_path)
+            program = self.editor_program
+            if program is not None:
+                # The running macro switches at its next iteration boundary
+                transform = screen_transform(screen or program["screen"], program["screen"])
+                tracks = transform_tracks(self.compile_commands(commands, os.path.dirname(os.path.abspath(file_path))), transform)
+                # The tasks of a run are made when it starts, so only the tracks it already has pick up the change
+                added = sorted(set(tracks) - set(program["tracks"]))
+                program["track_loops"] = track_loops
+                program["tracks"] = tracks
+                if added:
+                    self.log("Tracks added by the reload start with the next run: " + ", ".join(map(str, added)))
+        except Exception as e:
+            self.log("Macro reload failed: " + str(e))
+            return
+        self.ui.post(lambda: self.apply_reloaded_macro(file_path, commands, track_loops, screen), key=self.apply_reloaded_macro)
+        
+    def apply_reloaded_macro(self, file_path, commands, track_loops, screen):
+        self.commands = commands
+        self.compiled_tracks = None
+        self.macro_screen = self.get_macro_screen(screen)
+        self.listbox.delete(0, tk.END)
+        for cmd in self.commands:
+            self.listbox.insert(tk.END, self.get_display_text(cmd))
+        self.entry_track_loops.delete(0, tk.END)
+        self.entry_track_loops.insert(0, self.format_track_loops(track_loops))
+        self.log("Macro reloaded: " + file_path)
+        
+    def add_recent_macro(self, file_path):
+        file_path = os.path.abspath(file_path)
+        if file_path in self.recent_macros:
+            self.recent_macros.remove(file_path)
+        self.recent_macros.insert(0, file_path)
+        del self.recent_macros[MAX_RECENT_MACROS:]
+        self.refresh_recent_menu()
+        
+    def refresh_recent_menu(self):
+        self.menu_recent.delete(0, tk.END)
+        for file_path in self.recent_macros:
+            self.menu_recent.add_command(label=file_path, command=lambda file_path=file_path: self.load_macro_file(file_path))
+        
+    def restore_session(self):
+        try:
+            with open(SESSION_FILE, "r") as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            return
+        hotkeys = session.get("hotkeys", {})
+        self.start_hotkey_var.set(hotkeys.get("start", "f2"))
+        self.stop_hotkey_var.set(hotkeys.get("stop", "f3"))
+        self.action_start_hotkey_var.set(hotkeys.get("action_start", "f4"))
+        self.action_stop_hotkey_var.set(hotkeys.get("action_stop", "f5"))
+        self.slower_hotkey_var.set(hotkeys.get("slower", "f6"))
+        self.faster_hotkey_var.set(hotkeys.get("faster", "f7"))
+        self.entry_loop.delete(0, tk.END)
+        self.entry_loop.insert(0, session.get("loop_count", "1"))
+        run_limit = session.get("run_limit", {})
+        if run_limit.get("mode") in RUN_LIMITS:
+            self.run_limit_var.set(run_limit["mode"])
+        self.entry_run_limit.delete(0, tk.END)
+        self.entry_run_limit.insert(0, run_limit.get("value", ""))
+        self.watch_file_var.set(session.get("auto_reload", False))
+        humanize = session.get("humanize", {})
+        self.humanize_var.set(humanize.get("enabled", False))
+        self.entry_jitter.delete(0, tk.END)
+        self.entry_jitter.insert(0, humanize.get("jitter", "10"))
+        self.entry_seed.delete(0, tk.END)
+        self.entry_seed.insert(0, humanize.get("seed", ""))
+        if session.get("overlap_policy") in OVERLAP_POLICIES:
+            self.overlap_policy = session["overlap_policy"]
+            self.overlap_policy_var.set(self.overlap_policy)
+        if session.get("speed") in SPEEDS:
+            self.set_speed(session["speed"])
+        if session.get("geometry"):
+            # Only the height and position are restored; the width belongs to this version of the layout
+            self.geometry(f"{WINDOW_WIDTH}x" + session["geometry"].split("x", 1)[-1])
+        self.recent_macros = [p for p in session.get("recent_macros", []) if os.path.exists(p)]
+        self.refresh_recent_menu()
+        for item in session.get("library", []):
+            name = item["name"]
+            if name not in self.macro_library:
+                self.library_names.append(name)
+            track_loops = {int(track): count for track, count in item["track_loops"].items()}
+            screen = tuple(item["screen"]) if "screen" in item else self.screen_size
+            self.macro_library[name] = self.create_library_entry(item["commands"], item["loop"], track_loops,
+                                                                 item["hotkey"], screen, item.get("folder", ""))
+        self.refresh_library_list()
+        last_macro = session.get("last_macro")
+        if last_macro and os.path.exists(last_macro):
+            self.load_macro_file(last_macro)
+        self.log("Session restored: " + SESSION_FILE)
+        
+    def save_session(self):
+        session = {
+            "hotkeys": {
+                "start": self.start_hotkey_var.get(),
+                "stop": self.stop_hotkey_var.get(),
+                "action_start": self.action_start_hotkey_var.get(),
+                "action_stop": self.action_stop_hotkey_var.get(),
+                "slower": self.slower_hotkey_var.get(),
+                "faster": self.faster_hotkey_var.get(),
+            },
+            "loop_count": self.entry_loop.get().strip(),
+            "run_limit": {"mode": self.run_limit_var.get(), "value": self.entry_run_limit.get().strip()},
+            "auto_reload": self.watch_file_var.get(),
+            "overlap_policy": self.overlap_policy,
+            "speed": self.speed_var.get(),
+            "humanize": {
+                "enabled": self.humanize_var.get(),
+                "jitter": self.entry_jitter.get().strip(),
+                "seed": self.entry_seed.get().strip(),
+            },
+            "geometry": self.geometry(),
+            "recent_macros": self.recent_macros,
+            "last_macro": self.macro_path and os.path.abspath(self.macro_path),
+            "library": [{
+                "name": name,
+                "commands": self.macro_library[name]["commands"],
+                "loop": self.macro_library[name]["loop"],
+                "track_loops": self.macro_library[name]["track_loops"],
+                "hotkey": self.macro_library[name]["hotkey"],
+                "screen": list(self.macro_library[name]["screen"]),
+                "folder": self.macro_library[name]["folder"],
+            } for name in self.library_names],
+        }
+        try:
+            os.makedirs(SESSION_DIR, exist_ok=True)
+            with open(SESSION_FILE + ".tmp", "w") as f:
+                json.dump(session, f, indent=4)
+            os.replace(SESSION_FILE + ".tmp", SESSION_FILE)
+        except OSError as e:
+            self.log("Session save failed: " + str(e))
+        
+    def on_close(self):
+        self.save_session()
+        self.stop_macro()
+        for name in self.macro_library:
+            self.stop_library_macro(name)
+        if self.macro_watcher:
+            self.macro_watcher.stop()
+        self.click_capture.stop()
+        self.stop_hotkey_listener()
+        self.engine.stop()
+        self.ui.stop()
+        self.destroy()
+            
+    def read_macro_file(self, file_path):
+        with open(file_path, "r") as f:
+            data = json.load(f)
+        return self.parse_macro_data(data)
+        
+    def parse_macro_data(self, data):
+        # Multi-track files store per-track loop counts next to the command list
+        if isinstance(data, dict):
+            commands = data.get("commands", [])
+            track_loops = {int(track): count for track, count in data.get("track_loops", {}).items()}
+            screen = tuple(data["screen"]) if "screen" in data else None
+        else:
+            commands = data
+            track_loops = {}
+            screen = None
+        # screen is None for older files that only have absolute coordinates
+        return commands, track_loops, screen
+        
+    def get_macro_screen(self, screen):
+        if screen is None:
+            # Older absolute files are taken as made on this screen and get its size when saved again
+            self.log(f"Macro has no screen size; using the current screen {self.screen_size[0]}x{self.screen_size[1]}")
+            return self.screen_size
+        return screen
+        
     def get_display_text(self, cmd):
+        text = self.format_command(cmd)
+        track = cmd.get("track", 0)
+        if track:
+            return f"[Track {track}] " + text
+        return text
+            
+    def format_command(self, cmd):
+        number = OPCODE_NUMBERS.get(cmd.get("command"))
+        if number is None:
+            return str(cmd)
         try:
-            if cmd.get("command") == "key_tap":
-                return f"Key tap: {cmd.get('key', '')} x {cmd.get('repeat', 1)} times"
-            elif cmd.get("command") == "key_hold":
-                return f"Key hold: {cmd.get('key', '')} (duration: {cmd.get('duration', 0)} sec)"
-            elif cmd.get("command") == "wait":
-                return f"Wait: {cmd.get('duration', 0)} sec"
-            elif cmd.get("command") == "mouse_click":
-                return f"Mouse click: ({cmd.get('x', 0)}, {cmd.get('y', 0)}), button: {cmd.get('button', '')}"
-            elif cmd.get("command") == "mouse_hold":
-                return f"Mouse hold: ({cmd.get('x', 0)}, {cmd.get('y', 0)}), button: {cmd.get('button', '')} (duration: {cmd.get('duration', 0)} sec)"
-            elif cmd.get("command") == "mouse_scroll":
-                return f"Mouse scroll: horizontal {cmd.get('dx',0)}, vertical {cmd.get('dy',0)}"
-            else:
-                return str(cmd)
+            return OPCODES[number].format(cmd)
         except Exception as e:
             self.log("Error displaying command: " + str(e))
             return str(cmd)
         
     def format_hotkey(self, key_str):
-        key_str = key_str.strip().lower()
-        if not key_str.startswith("<") and not key_str.endswith(">"):
-            key_str = f"<{key_str}>"
-        return key_str
+        # Accepts single keys ("f2") as well as combinations ("ctrl+alt+1")
+        parts = []
+        for part in key_str.strip().lower().split("+"):
+            part = part.strip()
+            if len(part) > 1 and not part.startswith("<") and not part.endswith(">"):
+                part = f"<{part}>"
+            parts.append(part)
+        return "+".join(parts)
+        
+    def is_valid_hotkey(self, key_str):
+        try:
+            keyboard.HotKey.parse(self.format_hotkey(key_str))
+        except ValueError:
+            return False
+        return True
         
     def start_hotkey_listener(self):
         mapping = {
             self.format_hotkey(self.start_hotkey_var.get()): self.on_hotkey_start,
             self.format_hotkey(self.stop_hotkey_var.get()): self.on_hotkey_stop,
             self.format_hotkey(self.action_start_hotkey_var.get()): self.start_action_recording,
-            self.format_hotkey(self.action_stop_hotkey_var.get()): self.stop_action_recording
+            self.format_hotkey(self.action_stop_hotkey_var.get()): self.stop_action_recording,
+            self.format_hotkey(self.slower_hotkey_var.get()): lambda: self.step_speed(-1),
+            self.format_hotkey(self.faster_hotkey_var.get()): lambda: self.step_speed(1)
         }
+        for name, entry in self.macro_library.items():
+            if entry["hotkey"]:
+                mapping[self.format_hotkey(entry["hotkey"])] = lambda name=name: self.on_hotkey_library(name)
+        # One bad hotkey, e.g. from an older session file, must not take the others down with it
+        for hotkey in [hotkey for hotkey in mapping if not self.is_valid_hotkey(hotkey)]:
+            self.log(f"Invalid hotkey skipped: {hotkey}")
+            del mapping[hotkey]
+        # Hotkeys fire on the listener thread; run their handlers on the Tk thread
+        mapping = {hotkey: lambda callback=callback: self.ui.post(callback) for hotkey, callback in mapping.items()}
         self.hotkey_listener = keyboard.GlobalHotKeys(mapping)
         self.hotkey_thread = threading.Thread(target=self.hotkey_listener.run, daemon=True)
         self.hotkey_thread.start()
@@ -607,21 +2729,206 @@ class ManualMacroGUI(tk.Tk):
         
     def on_hotkey_start(self):
         self.log("Macro execution requested via hotkey.")
-        if not self.macro_running:
-            self.play_macro()
+        self.play_macro()
         
     def on_hotkey_stop(self):
         self.log("Macro stop requested via hotkey.")
         self.stop_macro()
+        for name in self.macro_library:
+            self.stop_library_macro(name)
+        
+    def on_hotkey_library(self, name):
+        self.log(f"Library macro toggled via hotkey: {name}")
+        self.toggle_library_macro(name)
+        
+    def add_library_macro(self):
+        name = self.entry_library_name.get().strip()
+        if name == "":
+            messagebox.showerror("Error", "Please enter a library macro name.")
+            return
+        if not self.commands:
+            messagebox.showinfo("Info", "No commands to add.")
+            return
+        try:
+            loop_count = int(self.entry_loop.get().strip())
+            track_loops = self.parse_track_loops(self.entry_track_loops.get())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a valid loop count.")
+            return
+        self.store_library_macro(name, copy.deepcopy(self.commands), loop_count, track_loops, self.macro_screen,
+                                 self.get_macro_folder())
+        
+    def add_library_file(self):
+        file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
+        if not file_path:
+            return
+        try:
+            loop_count = int(self.entry_loop.get().strip())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a valid loop count.")
+            return
+        try:
+            commands, track_loops, screen = self.read_macro_file(file_path)
+        except Exception as e:
+            messagebox.showerror("Error", "Macro load failed: " + str(e))
+            return
+        name = self.entry_library_name.get().strip() or os.path.splitext(os.path.basename(file_path))[0]
+        self.store_library_macro(name, commands, loop_count, track_loops, self.get_macro_screen(screen),
+                                 os.path.dirname(os.path.abspath(file_path)))
+        
+    def store_library_macro(self, name, commands, loop_count, track_loops, screen, folder):
+        hotkey = self.entry_library_hotkey.get().strip()
+        if hotkey and not self.is_valid_hotkey(hotkey):
+            messagebox.showerror("Error", "Please enter a valid hotkey, e.g. f8 or ctrl+alt+1.")
+            return
+        if name in self.macro_library:
+            self.macro_library[name]["worker"].close()
+        else:
+            self.library_names.append(name)
+        self.macro_library[name] = self.create_library_entry(commands, loop_count, track_loops, hotkey, screen, folder)
+        self.refresh_library_list()
+        self.log(f"Library macro added: {name} ({len(commands)} commands)")
+        self.apply_hotkeys()
+        
+    def create_library_entry(self, commands, loop_count, track_loops, hotkey, screen, folder):
+        return {
+            "commands": commands,
+            "loop": loop_count,
+            "track_loops": track_loops,
+            "hotkey": hotkey,
+            "screen": screen,
+            "folder": folder,  # Where relative Call files are found
+            # Each library macro has its own persistent worker
+            "worker": PlaybackWorker(self.engine, self.get_overlap_policy, self.log,
+                                     lambda: self.ui.post(self.refresh_library_list)),
+        }
+        
+    def remove_library_macro(self):
+        name = self.get_selected_library_name()
+        if name is None:
+            return
+        self.macro_library[name]["worker"].close()
+        del self.macro_library[name]
+        self.library_names.remove(name)
+        self.refresh_library_list()
+        self.log(f"Library macro removed: {name}")
+        self.apply_hotkeys()
+        
+    def open_library_macro(self):
+        name = self.get_selected_library_name()
+        if name is None:
+            return
+        entry = self.macro_library[name]
+        self.commands = copy.deepcopy(entry["commands"])
+        self.compiled_tracks = None
+        self.macro_screen = entry["screen"]
+        self.listbox.delete(0, tk.END)
+        for cmd in self.commands:
+            self.listbox.insert(tk.END, self.get_display_text(cmd))
+        self.entry_loop.delete(0, tk.END)
+        self.entry_loop.insert(0, str(entry["loop"]))
+        self.entry_track_loops.delete(0, tk.END)
+        self.entry_track_loops.insert(0, self.format_track_loops(entry["track_loops"]))
+        self.log(f"Library macro opened in editor: {name}")
+        
+    def get_selected_library_name(self):
+        selected = self.listbox_library.curselection()
+        if not selected:
+            messagebox.showerror("Error", "Please select a library macro.")
+            return None
+        return self.library_names[selected[0]]
+        
+    def refresh_library_list(self):
+        selected = self.listbox_library.curselection()
+        self.listbox_library.delete(0, tk.END)
+        for name in self.library_names:
+            entry = self.macro_library[name]
+            text = name
+            if entry["hotkey"]:
+                text += f" [{self.format_hotkey(entry['hotkey'])}]"
+            if self.is_library_macro_running(entry):
+                text += " - running"
+            self.listbox_library.insert(tk.END, text)
+        if selected and selected[0] < len(self.library_names):
+            self.listbox_library.selection_set(selected[0])
+        
+    def is_library_macro_running(self, entry):
+        return entry["worker"].is_busy()
+        
+    def play_selected_library_macro(self):
+        name = self.get_selected_library_name()
+        if name is not None:
+            self.play_library_macro(name)
+        
+    def stop_selected_library_macro(self):
+        name = self.get_selected_library_name()
+        if name is not None:
+            self.stop_library_macro(name)
+        
+    def toggle_library_macro(self, name):
+        entry = self.macro_library.get(name)
+        if entry is None:
+            return
+        if self.is_library_macro_running(entry):
+            self.stop_library_macro(name)
+        else:
+            self.play_library_macro(name)
+        
+    def play_library_macro(self, name):
+        entry = self.macro_library.get(name)
+        if entry is None:
+            return
+        try:
+            run_limit = self.parse_run_limit()
+            humanizer = self.create_humanizer()
+        except ValueError:
+            return
+        try:
+            tracks = self.compile_commands(entry["commands"], entry["folder"])
+        except ValueError as e:
+            messagebox.showerror("Error", "Macro compile failed: " + str(e))
+            return
+        transform = screen_transform(entry["screen"], self.update_screen_size())
+        entry["worker"].request(lambda: self.execute_library_macro(name, entry, tracks, transform, humanizer, run_limit))
+        
+    async def execute_library_macro(self, name, entry, tracks, transform, humanizer=None, run_limit=None):
+        self.log(f"Library macro started: {name}")
+        self.ui.post(self.refresh_library_list)
+        # Library macros use the run limit set in the controls, like the humanizer settings
+        program = {"tracks": transform_tracks(tracks, transform), "screen": self.screen_size,
+                   "humanizer": humanizer, "variables": {}, "subroutines": {},
+                   "stop_at": run_stop_time(run_limit),
+                   "loop_count": entry["loop"], "track_loops": entry["track_loops"]}
+        try:
+            await self.run_macro(program)
+        finally:
+            self.log(f"Library macro completed: {name}")
+        
+    def stop_library_macro(self, name):
+        entry = self.macro_library.get(name)
+        if entry is None or not self.is_library_macro_running(entry):
+            return
+        entry["worker"].cancel()
+        self.log(f"Library macro stop requested: {name}")
         
     def start_action_recording(self):
         if self.action_recording:
             return
         self.action_recording = True
         self.recorded_commands = []
+        self.record_modifiers = []
+        self.record_chord_modifiers = set()
+        self.record_chord_keys = set()
         self.last_record_time = time.time()
+        self.update_screen_size()
+        # The listener threads must not read Tk variables, so resolve the hotkeys here
+        self.record_ignored_keys = {
+            getattr(keyboard.Key, self.action_start_hotkey_var.get().strip().lower(), None),
+            getattr(keyboard.Key, self.action_stop_hotkey_var.get().strip().lower(), None),
+        }
         self.log("Action recording started.")
-        self.action_keyboard_listener = keyboard.Listener(on_release=self.action_on_key_release)
+        self.action_keyboard_listener = keyboard.Listener(on_press=self.action_on_key_press,
+                                                          on_release=self.action_on_key_release)
         self.action_mouse_listener = mouse.Listener(on_click=self.action_on_mouse_click)
         self.action_keyboard_listener.start()
         self.action_mouse_listener.start()
@@ -641,29 +2948,62 @@ class ManualMacroGUI(tk.Tk):
         for cmd in self.recorded_commands:
             self.commands.append(cmd)
             self.listbox.insert(tk.END, self.get_display_text(cmd))
+        self.compiled_tracks = None
         self.button_toggle_recording.config(text="Start Action Recording")
         
+    def action_on_key_press(self, key):
+        if not self.action_recording:
+            return
+        modifier = MODIFIER_NAMES.get(key)
+        if modifier:
+            if modifier not in self.record_modifiers:
+                self.record_modifiers.append(modifier)
+            return
+        if self.record_modifiers and key not in self.record_ignored_keys:
+            # A key pressed under held modifiers is recorded now, while the modifier state is known,
+            # since the modifiers are often released before the key
+            self.record_chord_keys.add(key_name(key).lower())
+            self.record_chord_modifiers.update(self.record_modifiers)
+            self.record_key(key, list(self.record_modifiers))
+        
     def action_on_key_release(self, key):
         if not self.action_recording:
             return
+        modifier = MODIFIER_NAMES.get(key)
+        if modifier:
+            if modifier in self.record_modifiers:
+                self.record_modifiers.remove(modifier)
+            if modifier in self.record_chord_modifiers:
+                # Only a modifier tapped on its own is recorded as a key tap
+                self.record_chord_modifiers.discard(modifier)
+                return
+        elif key_name(key).lower() in self.record_chord_keys:
+            self.record_chord_keys.discard(key_name(key).lower())
+            return
+        self.record_key(key, [])
+        
+    def record_key(self, key, modifiers):
         now = time.time()
         dt = now - self.last_record_time
         if dt > RECORD_WAIT_THRESHOLD:
             wait_cmd = {"command": "wait", "duration": round(dt, 2)}
             self.recorded_commands.append(wait_cmd)
             self.log("Recorded wait: {} sec".format(round(dt, 2)))
-        start_key = getattr(keyboard.Key, self.action_start_hotkey_var.get().strip().lower(), None)
-        stop_key  = getattr(keyboard.Key, self.action_stop_hotkey_var.get().strip().lower(), None)
-        if key == start_key or key == stop_key:
+        if key in self.record_ignored_keys:
             self.last_record_time = now
             return
-        try:
-            k = key.char
-        except AttributeError:
-            k = str(key)
-        key_cmd = {"command": "key_tap", "key": k, "repeat": 1}
+        k = key_name(key)
+        if modifiers == ["shift"] and not isinstance(key, keyboard.Key):
+            # Shift alone is already part of the typed character
+            modifiers = []
+        if modifiers:
+            keys = "+".join(modifiers + [k.lower() if "shift" in modifiers else k])
+            key_cmd = {"command": "key_chord", "keys": keys}
+            self.log("Recorded key chord: {}".format(keys))
+        else:
+            key_cmd = {"command": "key_tap", "key": k, "repeat": 1}
+            self.log("Recorded key tap: {}".format(k))
         self.recorded_commands.append(key_cmd)
-        self.log("Recorded key tap: {}".format(k))
         self.last_record_time = now
         
     def action_on_mouse_click(self, x, y, button, pressed):
@@ -677,9 +3017,10 @@ class ManualMacroGUI(tk.Tk):
             wait_cmd = {"command": "wait", "duration": round(dt, 2)}
             self.recorded_commands.append(wait_cmd)
             self.log("Recorded wait: {} sec".format(round(dt, 2)))
-        mouse_cmd = {"command": "mouse_click", "x": int(x), "y": int(y), "button": "left"}
+        x, y = self.to_macro_position(x, y)
+        mouse_cmd = {"command": "mouse_click", "x": x, "y": y, "button": "left"}
         self.recorded_commands.append(mouse_cmd)
-        self.log("Recorded mouse click: ({}, {})".format(int(x), int(y)))
+        self.log("Recorded mouse click: ({}, {})".format(x, y))
         self.last_record_time = now
         
     def toggle_action_recording(self):
@@ -695,209 +3036,45 @@ class ManualMacroGUI(tk.Tk):
             
     def edit_command(self, index):
         cmd = self.commands[index]
+        number = OPCODE_NUMBERS.get(cmd["command"])
+        if number is None:
+            messagebox.showerror("Error", "Unknown command: " + cmd["command"])
+            return
+        opcode = OPCODES[number]
         edit_win = tk.Toplevel(self)
         edit_win.title("Edit Command")
         edit_win.configure(bg=BG_COLOR)
         edit_win.wait_visibility()
         edit_win.grab_set()
         def save_changes():
-            if cmd["command"] == "key_tap":
-                new_key = entry_key.get().strip()
-                try:
-                    new_repeat = int(entry_repeat.get().strip())
-                except ValueError:
-                    messagebox.showerror("Error", "Please enter a valid repeat count.", parent=edit_win)
-                    return
-                if new_key == "":
-                    messagebox.showerror("Error", "Please enter a key value.", parent=edit_win)
-                    return
-                cmd["key"] = new_key
-                cmd["repeat"] = new_repeat
-            elif cmd["command"] == "key_hold":
-                new_key = entry_key.get().strip()
-                try:
-                    new_duration = float(entry_duration.get().strip())
-                except ValueError:
-                    messagebox.showerror("Error", "Please enter a valid hold duration.", parent=edit_win)
-                    return
-                if new_key == "":
-                    messagebox.showerror("Error", "Please enter a key value.", parent=edit_win)
-                    return
-                cmd["key"] = new_key
-                cmd["duration"] = new_duration
-            elif cmd["command"] == "wait":
-                try:
-                    new_duration = float(entry_duration.get().strip())
-                except ValueError:
-                    messagebox.showerror("Error", "Please enter a valid wait duration.", parent=edit_win)
-                    return
-                cmd["duration"] = new_duration
-            elif cmd["command"] == "mouse_click":
-                try:
-                    new_x = int(entry_x.get().strip())
-                    new_y = int(entry_y.get().strip())
-                except ValueError:
-                    messagebox.showerror("Error", "Please enter valid integer X, Y values.", parent=edit_win)
-                    return
-                new_button = var_button.get()
-                cmd["x"] = new_x
-                cmd["y"] = new_y
-                cmd["button"] = new_button
-            elif cmd["command"] == "mouse_hold":
-                try:
-                    new_x = int(entry_x.get().strip())
-                    new_y = int(entry_y.get().strip())
-                except ValueError:
-                    messagebox.showerror("Error", "Please enter valid integer X, Y values.", parent=edit_win)
-                    return
-                try:
-                    new_duration = float(entry_duration.get().strip())
-                except ValueError:
-                    messagebox.showerror("Error", "Please enter a valid hold duration.", parent=edit_win)
-                    return
-                new_button = var_button.get()
-                cmd["x"] = new_x
-                cmd["y"] = new_y
-                cmd["button"] = new_button
-                cmd["duration"] = new_duration
-            elif cmd["command"] == "mouse_scroll":
-                try:
-                    new_dx = int(entry_dx.get().strip())
-                    new_dy = int(entry_dy.get().strip())
-                except ValueError:
-                    messagebox.showerror("Error", "Please enter valid scroll values.", parent=edit_win)
-                    return
-                cmd["dx"] = new_dx
-                cmd["dy"] = new_dy
+            try:
+                new_track = int(entry_track.get().strip())
+                if new_track < 0:
+                    raise ValueError
+            except ValueError:
+                messagebox.showerror("Error", "Please enter a valid track number.", parent=edit_win)
+                return
+            values = self.read_command_fields(entries)
+            try:
+                cmd.update(opcode.parse(values))
+            except ValueError as e:
+                messagebox.showerror("Error", str(e), parent=edit_win)
+                return
+            if new_track:
+                cmd["track"] = new_track
+            else:
+                cmd.pop("track", None)
+            self.compiled_tracks = None
             self.listbox.delete(index)
             self.listbox.insert(index, self.get_display_text(cmd))
             self.log("Command modified: " + self.get_display_text(cmd))
             edit_win.destroy()
-        if cmd["command"] == "key_tap":
-            tk.Label(edit_win, text="Key:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_key = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_key.insert(0, cmd["key"])
-            entry_key.grid(row=0, column=1, padx=5, pady=5)
-            def on_key_press(event):
-                entry_key.delete(0, tk.END)
-                entry_key.insert(0, event.keysym)
-                return "break"
-            entry_key.bind("<Key>", on_key_press)
-            tk.Label(edit_win, text="Repeat:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=5)
-            entry_repeat = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_repeat.insert(0, str(cmd.get("repeat", 1)))
-            entry_repeat.grid(row=1, column=1, padx=5, pady=5)
-        elif cmd["command"] == "key_hold":
-            tk.Label(edit_win, text="Key:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_key = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_key.insert(0, cmd["key"])
-            entry_key.grid(row=0, column=1, padx=5, pady=5)
-            def on_key_press(event):
-                entry_key.delete(0, tk.END)
-                entry_key.insert(0, event.keysym)
-                return "break"
-            entry_key.bind("<Key>", on_key_press)
-            tk.Label(edit_win, text="Hold Duration (seconds):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=5)
-            entry_duration = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, str(cmd.get("duration", 1)))
-            entry_duration.grid(row=1, column=1, padx=5, pady=5)
-        elif cmd["command"] == "wait":
-            tk.Label(edit_win, text="Wait Duration (seconds):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_duration = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, str(cmd["duration"]))
-            entry_duration.grid(row=0, column=1, padx=5, pady=5)
-        elif cmd["command"] == "mouse_click":
-            tk.Label(edit_win, text="X:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_x = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_x.insert(0, str(cmd["x"]))
-            entry_x.grid(row=0, column=1, padx=5, pady=5)
-            tk.Label(edit_win, text="Y:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=5)
-            entry_y = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_y.insert(0, str(cmd["y"]))
-            entry_y.grid(row=0, column=3, padx=5, pady=5)
-            tk.Label(edit_win, text="Button:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=4, padx=5, pady=5)
-            var_button = tk.StringVar(value=cmd["button"])
-            option_button = tk.OptionMenu(edit_win, var_button, "left", "right", "middle")
-            option_button.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
-            option_button["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
-            option_button.grid(row=0, column=5, padx=5, pady=5)
-            def record_mouse_edit():
-                record_button_edit.config(text="Left click to complete mouse position recording", state=tk.DISABLED)
-                def on_click(x, y, button, pressed):
-                    if button == mouse.Button.left and pressed:
-                        entry_x.delete(0, tk.END)
-                        entry_x.insert(0, str(int(x)))
-                        entry_y.delete(0, tk.END)
-                        entry_y.insert(0, str(int(y)))
-                        edit_win.after(0, lambda: self.log(f"Mouse position recorded in edit window: ({int(x)}, {int(y)})"))
-                        record_button_edit.config(text="Record Mouse Position", state=tk.NORMAL)
-                        return False
-                listener = mouse.Listener(on_click=on_click)
-                listener.start()
-            record_button_edit = tk.Button(edit_win, text="Record Mouse Position", command=record_mouse_edit,
-                                           bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
-                                           activebackground=BUTTON_ACTIVE_BG)
-            record_button_edit.grid(row=1, column=0, columnspan=6, padx=5, pady=5, sticky="w")
-        elif cmd["command"] == "mouse_hold":
-            # First row: X, Y, Button
-            tk.Label(edit_win, text="X:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_x = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_x.insert(0, str(cmd["x"]))
-            entry_x.grid(row=0, column=1, padx=5, pady=5)
-            tk.Label(edit_win, text="Y:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=5)
-            entry_y = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_y.insert(0, str(cmd["y"]))
-            entry_y.grid(row=0, column=3, padx=5, pady=5)
-            tk.Label(edit_win, text="Button:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=4, padx=5, pady=5)
-            var_button = tk.StringVar(value=cmd["button"])
-            option_button = tk.OptionMenu(edit_win, var_button, "left", "right", "middle")
-            option_button.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
-            option_button["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
-            option_button.grid(row=0, column=5, padx=5, pady=5)
-            tk.Label(edit_win, text="Hold Duration (seconds):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=5)
-            entry_duration = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, str(cmd.get("duration", 1)))
-            entry_duration.grid(row=1, column=1, padx=5, pady=5)
-            def record_mouse_edit():
-                record_button_edit.config(text="Left click to complete mouse position recording", state=tk.DISABLED)
-                def on_click(x, y, button, pressed):
-                    if button == mouse.Button.left and pressed:
-                        entry_x.delete(0, tk.END)
-                        entry_x.insert(0, str(int(x)))
-                        entry_y.delete(0, tk.END)
-                        entry_y.insert(0, str(int(y)))
-                        edit_win.after(0, lambda: self.log(f"Mouse position recorded in edit window: ({int(x)}, {int(y)})"))
-                        record_button_edit.config(text="Record Mouse Position", state=tk.NORMAL)
-                        return False
-                listener = mouse.Listener(on_click=on_click)
-                listener.start()
-            record_button_edit = tk.Button(edit_win, text="Record Mouse Position", command=record_mouse_edit,
-                                           bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
-                                           activebackground=BUTTON_ACTIVE_BG)
-            record_button_edit.grid(row=1, column=2, columnspan=4, padx=5, pady=5, sticky="w")
-        elif cmd["command"] == "mouse_scroll":
-            tk.Label(edit_win, text="Horizontal Scroll:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_dx = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_dx.insert(0, str(cmd["dx"]))
-            entry_dx.grid(row=0, column=1, padx=5, pady=5)
-            tk.Label(edit_win, text="Vertical Scroll:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=5)
-            entry_dy = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_dy.insert(0, str(cmd["dy"]))
-            entry_dy.grid(row=0, column=3, padx=5, pady=5)
+        entries = self.build_command_fields(edit_win, opcode, cmd, 5)
+        tk.Label(edit_win, text="Track:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .grid(row=9, column=0, padx=5, pady=5)
+        entry_track = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        entry_track.insert(0, str(cmd.get("track", 0)))
+        entry_track.grid(row=9, column=1, padx=5, pady=5)
         tk.Button(edit_win, text="Save", command=save_changes,
                   bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG)\
             .grid(row=10, column=0, padx=5, pady=10)
@@ -970,6 +3147,7 @@ class ManualMacroGUI(tk.Tk):
                 if self.drop_index > self.drag_original_index:
                     self.drop_index -= 1
                 self.commands.insert(self.drop_index, cmd)
+                self.compiled_tracks = None
                 self.listbox.delete(0, tk.END)
                 for c in self.commands:
                     self.listbox.insert(tk.END, self.get_display_text(c))
@@ -998,7 +3176,278 @@ class ManualMacroGUI(tk.Tk):
                                          height=2, highlightthickness=0, bd=0, bg="red")
         self.drop_indicator.place(x=0, y=y)
 
+# Validators of the editor forms: values holds the entered text by field key
+def parse_key(values):
+    if not values["key"]:
+        raise ValueError("Please enter a key value.")
+    return values["key"]
+
+def parse_position(values, names=("x", "y")):
+    try:
+        return {name: int(values[name]) for name in names}
+    except ValueError:
+        raise ValueError("Please enter valid integer X, Y values.") from None
+
+def parse_duration(values, message, minimum=None):
+    try:
+        duration = float(values["duration"])
+        if minimum is not None and duration < minimum:
+            raise ValueError
+    except ValueError:
+        raise ValueError(message) from None
+    return duration
+
+def parse_template(values):
+    # The template has to be captured at the entered size
+    try:
+        width = int(values["width"])
+        height = int(values["height"])
+        if len(base64.b64decode(values["template"])) != width * height * 3:
+            raise ValueError
+    except ValueError:
+        raise ValueError("Please capture a template first.") from None
+    return {"width": width, "height": height, "template": values["template"]}
+
+def parse_key_tap(values):
+    key = parse_key(values)
+    try:
+        repeat = int(values["repeat"])
+    except ValueError:
+        raise ValueError("Please enter a valid repeat count.") from None
+    return {"key": key, "repeat": repeat}
+
+def parse_type_text(values):
+    if not values["text"]:
+        raise ValueError("Please enter the text to type.")
+    try:
+        cps = float(values["cps"])
+        if cps < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("Please enter a valid typing speed.") from None
+    return {"text": values["text"], "cps": int(cps) if cps.is_integer() else cps}
+
+def preview_text(text):
+    return repr(text[:30]) + ("..." if len(text) > 30 else "")
+
+def parse_paste_text(values):
+    if not values["text"]:
+        raise ValueError("Please enter the text to paste.")
+    return {"text": values["text"]}
+
+def format_type_text(cmd):
+    preview = preview_text(cmd.get("text", ""))
+    cps = cmd.get("cps", TYPE_RATE)
+    return f"Type text: {preview} ({cps} chars/sec)" if cps else f"Type text: {preview} (unlimited)"
+
+def estimate_type_text(cmd):
+    cps = cmd.get("cps", TYPE_RATE)
+    return (len(cmd.get("text", "")) / cps if cps else 0), 0
+
+def parse_key_chord(values):
+    keys = [key.strip() for key in values["keys"].split("+")]
+    if not all(keys):
+        raise ValueError("Please enter a key combination such as ctrl+shift+s.")
+    return {"keys": "+".join(keys)}
+
+def parse_mouse_scroll(values):
+    try:
+        return {"dx": int(values["dx"]), "dy": int(values["dy"])}
+    except ValueError:
+        raise ValueError("Please enter valid scroll values.") from None
+
+def parse_wait_image(values):
+    cmd = {**parse_position(values), **parse_template(values)}
+    try:
+        cmd["tolerance"] = int(values["tolerance"])
+        cmd["poll_interval"] = float(values["poll_interval"])
+        cmd["timeout"] = float(values["timeout"])
+        if not 0 <= cmd["tolerance"] <= 255 or cmd["poll_interval"] <= 0 or cmd["timeout"] < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("Please enter a tolerance from 0 to 255, a positive poll interval and a timeout.") from None
+    return cmd
+
+def parse_click_image(values):
+    cmd = {**parse_position(values), **parse_template(values)}
+    try:
+        for name in ("search_x", "search_y", "search_width", "search_height"):
+            cmd[name] = int(values[name])
+        cmd["threshold"] = float(values["threshold"])
+        if not 0 < cmd["threshold"] <= 1 or cmd["search_width"] < 0 or cmd["search_height"] < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("Please enter a threshold from 0 to 1 and a valid search region.") from None
+    cmd["button"] = values["button"]
+    return cmd
+
+def parse_loop_start(values):
+    try:
+        count = int(values["count"])
+        if count < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("Please enter a valid loop count.") from None
+    return {"count": count}
+
+def parse_if_pixel(values):
+    cmd = parse_position(values)
+    try:
+        parse_color(values["color"])
+        cmd["color"] = "#" + values["color"].lstrip("#").lower()
+        cmd["tolerance"] = int(values["tolerance"])
+        if not 0 <= cmd["tolerance"] <= 255:
+            raise ValueError
+    except ValueError:
+        raise ValueError("Please enter a #rrggbb color and a tolerance from 0 to 255.") from None
+    return cmd
+
+def parse_variable(values):
+    # If Variable and Set Variable
+    if not values["name"]:
+        raise ValueError("Please enter a variable name.")
+    try:
+        value = float(values["value"])
+    except ValueError:
+        raise ValueError("Please enter a numeric value.") from None
+    return {"name": values["name"], "op": values["op"], "value": int(value) if value.is_integer() else value}
+
+def parse_label(values, key):
+    if not values[key]:
+        raise ValueError("Please enter a label name.")
+    return {key: values[key]}
+
+def parse_call(values):
+    if not values["file"]:
+        raise ValueError("Please select a macro file.")
+    return {"file": values["file"]}
+
+def resolve_image_click(cmd):
+    if np is None:
+        return None
+    return (resolve_button(cmd["button"]), TemplateMatcher(decode_template(cmd), cmd["x"], cmd["y"]))
+
+X_FIELD = ("x", "X:", "")
+Y_FIELD = ("y", "Y:", "")
+BUTTON_FIELD = ("button", "Button:", "left", tuple(MOUSE_BUTTONS))
+EASING_FIELD = ("easing", "Easing:", "ease-in-out", tuple(EASINGS))
+MOVE_DURATION_FIELD = ("duration", "Duration (seconds):", "0.5")
+HOLD_DURATION_FIELD = ("duration", "Hold Duration (seconds):", "1")
+
+# The built-in command types, in Command Type menu order; plugins are appended after them
+for opcode in [
+    Opcode("key_tap", "Key Tap", [("key", "Key:", ""), ("repeat", "Repeat:", "1")], parse_key_tap,
+           lambda cmd: f"Key tap: {cmd.get('key', '')} x {cmd.get('repeat', 1)} times",
+           ManualMacroGUI.execute_key_tap, resolve=lambda cmd: resolve_key(cmd["key"]),
+           estimate=lambda cmd: (cmd.get("repeat", 1) * KEY_TAP_GAP, cmd.get("repeat", 1) * KEY_TAP_GAP)),
+    Opcode("wait", "Wait", [("duration", "Wait Duration (seconds):", "")],
+           lambda values: {"duration": parse_duration(values, "Please enter a valid wait duration.")},
+           lambda cmd: f"Wait: {cmd.get('duration', 0)} sec",
+           ManualMacroGUI.execute_wait, estimate=estimate_duration),
+    Opcode("mouse_click", "Mouse Click", [X_FIELD, Y_FIELD, BUTTON_FIELD],
+           lambda values: {**parse_position(values), "button": values["button"]},
+           lambda cmd: f"Mouse click: ({cmd.get('x', 0)}, {cmd.get('y', 0)}), button: {cmd.get('button', '')}",
+           ManualMacroGUI.execute_mouse_click, resolve=lambda cmd: resolve_button(cmd["button"])),
+    Opcode("key_hold", "Key Hold", [("key", "Key:", ""), HOLD_DURATION_FIELD],
+           lambda values: {"key": parse_key(values), "duration": parse_duration(values, "Please enter a valid hold duration.")},
+           lambda cmd: f"Key hold: {cmd.get('key', '')} (duration: {cmd.get('duration', 0)} sec)",
+           ManualMacroGUI.execute_key_hold, resolve=lambda cmd: resolve_key(cmd["key"]), estimate=estimate_duration),
+    Opcode("mouse_hold", "Mouse Hold", [X_FIELD, Y_FIELD, BUTTON_FIELD, HOLD_DURATION_FIELD],
+           lambda values: {**parse_position(values), "button": values["button"],
+                           "duration": parse_duration(values, "Please enter a valid hold duration.")},
+           lambda cmd: f"Mouse hold: ({cmd.get('x', 0)}, {cmd.get('y', 0)}), button: {cmd.get('button', '')} (duration: {cmd.get('duration', 0)} sec)",
+           ManualMacroGUI.execute_mouse_hold, resolve=lambda cmd: resolve_button(cmd["button"]), estimate=estimate_duration),
+    Opcode("mouse_scroll", "Mouse Scroll", [("dx", "Horizontal Scroll:", "0"), ("dy", "Vertical Scroll:", "0")], parse_mouse_scroll,
+           lambda cmd: f"Mouse scroll: horizontal {cmd.get('dx',0)}, vertical {cmd.get('dy',0)}",
+           ManualMacroGUI.execute_mouse_scroll),
+    Opcode("mouse_move", "Mouse Move", [X_FIELD, Y_FIELD, MOVE_DURATION_FIELD, EASING_FIELD],
+           lambda values: {**parse_position(values), "duration": parse_duration(values, "Please enter a valid move duration.", 0),
+                           "easing": values["easing"]},
+           lambda cmd: f"Mouse move: ({cmd.get('x', 0)}, {cmd.get('y', 0)}) (duration: {cmd.get('duration', 0)} sec, {cmd.get('easing', 'ease-in-out')})",
+           ManualMacroGUI.execute_mouse_move, estimate=estimate_duration),
+    Opcode("mouse_drag", "Mouse Drag",
+           [("x", "From X:", ""), ("y", "From Y:", ""), ("to_x", "To X:", ""), ("to_y", "To Y:", ""),
+            MOVE_DURATION_FIELD, EASING_FIELD, BUTTON_FIELD],
+           lambda values: {**parse_position(values, ("x", "y", "to_x", "to_y")),
+                           "duration": parse_duration(values, "Please enter a valid move duration.", 0),
+                           "easing": values["easing"], "button": values["button"]},
+           lambda cmd: f"Mouse drag: ({cmd.get('x', 0)}, {cmd.get('y', 0)}) -> ({cmd.get('to_x', 0)}, {cmd.get('to_y', 0)}), button: {cmd.get('button', '')} (duration: {cmd.get('duration', 0)} sec, {cmd.get('easing', 'ease-in-out')})",
+           ManualMacroGUI.execute_mouse_drag, resolve=lambda cmd: resolve_button(cmd["button"]), estimate=estimate_duration),
+    Opcode("wait_image", "Wait Until Image",
+           [X_FIELD, Y_FIELD, ("width", "Width:", "1"), ("height", "Height:", "1"), ("tolerance", "Tolerance:", "0"),
+            ("poll_interval", "Poll Interval (seconds):", str(IMAGE_POLL_INTERVAL)), ("timeout", "Timeout (seconds, 0 = none):", "0")],
+           parse_wait_image,
+           lambda cmd: f"Wait until image: ({cmd.get('x', 0)}, {cmd.get('y', 0)}) {cmd.get('width', 0)}x{cmd.get('height', 0)}, tolerance: {cmd.get('tolerance', 0)}",
+           ManualMacroGUI.execute_wait_image, resolve=lambda cmd: decode_template(cmd) if np is not None else None,
+           estimate=lambda cmd: None),
+    Opcode("click_image", "Click Image",
+           [X_FIELD, Y_FIELD, ("width", "Width:", ""), ("height", "Height:", ""),
+            ("search_x", "Search X:", "0"), ("search_y", "Search Y:", "0"),
+            ("search_width", "Search Width:", "0"), ("search_height", "Search Height:", "0"),
+            ("threshold", "Threshold (0-1):", str(MATCH_THRESHOLD)), BUTTON_FIELD],
+           parse_click_image,
+           lambda cmd: f"Click image: {cmd.get('width', 0)}x{cmd.get('height', 0)}, threshold: {cmd.get('threshold', MATCH_THRESHOLD)}, button: {cmd.get('button', '')}",
+           ManualMacroGUI.execute_click_image, resolve=resolve_image_click, estimate=lambda cmd: None),
+    Opcode("type_text", "Type Text", [("text", "Text:", ""), ("cps", "Characters per Second (0 = unlimited):", str(TYPE_RATE))],
+           parse_type_text, format_type_text,
+           ManualMacroGUI.execute_type_text, resolve=lambda cmd: [resolve_character(char) for char in cmd["text"]],
+           estimate=estimate_type_text),
+    Opcode("paste_text", "Paste Text", [("text", "Text:", "")], parse_paste_text,
+           lambda cmd: f"Paste text: {preview_text(cmd.get('text', ''))} ({len(cmd.get('text', ''))} characters)",
+           ManualMacroGUI.execute_paste_text, resolve=lambda cmd: keyboard.KeyCode.from_char("v")),
+    Opcode("key_chord", "Key Chord", [("keys", "Keys (e.g. ctrl+shift+s):", "")], parse_key_chord,
+           lambda cmd: f"Key chord: {cmd.get('keys', '')}",
+           ManualMacroGUI.execute_key_chord, resolve=lambda cmd: [resolve_key(key) for key in cmd["keys"].split("+")]),
+    # Control flow, run by interpret_code itself
+    Opcode("loop_start", "Loop Start", [("count", "Count (0 = infinite):", "2")], parse_loop_start,
+           lambda cmd: f"Loop start: {cmd.get('count', 0)} times" if cmd.get("count", 0) else "Loop start: infinite"),
+    Opcode("loop_end", "Loop End", [], lambda values: {}, lambda cmd: "Loop end"),
+    Opcode("if_pixel", "If Pixel",
+           [X_FIELD, Y_FIELD, ("color", "Color (#rrggbb):", "#000000"), ("tolerance", "Tolerance:", "0")], parse_if_pixel,
+           lambda cmd: f"If pixel ({cmd.get('x', 0)}, {cmd.get('y', 0)}) is {cmd.get('color', '')}, tolerance: {cmd.get('tolerance', 0)}",
+           resolve=lambda cmd: np.array([[parse_color(cmd["color"])]], dtype=np.int16) if np is not None else None),
+    Opcode("if_variable", "If Variable",
+           [("name", "Variable:", ""), ("op", "Operator:", "==", tuple(COMPARISONS)), ("value", "Value:", "0")], parse_variable,
+           lambda cmd: f"If {cmd.get('name', '')} {cmd.get('op', '==')} {cmd.get('value', 0)}"),
+    Opcode("else", "Else", [], lambda values: {}, lambda cmd: "Else"),
+    Opcode("end_if", "End If", [], lambda values: {}, lambda cmd: "End if"),
+    Opcode("set_variable", "Set Variable",
+           [("name", "Variable:", ""), ("op", "Operator:", "=", tuple(ASSIGNMENTS)), ("value", "Value:", "0")], parse_variable,
+           lambda cmd: f"Set variable: {cmd.get('name', '')} {cmd.get('op', '=')} {cmd.get('value', 0)}"),
+    Opcode("label", "Label", [("name", "Name:", "")], lambda values: parse_label(values, "name"),
+           lambda cmd: f"Label: {cmd.get('name', '')}"),
+    Opcode("goto", "Go To", [("label", "Label:", "")], lambda values: parse_label(values, "label"),
+           lambda cmd: f"Go to: {cmd.get('label', '')}"),
+    Opcode("call", "Call Macro", [("file", "Macro File:", "")], parse_call,
+           lambda cmd: f"Call macro: {cmd.get('file', '')}"),
+    Opcode("return", "Return", [], lambda values: {}, lambda cmd: "Return"),
+]:
+    register_command(opcode)
+OP_LOOP_START = OPCODE_NUMBERS["loop_start"]
+OP_LOOP_END = OPCODE_NUMBERS["loop_end"]
+OP_IF_PIXEL = OPCODE_NUMBERS["if_pixel"]
+OP_IF_VARIABLE = OPCODE_NUMBERS["if_variable"]
+OP_ELSE = OPCODE_NUMBERS["else"]
+OP_SET_VARIABLE = OPCODE_NUMBERS["set_variable"]
+OP_GOTO = OPCODE_NUMBERS["goto"]
+OP_CALL = OPCODE_NUMBERS["call"]
+OP_RETURN = OPCODE_NUMBERS["return"]
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--analyze", metavar="MACRO_FILE", help="print the expected run time of a macro file and exit")
+    parser.add_argument("--loops", type=int, default=1, help="loop count of the main track for --analyze, 0 = forever (default: 1)")
+    args = parser.parse_args()
+    if args.analyze:
+        # Plugin messages go to stderr so the report can be redirected on its own
+        load_plugins(lambda message: print(message, file=sys.stderr))
+        try:
+            commands, track_loops = read_macro_commands(args.analyze)
+        except (OSError, ValueError) as e:
+            sys.exit(f"Macro load failed: {e}")
+        estimates = analyze_commands(commands, os.path.dirname(os.path.abspath(args.analyze)))
+        print("\n".join(describe_estimates(estimates, "1x", args.loops, track_loops)))
+        return
     app = ManualMacroGUI()
     app.mainloop()
 
@@ -1,13 +1,76 @@
 #!/usr/bin/env python3
+import os
+import copy
 import time
+import datetime
+import collections
 import json
+import argparse
+import operator
+import math
+import array
+import mmap
+import asyncio
+import pickle
+import hashlib
+import base64
+import concurrent.futures
+import ctypes
+import ctypes.util
 import threading
+import signal
+import sys
+import importlib.util
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from pynput import keyboard, mouse
+# 可选：只有屏幕相关命令需要这些
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import mss
+except ImportError:
+    mss = None
 
 DRAG_THRESHOLD = 5  # 拖拽开始前的最小移动像素
 RECORD_WAIT_THRESHOLD = 0.1  # 事件之间的最小等待时间（秒）
+KEY_TAP_GAP = 0.05  # 每次键敲击后的延迟（秒）
+COMMAND_GAP = 0.1  # 每条命令后的延迟（秒）
+TYPE_RATE = 20  # 输入文本命令的默认速度（每秒字符数）
+WATCH_POLL_INTERVAL = 0.5  # 宏文件监视的轮询间隔（秒）
+IMAGE_POLL_INTERVAL = 0.05  # 等待图像命令的默认屏幕轮询间隔（秒）
+MATCH_THRESHOLD = 0.9      # 图像点击默认所需的最小归一化互相关
+PYRAMID_MIN_SIZE = 8       # 模板较短边不小于该值时继续降采样
+PYRAMID_CANDIDATES = 3     # 在全分辨率下细化的最佳粗匹配数
+LOCAL_SEARCH_MARGIN = 32   # 在搜索整个区域之前先搜索上次命中位置周围的像素数
+HUMAN_MOVE_TIME = 0.1      # 人性化指针移动的基础时长（秒）
+HUMAN_MOVE_SPEED = 2500    # 较长移动按每秒像素数追加时长
+HUMAN_CURVE = 0.15         # 移动的最大侧向弯曲，按其长度的比例
+MOVE_RATE = 125            # 移动过程中每秒的指针更新次数
+UI_FRAME_INTERVAL = 16  # 应用排队的界面更新的间隔（毫秒）
+OVERLAP_POLICIES = ("queue", "restart", "ignore")  # 宏运行期间再次触发时的处理方式
+RUN_LIMITS = ("none", "duration", "until")  # 除循环次数外还能结束运行的方式
+SPEEDS = {"0.1x": 0.1, "0.25x": 0.25, "0.5x": 0.5, "1x": 1.0, "2x": 2.0, "5x": 5.0, "10x": 10.0, "max": 0}  # 回放速度；0 = 尽可能快
+MAX_CALL_DEPTH = 16  # 运行被中止前调用宏命令的最大嵌套深度
+ENGINE_STOP_TIMEOUT = 2.0  # 关闭时等待已停止的运行和引擎线程的时间（秒）
+WINDOW_WIDTH = 820  # 在窗口滚动条旁边为各行保留 800 像素
+WINDOW_HEIGHT = 900  # 初始高度；窗口可以纵向调整大小，内容可以滚动
+
+# 会话存储（快捷键、最近的宏、窗口状态、上一个宏的缓存）
+SESSION_DIR = os.path.join(os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config"), "blouplanet-macro")
+SESSION_FILE = os.path.join(SESSION_DIR, "session.json")
+LAST_MACRO_CACHE_FILE = os.path.join(SESSION_DIR, "last_macro.pickle")
+MAX_RECENT_MACROS = 10
+# 命令插件：启动时加载这里的每个 .py 文件，并用本模块调用其 register(macro)，
+# 以便它通过 macro.register_command(macro.Opcode(...)) 添加命令类型
+PLUGIN_DIR = os.path.join(SESSION_DIR, "plugins")
+
+# 已编译宏的缓存，以宏文件内容的 SHA-256 为键
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "blouplanet-macro", "compiled")
+MACRO_CACHE_VERSION = 4  # 编译后的宏结构变化时递增
+MAX_CACHED_MACROS = 50
 
 # 色彩及字体设置
 BG_COLOR = "#2C2F33"
@@ -23,17 +86,948 @@ BUTTON_FG = "white"
 BUTTON_ACTIVE_BG = "#5b6eae"
 FONT = ("Helvetica", 12)
 
+MOUSE_BUTTONS = {
+    "left": mouse.Button.left,
+    "right": mouse.Button.right,
+    "middle": mouse.Button.middle,
+}
+
+# 录制器当作组合键修饰键的键
+MODIFIER_NAMES = {
+    keyboard.Key.ctrl: "ctrl", keyboard.Key.ctrl_l: "ctrl", keyboard.Key.ctrl_r: "ctrl",
+    keyboard.Key.shift: "shift", keyboard.Key.shift_l: "shift", keyboard.Key.shift_r: "shift",
+    keyboard.Key.alt: "alt", keyboard.Key.alt_l: "alt", keyboard.Key.alt_r: "alt",
+    keyboard.Key.cmd: "cmd", keyboard.Key.cmd_l: "cmd", keyboard.Key.cmd_r: "cmd",
+}
+
+def resolve_key(key):
+    try:
+        return getattr(keyboard.Key, key.lower())
+    except AttributeError:
+        return key
+
+# 已输入过的字符对应的键：字符 -> (键, 是否按 Shift)
+TYPED_KEYS = {}
+TYPED_SPECIAL_KEYS = {"\n": keyboard.Key.enter, "\t": keyboard.Key.tab, " ": keyboard.Key.space}
+
+def resolve_character(char):
+    keystroke = TYPED_KEYS.get(char)
+    if keystroke is None:
+        if char in TYPED_SPECIAL_KEYS:
+            keystroke = (TYPED_SPECIAL_KEYS[char], False)
+        elif char != char.lower() and len(char.lower()) == 1:
+            # 大写字母就是其小写字母加 Shift
+            keystroke = (keyboard.KeyCode.from_char(char.lower()), True)
+        else:
+            keystroke = (keyboard.KeyCode.from_char(char), False)
+        TYPED_KEYS[char] = keystroke
+    return keystroke
+
+def key_name(key):
+    # 监听器的键 -> 键字段使用的名称，例如 "space" 或 "a"
+    if isinstance(key, keyboard.Key):
+        return key.name
+    return key.char or str(key)
+
+def resolve_button(button_str):
+    return MOUSE_BUTTONS.get(button_str, mouse.Button.left)
+
+def parse_color(text):
+    # "#rrggbb" -> (r, g, b)
+    text = text.strip().lstrip("#")
+    if len(text) != 6:
+        raise ValueError("invalid color: " + text)
+    return tuple(int(text[i:i + 2], 16) for i in (0, 2, 4))
+
+# 如果变量和设置变量命令的运算符
+COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+ASSIGNMENTS = {
+    "=": lambda old, value: value,
+    "+=": operator.add,
+    "-=": operator.sub,
+}
+
+class Opcode:
+    # 一种命令类型的全部信息：编辑表单、在命令列表中的文本以及执行方式
+    def __init__(self, name, label, fields, parse, format, execute=None, resolve=None, estimate=None):
+        self.name = name
+        self.label = label      # 命令类型菜单项
+        self.fields = fields    # 编辑字段：(key, label, default) 或 (key, label, default, choices)
+        self.parse = parse      # 按字段键的输入文本 -> 命令参数；ValueError 携带给用户的消息
+        self.format = format    # cmd -> 显示文本
+        self.execute = execute  # 协程 (gui, cmd, target, deadline, humanizer) -> deadline；流程控制为 None
+        self.resolve = resolve  # cmd -> target，编译时只计算一次
+        self.estimate = estimate  # cmd -> (秒数, 其中固定间隔) 供分析器使用；不耗时则为 None，
+                                  # 时间取决于屏幕时函数返回 None
+
+OPCODES = []           # 已注册的命令类型；每个的位置就是其操作码编号
+OPCODE_NUMBERS = {}    # 命令名 -> 操作码编号
+OPCODE_EXECUTORS = []  # 每个操作码编号的执行器，供分派循环使用
+COMMAND_TYPES = {}     # 命令类型菜单项 -> Opcode
+
+def register_command(opcode):
+    # 内置命令类型和插件都经过这里
+    if opcode.name in OPCODE_NUMBERS or opcode.label in COMMAND_TYPES:
+        raise ValueError("command type already registered: " + opcode.name)
+    OPCODE_NUMBERS[opcode.name] = len(OPCODES)
+    OPCODES.append(opcode)
+    OPCODE_EXECUTORS.append(opcode.execute)
+    COMMAND_TYPES[opcode.label] = opcode
+
+def load_plugins(log):
+    # 由窗口和 --analyze 各调用一次，在内置命令类型注册之后
+    try:
+        names = sorted(name for name in os.listdir(PLUGIN_DIR) if name.endswith(".py"))
+    except OSError:
+        return
+    for name in names:
+        try:
+            spec = importlib.util.spec_from_file_location("macro_plugin_" + name[:-3], os.path.join(PLUGIN_DIR, name))
+            plugin = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(plugin)
+            plugin.register(sys.modules[__name__])
+            log("插件已加载: " + name)
+        except Exception as e:
+            log(f"插件 {name} 加载失败: {e}")
+
+class Bytecode:
+    # 已编译的命令列表：每条命令一个操作码，外加操作码索引的操作数表
+    def __init__(self, ops=None, args=None, cmds=None, targets=None):
+        self.ops = ops if ops is not None else array.array("i")
+        self.args = args if args is not None else array.array("i")  # 跳转目标，没有时为 -1
+        self.cmds = cmds if cmds is not None else []
+        self.targets = targets if targets is not None else []  # 编译时解析的按键、鼠标按钮和模板
+        
+    def __len__(self):
+        return len(self.ops)
+        
+    def append(self, op, cmd, target=None, arg=-1):
+        self.ops.append(op)
+        self.args.append(arg)
+        self.cmds.append(cmd)
+        self.targets.append(target)
+        
+    def with_commands(self, cmds):
+        # 操作数不同的同一程序，例如按当前屏幕缩放的坐标
+        return Bytecode(self.ops, self.args, cmds, self.targets)
+        
+    def disassemble(self):
+        lines = []
+        for index, op in enumerate(self.ops):
+            opcode = OPCODES[op]
+            jump = f"-> {self.args[index]}" if self.args[index] >= 0 else ""
+            lines.append(f"{index:4}  {op:3} {opcode.name:<13} {jump:<8} {opcode.format(self.cmds[index])}")
+        return lines
+
+class MacroEstimate:
+    # 命令列表执行一遍的预计时间，无需运行即可算出
+    def __init__(self):
+        self.seconds = collections.Counter()  # 命令名 -> 这些命令花费的时间，含间隔
+        self.counts = collections.Counter()   # 命令名 -> 执行次数
+        self.dead_time = 0.0                  # 花在固定间隔上的时间 (COMMAND_GAP, KEY_TAP_GAP)
+        self.notes = []                       # 实际时间可能不同的原因
+
+    def total(self):
+        return sum(self.seconds.values())
+
+    def add(self, other, factor=1):
+        for name, seconds in other.seconds.items():
+            self.seconds[name] += seconds * factor
+        for name, count in other.counts.items():
+            self.counts[name] += count * factor
+        self.dead_time += other.dead_time * factor
+        self.notes.extend(note for note in other.notes if note not in self.notes)
+
+def read_macro_commands(path):
+    # 宏文件的命令列表和各轨道的循环次数
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return data.get("commands", []), {int(track): count for track, count in data.get("track_loops", {}).items()}
+    return data, {}
+
+def estimate_duration(cmd):
+    return cmd.get("duration", 0), 0
+
+def estimate_commands(commands, depth=0, folder=""):
+    # 循环按次数相乘，条件取较长的分支，被调用的宏会被读入
+    estimate, index = estimate_block(commands, 0, depth, folder)
+    while index < len(commands):
+        # 缺少开头的循环结束、否则或结束如果；compile_code 会拒绝，估计在其后继续
+        cmd = commands[index]
+        estimate.notes.append(f"第 {index + 1} 条命令缺少对应的开头，已跳过: " + OPCODES[OPCODE_NUMBERS[cmd["command"]]].format(cmd))
+        rest, index = estimate_block(commands, index + 1, depth, folder)
+        estimate.add(rest)
+    return estimate
+
+def estimate_block(commands, index, depth, folder):
+    # 一直到结束该块的循环结束、否则或结束如果，返回 (估计, 该命令的索引)
+    estimate = MacroEstimate()
+    while index < len(commands):
+        cmd = commands[index]
+        name = cmd.get("command")
+        if name in ("loop_end", "else", "end_if"):
+            break
+        index += 1
+        number = OPCODE_NUMBERS.get(name)
+        if number is None:
+            estimate.notes.append(f"未知命令未计入: {name}")
+            continue
+        opcode = OPCODES[number]
+        if name == "loop_start":
+            body, index = estimate_block(commands, index, depth, folder)
+            if index >= len(commands) or commands[index].get("command") != "loop_end":
+                estimate.notes.append("循环开始缺少循环结束: " + opcode.format(cmd))
+            index += 1
+            count = cmd.get("count", 0)
+            if not count:
+                estimate.notes.append("无限循环只计一次: " + opcode.format(cmd))
+            estimate.add(body, count or 1)
+        elif name in ("if_pixel", "if_variable"):
+            branch, index = estimate_block(commands, index, depth, folder)
+            other = MacroEstimate()
+            if index < len(commands) and commands[index].get("command") == "else":
+                other, index = estimate_block(commands, index + 1, depth, folder)
+            if index >= len(commands) or commands[index].get("command") != "end_if":
+                estimate.notes.append("如果缺少对应的结束如果: " + opcode.format(cmd))
+            index += 1
+            # 只会执行一个分支；计入较长的那个
+            estimate.add(max(branch, other, key=MacroEstimate.total))
+        elif name == "call":
+            estimate.add(estimate_call(cmd, depth, folder))
+        elif name in ("goto", "return"):
+            estimate.notes.append("未跟随跳转: " + opcode.format(cmd))
+        elif opcode.execute is not None:
+            seconds = dead = 0
+            if opcode.estimate is not None:
+                result = opcode.estimate(cmd)
+                if result is None:
+                    estimate.notes.append("取决于屏幕，按瞬间完成计算: " + opcode.format(cmd))
+                else:
+                    seconds, dead = result
+            # 引擎在每条命令后休眠 COMMAND_GAP
+            estimate.seconds[name] += seconds + COMMAND_GAP
+            estimate.counts[name] += 1
+            estimate.dead_time += dead + COMMAND_GAP
+    return estimate, index
+
+def estimate_call(cmd, depth, folder):
+    path = os.path.abspath(os.path.join(folder, cmd.get("file", "")))
+    if depth >= MAX_CALL_DEPTH:
+        estimate = MacroEstimate()
+        estimate.notes.append(f"宏调用嵌套超过 {MAX_CALL_DEPTH} 层: {path}")
+        return estimate
+    try:
+        commands, _ = read_macro_commands(path)
+    except (OSError, ValueError) as e:
+        estimate = MacroEstimate()
+        estimate.notes.append(f"未能读取被调用的宏: {path} ({e})")
+        return estimate
+    # 被调用文件所有轨道的命令按顺序执行，与 call_macro 相同
+    return estimate_commands(commands, depth + 1, os.path.dirname(path))
+
+def analyze_commands(commands, folder=""):
+    # 轨道号 -> 该轨道一次循环的 MacroEstimate
+    grouped = {}
+    for cmd in commands:
+        grouped.setdefault(cmd.get("track", 0), []).append(cmd)
+    return {track: estimate_commands(track_commands, 0, folder) for track, track_commands in grouped.items()}
+
+def describe_estimates(estimates, speed="1x", loop_count=1, track_loops=None):
+    # 循环次数与 run_macro 相同：主轨道运行 loop_count 次，其他轨道按各自的次数；0 = 无限
+    counts = {track: loop_count if track == 0 else (track_loops or {}).get(track, loop_count) for track in estimates}
+    lines = []
+    for track, estimate in sorted(estimates.items()):
+        total = estimate.total()
+        lines.append(f"轨道 {track}: 每次循环 {total:.3f} 秒，{sum(estimate.counts.values())} 条命令")
+        if counts[track]:
+            lines.append(f"  循环: {counts[track]} 次，共 {total * counts[track]:.3f} 秒")
+        elif track == 0:
+            lines.append("  循环: 无限")
+        else:
+            lines.append("  循环: 无限，直到其他轨道结束")
+        for name, seconds in estimate.seconds.most_common():
+            share = seconds / total * 100 if total else 0
+            lines.append(f"  {OPCODES[OPCODE_NUMBERS[name]].label:<18} {estimate.counts[name]:>7} x {seconds:10.3f} 秒 {share:6.1f}%")
+        share = estimate.dead_time / total * 100 if total else 0
+        lines.append(f"  空闲时间 (命令和按键后的固定间隔): {estimate.dead_time:.3f} 秒 ({share:.1f}%)")
+        for note in estimate.notes:
+            lines.append("  注意: " + note)
+        lines.append("")
+    if estimates:
+        # 轨道并行运行，运行在最后一个有限轨道结束时结束；无限循环的主轨道，
+        # 或者只有无限轨道时，永远不会结束
+        finite = [track for track in estimates if counts[track]]
+        if counts.get(0) == 0 or not finite:
+            lines.append("运行时长: 无限（直到停止或达到运行限制）")
+        else:
+            length = max(estimates[track].total() * counts[track] for track in finite)
+            lines.append(f"运行时长: {length:.3f} 秒")
+            if SPEEDS[speed] and SPEEDS[speed] != 1:
+                lines.append(f"速度 {speed} 时: {length / SPEEDS[speed]:.3f} 秒")
+    return lines
+
+def get_track_loop_count(program, track):
+    # 主轨道使用控件中的循环次数，其他轨道使用文件中各自的次数；0 = 无限
+    loop_count = program["loop_count"]
+    return loop_count if track == 0 else program["track_loops"].get(track, loop_count)
+
+def get_file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+class HeldInputs:
+    # 回放按下但尚未松开的键和按钮
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.held = set()  # (控制器, 键或按钮)
+
+    def add(self, controller, key):
+        with self.lock:
+            self.held.add((controller, key))
+
+    def discard(self, controller, key):
+        with self.lock:
+            self.held.discard((controller, key))
+
+    def release_all(self):
+        # 一次性全部松开，不管按下它们的运行停在什么状态
+        with self.lock:
+            held, self.held = self.held, set()
+        for controller, key in held:
+            try:
+                controller.release(key)
+            except Exception:
+                pass
+        return len(held)
+
+class TrackedInput:
+    # 控制器混入类，把每次按下记录在 HeldInputs 中直到松开
+    def __init__(self, held):
+        super().__init__()
+        self.held = held
+
+    def press(self, key):
+        super().press(key)
+        self.held.add(self, key)
+
+    def release(self, key):
+        self.held.discard(self, key)
+        super().release(key)
+
+class TrackedKeyboardController(TrackedInput, keyboard.Controller):
+    pass
+
+class TrackedMouseController(TrackedInput, mouse.Controller):
+    pass
+
+class PlaybackEngine:
+    # 所有宏运行、定时器和文件监视共用的一个 asyncio 事件循环线程
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.held = HeldInputs()  # 由此引擎上的任意运行按下
+        self.active_runs = 0
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        # 线程安全；取消返回的 future 即可取消该协程
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        # 从其他线程调用；在所有运行都已取消、其输入已松开
+        # 并且循环线程结束后返回
+        if not self.thread.is_alive():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(ENGINE_STOP_TIMEOUT)
+        except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError):
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(ENGINE_STOP_TIMEOUT)
+        # 只有某个运行忽略了取消时，这里才还有按住的输入
+        self.held.release_all()
+
+    async def shutdown(self):
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # 在循环本身上松开，之后任何运行都不能再按下任何东西
+        self.held.release_all()
+
+class PlaybackWorker:
+    # 常驻任务，逐个执行某个宏排队的运行请求
+    def __init__(self, engine, get_policy, log, on_done=None):
+        self.engine = engine
+        self.get_policy = get_policy
+        self.log = log
+        self.on_done = on_done
+        self.pending = collections.deque()  # 等待运行的协程工厂
+        self.current = None
+        self.closed = False
+        self.wakeup = None  # 由 run() 在引擎循环上创建；Python 3.10 之前 Event 会绑定到创建它的循环
+        self.future = engine.submit(self.run())
+
+    def request(self, factory):
+        self.engine.loop.call_soon_threadsafe(self.enqueue, factory)
+
+    def cancel(self):
+        self.engine.loop.call_soon_threadsafe(self.cancel_all)
+
+    def close(self):
+        self.closed = True
+        self.cancel()
+        self.future.cancel()
+
+    def is_busy(self):
+        return bool(self.pending) or (self.current is not None and not self.current.done())
+
+    def enqueue(self, factory):
+        # 已排队但尚未开始的请求也算作正在运行
+        if self.is_busy():
+            policy = self.get_policy()
+            if policy == "ignore":
+                self.log("宏已在运行，已忽略此次触发。")
+                return
+            if policy == "restart":
+                self.cancel_all()
+        self.pending.append(factory)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def cancel_all(self):
+        self.pending.clear()
+        if self.current is not None:
+            self.current.cancel()
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            while not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            factory = self.pending.popleft()
+            if self.closed:
+                return
+            self.current = asyncio.ensure_future(factory())
+            self.engine.active_runs += 1
+            try:
+                # 仅取消本次运行时 asyncio.wait 不会抛出异常
+                await asyncio.wait([self.current])
+            finally:
+                # close() 在运行中途取消此工作器时也一样
+                self.engine.active_runs -= 1
+            interrupted = self.current.cancelled()
+            if not interrupted and self.current.exception() is not None:
+                self.log("宏执行失败: " + str(self.current.exception()))
+                interrupted = True
+            if interrupted and not self.engine.active_runs:
+                # 没有其他运行，所以仍按着的都是这次运行留下的
+                released = self.engine.held.release_all()
+                if released:
+                    self.log(f"已松开 {released} 个按住的键和按钮.")
+            if self.on_done:
+                self.on_done()
+
+class UIDispatcher:
+    # 收集来自其他线程的界面更新，由 Tk 主循环每帧统一应用
+    def __init__(self, root, write_log):
+        self.root = root
+        self.write_log = write_log
+        self.lock = threading.Lock()
+        self.lines = []
+        self.calls = {}  # 键 -> 回调；相同键的新更新会替换尚未执行的旧更新
+        self.after_id = None
+
+    def start(self):
+        self.after_id = self.root.after(UI_FRAME_INTERVAL, self.drain)
+
+    def stop(self):
+        if self.after_id:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+    def log(self, message):
+        with self.lock:
+            self.lines.append(message)
+
+    def post(self, callback, key=None):
+        with self.lock:
+            self.calls[key or callback] = callback
+
+    def drain(self):
+        with self.lock:
+            lines, self.lines = self.lines, []
+            calls, self.calls = self.calls, {}
+        if lines:
+            self.write_log("\n".join(lines) + "\n")
+        for callback in calls.values():
+            try:
+                callback()
+            except Exception as e:
+                self.root.report_callback_exception(type(e), e, e.__traceback__)
+        self.after_id = self.root.after(UI_FRAME_INTERVAL, self.drain)
+
+class ClickCapture:
+    # 共享的鼠标监听器，把下一次左键点击的位置交给请求方
+    def __init__(self, post):
+        self.post = post  # 回调通过它在 Tk 线程中投递
+        self.lock = threading.Lock()
+        self.listener = None
+        self.waiting = None
+
+    def capture(self, callback):
+        with self.lock:
+            previous, self.waiting = self.waiting, callback
+            if self.listener is None:
+                # 首次使用时启动并保持运行，之后的拾取可立即响应
+                self.listener = mouse.Listener(on_click=self.on_click)
+                self.listener.start()
+        if previous:
+            # 只有最新的请求会得到这次点击
+            self.post(lambda: previous(None))
+
+    def stop(self):
+        with self.lock:
+            self.waiting = None
+            if self.listener:
+                self.listener.stop()
+                self.listener = None
+
+    def on_click(self, x, y, button, pressed):
+        if button != mouse.Button.left or not pressed:
+            return
+        with self.lock:
+            callback, self.waiting = self.waiting, None
+        if callback:
+            self.post(lambda: callback((int(x), int(y))))
+
+# 随屏幕尺寸缩放的坐标字段，按命令列出
+POSITION_COMMANDS = {
+    "mouse_click": (("x", "y"),),
+    "mouse_hold": (("x", "y"),),
+    "mouse_move": (("x", "y"),),
+    "mouse_drag": (("x", "y"), ("to_x", "to_y")),
+    "if_pixel": (("x", "y"),),
+}
+
+def screen_transform(reference, current):
+    # 从制作宏时的屏幕到当前屏幕的缩放比例
+    return (current[0] / reference[0], current[1] / reference[1])
+
+def transform_tracks(tracks, transform):
+    # 每次运行只应用一次，播放过程本身不再处理坐标
+    if transform == (1.0, 1.0):
+        return tracks
+    scale_x, scale_y = transform
+    def scale(cmd):
+        cmd = dict(cmd)
+        for field_x, field_y in POSITION_COMMANDS[cmd["command"]]:
+            cmd[field_x] = round(cmd[field_x] * scale_x)
+            cmd[field_y] = round(cmd[field_y] * scale_y)
+        return cmd
+    return {track: code.with_commands([scale(cmd) if cmd["command"] in POSITION_COMMANDS else cmd for cmd in code.cmds])
+            for track, code in tracks.items()}
+
+# 每个函数把 0..1 的进度映射为缓动后的进度，浮点数和 numpy 数组都适用
+EASINGS = {
+    "linear": lambda t: t,
+    "ease-in": lambda t: t * t,
+    "ease-out": lambda t: t * (2 - t),
+    "ease-in-out": lambda t: t * t * (3 - 2 * t),
+}
+
+def interpolate_path(start, end, duration, easing):
+    # 返回直线移动的所有点及点之间的时间
+    count = max(2, int(duration * MOVE_RATE) + 1)
+    ease = EASINGS[easing]
+    if np is None:
+        steps = [ease(i / (count - 1)) for i in range(count)]
+        points = [(round(start[0] + (end[0] - start[0]) * t), round(start[1] + (end[1] - start[1]) * t)) for t in steps]
+    else:
+        steps = ease(np.linspace(0, 1, count))[:, None]
+        start = np.asarray(start, dtype=float)
+        points = np.rint(start + (np.asarray(end, dtype=float) - start) * steps).astype(int).tolist()
+        points = [tuple(point) for point in points]
+    return points, duration / (count - 1)
+
+class Humanizer:
+    # 带种子的时间抖动和曲线指针路径；每条轨道使用自己的随机流
+    def __init__(self, jitter, seed, stream=0):
+        self.jitter = jitter  # 等待时间的最大相对变化，例如 0.1 表示 +-10%
+        self.seed = seed
+        self.rng = np.random.default_rng([seed, stream])
+
+    def for_track(self, track):
+        return Humanizer(self.jitter, self.seed, track)
+
+    def vary(self, duration):
+        return duration * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+    def path(self, start, end, duration=0, easing="ease-in-out"):
+        # 整个移动预先作为一个数组采样，发送时只需更新位置
+        start = np.asarray(start, dtype=float)
+        end = np.asarray(end, dtype=float)
+        delta = end - start
+        if not duration:
+            duration = HUMAN_MOVE_TIME + float(np.hypot(*delta)) / HUMAN_MOVE_SPEED
+        duration = self.vary(duration)
+        count = max(2, int(duration * MOVE_RATE) + 1)
+        # 控制点随机侧移的三次贝塞尔曲线
+        normal = np.array([-delta[1], delta[0]])
+        bends = self.rng.uniform(-HUMAN_CURVE, HUMAN_CURVE, 2)
+        control1 = start + delta * 0.3 + normal * bends[0]
+        control2 = start + delta * 0.7 + normal * bends[1]
+        t = EASINGS[easing](np.linspace(0, 1, count))[:, None]
+        points = ((1 - t) ** 3 * start + 3 * (1 - t) ** 2 * t * control1
+                  + 3 * (1 - t) * t ** 2 * control2 + t ** 3 * end)
+        return [tuple(point) for point in np.rint(points).astype(int).tolist()], duration / (count - 1)
+
+def encode_template(image):
+    return base64.b64encode(np.ascontiguousarray(image, dtype=np.uint8).tobytes()).decode("ascii")
+
+def decode_template(cmd):
+    # 在编译时解码一次；使用 int16 以免差值溢出回绕
+    data = np.frombuffer(base64.b64decode(cmd["template"]), dtype=np.uint8)
+    return data.reshape(cmd["height"], cmd["width"], 3).astype(np.int16)
+
+def to_gray(image):
+    return image.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+def downsample(image):
+    # 通过对 2x2 块取平均将宽高减半
+    height, width = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    image = image[:height, :width]
+    return (image[0::2, 0::2] + image[1::2, 0::2] + image[0::2, 1::2] + image[1::2, 1::2]) / 4
+
+def box_sums(image, height, width):
+    # 利用积分图计算每个 高 x 宽 窗口的和
+    integral = np.pad(image.cumsum(0, dtype=np.float64).cumsum(1), ((1, 0), (1, 0)))
+    return (integral[height:, width:] - integral[:-height, width:]
+            - integral[height:, :-width] + integral[:-height, :-width])
+
+def match_template(image, template):
+    # 模板在图像每个位置上的归一化互相关
+    height, width = template.shape
+    if image.shape[0] < height or image.shape[1] < width:
+        return np.zeros((0, 0))
+    shade = float(template.mean())
+    template = template - shade
+    energy = float(np.square(template, dtype=np.float64).sum())
+    sums = box_sums(image, height, width)
+    squares = box_sums(np.square(image, dtype=np.float64), height, width)
+    if energy < 1e-6 * template.size:
+        # 单色模板没有可供相关计算的图案，得分会一直是 0；因此改为按每个窗口与它那一种
+        # 色调的接近程度打分，完全一致时为 1
+        distance = squares - 2 * shade * sums + shade * shade * (height * width)
+        return 1 - np.sqrt(np.maximum(distance, 0) / (height * width)) / 255
+    # 通过 FFT 计算相关；有效部分不会发生循环回绕
+    spectrum = np.fft.rfft2(image) * np.fft.rfft2(template[::-1, ::-1], s=image.shape)
+    numerator = np.fft.irfft2(spectrum, s=image.shape)[height - 1:, width - 1:]
+    variance = squares - sums * sums / (height * width)
+    denominator = np.sqrt(np.maximum(variance, 0) * energy)
+    return np.where(denominator > 1e-6, numerator / np.maximum(denominator, 1e-6), 0.0)
+
+def best_match(image, template):
+    scores = match_template(image, template)
+    if scores.size == 0:
+        return 0, 0, -1.0
+    row, col = np.unravel_index(np.argmax(scores), scores.shape)
+    return int(row), int(col), float(scores[row, col])
+
+def refine_match(image, template, row, col, radius):
+    # (row, col) 周围 radius 像素内的最佳匹配
+    height, width = template.shape
+    top, left = max(row - radius, 0), max(col - radius, 0)
+    row, col, score = best_match(image[top:row + height + radius, left:col + width + radius], template)
+    return top + row, left + col, score
+
+class TemplateMatcher:
+    # 模板的灰度金字塔以及上次在屏幕上找到它的位置
+    def __init__(self, template, x, y):
+        self.height, self.width = template.shape[:2]
+        self.pyramid = [to_gray(template)]
+        while min(self.pyramid[-1].shape) >= 2 * PYRAMID_MIN_SIZE:
+            self.pyramid.append(downsample(self.pyramid[-1]))
+        self.last_hit = (x, y)  # 初始值为截取模板的位置
+
+    def search(self, image):
+        # 只在最粗一层做全搜索，然后逐层细化最佳候选
+        levels = [image]
+        for _ in range(len(self.pyramid) - 1):
+            levels.append(downsample(levels[-1]))
+        top = len(self.pyramid) - 1
+        scores = match_template(levels[top], self.pyramid[top])
+        if scores.size == 0:
+            return None
+        count = min(PYRAMID_CANDIDATES, scores.size)
+        best = None
+        for index in np.argpartition(scores.ravel(), -count)[-count:]:
+            row, col = divmod(int(index), scores.shape[1])
+            score = float(scores[row, col])
+            for level in range(top - 1, -1, -1):
+                row, col, score = refine_match(levels[level], self.pyramid[level], row * 2, col * 2, 2)
+            if best is None or score > best[2]:
+                best = (col, row, score)
+        return best
+
+class ScreenSampler:
+    # 只抓取所需的屏幕区域；X 服务器支持时 mss 会使用 XShm
+    def __init__(self):
+        # 由一个线程为所有抓取保持同一个抓取器（及其共享内存段）
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.sct = None
+
+    @staticmethod
+    def available():
+        return np is not None and mss is not None
+
+    def get_grabber(self):
+        if self.sct is None:
+            self.sct = mss.mss()
+        return self.sct
+
+    def grab(self, x, y, width, height):
+        shot = self.get_grabber().grab({"left": x, "top": y, "width": width, "height": height})
+        # BGRA -> RGB
+        return np.frombuffer(shot.bgra, dtype=np.uint8).reshape(height, width, 4)[:, :, 2::-1]
+
+    def capture(self, x, y, width, height):
+        return self.executor.submit(self.grab, x, y, width, height).result()
+
+    def compare(self, x, y, template, tolerance):
+        region = self.grab(x, y, template.shape[1], template.shape[0])
+        return int(np.abs(region - template).max()) <= tolerance
+
+    async def matches(self, x, y, template, tolerance):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.compare, x, y, template, tolerance)
+
+    def locate(self, matcher, region, threshold):
+        x, y, width, height = region
+        if width <= 0 or height <= 0:
+            screen = self.get_grabber().monitors[0]  # 所有显示器的外接矩形
+            x, y, width, height = screen["left"], screen["top"], screen["width"], screen["height"]
+        # 先在上次命中位置附近查找；只有目标移动时才搜索整个区域
+        last_x, last_y = matcher.last_hit
+        left = max(x, last_x - LOCAL_SEARCH_MARGIN)
+        top = max(y, last_y - LOCAL_SEARCH_MARGIN)
+        right = min(x + width, last_x + matcher.width + LOCAL_SEARCH_MARGIN)
+        bottom = min(y + height, last_y + matcher.height + LOCAL_SEARCH_MARGIN)
+        if right - left >= matcher.width and bottom - top >= matcher.height:
+            image = to_gray(self.grab(left, top, right - left, bottom - top))
+            row, col, score = best_match(image, matcher.pyramid[0])
+            if score >= threshold:
+                matcher.last_hit = (left + col, top + row)
+                return left + col, top + row, score
+        hit = matcher.search(to_gray(self.grab(x, y, width, height)))
+        if hit is None or hit[2] < threshold:
+            return None
+        matcher.last_hit = (x + hit[0], y + hit[1])
+        return x + hit[0], y + hit[1], hit[2]
+
+    async def find(self, matcher, region, threshold):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.locate, matcher, region, threshold)
+
+def wake_future(future):
+    if not future.done():
+        future.set_result(None)
+
+class PlaybackClock:
+    # 宏时间：按回放速度缩放的事件循环时钟 (time.monotonic())。
+    # 截止时间保持为宏时间，所以速度变化作用于所有进行中和之后的时长
+    def __init__(self):
+        self.speed = 1.0      # SPEEDS 之一；0 = 尽可能快
+        self.base = 0.0       # 上次改变速度时的宏时间
+        self.loop_base = 0.0  # 上次改变速度时的循环时间
+        self.sleepers = set()
+
+    def now(self):
+        # 尽可能快时宏时间仍按 1x 前进，之后换速度时从当前时刻继续
+        return self.base + (asyncio.get_running_loop().time() - self.loop_base) * (self.speed or 1)
+
+    def set_speed(self, speed):
+        # 在引擎线程上调用；等待者被唤醒并按新速度重新计划
+        self.base = self.now()
+        self.loop_base = asyncio.get_running_loop().time()
+        self.speed = speed
+        for future in self.sleepers:
+            if not future.done():
+                future.set_result(True)
+
+    async def sleep_until(self, deadline):
+        # 返回调用方接着使用的截止时间
+        loop = asyncio.get_running_loop()
+        while self.speed:
+            future = loop.create_future()
+            handle = loop.call_at(self.loop_base + (deadline - self.base) / self.speed, wake_future, future)
+            self.sleepers.add(future)
+            try:
+                if not await future:
+                    return deadline
+            finally:
+                handle.cancel()
+                self.sleepers.discard(future)
+        # 尽可能快：调用方的截止时间被拉回当前时刻，而不是跑到它前面，
+        # 这样每个轨道保留自己的时间，换速度时也没有积压要补放
+        await asyncio.sleep(0)
+        return self.now()
+
+CLOCK = PlaybackClock()  # 所有运行共用，所以一个速度设置作用于全部
+sleep_until = CLOCK.sleep_until
+
+def parse_run_duration(text):
+    # "90"、"90s"、"45m"、"2h" 或 "1:30:00" -> 秒
+    text = text.strip().lower()
+    if ":" in text:
+        seconds = 0
+        for part in text.split(":"):
+            seconds = seconds * 60 + float(part)
+    else:
+        units = {"s": 1, "m": 60, "h": 3600}
+        scale = units.get(text[-1:])
+        seconds = float(text[:-1]) * scale if scale else float(text)
+    if not seconds > 0:
+        raise ValueError("invalid duration: " + text)
+    return seconds
+
+def next_clock_time(text):
+    # "17:00" 或 "17:00:30" -> 本地时钟下一次显示该时间时的纪元秒数
+    text = text.strip()
+    clock = datetime.datetime.strptime(text, "%H:%M:%S" if text.count(":") == 2 else "%H:%M").time()
+    now = datetime.datetime.now()
+    target = datetime.datetime.combine(now.date(), clock)
+    if target <= now:
+        target += datetime.timedelta(days=1)
+    return target.timestamp()
+
+def run_stop_time(run_limit):
+    # 运行结束时的循环（单调）时间，无限制时为 None
+    if run_limit is None:
+        return None
+    mode, value = run_limit
+    now = asyncio.get_running_loop().time()
+    if mode == "duration":
+        return now + value
+    # 只读取一次挂钟时间，所以之后的时钟调整不会移动结束时间
+    return now + value - time.time()
+
+class MacroFileWatcher:
+    # 使用 inotify 监视一个宏文件，不可用时退回到 mtime 轮询
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+
+    def __init__(self, path, on_change, engine):
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.engine = engine
+        self.signature = self.get_signature()
+        self.future = None
+
+    def start(self):
+        self.future = self.engine.submit(self.run())
+
+    def stop(self):
+        if self.future:
+            self.future.cancel()
+
+    def get_signature(self):
+        return get_file_signature(self.path)
+
+    def mark_current(self):
+        self.signature = self.get_signature()
+
+    async def check(self):
+        signature = self.get_signature()
+        if signature is not None and signature != self.signature:
+            self.signature = signature
+            # 在事件循环之外解析，以免影响正在运行的宏的时序
+            await asyncio.get_running_loop().run_in_executor(None, self.on_change, self.path)
+
+    def open_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        # 编辑器常通过临时文件加重命名来保存，因此监视所在目录
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(os.path.dirname(self.path)), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    async def run(self):
+        fd = self.open_inotify()
+        if fd is None:
+            while True:
+                await asyncio.sleep(WATCH_POLL_INTERVAL)
+                await self.check()
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        def on_readable():
+            try:
+                os.read(fd, 65536)
+            except BlockingIOError:
+                pass
+            changed.set()
+        loop.add_reader(fd, on_readable)
+        try:
+            while True:
+                await changed.wait()
+                changed.clear()
+                await self.check()
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
+
 class ManualMacroGUI(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("BLOUplanet's Macro - 键盘/鼠标宏程序")
-        self.geometry("800x900")
-        self.resizable(False, False)
+        self.geometry(f"{WINDOW_WIDTH}x{WINDOW_HEIGHT}")
+        self.resizable(False, True)
         self.configure(bg=BG_COLOR)
+        # 所有来自其他线程的更新都经过这里
+        self.ui = UIDispatcher(self, self.write_log)
+        self.click_capture = ClickCapture(self.ui.post)
+        self.screen = ScreenSampler()
+        load_plugins(self.log)
         
         # 宏命令相关变量
         self.commands = []  # 保存宏命令的列表
+        self.compiled_tracks = None      # 从缓存加载的 self.commands 编译结果
         self.macro_running = False
+        self.overlap_policy = "ignore"   # OVERLAP_POLICIES 之一
+        self.editor_program = None       # 正在运行的编辑器宏的编译结果
+        self.generated_code = {}         # 生成的轨道函数的工厂，按命令列表哈希索引
+        self.macro_path = None           # 最近加载或保存的宏文件路径
+        self.macro_watcher = None
+        self.recent_macros = []          # 最近使用的宏文件，最新的在前
+        self.screen_size = (self.winfo_screenwidth(), self.winfo_screenheight())  # 每次运行前刷新
+        self.macro_screen = self.screen_size  # 编辑器宏坐标所对应的屏幕尺寸
         self.drag_original_index = None  # 拖拽开始时的项目索引
         self.dragged_command = None      # 拖拽开始时选中的命令对象
         self.ghost = None                # 拖拽时显示的半透明影像
@@ -46,6 +1040,9 @@ class ManualMacroGUI(tk.Tk):
         self.action_recording = False
         self.recorded_commands = []      # 通过动作记录生成的命令
         self.last_record_time = 0
+        self.record_modifiers = []       # 按住的修饰键名称，按按下顺序
+        self.record_chord_modifiers = set()  # 已作为组合键一部分录制的修饰键；松开时不再录制
+        self.record_chord_keys = set()       # 按下时已录制的按键名；松开时不再录制
         self.action_keyboard_listener = None
         self.action_mouse_listener = None
 
@@ -53,11 +1050,29 @@ class ManualMacroGUI(tk.Tk):
         self.action_start_hotkey_var = tk.StringVar(value="f4")
         self.action_stop_hotkey_var = tk.StringVar(value="f5")
         
+        # 宏库: 名称 -> 已加载的宏，各自拥有快捷键和运行实例
+        self.macro_library = {}
+        self.library_names = []          # 按列表顺序排列的宏库名称
+        
         # 点击背景时取消焦点
         self.bind_all("<Button-1>", self.clear_focus, add="+")
         
+        # 以下所有内容都放在可滚动的画布中，这样最高的命令表单也能放进较矮的屏幕
+        self.canvas_main = tk.Canvas(self, bg=BG_COLOR, highlightthickness=0)
+        self.scrollbar_main = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.canvas_main.yview)
+        self.canvas_main.config(yscrollcommand=self.scrollbar_main.set)
+        self.scrollbar_main.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas_main.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.frame_main = tk.Frame(self.canvas_main, bg=BG_COLOR)
+        main_window = self.canvas_main.create_window(0, 0, window=self.frame_main, anchor="nw")
+        self.frame_main.bind("<Configure>", lambda event: self.canvas_main.config(scrollregion=self.canvas_main.bbox("all")))
+        self.canvas_main.bind("<Configure>", lambda event: self.canvas_main.itemconfigure(main_window, width=event.width))
+        self.bind_all("<MouseWheel>", self.on_main_wheel, add="+")
+        self.bind_all("<Button-4>", self.on_main_wheel, add="+")
+        self.bind_all("<Button-5>", self.on_main_wheel, add="+")
+        
         # --- 命令列表区域 ---
-        self.frame_list = tk.Frame(self, bg=FRAME_BG)
+        self.frame_list = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_list.pack(padx=10, pady=5, fill=tk.BOTH, expand=True)
         
         self.listbox = tk.Listbox(self.frame_list, width=80, height=10, bg=LISTBOX_BG, fg=LISTBOX_FG,
@@ -74,28 +1089,34 @@ class ManualMacroGUI(tk.Tk):
         self.listbox.config(yscrollcommand=self.scrollbar.set)
         
         # --- 命令添加编辑区域 ---
-        self.frame_editor = tk.Frame(self, bg=FRAME_BG)
+        self.frame_editor = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_editor.pack(padx=10, pady=5, fill=tk.X)
         tk.Label(self.frame_editor, text="命令类型:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
             .grid(row=0, column=0, padx=5, pady=5)
-        self.command_type_var = tk.StringVar(value="键敲击")
+        self.command_type_var = tk.StringVar(value=OPCODES[0].label)
         self.option_menu = tk.OptionMenu(self.frame_editor, self.command_type_var,
-                                         "键敲击", "等待", "鼠标点击", "键长按", "鼠标长按", "鼠标滚动",
-                                         command=self.update_param_fields)
+                                         *COMMAND_TYPES, command=self.update_param_fields)
         self.option_menu.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
         self.option_menu["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
         self.option_menu.grid(row=0, column=1, padx=5, pady=5)
+        # 参数字段独占编辑区的一整行，长表单不会被截断
+        self.frame_editor.columnconfigure(2, weight=1)
         self.frame_params = tk.Frame(self.frame_editor, bg=FRAME_BG)
-        self.frame_params.grid(row=0, column=2, padx=5, pady=5)
+        self.frame_params.grid(row=1, column=0, columnspan=3, padx=5, pady=5, sticky="w")
         self.param_entries = {}
-        self.update_param_fields("键敲击")
+        self.update_param_fields(OPCODES[0].label)
+        tk.Label(self.frame_editor, text="轨道:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .grid(row=2, column=0, padx=5, pady=5)
+        self.entry_track = tk.Entry(self.frame_editor, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_track.insert(0, "0")
+        self.entry_track.grid(row=2, column=1, padx=5, pady=5, sticky="w")
         self.button_add = tk.Button(self.frame_editor, text="添加命令", command=self.add_command,
                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
                                     activebackground=BUTTON_ACTIVE_BG)
-        self.button_add.grid(row=0, column=3, padx=5, pady=5)
+        self.button_add.grid(row=2, column=2, padx=5, pady=5, sticky="w")
         
         # --- 控制按钮区域 ---
-        self.frame_controls = tk.Frame(self, bg=FRAME_BG)
+        self.frame_controls = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_controls.pack(padx=10, pady=5, fill=tk.X)
         # 上部: 删除所选命令、运行宏、停止宏
         self.frame_controls_top = tk.Frame(self.frame_controls, bg=FRAME_BG)
@@ -112,6 +1133,14 @@ class ManualMacroGUI(tk.Tk):
                                      bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
                                      activebackground=BUTTON_ACTIVE_BG)
         self.button_stop.pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Label(self.frame_controls_top, text="运行中触发:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.overlap_policy_var = tk.StringVar(value=self.overlap_policy)
+        self.option_overlap_policy = tk.OptionMenu(self.frame_controls_top, self.overlap_policy_var, *OVERLAP_POLICIES,
+                                                   command=self.set_overlap_policy)
+        self.option_overlap_policy.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
+        self.option_overlap_policy["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+        self.option_overlap_policy.pack(side=tk.LEFT, padx=5, pady=5)
         # 下部: 保存宏、加载宏、重复次数
         self.frame_controls_bottom = tk.Frame(self.frame_controls, bg=FRAME_BG)
         self.frame_controls_bottom.pack(fill=tk.X, pady=(5,0))
@@ -123,14 +1152,76 @@ class ManualMacroGUI(tk.Tk):
                                      bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
                                      activebackground=BUTTON_ACTIVE_BG)
         self.button_load.pack(side=tk.LEFT, padx=5, pady=5)
+        self.menubutton_recent = tk.Menubutton(self.frame_controls_bottom, text="最近", bg=BUTTON_BG, fg=BUTTON_FG,
+                                               font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG)
+        self.menu_recent = tk.Menu(self.menubutton_recent, tearoff=0, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+        self.menubutton_recent.config(menu=self.menu_recent)
+        self.menubutton_recent.pack(side=tk.LEFT, padx=5, pady=5)
+        self.watch_file_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.frame_controls_bottom, text="自动重新加载", variable=self.watch_file_var,
+                       command=self.update_macro_watcher, bg=BG_COLOR, fg=LABEL_FG, font=FONT,
+                       selectcolor=ENTRY_BG, activebackground=BG_COLOR, activeforeground=LABEL_FG)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
         tk.Label(self.frame_controls_bottom, text="重复次数 (0:无限):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
             .pack(side=tk.LEFT, padx=5, pady=5)
         self.entry_loop = tk.Entry(self.frame_controls_bottom, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
         self.entry_loop.insert(0, "1")
         self.entry_loop.pack(side=tk.LEFT, padx=5, pady=5)
+        self.frame_controls_run_limit = tk.Frame(self.frame_controls, bg=FRAME_BG)
+        self.frame_controls_run_limit.pack(fill=tk.X)
+        tk.Label(self.frame_controls_run_limit, text="运行限制:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.run_limit_var = tk.StringVar(value="none")
+        self.option_run_limit = tk.OptionMenu(self.frame_controls_run_limit, self.run_limit_var, *RUN_LIMITS)
+        self.option_run_limit.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
+        self.option_run_limit["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+        self.option_run_limit.pack(side=tk.LEFT, padx=5, pady=5)
+        # 时长如 "2h" 或 "1:30:00"，或时刻如 "17:00"
+        self.entry_run_limit = tk.Entry(self.frame_controls_run_limit, width=8, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_run_limit.pack(side=tk.LEFT, padx=5, pady=5)
+        # 各轨道的重复次数，例如 "1:0, 2:3"（未列出的轨道使用上面的次数）
+        self.frame_controls_tracks = tk.Frame(self.frame_controls, bg=FRAME_BG)
+        self.frame_controls_tracks.pack(fill=tk.X)
+        tk.Label(self.frame_controls_tracks, text="轨道重复次数 (轨道:次数):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_track_loops = tk.Entry(self.frame_controls_tracks, width=20, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_track_loops.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_disassemble = tk.Button(self.frame_controls_tracks, text="显示字节码", command=self.show_disassembly,
+                                            bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                            activebackground=BUTTON_ACTIVE_BG)
+        self.button_disassemble.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_analyze = tk.Button(self.frame_controls_tracks, text="分析", command=self.show_analysis,
+                                        bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                        activebackground=BUTTON_ACTIVE_BG)
+        self.button_analyze.pack(side=tk.LEFT, padx=5, pady=5)
+        self.frame_controls_humanize = tk.Frame(self.frame_controls, bg=FRAME_BG)
+        self.frame_controls_humanize.pack(fill=tk.X)
+        self.humanize_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.frame_controls_humanize, text="人性化", variable=self.humanize_var,
+                       bg=BG_COLOR, fg=LABEL_FG, font=FONT,
+                       selectcolor=ENTRY_BG, activebackground=BG_COLOR, activeforeground=LABEL_FG)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Label(self.frame_controls_humanize, text="抖动 (%):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_jitter = tk.Entry(self.frame_controls_humanize, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_jitter.insert(0, "10")
+        self.entry_jitter.pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Label(self.frame_controls_humanize, text="种子 (空 = 随机):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_seed = tk.Entry(self.frame_controls_humanize, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_seed.pack(side=tk.LEFT, padx=5, pady=5)
+        self.frame_controls_speed = tk.Frame(self.frame_controls, bg=FRAME_BG)
+        self.frame_controls_speed.pack(fill=tk.X)
+        tk.Label(self.frame_controls_speed, text="速度:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.speed_var = tk.StringVar(value="1x")
+        self.option_speed = tk.OptionMenu(self.frame_controls_speed, self.speed_var, *SPEEDS, command=self.set_speed)
+        self.option_speed.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
+        self.option_speed["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+        self.option_speed.pack(side=tk.LEFT, padx=5, pady=5)
         
         # --- 快捷键设置区域 ---
-        self.frame_hotkeys = tk.Frame(self, bg=FRAME_BG)
+        self.frame_hotkeys = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_hotkeys.pack(padx=10, pady=5, fill=tk.X)
         tk.Label(self.frame_hotkeys, text="宏运行快捷键:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
             .pack(side=tk.LEFT, padx=5, pady=5)
@@ -148,9 +1239,22 @@ class ManualMacroGUI(tk.Tk):
                                               bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
                                               activebackground=BUTTON_ACTIVE_BG)
         self.button_apply_hotkeys.pack(side=tk.LEFT, padx=5, pady=5)
+        # 速度快捷键单独一行；上面的应用快捷键也会应用它们
+        self.frame_speed_hotkeys = tk.Frame(self.frame_main, bg=FRAME_BG)
+        self.frame_speed_hotkeys.pack(padx=10, pady=5, fill=tk.X)
+        tk.Label(self.frame_speed_hotkeys, text="速度快捷键 (减速/加速):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.slower_hotkey_var = tk.StringVar(value="f6")
+        self.entry_slower_hotkey = tk.Entry(self.frame_speed_hotkeys, textvariable=self.slower_hotkey_var,
+                                            width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_slower_hotkey.pack(side=tk.LEFT, padx=5, pady=5)
+        self.faster_hotkey_var = tk.StringVar(value="f7")
+        self.entry_faster_hotkey = tk.Entry(self.frame_speed_hotkeys, textvariable=self.faster_hotkey_var,
+                                            width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_faster_hotkey.pack(side=tk.LEFT, padx=5, pady=5)
         
         # --- 动作记录区域 ---
-        self.frame_action_record = tk.Frame(self, bg=FRAME_BG)
+        self.frame_action_record = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_action_record.pack(padx=10, pady=5, fill=tk.X)
         tk.Label(self.frame_action_record, text="动作记录快捷键 (开始/结束):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
             .pack(side=tk.LEFT, padx=5, pady=5)
@@ -165,15 +1269,68 @@ class ManualMacroGUI(tk.Tk):
                                                  activebackground=BUTTON_ACTIVE_BG)
         self.button_toggle_recording.pack(side=tk.LEFT, padx=5, pady=5)
         
+        # --- 宏库区域 ---
+        self.frame_library = tk.Frame(self.frame_main, bg=FRAME_BG)
+        self.frame_library.pack(padx=10, pady=5, fill=tk.X)
+        self.listbox_library = tk.Listbox(self.frame_library, width=80, height=4, bg=LISTBOX_BG, fg=LISTBOX_FG,
+                                          font=FONT, selectbackground=BUTTON_BG, selectforeground="white", relief=tk.FLAT,
+                                          exportselection=False)
+        self.listbox_library.pack(fill=tk.X)
+        self.frame_library_add = tk.Frame(self.frame_library, bg=FRAME_BG)
+        self.frame_library_add.pack(fill=tk.X)
+        tk.Label(self.frame_library_add, text="宏库名称:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_library_name = tk.Entry(self.frame_library_add, width=12, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_library_name.pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Label(self.frame_library_add, text="快捷键:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_library_hotkey = tk.Entry(self.frame_library_add, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_library_hotkey.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_add = tk.Button(self.frame_library_add, text="添加当前宏", command=self.add_library_macro,
+                                            bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                            activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_add.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_add_file = tk.Button(self.frame_library_add, text="从文件添加", command=self.add_library_file,
+                                                 bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                                 activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_add_file.pack(side=tk.LEFT, padx=5, pady=5)
+        self.frame_library_controls = tk.Frame(self.frame_library, bg=FRAME_BG)
+        self.frame_library_controls.pack(fill=tk.X)
+        self.button_library_run = tk.Button(self.frame_library_controls, text="运行", command=self.play_selected_library_macro,
+                                            bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                            activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_run.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_stop = tk.Button(self.frame_library_controls, text="停止", command=self.stop_selected_library_macro,
+                                             bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                             activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_stop.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_open = tk.Button(self.frame_library_controls, text="在编辑器中打开", command=self.open_library_macro,
+                                             bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                             activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_open.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_remove = tk.Button(self.frame_library_controls, text="移除", command=self.remove_library_macro,
+                                               bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                               activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_remove.pack(side=tk.LEFT, padx=5, pady=5)
+        
         # --- 日志输出区域 ---
-        self.text_log = tk.Text(self, height=10, width=90, state=tk.NORMAL, bg=LISTBOX_BG, fg=LISTBOX_FG,
+        self.text_log = tk.Text(self.frame_main, height=10, width=90, state=tk.NORMAL, bg=LISTBOX_BG, fg=LISTBOX_FG,
                                 font=FONT, relief=tk.FLAT)
         self.text_log.pack(padx=10, pady=5)
         
-        self.keyboard_controller = keyboard.Controller()
-        self.mouse_controller = mouse.Controller()
+        # 播放线程仅在此创建一次；每次运行都是发给 worker 的请求
+        self.engine = PlaybackEngine()
+        self.engine.start()
+        self.keyboard_controller = TrackedKeyboardController(self.engine.held)
+        self.mouse_controller = TrackedMouseController(self.engine.held)
+        self.editor_worker = PlaybackWorker(self.engine, self.get_overlap_policy, self.log,
+                                            lambda: self.ui.post(self.finish_macro_run))
         
         self.hotkey_listener = None
+        self.restore_session()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.on_close())
+        self.ui.start()
         self.after(100, self.start_hotkey_listener)
         
     # 取消焦点
@@ -181,224 +1338,196 @@ class ManualMacroGUI(tk.Tk):
         if not isinstance(event.widget, (tk.Entry, tk.Text)):
             self.focus_set()
             
+    def on_main_wheel(self, event):
+        # 列表和日志自己滚动，其他窗口保留各自的滚轮
+        widget = event.widget
+        if not isinstance(widget, tk.Misc) or isinstance(widget, (tk.Listbox, tk.Text)) or widget.winfo_toplevel() is not self:
+            return
+        if event.num == 4 or event.delta > 0:
+            self.canvas_main.yview_scroll(-1, "units")
+        elif event.num == 5 or event.delta < 0:
+            self.canvas_main.yview_scroll(1, "units")
+            
     def log(self, message):
-        self.text_log.insert(tk.END, message + "\n")
-        self.text_log.see(tk.END)
+        # 可在任意线程中调用
         print(message)
+        self.ui.log(message)
+        
+    def write_log(self, text):
+        self.text_log.insert(tk.END, text)
+        self.text_log.see(tk.END)
         
     def update_param_fields(self, command_type):
         for widget in self.frame_params.winfo_children():
             widget.destroy()
         self.param_entries.clear()
-        if command_type == "键敲击":
-            tk.Label(self.frame_params, text="键:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_key = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_key.grid(row=0, column=1, padx=5, pady=2)
-            def on_key_press(event):
-                entry_key.delete(0, tk.END)
-                entry_key.insert(0, event.keysym)
-                return "break"
-            entry_key.bind("<Key>", on_key_press)
-            self.param_entries["key"] = entry_key
-            tk.Label(self.frame_params, text="重复次数:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=2)
-            entry_repeat = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_repeat.insert(0, "1")
-            entry_repeat.grid(row=1, column=1, padx=5, pady=2)
-            self.param_entries["repeat"] = entry_repeat
-        elif command_type == "等待":
-            tk.Label(self.frame_params, text="等待时间（秒）:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_duration = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.grid(row=0, column=1, padx=5, pady=2)
-            self.param_entries["duration"] = entry_duration
-        elif command_type == "鼠标点击":
-            tk.Label(self.frame_params, text="X:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_x = tk.Entry(self.frame_params, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_x.grid(row=0, column=1, padx=5, pady=2)
-            self.param_entries["x"] = entry_x
-            tk.Label(self.frame_params, text="Y:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=2)
-            entry_y = tk.Entry(self.frame_params, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_y.grid(row=0, column=3, padx=5, pady=2)
-            self.param_entries["y"] = entry_y
-            tk.Label(self.frame_params, text="按钮:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=4, padx=5, pady=2)
-            self.mouse_button_var = tk.StringVar(value="left")
-            option_button = tk.OptionMenu(self.frame_params, self.mouse_button_var, "left", "right", "middle")
-            option_button.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
-            option_button["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
-            option_button.grid(row=0, column=5, padx=5, pady=2)
-            self.param_entries["button"] = self.mouse_button_var
-            # “记录鼠标位置”按钮放在新的一行
-            self.button_record_mouse = tk.Button(self.frame_params, text="记录鼠标位置", command=self.record_mouse_position,
-                                                 bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
-                                                 activebackground=BUTTON_ACTIVE_BG)
-            self.button_record_mouse.grid(row=1, column=0, columnspan=6, padx=5, pady=2, sticky="w")
-        elif command_type == "键长按":
-            tk.Label(self.frame_params, text="键:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_key = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_key.grid(row=0, column=1, padx=5, pady=2)
-            def on_key_press(event):
-                entry_key.delete(0, tk.END)
-                entry_key.insert(0, event.keysym)
-                return "break"
-            entry_key.bind("<Key>", on_key_press)
-            self.param_entries["key"] = entry_key
-            tk.Label(self.frame_params, text="按住时间（秒）:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=2)
-            entry_duration = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, "1")
-            entry_duration.grid(row=1, column=1, padx=5, pady=2)
-            self.param_entries["duration"] = entry_duration
-        elif command_type == "鼠标长按":
-            # 第一行: X, Y, 按钮
-            tk.Label(self.frame_params, text="X:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_x = tk.Entry(self.frame_params, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_x.grid(row=0, column=1, padx=5, pady=2)
-            self.param_entries["x"] = entry_x
-            tk.Label(self.frame_params, text="Y:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=2)
-            entry_y = tk.Entry(self.frame_params, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_y.grid(row=0, column=3, padx=5, pady=2)
-            self.param_entries["y"] = entry_y
-            tk.Label(self.frame_params, text="按钮:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=4, padx=5, pady=2)
-            self.mouse_button_var = tk.StringVar(value="left")
-            option_button = tk.OptionMenu(self.frame_params, self.mouse_button_var, "left", "right", "middle")
-            option_button.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
-            option_button["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
-            option_button.grid(row=0, column=5, padx=5, pady=2)
-            self.param_entries["button"] = self.mouse_button_var
-            # 第二行: 按住时间及记录鼠标位置按钮
-            tk.Label(self.frame_params, text="按住时间（秒）:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=2)
-            entry_duration = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, "1")
-            entry_duration.grid(row=1, column=1, padx=5, pady=2)
-            self.param_entries["duration"] = entry_duration
-            self.button_record_mouse = tk.Button(self.frame_params, text="记录鼠标位置", command=self.record_mouse_position,
-                                                 bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
-                                                 activebackground=BUTTON_ACTIVE_BG)
-            self.button_record_mouse.grid(row=1, column=2, columnspan=4, padx=5, pady=2, sticky="w")
-        elif command_type == "鼠标滚动":
-            tk.Label(self.frame_params, text="水平滚动:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_dx = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_dx.insert(0, "0")
-            entry_dx.grid(row=0, column=1, padx=5, pady=2)
-            self.param_entries["dx"] = entry_dx
-            tk.Label(self.frame_params, text="垂直滚动:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=2)
-            entry_dy = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_dy.insert(0, "0")
-            entry_dy.grid(row=0, column=3, padx=5, pady=2)
-            self.param_entries["dy"] = entry_dy
-
-    def record_mouse_position(self):
-        self.button_record_mouse.config(text="单击左键记录鼠标位置完成", state=tk.DISABLED)
+        self.param_entries.update(self.build_command_fields(self.frame_params, COMMAND_TYPES[command_type], {}, 2))
+            
+    def build_command_fields(self, parent, opcode, cmd, pady):
+        # 编辑区和编辑窗口共用；按字段键返回输入框/变量
+        entries = {}
+        for i, field in enumerate(opcode.fields):
+            key, text, default = field[:3]
+            # 每行两组标签和输入框，最宽的表单也能放进窗口
+            row, column = divmod(i, 2)
+            tk.Label(parent, text=text, bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+                .grid(row=row, column=column * 2, padx=5, pady=pady)
+            value = str(cmd.get(key, default))
+            if len(field) > 3:
+                # 固定的选项集合，例如鼠标按钮或缓动
+                entries[key] = tk.StringVar(value=value)
+                option = tk.OptionMenu(parent, entries[key], *field[3])
+                option.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
+                option["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+                option.grid(row=row, column=column * 2 + 1, padx=5, pady=pady)
+            else:
+                entries[key] = tk.Entry(parent, width=30 if key in ("file", "text") else 8, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+                entries[key].insert(0, value)
+                entries[key].grid(row=row, column=column * 2 + 1, padx=5, pady=pady)
+                if key == "key":
+                    entries[key].bind("<Key>", lambda event, entry=entries[key]: self.capture_key(entry, event))
+        # 辅助按钮放在字段下方一行，根据命令拥有的字段选择
+        buttons = []
+        # 屏幕命令的位置按宏的屏幕保存，图像区域按原样保存
+        scale = opcode.name in POSITION_COMMANDS
+        pairs = POSITION_COMMANDS.get(opcode.name, (("x", "y"),) if "x" in entries else ())
+        for fields, text in zip(pairs, ("记录鼠标位置", "记录终点位置")):
+            button = tk.Button(parent, text=text, bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                               activebackground=BUTTON_ACTIVE_BG)
+            button.config(command=lambda button=button, fields=fields: self.record_position(button, entries, fields, scale))
+            buttons.append(button)
+        if "width" in entries and "height" in entries:
+            # 在保存前保存在变量中，这样取消不会改动命令
+            entries["template"] = tk.StringVar(value=cmd.get("template", ""))
+            buttons.append(tk.Button(parent, text="截取模板", command=lambda: self.capture_template(entries, parent),
+                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG))
+        if "color" in entries:
+            buttons.append(tk.Button(parent, text="捕获颜色", command=lambda: self.capture_color(entries, parent),
+                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG))
+        if "file" in entries:
+            buttons.append(tk.Button(parent, text="浏览", command=lambda: self.browse_macro_file(entries["file"]),
+                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG))
+        if "text" in entries:
+            # 长文本或多行文本从文件载入比在输入框里输入方便
+            buttons.append(tk.Button(parent, text="载入文本文件", command=lambda: self.load_text_file(entries["text"], parent),
+                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG))
+        row = (len(opcode.fields) + 1) // 2
+        for i, button in enumerate(buttons):
+            button.grid(row=row, column=i * 2, columnspan=2, padx=5, pady=pady, sticky="w")
+        return entries
+        
+    def capture_key(self, entry, event):
+        # 按键字段取按下的键名，而不是输入的文本
+        entry.delete(0, tk.END)
+        entry.insert(0, event.keysym)
+        return "break"
+        
+    def record_position(self, button, entries, fields, scale):
+        text = button.cget("text")
+        button.config(text="单击左键记录鼠标位置完成", state=tk.DISABLED)
         self.log("等待记录鼠标位置... 单击左键完成记录.")
-        def on_click(x, y, button, pressed):
-            if button == mouse.Button.left and pressed:
-                self.after(0, lambda: self.set_mouse_position(x, y))
-                return False
-        listener = mouse.Listener(on_click=on_click)
-        listener.start()
-        
-    def set_mouse_position(self, x, y):
-        if "x" in self.param_entries:
-            self.param_entries["x"].delete(0, tk.END)
-            self.param_entries["x"].insert(0, str(int(x)))
-        if "y" in self.param_entries:
-            self.param_entries["y"].delete(0, tk.END)
-            self.param_entries["y"].insert(0, str(int(y)))
-        self.log(f"记录到鼠标位置: ({int(x)}, {int(y)})")
-        self.button_record_mouse.config(text="记录鼠标位置", state=tk.NORMAL)
+        def set_position(position):
+            # 当另一个拾取请求接管时 position 为 None
+            if not button.winfo_exists():
+                return
+            if position is not None:
+                x, y = self.to_macro_position(*position) if scale else position
+                for name, value in zip(fields, (x, y)):
+                    entries[name].delete(0, tk.END)
+                    entries[name].insert(0, str(value))
+                self.log(f"记录到鼠标位置: ({x}, {y})")
+            button.config(text=text, state=tk.NORMAL)
+        self.click_capture.capture(set_position)
+        
+    def capture_color(self, entries, parent):
+        if not self.screen.available():
+            messagebox.showerror("错误", "图像命令需要 numpy 和 mss 包.", parent=parent)
+            return
+        try:
+            x = int(entries["x"].get().strip())
+            y = int(entries["y"].get().strip())
+        except ValueError:
+            messagebox.showerror("错误", "请输入有效的整数X, Y值.", parent=parent)
+            return
+        try:
+            red, green, blue = (int(value) for value in self.screen.capture(x, y, 1, 1)[0, 0])
+        except Exception as e:
+            messagebox.showerror("错误", "屏幕截取失败: " + str(e), parent=parent)
+            return
+        color = f"#{red:02x}{green:02x}{blue:02x}"
+        entries["color"].delete(0, tk.END)
+        entries["color"].insert(0, color)
+        self.log(f"已捕获颜色: {color}，位置 ({x}, {y})")
+        
+    def browse_macro_file(self, entry):
+        file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
+        if file_path:
+            entry.delete(0, tk.END)
+            entry.insert(0, file_path)
+            
+    def load_text_file(self, entry, parent):
+        file_path = filedialog.askopenfilename(filetypes=[("Text files", "*.txt"), ("All files", "*")])
+        if not file_path:
+            return
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror("错误", "文本文件载入失败: " + str(e), parent=parent)
+            return
+        entry.delete(0, tk.END)
+        entry.insert(0, text)
+        
+    def read_command_fields(self, entries):
+        # 按字段键取输入的文本；要输入或粘贴的文本保留首尾空格
+        return {key: widget.get() if key == "text" else widget.get().strip() for key, widget in entries.items()}
+        
+    def capture_template(self, entries, parent):
+        if not self.screen.available():
+            messagebox.showerror("错误", "图像命令需要 numpy 和 mss 包.", parent=parent)
+            return
+        try:
+            x = int(entries["x"].get().strip())
+            y = int(entries["y"].get().strip())
+            width = int(entries["width"].get().strip())
+            height = int(entries["height"].get().strip())
+            if width <= 0 or height <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("错误", "请输入有效的整数 X, Y, 宽度和高度值.", parent=parent)
+            return
+        try:
+            image = self.screen.capture(x, y, width, height)
+        except Exception as e:
+            messagebox.showerror("错误", "屏幕截取失败: " + str(e), parent=parent)
+            return
+        entries["template"].set(encode_template(image))
+        self.log(f"已截取模板: {width}x{height}，位置 ({x}, {y})")
+        if np.ptp(to_gray(image)) == 0:
+            self.log("模板只有一种色调；将按色调而不是图案查找.")
         
     def add_command(self):
         command_type = self.command_type_var.get()
-        if command_type == "键敲击":
-            key = self.param_entries["key"].get().strip()
-            if key == "":
-                messagebox.showerror("错误", "请输入键值.")
-                return
-            try:
-                repeat = int(self.param_entries["repeat"].get().strip())
-            except ValueError:
-                messagebox.showerror("错误", "请输入有效的重复次数.")
-                return
-            cmd = {"command": "key_tap", "key": key, "repeat": repeat}
-            display_text = f"键敲击: {key} x {repeat}次"
-        elif command_type == "等待":
-            try:
-                duration = float(self.param_entries["duration"].get().strip())
-            except ValueError:
-                messagebox.showerror("错误", "请输入有效的等待时间.")
-                return
-            cmd = {"command": "wait", "duration": duration}
-            display_text = f"等待: {duration}秒"
-        elif command_type == "鼠标点击":
-            x_str = self.param_entries["x"].get().strip()
-            y_str = self.param_entries["y"].get().strip()
-            if not x_str or not y_str:
-                messagebox.showerror("错误", "请输入X, Y值.")
-                return
-            try:
-                x = int(x_str)
-                y = int(y_str)
-            except ValueError:
-                messagebox.showerror("错误", "请输入有效的整数X, Y值.")
-                return
-            button = self.param_entries["button"].get()
-            cmd = {"command": "mouse_click", "x": x, "y": y, "button": button}
-            display_text = f"鼠标点击: ({x}, {y}), 按钮: {button}"
-        elif command_type == "键长按":
-            key = self.param_entries["key"].get().strip()
-            if key == "":
-                messagebox.showerror("错误", "请输入键值.")
-                return
-            try:
-                duration = float(self.param_entries["duration"].get().strip())
-            except ValueError:
-                messagebox.showerror("错误", "请输入有效的按住时间.")
-                return
-            cmd = {"command": "key_hold", "key": key, "duration": duration}
-            display_text = f"键长按: {key} (按住时间: {duration}秒)"
-        elif command_type == "鼠标长按":
-            x_str = self.param_entries["x"].get().strip()
-            y_str = self.param_entries["y"].get().strip()
-            if not x_str or not y_str:
-                messagebox.showerror("错误", "请输入X, Y值.")
-                return
-            try:
-                x = int(x_str)
-                y = int(y_str)
-            except ValueError:
-                messagebox.showerror("错误", "请输入有效的整数X, Y值.")
-                return
-            button = self.param_entries["button"].get()
-            try:
-                duration = float(self.param_entries["duration"].get().strip())
-            except ValueError:
-                messagebox.showerror("错误", "请输入有效的按住时间.")
-                return
-            cmd = {"command": "mouse_hold", "x": x, "y": y, "button": button, "duration": duration}
-            display_text = f"鼠标长按: ({x}, {y}), 按钮: {button} (按住时间: {duration}秒)"
-        elif command_type == "鼠标滚动":
-            try:
-                dx = int(self.param_entries["dx"].get().strip())
-                dy = int(self.param_entries["dy"].get().strip())
-            except ValueError:
-                messagebox.showerror("错误", "请输入有效的滚动值.")
-                return
-            cmd = {"command": "mouse_scroll", "dx": dx, "dy": dy}
-            display_text = f"鼠标滚动: 水平 {dx}, 垂直 {dy}"
-        else:
+        try:
+            track = int(self.entry_track.get().strip())
+            if track < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("错误", "请输入有效的轨道编号.")
+            return
+        opcode = COMMAND_TYPES.get(command_type)
+        if opcode is None:
+            return
+        values = self.read_command_fields(self.param_entries)
+        try:
+            cmd = {"command": opcode.name, **opcode.parse(values)}
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
             return
+        display_text = self.format_command(cmd)
+        if track:
+            cmd["track"] = track
+            display_text = self.get_display_text(cmd)
         
         selected = self.listbox.curselection()
         if selected:
@@ -408,6 +1537,7 @@ class ManualMacroGUI(tk.Tk):
         else:
             self.commands.append(cmd)
             self.listbox.insert(tk.END, display_text)
+        self.compiled_tracks = None
         self.log("命令已添加: " + display_text)
         
     def remove_command(self):
@@ -418,6 +1548,7 @@ class ManualMacroGUI(tk.Tk):
         index = selected[0]
         self.listbox.delete(index)
         removed = self.commands.pop(index)
+        self.compiled_tracks = None
         self.log("命令已删除: " + str(removed))
         
     def play_macro(self):
@@ -429,98 +1560,764 @@ class ManualMacroGUI(tk.Tk):
         except ValueError:
             messagebox.showerror("错误", "请输入有效的重复次数.")
             return
-        self.log("宏执行开始.")
+        try:
+            track_loops = self.parse_track_loops(self.entry_track_loops.get())
+        except ValueError:
+            messagebox.showerror("错误", "请以 轨道:次数 的形式输入轨道重复次数.")
+            return
+        try:
+            run_limit = self.parse_run_limit()
+        except ValueError:
+            return
+        try:
+            humanizer = self.create_humanizer()
+        except ValueError:
+            return
+        try:
+            self.compiled_tracks = self.compiled_tracks or self.compile_commands(self.commands, self.get_macro_folder())
+        except ValueError as e:
+            messagebox.showerror("错误", "宏编译失败: " + str(e))
+            return
+        tracks = self.compiled_tracks
+        transform = screen_transform(self.macro_screen, self.update_screen_size())
         self.macro_running = True
-        self.button_stop.config(state=tk.NORMAL)
-        thread = threading.Thread(target=self.execute_macro, args=(loop_count,))
-        thread.daemon = True
-        thread.start()
+        self.refresh_run_state()
+        self.editor_worker.request(lambda: self.execute_macro(tracks, loop_count, track_loops, transform, humanizer, run_limit))
+        
+    def parse_run_limit(self):
+        # None、("duration", 秒) 或 ("until", 纪元秒)；限制无效时提示后抛出 ValueError
+        mode = self.run_limit_var.get()
+        text = self.entry_run_limit.get()
+        try:
+            if mode == "duration":
+                return ("duration", parse_run_duration(text))
+            if mode == "until":
+                return ("until", next_clock_time(text))
+        except ValueError:
+            messagebox.showerror("错误", "请以时长 (90, 45m, 2h, 1:30:00) 或时刻 (17:00) 输入运行限制.")
+            raise
+        return None
+        
+    def create_humanizer(self):
+        # 未启用人性化时返回 None；报告错误设置后抛出 ValueError
+        if not self.humanize_var.get():
+            return None
+        if np is None:
+            messagebox.showerror("错误", "人性化需要 numpy 包。")
+            raise ValueError("numpy is missing")
+        try:
+            jitter = float(self.entry_jitter.get().strip()) / 100
+            seed_text = self.entry_seed.get().strip()
+            seed = int(seed_text) if seed_text else int(np.random.default_rng().integers(2 ** 31))
+            if not 0 <= jitter <= 1 or seed < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("错误", "请输入 0 到 100 的抖动和非负整数种子。")
+            raise
+        # 记录下来，以便输入同一种子重现随机运行
+        self.log(f"人性化种子: {seed}")
+        return Humanizer(jitter, seed)
+        
+    def update_screen_size(self):
+        self.screen_size = (self.winfo_screenwidth(), self.winfo_screenheight())
+        return self.screen_size
+        
+    def to_macro_position(self, x, y):
+        # 把当前屏幕上的位置换算到编辑器宏的坐标空间
+        return (round(x * self.macro_screen[0] / self.screen_size[0]),
+                round(y * self.macro_screen[1] / self.screen_size[1]))
+        
+    def get_overlap_policy(self):
+        return self.overlap_policy
         
-    def execute_macro(self, loop_count):
+    def set_overlap_policy(self, policy):
+        self.overlap_policy = policy
+        self.log("重叠策略: " + policy)
+        
+    def set_speed(self, speed):
+        # 运行中的宏立即采用新速度；不重新编译
+        self.speed_var.set(speed)
+        self.engine.loop.call_soon_threadsafe(CLOCK.set_speed, SPEEDS[speed])
+        self.log("回放速度: " + speed)
+        
+    def step_speed(self, step):
+        speeds = list(SPEEDS)
+        index = speeds.index(self.speed_var.get()) + step
+        if 0 <= index < len(speeds):
+            self.set_speed(speeds[index])
+        
+    def parse_track_loops(self, text):
+        track_loops = {}
+        for item in text.replace(";", ",").split(","):
+            if not item.strip():
+                continue
+            track, count = item.split(":")
+            track_loops[int(track)] = int(count)
+        if any(track < 0 or count < 0 for track, count in track_loops.items()):
+            raise ValueError("negative track or loop count")
+        return track_loops
+        
+    def format_track_loops(self, track_loops):
+        return ", ".join(f"{track}:{count}" for track, count in sorted(track_loops.items()))
+        
+    def show_disassembly(self):
+        if not self.commands:
+            messagebox.showinfo("信息", "没有要执行的命令.")
+            return
+        try:
+            self.compiled_tracks = self.compiled_tracks or self.compile_commands(self.commands, self.get_macro_folder())
+        except ValueError as e:
+            messagebox.showerror("错误", "宏编译失败: " + str(e))
+            return
+        win = tk.Toplevel(self)
+        win.title("字节码")
+        win.configure(bg=BG_COLOR)
+        text = tk.Text(win, width=100, height=30, bg=LISTBOX_BG, fg=LISTBOX_FG, font=("Courier", 11), relief=tk.FLAT)
+        for track, code in sorted(self.compiled_tracks.items()):
+            text.insert(tk.END, f"轨道 {track}: {len(code)} 条指令\n")
+            text.insert(tk.END, "\n".join(code.disassemble()) + "\n\n")
+        text.config(state=tk.DISABLED)
+        text.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+        
+    def show_analysis(self):
+        if not self.commands:
+            messagebox.showinfo("信息", "没有要执行的命令.")
+            return
+        try:
+            # 先编译可以发现不配对的块，否则估计只能去猜
+            self.compiled_tracks = self.compiled_tracks or self.compile_commands(self.commands, self.get_macro_folder())
+        except ValueError as e:
+            messagebox.showerror("错误", "宏编译失败: " + str(e))
+            return
+        try:
+            loop_count = int(self.entry_loop.get().strip())
+            track_loops = self.parse_track_loops(self.entry_track_loops.get())
+        except ValueError:
+            messagebox.showerror("错误", "请输入有效的循环次数，并以 轨道:次数 的形式输入轨道循环次数.")
+            return
+        lines = describe_estimates(analyze_commands(self.commands, self.get_macro_folder()), self.speed_var.get(),
+                                   loop_count, track_loops)
+        win = tk.Toplevel(self)
+        win.title("宏分析")
+        win.configure(bg=BG_COLOR)
+        text = tk.Text(win, width=100, height=30, bg=LISTBOX_BG, fg=LISTBOX_FG, font=("Courier", 11), relief=tk.FLAT)
+        text.insert(tk.END, "\n".join(lines) + "\n")
+        text.config(state=tk.DISABLED)
+        text.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+        
+    def compile_commands(self, commands, folder=""):
+        # 按轨道分组命令，并分别编译每条轨道
+        grouped = {}
+        for cmd in commands:
+            grouped.setdefault(cmd.get("track", 0), []).append(cmd)
+        tracks = {}
+        for track, track_commands in grouped.items():
+            try:
+                tracks[track] = self.compile_code(track_commands, folder)
+            except ValueError as e:
+                raise ValueError(f"轨道 {track}: {e}") from None
+        return tracks
+        
+    def compile_code(self, commands, folder=""):
+        # 一次性解析按键/按钮，并把代码块变成跳转到绝对索引的指令，
+        # 这样无论代码块嵌套多深，一次跳转的开销都相同。
+        # 相对路径的 Call 文件在 folder（调用方宏所在的文件夹）中查找；"" 表示工作目录
+        code = Bytecode()
+        blocks = []  # 尚未闭合的循环开始/如果/否则命令的索引
+        labels = {}
+        gotos = []
+        for index, cmd in enumerate(commands):
+            name = cmd["command"]
+            number = OPCODE_NUMBERS.get(name)
+            if number is None:
+                raise ValueError(f"未知命令 {name} (第 {index + 1} 条命令)")
+            resolve = OPCODES[number].resolve
+            target = resolve(cmd) if resolve else None
+            jump = -1
+            if name == "if_pixel":
+                # 跳过代码块的目标由否则/结束如果填入
+                blocks.append(index)
+            elif name in ("loop_start", "if_variable"):
+                blocks.append(index)
+            elif name == "loop_end":
+                if not blocks or commands[blocks[-1]]["command"] != "loop_start":
+                    raise ValueError(f"循环结束缺少循环开始 (第 {index + 1} 条命令)")
+                jump = blocks.pop()  # 回到循环开始，并跳过它本身
+            elif name in ("else", "end_if"):
+                opener = commands[blocks[-1]]["command"] if blocks else None
+                if opener not in (("if_pixel", "if_variable") if name == "else" else ("if_pixel", "if_variable", "else")):
+                    raise ValueError(f"{'否则' if name == 'else' else '结束如果'} 缺少如果 (第 {index + 1} 条命令)")
+                # 条件为假时跳到此命令之后，如果部分执行完进入否则部分时也一样
+                code.args[blocks.pop()] = index + 1
+                if name == "else":
+                    blocks.append(index)
+            elif name == "label":
+                if cmd["name"] in labels:
+                    raise ValueError(f"重复的标签 {cmd['name']} (第 {index + 1} 条命令)")
+                labels[cmd["name"]] = index
+            elif name == "goto":
+                gotos.append(index)
+            elif name == "call":
+                target = os.path.abspath(os.path.join(folder, cmd["file"]))
+            code.append(number, cmd, target, jump)
+        if blocks:
+            start_name = commands[blocks[-1]]["command"]
+            raise ValueError(f"{'循环开始' if start_name == 'loop_start' else '如果'} 缺少结束 (第 {blocks[-1] + 1} 条命令)")
+        for index in gotos:
+            cmd = code.cmds[index]
+            if cmd["label"] not in labels:
+                raise ValueError(f"跳转到未知标签 {cmd['label']} (第 {index + 1} 条命令)")
+            code.args[index] = labels[cmd["label"]]
+        return code
+        
+    async def execute_macro(self, tracks, loop_count, track_loops, transform, humanizer=None, run_limit=None):
+        self.log("宏执行开始.")
+        self.editor_program = {"tracks": transform_tracks(tracks, transform), "screen": self.screen_size,
+                               "humanizer": humanizer, "variables": {}, "subroutines": {},
+                               "stop_at": run_stop_time(run_limit),
+                               "loop_count": loop_count, "track_loops": track_loops}
+        try:
+            await self.run_macro(self.editor_program)
+        finally:
+            self.editor_program = None
+            self.log("宏执行完成.")
+                
+    def finish_macro_run(self):
+        # 每次编辑器运行结束后调用，包括被停止取消的运行；期间排队的请求会让停止按钮保持可用
+        if not self.editor_worker.is_busy():
+            self.macro_running = False
+            self.refresh_run_state()
+        
+    def refresh_run_state(self):
+        self.button_stop.config(state=tk.NORMAL if self.macro_running else tk.DISABLED)
+        
+    async def run_macro(self, program):
+        # 所有轨道都以同一开始时间进行调度
+        start_time = CLOCK.now()
+        tasks = []
+        awaited = []
+        for track in sorted(program["tracks"]):
+            task = asyncio.ensure_future(self.execute_track(track, program, start_time))
+            tasks.append(task)
+            if track == 0 or get_track_loop_count(program, track) != 0:
+                awaited.append(task)
+        try:
+            # 无限轨道与主轨道及有限轨道并行运行，并随其一同结束
+            await asyncio.gather(*(awaited or tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+    async def execute_track(self, track, program, start_time):
+        deadline = start_time
         iteration = 0
-        while self.macro_running and (loop_count == 0 or iteration < loop_count):
-            self.log(f"第 {iteration+1} 次循环开始.")
-            for cmd in self.commands:
-                if not self.macro_running:
+        humanizer = program.get("humanizer")
+        if humanizer:
+            humanizer = humanizer.for_track(track)
+        stop_at = program.get("stop_at")
+        loop = asyncio.get_running_loop()
+        while True:
+            # 重新加载的宏文件可能改变循环次数；在这里生效
+            loop_count = get_track_loop_count(program, track)
+            if loop_count and iteration >= loop_count:
+                break
+            if stop_at is not None and loop.time() >= stop_at:
+                break
+            if track == 0:
+                self.log(f"第 {iteration+1} 次循环开始.")
+            else:
+                self.log(f"轨道 {track}: 第 {iteration+1} 次循环开始.")
+            # 重新加载的宏文件会替换 program["tracks"]，在此处生效
+            run = self.run_code(program["tracks"].get(track) or Bytecode(), program, deadline, humanizer)
+            if stop_at is None:
+                deadline = await run
+            else:
+                finished, deadline = await self.run_until(run, stop_at)
+                if not finished:
                     break
-                if cmd["command"] == "key_tap":
-                    key = cmd["key"]
-                    repeat = cmd.get("repeat", 1)
-                    for _ in range(repeat):
-                        if not self.macro_running:
-                            break
-                        try:
-                            key_obj = getattr(keyboard.Key, key.lower())
-                        except AttributeError:
-                            key_obj = key
-                        self.keyboard_controller.press(key_obj)
-                        self.keyboard_controller.release(key_obj)
-                        self.log(f"执行键敲击: {key}")
-                        time.sleep(0.05)
-                elif cmd["command"] == "key_hold":
+            iteration += 1
+            if track == 0:
+                self.log(f"第 {iteration} 次循环完成.")
+            else:
+                self.log(f"轨道 {track}: 第 {iteration} 次循环完成.")
+            # 只含流程控制的一次循环从不等待；这样引擎线程
+            # 才能处理停止和其他宏
+            await asyncio.sleep(0)
+        if loop_count == 0 or iteration < loop_count:
+            # 只有运行限制会让轨道在循环次数之前结束
+            if track == 0:
+                self.log(f"已达到运行限制，共完成 {iteration} 次循环.")
+            else:
+                self.log(f"轨道 {track}: 已达到运行限制，共完成 {iteration} 次循环.")
+        return iteration
+        
+    async def run_until(self, coro, stop_at):
+        # 把 coro 运行到结束，或在 stop_at（循环时间）取消它，即使正处于长时间等待中。
+        # 返回 (True, 结果) 或 (False, None)
+        task = asyncio.ensure_future(coro)
+        try:
+            await asyncio.wait([task], timeout=stop_at - asyncio.get_running_loop().time())
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.wait([task])
+        if task.cancelled():
+            return False, None
+        return True, task.result()
+        
+    async def run_code(self, code, program, deadline, humanizer, depth=0):
+        # 生成的代码是快速路径；人性化运行和跳转由解释器处理
+        if humanizer is None:
+            run = self.get_generated_code(code, program)
+            if run is not None:
+                return await run(deadline, depth)
+        return await self.interpret_code(code, program, deadline, humanizer, depth)
+        
+    def get_generated_code(self, code, program):
+        # 每个命令列表每次运行一个函数，因此只有轨道重新加载时才计算哈希
+        generated = program.setdefault("generated", {})
+        entry = generated.get(id(code))
+        if entry is None or entry[0] is not code:
+            digest = hashlib.sha256(json.dumps(code.cmds, sort_keys=True).encode("utf-8")).hexdigest()
+            if digest not in self.generated_code:
+                if len(self.generated_code) >= MAX_CACHED_MACROS:
+                    self.generated_code.clear()
+                source = self.generate_source(code)
+                if source is None:
+                    self.generated_code[digest] = None
+                else:
+                    namespace = {"asyncio": asyncio, "sleep_until": sleep_until}
+                    exec(compile(source, f"<macro {digest[:12]}>", "exec"), namespace)
+                    self.generated_code[digest] = namespace["make"]
+            make = self.generated_code[digest]
+            run = None if make is None else make(self, program, code.targets, code.cmds)
+            entry = generated[id(code)] = (code, run)
+        return entry[1]
+        
+    def generate_source(self, code):
+        # 为一个已编译命令列表生成的直线式 Python 代码；使用跳转时返回 None。
+        # 宏中的值只通过 repr() 写入，绝不作为代码
+        head = ["def make(gui, program, targets, cmds):",
+                "    press = gui.keyboard_controller.press",
+                "    release = gui.keyboard_controller.release",
+                "    mouse = gui.mouse_controller",
+                "    click = mouse.click",
+                "    mouse_press = mouse.press",
+                "    mouse_release = mouse.release",
+                "    scroll = mouse.scroll",
+                "    log = gui.log",
+                "    execute_command = gui.execute_command",
+                "    call_macro = gui.call_macro",
+                "    set_variable = gui.set_variable",
+                "    matches = gui.screen.matches",
+                "    variables = program['variables']"]
+        body = ["    async def run(deadline, depth):"]
+        indent = "        "
+        def emit(*statements):
+            body.extend(indent + statement for statement in statements)
+        def close_block():
+            if body[-1].endswith(":"):
+                emit("pass")
+        def number(value):
+            # inf 和 nan 的 repr() 是裸名称，所以在 make() 中绑定一次
+            if isinstance(value, float) and not math.isfinite(value):
+                constant = f"n{len(head)}"
+                head.append(f"    {constant} = float({str(value)!r})")
+                return constant
+            return repr(value)
+        for index, op in enumerate(code.ops):
+            name = OPCODES[op].name
+            cmd = code.cmds[index]
+            target = code.targets[index]
+            if target is not None:
+                head.append(f"    t{index} = targets[{index}]")
+            if name == "key_tap":
+                key = cmd["key"]
+                message = f"执行键敲击: {key}"
+                repeat = int(cmd.get("repeat", 1))
+                if repeat != 1:
+                    emit(f"for _ in range({repeat}):")
+                    indent += "    "
+                emit(f"press(t{index})", f"release(t{index})", f"log({message!r})",
+                     f"deadline += {KEY_TAP_GAP!r}", "deadline = await sleep_until(deadline)")
+                if repeat != 1:
+                    close_block()
+                    indent = indent[:-4]
+            elif name == "key_chord":
+                message = f"组合键已执行: {cmd['keys']}"
+                emit(*(f"press(t{index}[{i}])" for i in range(len(target))),
+                     *(f"release(t{index}[{i}])" for i in reversed(range(len(target)))), f"log({message!r})")
+            elif name in ("key_hold", "mouse_hold"):
+                if name == "key_hold":
                     key = cmd["key"]
-                    duration = cmd["duration"]
-                    try:
-                        key_obj = getattr(keyboard.Key, key.lower())
-                    except AttributeError:
-                        key_obj = key
-                    self.keyboard_controller.press(key_obj)
-                    self.log(f"开始键长按: {key}")
-                    time.sleep(duration)
-                    self.keyboard_controller.release(key_obj)
-                    self.log(f"结束键长按: {key}")
-                elif cmd["command"] == "wait":
-                    duration = cmd["duration"]
-                    self.log(f"开始等待: {duration}秒")
-                    time.sleep(duration)
-                    self.log("等待结束")
-                elif cmd["command"] == "mouse_click":
-                    x = cmd["x"]
-                    y = cmd["y"]
-                    button_str = cmd["button"]
-                    if button_str == "left":
-                        btn = mouse.Button.left
-                    elif button_str == "right":
-                        btn = mouse.Button.right
-                    elif button_str == "middle":
-                        btn = mouse.Button.middle
-                    else:
-                        btn = mouse.Button.left
-                    self.mouse_controller.position = (x, y)
-                    self.mouse_controller.click(btn)
-                    self.log(f"执行鼠标点击: ({x}, {y}), 按钮: {button_str}")
-                elif cmd["command"] == "mouse_hold":
-                    x = cmd["x"]
-                    y = cmd["y"]
+                    start = f"开始键长按: {key}"
+                    end = f"结束键长按: {key}"
+                    emit(f"press(t{index})", f"log({start!r})")
+                else:
+                    x = int(cmd["x"])
+                    y = int(cmd["y"])
                     button_str = cmd["button"]
-                    if button_str == "left":
-                        btn = mouse.Button.left
-                    elif button_str == "right":
-                        btn = mouse.Button.right
-                    elif button_str == "middle":
-                        btn = mouse.Button.middle
+                    start = f"开始鼠标长按: ({x}, {y}), 按钮: {button_str}"
+                    end = f"结束鼠标长按: ({x}, {y}), 按钮: {button_str}"
+                    emit(f"mouse.position = ({x}, {y})", f"mouse_press(t{index})", f"log({start!r})")
+                release = "release" if name == "key_hold" else "mouse_release"
+                emit(f"deadline += {number(float(cmd['duration']))}", "try:", "    deadline = await sleep_until(deadline)",
+                     "finally:", f"    {release}(t{index})", f"    log({end!r})")
+            elif name == "wait":
+                duration = cmd["duration"]
+                start = f"开始等待: {duration}秒"
+                end = "等待结束"
+                emit(f"log({start!r})", f"deadline += {number(float(duration))}", "deadline = await sleep_until(deadline)", f"log({end!r})")
+            elif name == "mouse_click":
+                x = int(cmd["x"])
+                y = int(cmd["y"])
+                button_str = cmd["button"]
+                message = f"执行鼠标点击: ({x}, {y}), 按钮: {button_str}"
+                emit(f"mouse.position = ({x}, {y})", f"click(t{index})", f"log({message!r})")
+            elif name == "mouse_scroll":
+                dx = int(cmd["dx"])
+                dy = int(cmd["dy"])
+                message = f"鼠标滚动: 水平 {dx}, 垂直 {dy}"
+                emit(f"scroll({dx}, {dy})", f"log({message!r})")
+            elif name == "loop_start":
+                emit(f"for _ in range({int(cmd['count'])}):" if cmd["count"] else "while True:")
+                indent += "    "
+            elif name == "loop_end":
+                # 即使循环体从不等待，也能让停止生效
+                emit("await asyncio.sleep(0)")
+                indent = indent[:-4]
+            elif name == "if_pixel":
+                if target is None or not self.screen.available():
+                    message = "图像命令需要 numpy 和 mss 包."
+                    emit(f"raise RuntimeError({message!r})")
+                emit(f"if await matches({int(cmd['x'])}, {int(cmd['y'])}, t{index}, {int(cmd.get('tolerance', 0))}):")
+                indent += "    "
+            elif name == "if_variable":
+                if cmd["op"] not in COMPARISONS or not isinstance(cmd["value"], (int, float)):
+                    raise ValueError(f"invalid condition: {cmd['op']} {cmd['value']!r}")
+                emit(f"if variables.get({str(cmd['name'])!r}, 0) {cmd['op']} {number(cmd['value'])}:")
+                indent += "    "
+            elif name == "else":
+                close_block()
+                indent = indent[:-4]
+                emit("else:")
+                indent += "    "
+            elif name == "end_if":
+                close_block()
+                indent = indent[:-4]
+            elif name == "set_variable":
+                head.append(f"    c{index} = cmds[{index}]")
+                emit(f"set_variable(c{index}, variables)")
+            elif name == "call":
+                emit(f"deadline = await call_macro(t{index}, program, deadline, None, depth)")
+            elif name == "return":
+                emit("return deadline")
+            elif name == "goto":
+                return None
+            elif OPCODES[op].execute is not None:
+                # Label 和没有执行函数的插件命令什么也不做，与 interpret_code 相同
+                head.append(f"    c{index} = cmds[{index}]")
+                emit(f"deadline = await execute_command({name!r}, c{index}, {f't{index}' if target is not None else 'None'}, deadline)")
+            if OPCODES[op].execute is not None:
+                emit(f"deadline += {COMMAND_GAP!r}", "deadline = await sleep_until(deadline)")
+        emit("return deadline")
+        return "\n".join(head + body + ["    return run", ""])
+        
+    async def interpret_code(self, code, program, deadline, humanizer, depth=0):
+        # 字节码虚拟机：命令交给其操作码的执行器，流程控制在这里处理
+        # 跳转直接去往 compile_code 存下的索引
+        ops, args, cmds, targets = code.ops, code.args, code.cmds, code.targets
+        executors = OPCODE_EXECUTORS
+        counters = {}  # 每个运行中循环的剩余次数，以其循环开始的索引为键
+        variables = program["variables"]
+        pc = 0
+        end = len(ops)
+        while pc < end:
+            op = ops[pc]
+            execute = executors[op]
+            if execute is not None:
+                deadline = await execute(self, cmds[pc], targets[pc], deadline, humanizer)
+                deadline += humanizer.vary(COMMAND_GAP) if humanizer else COMMAND_GAP
+                deadline = await sleep_until(deadline)
+            elif op == OP_LOOP_START:
+                counters[pc] = cmds[pc]["count"]
+            elif op == OP_LOOP_END:
+                # 无限循环（次数 0）会变为负数，永远不会到达零
+                start = args[pc]
+                left = counters.get(start, 1) - 1
+                if left != 0:
+                    counters[start] = left
+                    pc = start + 1
+                    # 即使循环体从不等待，也能让停止生效
+                    await asyncio.sleep(0)
+                    continue
+            elif op == OP_IF_PIXEL:
+                cmd = cmds[pc]
+                if targets[pc] is None or not self.screen.available():
+                    raise RuntimeError("图像命令需要 numpy 和 mss 包.")
+                if not await self.screen.matches(cmd["x"], cmd["y"], targets[pc], cmd.get("tolerance", 0)):
+                    pc = args[pc]
+                    continue
+            elif op == OP_IF_VARIABLE:
+                cmd = cmds[pc]
+                if not COMPARISONS[cmd["op"]](variables.get(cmd["name"], 0), cmd["value"]):
+                    pc = args[pc]
+                    continue
+            elif op == OP_ELSE:
+                pc = args[pc]
+                continue
+            elif op == OP_GOTO:
+                pc = args[pc]
+                await asyncio.sleep(0)
+                continue
+            elif op == OP_SET_VARIABLE:
+                self.set_variable(cmds[pc], variables)
+            elif op == OP_CALL:
+                deadline = await self.call_macro(targets[pc], program, deadline, humanizer, depth)
+            elif op == OP_RETURN:
+                break
+            pc += 1
+        return deadline
+        
+    def set_variable(self, cmd, variables):
+        variables[cmd["name"]] = ASSIGNMENTS[cmd["op"]](variables.get(cmd["name"], 0), cmd["value"])
+        self.log(f"变量已设置: {cmd['name']} = {variables[cmd['name']]}")
+        
+    async def call_macro(self, path, program, deadline, humanizer, depth):
+        if depth >= MAX_CALL_DEPTH:
+            raise RuntimeError(f"宏调用嵌套超过 {MAX_CALL_DEPTH} 层: {path}")
+        code = program["subroutines"].get(path)
+        if code is None:
+            # 每次运行编译一次，并在引擎循环之外进行，这样其他轨道在此期间保持各自的时序
+            loop = asyncio.get_running_loop()
+            code = await loop.run_in_executor(None, self.compile_subroutine, path, program["screen"])
+            program["subroutines"][path] = code
+        self.log("调用宏: " + path)
+        deadline = await self.run_code(code, program, deadline, humanizer, depth + 1)
+        self.log("宏调用返回: " + path)
+        return deadline
+        
+    def compile_subroutine(self, path, screen):
+        # 被调用文件所有轨道的命令按顺序运行；它自己的调用相对于它所在的文件夹
+        commands, _, file_screen = self.read_macro_file(path)
+        transform = screen_transform(file_screen or screen, screen)
+        return transform_tracks({0: self.compile_code(commands, os.path.dirname(path))}, transform)[0]
+        
+    async def execute_command(self, name, cmd, target, deadline, humanizer=None):
+        # 从 deadline 开始执行一条命令，并返回其结束时间
+        return await OPCODES[OPCODE_NUMBERS[name]].execute(self, cmd, target, deadline, humanizer)
+        
+    async def execute_key_tap(self, cmd, target, deadline, humanizer):
+        key = cmd["key"]
+        repeat = cmd.get("repeat", 1)
+        for _ in range(repeat):
+            self.keyboard_controller.press(target)
+            self.keyboard_controller.release(target)
+            self.log(f"执行键敲击: {key}")
+            deadline += KEY_TAP_GAP
+            deadline = await sleep_until(deadline)
+        return deadline
+        
+    async def execute_key_chord(self, cmd, target, deadline, humanizer):
+        # 按顺序按下、逆序松开，中间没有任何等待
+        for key in target:
+            self.keyboard_controller.press(key)
+        for key in reversed(target):
+            self.keyboard_controller.release(key)
+        self.log(f"组合键已执行: {cmd['keys']}")
+        return deadline
+        
+    async def execute_key_hold(self, cmd, target, deadline, humanizer):
+        key = cmd["key"]
+        self.keyboard_controller.press(target)
+        self.log(f"开始键长按: {key}")
+        deadline += cmd["duration"]
+        try:
+            deadline = await sleep_until(deadline)
+        finally:
+            self.keyboard_controller.release(target)
+            self.log(f"结束键长按: {key}")
+        return deadline
+        
+    async def execute_wait(self, cmd, target, deadline, humanizer):
+        duration = cmd["duration"]
+        if humanizer:
+            duration = round(humanizer.vary(duration), 3)
+        self.log(f"开始等待: {duration}秒")
+        deadline += duration
+        deadline = await sleep_until(deadline)
+        self.log("等待结束")
+        return deadline
+        
+    async def execute_mouse_click(self, cmd, target, deadline, humanizer):
+        x = cmd["x"]
+        y = cmd["y"]
+        button_str = cmd["button"]
+        deadline = await self.move_pointer(x, y, deadline, humanizer)
+        self.mouse_controller.click(target)
+        self.log(f"执行鼠标点击: ({x}, {y}), 按钮: {button_str}")
+        return deadline
+        
+    async def execute_mouse_hold(self, cmd, target, deadline, humanizer):
+        x = cmd["x"]
+        y = cmd["y"]
+        button_str = cmd["button"]
+        deadline = await self.move_pointer(x, y, deadline, humanizer)
+        self.mouse_controller.press(target)
+        self.log(f"开始鼠标长按: ({x}, {y}), 按钮: {button_str}")
+        deadline += cmd["duration"]
+        try:
+            deadline = await sleep_until(deadline)
+        finally:
+            self.mouse_controller.release(target)
+            self.log(f"结束鼠标长按: ({x}, {y}), 按钮: {button_str}")
+        return deadline
+        
+    async def execute_type_text(self, cmd, target, deadline, humanizer):
+        # 每个字符一次按键，按固定节拍；速度为 0 时一次发送全部文本
+        cps = cmd.get("cps", TYPE_RATE)
+        interval = 1 / cps if cps else 0
+        shifted = False
+        try:
+            for key, shift in target:
+                # 连续的大写字母期间 Shift 保持按下
+                if shift != shifted:
+                    if shift:
+                        self.keyboard_controller.press(keyboard.Key.shift)
                     else:
-                        btn = mouse.Button.left
-                    self.mouse_controller.position = (x, y)
-                    self.mouse_controller.press(btn)
-                    self.log(f"开始鼠标长按: ({x}, {y}), 按钮: {button_str}")
-                    time.sleep(cmd["duration"])
-                    self.mouse_controller.release(btn)
-                    self.log(f"结束鼠标长按: ({x}, {y}), 按钮: {button_str}")
-                elif cmd["command"] == "mouse_scroll":
-                    dx = cmd["dx"]
-                    dy = cmd["dy"]
-                    self.mouse_controller.scroll(dx, dy)
-                    self.log(f"执行鼠标滚动: 水平 {dx}, 垂直 {dy}")
-                time.sleep(0.1)
-            iteration += 1
-            self.log(f"第 {iteration} 次循环完成.")
-        self.log("宏执行完成.")
-        self.macro_running = False
-        self.button_stop.config(state=tk.DISABLED)
+                        self.keyboard_controller.release(keyboard.Key.shift)
+                    shifted = shift
+                self.keyboard_controller.press(key)
+                self.keyboard_controller.release(key)
+                if interval:
+                    deadline += humanizer.vary(interval) if humanizer else interval
+                    deadline = await sleep_until(deadline)
+        finally:
+            if shifted:
+                self.keyboard_controller.release(keyboard.Key.shift)
+        self.log(f"文本已输入: {len(target)} 个字符")
+        return deadline
+        
+    async def execute_paste_text(self, cmd, target, deadline, humanizer):
+        # 剪贴板属于 Tk 线程：文本在那里设置，粘贴要等它设置完
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        def set_clipboard():
+            self.clipboard_clear()
+            self.clipboard_append(cmd["text"])
+            loop.call_soon_threadsafe(wake_future, ready)
+        self.ui.post(set_clipboard)
+        await ready
+        self.keyboard_controller.press(keyboard.Key.ctrl)
+        try:
+            self.keyboard_controller.press(target)
+            self.keyboard_controller.release(target)
+        finally:
+            self.keyboard_controller.release(keyboard.Key.ctrl)
+        self.log(f"文本已粘贴: {len(cmd['text'])} 个字符")
+        # 宏的其余部分从粘贴时刻开始计时
+        deadline = CLOCK.now()
+        return deadline
+        
+    async def execute_mouse_scroll(self, cmd, target, deadline, humanizer):
+        dx = cmd["dx"]
+        dy = cmd["dy"]
+        self.mouse_controller.scroll(dx, dy)
+        self.log(f"鼠标滚动: 水平 {dx}, 垂直 {dy}")
+        return deadline
+        
+    async def execute_mouse_move(self, cmd, target, deadline, humanizer):
+        x = cmd["x"]
+        y = cmd["y"]
+        deadline = await self.move_pointer(x, y, deadline, humanizer, cmd.get("duration", 0), cmd.get("easing", "ease-in-out"))
+        self.log(f"鼠标已移动: ({x}, {y})")
+        return deadline
+        
+    async def execute_mouse_drag(self, cmd, target, deadline, humanizer):
+        x = cmd["x"]
+        y = cmd["y"]
+        to_x = cmd["to_x"]
+        to_y = cmd["to_y"]
+        button_str = cmd["button"]
+        deadline = await self.move_pointer(x, y, deadline, humanizer)
+        self.mouse_controller.press(target)
+        self.log(f"开始鼠标拖动: ({x}, {y}), 按钮: {button_str}")
+        try:
+            deadline = await self.move_pointer(to_x, to_y, deadline, humanizer,
+                                               cmd.get("duration", 0), cmd.get("easing", "ease-in-out"))
+        finally:
+            # 即使运行在拖动途中被停止，也会松开按钮
+            self.mouse_controller.release(target)
+            self.log(f"结束鼠标拖动: ({to_x}, {to_y}), 按钮: {button_str}")
+        return deadline
+        
+    async def execute_wait_image(self, cmd, target, deadline, humanizer):
+        if target is None or not self.screen.available():
+            raise RuntimeError("图像命令需要 numpy 和 mss 包.")
+        x = cmd["x"]
+        y = cmd["y"]
+        tolerance = cmd.get("tolerance", 0)
+        poll_interval = cmd.get("poll_interval", IMAGE_POLL_INTERVAL)
+        timeout = cmd.get("timeout", 0)
+        self.log(f"开始等待图像: ({x}, {y})")
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        poll_time = start
+        matched = await self.screen.matches(x, y, target, tolerance)
+        while not matched:
+            if timeout and loop.time() - start >= timeout:
+                break
+            # 轮询保持在固定时间网格上，速率不会随抓取耗时漂移
+            poll_time += poll_interval
+            await asyncio.sleep(poll_time - loop.time())
+            matched = await self.screen.matches(x, y, target, tolerance)
+        if matched:
+            self.log(f"{loop.time() - start:.2f}秒后图像匹配")
+        else:
+            self.log(f"等待图像超时 ({timeout}秒)")
+        # 宏的其余部分从屏幕就绪的时刻开始计时
+        deadline = CLOCK.now()
+        return deadline
+        
+    async def execute_click_image(self, cmd, target, deadline, humanizer):
+        if target is None or not self.screen.available():
+            raise RuntimeError("图像命令需要 numpy 和 mss 包.")
+        button, matcher = target
+        button_str = cmd["button"]
+        region = (cmd.get("search_x", 0), cmd.get("search_y", 0), cmd.get("search_width", 0), cmd.get("search_height", 0))
+        hit = await self.screen.find(matcher, region, cmd.get("threshold", MATCH_THRESHOLD))
+        if hit is None:
+            self.log("未找到图像，已跳过点击")
+        else:
+            # 点击匹配区域的中心
+            x = hit[0] + matcher.width // 2
+            y = hit[1] + matcher.height // 2
+            self.mouse_controller.position = (x, y)
+            self.mouse_controller.click(button)
+            self.log(f"执行图像点击: ({x}, {y}), 匹配度: {hit[2]:.2f}, 按钮: {button_str}")
+        deadline = max(deadline, CLOCK.now())
+        return deadline
+        
+    async def move_pointer(self, x, y, deadline, humanizer, duration=0, easing="ease-in-out"):
+        if humanizer is not None:
+            points, interval = humanizer.path(self.mouse_controller.position, (x, y), duration, easing)
+        elif duration > 0:
+            points, interval = interpolate_path(self.mouse_controller.position, (x, y), duration, easing)
+        else:
+            self.mouse_controller.position = (x, y)
+            return deadline
+        # 点按固定的截止时间网格发送，中间不做任何计算
+        for point in points[1:]:
+            deadline += interval
+            deadline = await sleep_until(deadline)
+            self.mouse_controller.position = point
+        return deadline
         
     def stop_macro(self):
         self.macro_running = False
+        self.refresh_run_state()
+        self.editor_worker.cancel()
         self.log("请求停止宏执行.")
         
     def save_macro(self):
@@ -529,9 +2326,23 @@ class ManualMacroGUI(tk.Tk):
         if not file_path:
             return
         try:
-            with open(file_path, "w") as f:
-                json.dump(self.commands, f, indent=4)
+            track_loops = self.parse_track_loops(self.entry_track_loops.get())
+            # 保存屏幕尺寸后，坐标可以在其他分辨率下使用
+            data = {"screen": list(self.macro_screen), "commands": self.commands}
+            if track_loops:
+                data["track_loops"] = track_loops
+            content = json.dumps(data, indent=4).encode("utf-8")
+            with open(file_path, "wb") as f:
+                f.write(content)
             self.log("宏已保存: " + file_path)
+            digest = hashlib.sha256(content).hexdigest()
+            folder = os.path.dirname(os.path.abspath(file_path))
+            if self.load_compiled_macro(digest, folder) is None:
+                self.save_compiled_macro(digest, folder, self.compile_macro(self.commands, track_loops, self.macro_screen, folder))
+            self.save_last_macro_cache(file_path, get_file_signature(file_path), digest)
+            # 相对路径的 Call 文件现在相对于保存到的文件夹解析
+            self.compiled_tracks = None
+            self.set_macro_path(file_path)
         except Exception as e:
             messagebox.showerror("错误", "宏保存失败: " + str(e))
         
@@ -539,51 +2350,362 @@ class ManualMacroGUI(tk.Tk):
         file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
         if not file_path:
             return
+        self.load_macro_file(file_path)
+        
+    def load_macro_file(self, file_path):
         try:
-            with open(file_path, "r") as f:
-                self.commands = json.load(f)
+            compiled = self.read_macro_file_cached(file_path)
+            self.commands = compiled["commands"]
+            self.compiled_tracks = compiled["tracks"]
+            self.macro_screen = self.get_macro_screen(compiled["screen"])
+            self.entry_track_loops.delete(0, tk.END)
+            self.entry_track_loops.insert(0, self.format_track_loops(compiled["track_loops"]))
             self.listbox.delete(0, tk.END)
-            for cmd in self.commands:
-                disp = self.get_display_text(cmd)
+            for disp in compiled["display"]:
                 self.listbox.insert(tk.END, disp)
                 self.log("加载命令: " + disp)
             self.log("宏加载完成: " + file_path)
+            self.set_macro_path(file_path)
         except Exception as e:
             messagebox.showerror("错误", "宏加载失败: " + str(e))
             
+    def read_macro_file_cached(self, file_path):
+        # 上一个宏的缓存把未改变的文件（mtime 和大小相同）映射到其内容哈希，
+        # 因此连重新读取和计算哈希都不需要
+        signature = get_file_signature(file_path)
+        content = None
+        digest = None
+        try:
+            with open(LAST_MACRO_CACHE_FILE, "rb") as f:
+                cache = pickle.load(f)
+            if cache["path"] == os.path.abspath(file_path) and cache["signature"] == signature:
+                digest = cache["digest"]
+        except Exception:
+            pass
+        if digest is None:
+            with open(file_path, "rb") as f:
+                content = f.read()
+            digest = hashlib.sha256(content).hexdigest()
+        folder = os.path.dirname(os.path.abspath(file_path))
+        compiled = self.load_compiled_macro(digest, folder)
+        if compiled is None:
+            if content is None:
+                with open(file_path, "rb") as f:
+                    content = f.read()
+            commands, track_loops, screen = self.parse_macro_data(json.loads(content))
+            compiled = self.compile_macro(commands, track_loops, screen, folder)
+            self.save_compiled_macro(digest, folder, compiled)
+        self.save_last_macro_cache(file_path, signature, digest)
+        return compiled
+        
+    def compile_macro(self, commands, track_loops, screen, folder):
+        # 无需再次解析即可显示和运行宏所需的全部内容
+        try:
+            tracks = self.compile_commands(commands, folder)
+        except ValueError:
+            tracks = None  # 未闭合的代码块在播放宏时报告
+        return {
+            "commands": commands,
+            "track_loops": track_loops,
+            "screen": screen,
+            "display": [self.get_display_text(cmd) for cmd in commands],
+            "tracks": tracks,
+        }
+        
+    def get_compiled_cache_path(self, digest, folder):
+        # 显示文本取决于本脚本的语言，操作码编号取决于已加载的插件
+        # Call 目标取决于文件所在的文件夹
+        tag = os.path.splitext(os.path.basename(__file__))[0]
+        opcodes = hashlib.sha256(" ".join(OPCODE_NUMBERS).encode("utf-8")).hexdigest()[:8]
+        location = hashlib.sha256(folder.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(CACHE_DIR, f"{digest}.v{MACRO_CACHE_VERSION}.{tag}.{opcodes}.{location}.pickle")
+        
+    def load_compiled_macro(self, digest, folder):
+        try:
+            with open(self.get_compiled_cache_path(digest, folder), "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return pickle.loads(data)
+        except Exception:
+            return None
+        
+    def save_compiled_macro(self, digest, folder, compiled):
+        path = self.get_compiled_cache_path(digest, folder)
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(compiled, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+            # 只保留最近写入的条目；文件夹中的其他文件保持不动
+            entries = sorted((os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR) if name.endswith(".pickle")),
+                             key=os.path.getmtime, reverse=True)
+            for old_path in entries[MAX_CACHED_MACROS:]:
+                os.remove(old_path)
+        except Exception as e:
+            # 插件目标可能根本无法 pickle，这会引发 PicklingError 以外的异常
+            self.log("宏缓存保存失败: " + str(e))
+            try:
+                os.remove(path + ".tmp")
+            except OSError:
+                pass
+        
+    def save_last_macro_cache(self, file_path, signature, digest):
+        try:
+            os.makedirs(SESSION_DIR, exist_ok=True)
+            with open(LAST_MACRO_CACHE_FILE + ".tmp", "wb") as f:
+                pickle.dump({"path": os.path.abspath(file_path), "signature": signature, "digest": digest},
+                            f, pickle.HIGHEST_PROTOCOL)
+            os.replace(LAST_MACRO_CACHE_FILE + ".tmp", LAST_MACRO_CACHE_FILE)
+        except OSError as e:
+            self.log("宏缓存保存失败: " + str(e))
+            
+    def get_macro_folder(self):
+        # 相对路径的 Call 文件在宏旁边查找；未保存的宏使用工作目录
+        return os.path.dirname(os.path.abspath(self.macro_path)) if self.macro_path else ""
+        
+    def set_macro_path(self, file_path):
+        self.add_recent_macro(file_path)
+        if self.macro_watcher and self.macro_watcher.path == os.path.abspath(file_path):
+            # 自己保存的文件不应被当作外部修改
+            self.macro_watcher.mark_current()
+            return
+        self.macro_path = file_path
+        self.update_macro_watcher()
+        
+    def update_macro_watcher(self):
+        if self.macro_watcher:
+            self.macro_watcher.stop()
+            self.macro_watcher = None
+        if self.watch_file_var.get() and self.macro_path:
+            self.macro_watcher = MacroFileWatcher(self.macro_path, self.on_macro_file_changed, self.engine)
+            self.macro_watcher.start()
+            self.log("正在监视宏文件: " + self.macro_path)
+        
+    def on_macro_file_changed(self, file_path):
+        # 由监视线程调用
+        try:
+            commands, track_loops, screen = self.read_macro_file(file_path)
+            program = self.editor_program
+            if program is not None:
+                # 正在运行的宏在下一次循环开始时切换
+                transform = screen_transform(screen or program["screen"], program["screen"])
+                tracks = transform_tracks(self.compile_commands(commands, os.path.dirname(os.path.abspath(file_path))), transform)
+                # 一次运行的任务在开始时创建，所以只有已有的轨道会采用更改
+                added = sorted(set(tracks) - set(program["tracks"]))
+                program["track_loops"] = track_loops
+                program["tracks"] = tracks
+                if added:
+                    self.log("重新加载新增的轨道将在下次运行时开始: " + ", ".join(map(str, added)))
+        except Exception as e:
+            self.log("宏重新加载失败: " + str(e))
+            return
+        self.ui.post(lambda: self.apply_reloaded_macro(file_path, commands, track_loops, screen), key=self.apply_reloaded_macro)
+        
+    def apply_reloaded_macro(self, file_path, commands, track_loops, screen):
+        self.commands = commands
+        self.compiled_tracks = None
+        self.macro_screen = self.get_macro_screen(screen)
+        self.listbox.delete(0, tk.END)
+        for cmd in self.commands:
+            self.listbox.insert(tk.END, self.get_display_text(cmd))
+        self.entry_track_loops.delete(0, tk.END)
+        self.entry_track_loops.insert(0, self.format_track_loops(track_loops))
+        self.log("宏已重新加载: " + file_path)
+        
+    def add_recent_macro(self, file_path):
+        file_path = os.path.abspath(file_path)
+        if file_path in self.recent_macros:
+            self.recent_macros.remove(file_path)
+        self.recent_macros.insert(0, file_path)
+        del self.recent_macros[MAX_RECENT_MACROS:]
+        self.refresh_recent_menu()
+        
+    def refresh_recent_menu(self):
+        self.menu_recent.delete(0, tk.END)
+        for file_path in self.recent_macros:
+            self.menu_recent.add_command(label=file_path, command=lambda file_path=file_path: self.load_macro_file(file_path))
+        
+    def restore_session(self):
+        try:
+            with open(SESSION_FILE, "r") as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            return
+        hotkeys = session.get("hotkeys", {})
+        self.start_hotkey_var.set(hotkeys.get("start", "f2"))
+        self.stop_hotkey_var.set(hotkeys.get("stop", "f3"))
+        self.action_start_hotkey_var.set(hotkeys.get("action_start", "f4"))
+        self.action_stop_hotkey_var.set(hotkeys.get("action_stop", "f5"))
+        self.slower_hotkey_var.set(hotkeys.get("slower", "f6"))
+        self.faster_hotkey_var.set(hotkeys.get("faster", "f7"))
+        self.entry_loop.delete(0, tk.END)
+        self.entry_loop.insert(0, session.get("loop_count", "1"))
+        run_limit = session.get("run_limit", {})
+        if run_limit.get("mode") in RUN_LIMITS:
+            self.run_limit_var.set(run_limit["mode"])
+        self.entry_run_limit.delete(0, tk.END)
+        self.entry_run_limit.insert(0, run_limit.get("value", ""))
+        self.watch_file_var.set(session.get("auto_reload", False))
+        humanize = session.get("humanize", {})
+        self.humanize_var.set(humanize.get("enabled", False))
+        self.entry_jitter.delete(0, tk.END)
+        self.entry_jitter.insert(0, humanize.get("jitter", "10"))
+        self.entry_seed.delete(0, tk.END)
+        self.entry_seed.insert(0, humanize.get("seed", ""))
+        if session.get("overlap_policy") in OVERLAP_POLICIES:
+            self.overlap_policy = session["overlap_policy"]
+            self.overlap_policy_var.set(self.overlap_policy)
+        if session.get("speed") in SPEEDS:
+            self.set_speed(session["speed"])
+        if session.get("geometry"):
+            # 只恢复高度和位置；宽度属于当前版本的布局
+            self.geometry(f"{WINDOW_WIDTH}x" + session["geometry"].split("x", 1)[-1])
+        self.recent_macros = [p for p in session.get("recent_macros", []) if os.path.exists(p)]
+        self.refresh_recent_menu()
+        for item in session.get("library", []):
+            name = item["name"]
+            if name not in self.macro_library:
+                self.library_names.append(name)
+            track_loops = {int(track): count for track, count in item["track_loops"].items()}
+            screen = tuple(item["screen"]) if "screen" in item else self.screen_size
+            self.macro_library[name] = self.create_library_entry(item["commands"], item["loop"], track_loops,
+                                                                 item["hotkey"], screen, item.get("folder", ""))
+        self.refresh_library_list()
+        last_macro = session.get("last_macro")
+        if last_macro and os.path.exists(last_macro):
+            self.load_macro_file(last_macro)
+        self.log("会话已恢复: " + SESSION_FILE)
+        
+    def save_session(self):
+        session = {
+            "hotkeys": {
+                "start": self.start_hotkey_var.get(),
+                "stop": self.stop_hotkey_var.get(),
+                "action_start": self.action_start_hotkey_var.get(),
+                "action_stop": self.action_stop_hotkey_var.get(),
+                "slower": self.slower_hotkey_var.get(),
+                "faster": self.faster_hotkey_var.get(),
+            },
+            "loop_count": self.entry_loop.get().strip(),
+            "run_limit": {"mode": self.run_limit_var.get(), "value": self.entry_run_limit.get().strip()},
+            "auto_reload": self.watch_file_var.get(),
+            "overlap_policy": self.overlap_policy,
+            "speed": self.speed_var.get(),
+            "humanize": {
+                "enabled": self.humanize_var.get(),
+                "jitter": self.entry_jitter.get().strip(),
+                "seed": self.entry_seed.get().strip(),
+            },
+            "geometry": self.geometry(),
+            "recent_macros": self.recent_macros,
+            "last_macro": self.macro_path and os.path.abspath(self.macro_path),
+            "library": [{
+                "name": name,
+                "commands": self.macro_library[name]["commands"],
+                "loop": self.macro_library[name]["loop"],
+                "track_loops": self.macro_library[name]["track_loops"],
+                "hotkey": self.macro_library[name]["hotkey"],
+                "screen": list(self.macro_library[name]["screen"]),
+                "folder": self.macro_library[name]["folder"],
+            } for name in self.library_names],
+        }
+        try:
+            os.makedirs(SESSION_DIR, exist_ok=True)
+            with open(SESSION_FILE + ".tmp", "w") as f:
+                json.dump(session, f, indent=4)
+            os.replace(SESSION_FILE + ".tmp", SESSION_FILE)
+        except OSError as e:
+            self.log("会话保存失败: " + str(e))
+        
+    def on_close(self):
+        self.save_session()
+        self.stop_macro()
+        for name in self.macro_library:
+            self.stop_library_macro(name)
+        if self.macro_watcher:
+            self.macro_watcher.stop()
+        self.click_capture.stop()
+        self.stop_hotkey_listener()
+        self.engine.stop()
+        self.ui.stop()
+        self.destroy()
+            
+    def read_macro_file(self, file_path):
+        with open(file_path, "r") as f:
+            data = json.load(f)
+        return self.parse_macro_data(data)
+        
+    def parse_macro_data(self, data):
+        # 多轨道文件在命令列表旁保存各轨道的重复次数
+        if isinstance(data, dict):
+            commands = data.get("commands", [])
+            track_loops = {int(track): count for track, count in data.get("track_loops", {}).items()}
+            screen = tuple(data["screen"]) if "screen" in data else None
+        else:
+            commands = data
+            track_loops = {}
+            screen = None
+        # 只有绝对坐标的旧文件 screen 为 None
+        return commands, track_loops, screen
+        
+    def get_macro_screen(self, screen):
+        if screen is None:
+            # 旧的绝对坐标文件视为在当前屏幕上制作，再次保存时写入该屏幕尺寸
+            self.log(f"宏没有屏幕尺寸，使用当前屏幕 {self.screen_size[0]}x{self.screen_size[1]}")
+            return self.screen_size
+        return screen
+        
     def get_display_text(self, cmd):
+        text = self.format_command(cmd)
+        track = cmd.get("track", 0)
+        if track:
+            return f"[轨道 {track}] " + text
+        return text
+            
+    def format_command(self, cmd):
+        number = OPCODE_NUMBERS.get(cmd.get("command"))
+        if number is None:
+            return str(cmd)
         try:
-            if cmd.get("command") == "key_tap":
-                return f"键敲击: {cmd.get('key', '')} x {cmd.get('repeat', 1)}次"
-            elif cmd.get("command") == "key_hold":
-                return f"键长按: {cmd.get('key', '')} (按住时间: {cmd.get('duration', 0)}秒)"
-            elif cmd.get("command") == "wait":
-                return f"等待: {cmd.get('duration', 0)}秒"
-            elif cmd.get("command") == "mouse_click":
-                return f"鼠标点击: ({cmd.get('x', 0)}, {cmd.get('y', 0)}), 按钮: {cmd.get('button', '')}"
-            elif cmd.get("command") == "mouse_hold":
-                return f"鼠标长按: ({cmd.get('x', 0)}, {cmd.get('y', 0)}), 按钮: {cmd.get('button', '')} (按住时间: {cmd.get('duration', 0)}秒)"
-            elif cmd.get("command") == "mouse_scroll":
-                return f"鼠标滚动: 水平 {cmd.get('dx',0)}, 垂直 {cmd.get('dy',0)}"
-            else:
-                return str(cmd)
+            return OPCODES[number].format(cmd)
         except Exception as e:
             self.log("命令显示错误: " + str(e))
             return str(cmd)
         
     def format_hotkey(self, key_str):
-        key_str = key_str.strip().lower()
-        if not key_str.startswith("<") and not key_str.endswith(">"):
-            key_str = f"<{key_str}>"
-        return key_str
+        # 支持单个按键（"f2"）和组合键（"ctrl+alt+1"）
+        parts = []
+        for part in key_str.strip().lower().split("+"):
+            part = part.strip()
+            if len(part) > 1 and not part.startswith("<") and not part.endswith(">"):
+                part = f"<{part}>"
+            parts.append(part)
+        return "+".join(parts)
+        
+    def is_valid_hotkey(self, key_str):
+        try:
+            keyboard.HotKey.parse(self.format_hotkey(key_str))
+        except ValueError:
+            return False
+        return True
         
     def start_hotkey_listener(self):
         mapping = {
             self.format_hotkey(self.start_hotkey_var.get()): self.on_hotkey_start,
             self.format_hotkey(self.stop_hotkey_var.get()): self.on_hotkey_stop,
             self.format_hotkey(self.action_start_hotkey_var.get()): self.start_action_recording,
-            self.format_hotkey(self.action_stop_hotkey_var.get()): self.stop_action_recording
+            self.format_hotkey(self.action_stop_hotkey_var.get()): self.stop_action_recording,
+            self.format_hotkey(self.slower_hotkey_var.get()): lambda: self.step_speed(-1),
+            self.format_hotkey(self.faster_hotkey_var.get()): lambda: self.step_speed(1)
         }
+        for name, entry in self.macro_library.items():
+            if entry["hotkey"]:
+                mapping[self.format_hotkey(entry["hotkey"])] = lambda name=name: self.on_hotkey_library(name)
+        # 一个无效的快捷键（例如来自旧的会话文件）不能连累其他快捷键
+        for hotkey in [hotkey for hotkey in mapping if not self.is_valid_hotkey(hotkey)]:
+            self.log(f"已跳过无效的快捷键: {hotkey}")
+            del mapping[hotkey]
+        # 快捷键在监听线程中触发；其处理函数在 Tk 线程中运行
+        mapping = {hotkey: lambda callback=callback: self.ui.post(callback) for hotkey, callback in mapping.items()}
         self.hotkey_listener = keyboard.GlobalHotKeys(mapping)
         self.hotkey_thread = threading.Thread(target=self.hotkey_listener.run, daemon=True)
         self.hotkey_thread.start()
@@ -605,21 +2727,206 @@ class ManualMacroGUI(tk.Tk):
         
     def on_hotkey_start(self):
         self.log("通过快捷键请求宏执行.")
-        if not self.macro_running:
-            self.play_macro()
+        self.play_macro()
         
     def on_hotkey_stop(self):
         self.log("通过快捷键请求宏停止.")
         self.stop_macro()
+        for name in self.macro_library:
+            self.stop_library_macro(name)
+        
+    def on_hotkey_library(self, name):
+        self.log(f"通过快捷键切换宏库宏: {name}")
+        self.toggle_library_macro(name)
+        
+    def add_library_macro(self):
+        name = self.entry_library_name.get().strip()
+        if name == "":
+            messagebox.showerror("错误", "请输入宏库宏的名称.")
+            return
+        if not self.commands:
+            messagebox.showinfo("信息", "没有可添加的命令.")
+            return
+        try:
+            loop_count = int(self.entry_loop.get().strip())
+            track_loops = self.parse_track_loops(self.entry_track_loops.get())
+        except ValueError:
+            messagebox.showerror("错误", "请输入有效的重复次数.")
+            return
+        self.store_library_macro(name, copy.deepcopy(self.commands), loop_count, track_loops, self.macro_screen,
+                                 self.get_macro_folder())
+        
+    def add_library_file(self):
+        file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
+        if not file_path:
+            return
+        try:
+            loop_count = int(self.entry_loop.get().strip())
+        except ValueError:
+            messagebox.showerror("错误", "请输入有效的重复次数.")
+            return
+        try:
+            commands, track_loops, screen = self.read_macro_file(file_path)
+        except Exception as e:
+            messagebox.showerror("错误", "宏加载失败: " + str(e))
+            return
+        name = self.entry_library_name.get().strip() or os.path.splitext(os.path.basename(file_path))[0]
+        self.store_library_macro(name, commands, loop_count, track_loops, self.get_macro_screen(screen),
+                                 os.path.dirname(os.path.abspath(file_path)))
+        
+    def store_library_macro(self, name, commands, loop_count, track_loops, screen, folder):
+        hotkey = self.entry_library_hotkey.get().strip()
+        if hotkey and not self.is_valid_hotkey(hotkey):
+            messagebox.showerror("错误", "请输入有效的快捷键，例如 f8 或 ctrl+alt+1.")
+            return
+        if name in self.macro_library:
+            self.macro_library[name]["worker"].close()
+        else:
+            self.library_names.append(name)
+        self.macro_library[name] = self.create_library_entry(commands, loop_count, track_loops, hotkey, screen, folder)
+        self.refresh_library_list()
+        self.log(f"宏库宏已添加: {name} ({len(commands)} 条命令)")
+        self.apply_hotkeys()
+        
+    def create_library_entry(self, commands, loop_count, track_loops, hotkey, screen, folder):
+        return {
+            "commands": commands,
+            "loop": loop_count,
+            "track_loops": track_loops,
+            "hotkey": hotkey,
+            "screen": screen,
+            "folder": folder,  # 相对路径的 Call 文件所在位置
+            # 每个宏库宏都有自己的常驻 worker
+            "worker": PlaybackWorker(self.engine, self.get_overlap_policy, self.log,
+                                     lambda: self.ui.post(self.refresh_library_list)),
+        }
+        
+    def remove_library_macro(self):
+        name = self.get_selected_library_name()
+        if name is None:
+            return
+        self.macro_library[name]["worker"].close()
+        del self.macro_library[name]
+        self.library_names.remove(name)
+        self.refresh_library_list()
+        self.log(f"宏库宏已移除: {name}")
+        self.apply_hotkeys()
+        
+    def open_library_macro(self):
+        name = self.get_selected_library_name()
+        if name is None:
+            return
+        entry = self.macro_library[name]
+        self.commands = copy.deepcopy(entry["commands"])
+        self.compiled_tracks = None
+        self.macro_screen = entry["screen"]
+        self.listbox.delete(0, tk.END)
+        for cmd in self.commands:
+            self.listbox.insert(tk.END, self.get_display_text(cmd))
+        self.entry_loop.delete(0, tk.END)
+        self.entry_loop.insert(0, str(entry["loop"]))
+        self.entry_track_loops.delete(0, tk.END)
+        self.entry_track_loops.insert(0, self.format_track_loops(entry["track_loops"]))
+        self.log(f"宏库宏已在编辑器中打开: {name}")
+        
+    def get_selected_library_name(self):
+        selected = self.listbox_library.curselection()
+        if not selected:
+            messagebox.showerror("错误", "请选择一个宏库宏.")
+            return None
+        return self.library_names[selected[0]]
+        
+    def refresh_library_list(self):
+        selected = self.listbox_library.curselection()
+        self.listbox_library.delete(0, tk.END)
+        for name in self.library_names:
+            entry = self.macro_library[name]
+            text = name
+            if entry["hotkey"]:
+                text += f" [{self.format_hotkey(entry['hotkey'])}]"
+            if self.is_library_macro_running(entry):
+                text += " - 运行中"
+            self.listbox_library.insert(tk.END, text)
+        if selected and selected[0] < len(self.library_names):
+            self.listbox_library.selection_set(selected[0])
+        
+    def is_library_macro_running(self, entry):
+        return entry["worker"].is_busy()
+        
+    def play_selected_library_macro(self):
+        name = self.get_selected_library_name()
+        if name is not None:
+            self.play_library_macro(name)
+        
+    def stop_selected_library_macro(self):
+        name = self.get_selected_library_name()
+        if name is not None:
+            self.stop_library_macro(name)
+        
+    def toggle_library_macro(self, name):
+        entry = self.macro_library.get(name)
+        if entry is None:
+            return
+        if self.is_library_macro_running(entry):
+            self.stop_library_macro(name)
+        else:
+            self.play_library_macro(name)
+        
+    def play_library_macro(self, name):
+        entry = self.macro_library.get(name)
+        if entry is None:
+            return
+        try:
+            run_limit = self.parse_run_limit()
+            humanizer = self.create_humanizer()
+        except ValueError:
+            return
+        try:
+            tracks = self.compile_commands(entry["commands"], entry["folder"])
+        except ValueError as e:
+            messagebox.showerror("错误", "宏编译失败: " + str(e))
+            return
+        transform = screen_transform(entry["screen"], self.update_screen_size())
+        entry["worker"].request(lambda: self.execute_library_macro(name, entry, tracks, transform, humanizer, run_limit))
+        
+    async def execute_library_macro(self, name, entry, tracks, transform, humanizer=None, run_limit=None):
+        self.log(f"宏库宏已开始: {name}")
+        self.ui.post(self.refresh_library_list)
+        # 库宏使用控制区设置的运行限制，与人性化设置相同
+        program = {"tracks": transform_tracks(tracks, transform), "screen": self.screen_size,
+                   "humanizer": humanizer, "variables": {}, "subroutines": {},
+                   "stop_at": run_stop_time(run_limit),
+                   "loop_count": entry["loop"], "track_loops": entry["track_loops"]}
+        try:
+            await self.run_macro(program)
+        finally:
+            self.log(f"宏库宏已完成: {name}")
+        
+    def stop_library_macro(self, name):
+        entry = self.macro_library.get(name)
+        if entry is None or not self.is_library_macro_running(entry):
+            return
+        entry["worker"].cancel()
+        self.log(f"请求停止宏库宏: {name}")
         
     def start_action_recording(self):
         if self.action_recording:
             return
         self.action_recording = True
         self.recorded_commands = []
+        self.record_modifiers = []
+        self.record_chord_modifiers = set()
+        self.record_chord_keys = set()
         self.last_record_time = time.time()
+        self.update_screen_size()
+        # 监听线程不能读取 Tk 变量，因此在这里解析快捷键
+        self.record_ignored_keys = {
+            getattr(keyboard.Key, self.action_start_hotkey_var.get().strip().lower(), None),
+            getattr(keyboard.Key, self.action_stop_hotkey_var.get().strip().lower(), None),
+        }
         self.log("动作记录已开始.")
-        self.action_keyboard_listener = keyboard.Listener(on_release=self.action_on_key_release)
+        self.action_keyboard_listener = keyboard.Listener(on_press=self.action_on_key_press,
+                                                          on_release=self.action_on_key_release)
         self.action_mouse_listener = mouse.Listener(on_click=self.action_on_mouse_click)
         self.action_keyboard_listener.start()
         self.action_mouse_listener.start()
@@ -639,29 +2946,62 @@ class ManualMacroGUI(tk.Tk):
         for cmd in self.recorded_commands:
             self.commands.append(cmd)
             self.listbox.insert(tk.END, self.get_display_text(cmd))
+        self.compiled_tracks = None
         self.button_toggle_recording.config(text="开始记录动作")
         
+    def action_on_key_press(self, key):
+        if not self.action_recording:
+            return
+        modifier = MODIFIER_NAMES.get(key)
+        if modifier:
+            if modifier not in self.record_modifiers:
+                self.record_modifiers.append(modifier)
+            return
+        if self.record_modifiers and key not in self.record_ignored_keys:
+            # 按住修饰键时按下的键现在就录制，此时修饰键状态是确定的，
+            # 因为修饰键常常先于该键松开
+            self.record_chord_keys.add(key_name(key).lower())
+            self.record_chord_modifiers.update(self.record_modifiers)
+            self.record_key(key, list(self.record_modifiers))
+        
     def action_on_key_release(self, key):
         if not self.action_recording:
             return
+        modifier = MODIFIER_NAMES.get(key)
+        if modifier:
+            if modifier in self.record_modifiers:
+                self.record_modifiers.remove(modifier)
+            if modifier in self.record_chord_modifiers:
+                # 只有单独敲击的修饰键才录制为键敲击
+                self.record_chord_modifiers.discard(modifier)
+                return
+        elif key_name(key).lower() in self.record_chord_keys:
+            self.record_chord_keys.discard(key_name(key).lower())
+            return
+        self.record_key(key, [])
+        
+    def record_key(self, key, modifiers):
         now = time.time()
         dt = now - self.last_record_time
         if dt > RECORD_WAIT_THRESHOLD:
             wait_cmd = {"command": "wait", "duration": round(dt, 2)}
             self.recorded_commands.append(wait_cmd)
             self.log("记录等待: {}秒".format(round(dt, 2)))
-        start_key = getattr(keyboard.Key, self.action_start_hotkey_var.get().strip().lower(), None)
-        stop_key  = getattr(keyboard.Key, self.action_stop_hotkey_var.get().strip().lower(), None)
-        if key == start_key or key == stop_key:
+        if key in self.record_ignored_keys:
             self.last_record_time = now
             return
-        try:
-            k = key.char
-        except AttributeError:
-            k = str(key)
-        key_cmd = {"command": "key_tap", "key": k, "repeat": 1}
+        k = key_name(key)
+        if modifiers == ["shift"] and not isinstance(key, keyboard.Key):
+            # 单独的 Shift 已体现在输入的字符中
+            modifiers = []
+        if modifiers:
+            keys = "+".join(modifiers + [k.lower() if "shift" in modifiers else k])
+            key_cmd = {"command": "key_chord", "keys": keys}
+            self.log("已录制组合键: {}".format(keys))
+        else:
+            key_cmd = {"command": "key_tap", "key": k, "repeat": 1}
+            self.log("记录键敲击: {}".format(k))
         self.recorded_commands.append(key_cmd)
-        self.log("记录键敲击: {}".format(k))
         self.last_record_time = now
         
     def action_on_mouse_click(self, x, y, button, pressed):
@@ -675,9 +3015,10 @@ class ManualMacroGUI(tk.Tk):
             wait_cmd = {"command": "wait", "duration": round(dt, 2)}
             self.recorded_commands.append(wait_cmd)
             self.log("记录等待: {}秒".format(round(dt, 2)))
-        mouse_cmd = {"command": "mouse_click", "x": int(x), "y": int(y), "button": "left"}
+        x, y = self.to_macro_position(x, y)
+        mouse_cmd = {"command": "mouse_click", "x": x, "y": y, "button": "left"}
         self.recorded_commands.append(mouse_cmd)
-        self.log("记录鼠标点击: ({}, {})".format(int(x), int(y)))
+        self.log("记录鼠标点击: ({}, {})".format(x, y))
         self.last_record_time = now
         
     def toggle_action_recording(self):
@@ -693,209 +3034,45 @@ class ManualMacroGUI(tk.Tk):
             
     def edit_command(self, index):
         cmd = self.commands[index]
+        number = OPCODE_NUMBERS.get(cmd["command"])
+        if number is None:
+            messagebox.showerror("错误", "未知命令: " + cmd["command"])
+            return
+        opcode = OPCODES[number]
         edit_win = tk.Toplevel(self)
         edit_win.title("修改命令")
         edit_win.configure(bg=BG_COLOR)
         edit_win.wait_visibility()
         edit_win.grab_set()
         def save_changes():
-            if cmd["command"] == "key_tap":
-                new_key = entry_key.get().strip()
-                try:
-                    new_repeat = int(entry_repeat.get().strip())
-                except ValueError:
-                    messagebox.showerror("错误", "请输入有效的重复次数.", parent=edit_win)
-                    return
-                if new_key == "":
-                    messagebox.showerror("错误", "请输入键值.", parent=edit_win)
-                    return
-                cmd["key"] = new_key
-                cmd["repeat"] = new_repeat
-            elif cmd["command"] == "key_hold":
-                new_key = entry_key.get().strip()
-                try:
-                    new_duration = float(entry_duration.get().strip())
-                except ValueError:
-                    messagebox.showerror("错误", "请输入有效的按住时间.", parent=edit_win)
-                    return
-                if new_key == "":
-                    messagebox.showerror("错误", "请输入键值.", parent=edit_win)
-                    return
-                cmd["key"] = new_key
-                cmd["duration"] = new_duration
-            elif cmd["command"] == "wait":
-                try:
-                    new_duration = float(entry_duration.get().strip())
-                except ValueError:
-                    messagebox.showerror("错误", "请输入有效的等待时间.", parent=edit_win)
-                    return
-                cmd["duration"] = new_duration
-            elif cmd["command"] == "mouse_click":
-                try:
-                    new_x = int(entry_x.get().strip())
-                    new_y = int(entry_y.get().strip())
-                except ValueError:
-                    messagebox.showerror("错误", "请输入有效的整数X, Y值.", parent=edit_win)
-                    return
-                new_button = var_button.get()
-                cmd["x"] = new_x
-                cmd["y"] = new_y
-                cmd["button"] = new_button
-            elif cmd["command"] == "mouse_hold":
-                try:
-                    new_x = int(entry_x.get().strip())
-                    new_y = int(entry_y.get().strip())
-                except ValueError:
-                    messagebox.showerror("错误", "请输入有效的整数X, Y值.", parent=edit_win)
-                    return
-                try:
-                    new_duration = float(entry_duration.get().strip())
-                except ValueError:
-                    messagebox.showerror("错误", "请输入有效的按住时间.", parent=edit_win)
-                    return
-                new_button = var_button.get()
-                cmd["x"] = new_x
-                cmd["y"] = new_y
-                cmd["button"] = new_button
-                cmd["duration"] = new_duration
-            elif cmd["command"] == "mouse_scroll":
-                try:
-                    new_dx = int(entry_dx.get().strip())
-                    new_dy = int(entry_dy.get().strip())
-                except ValueError:
-                    messagebox.showerror("错误", "请输入有效的滚动值.", parent=edit_win)
-                    return
-                cmd["dx"] = new_dx
-                cmd["dy"] = new_dy
+            try:
+                new_track = int(entry_track.get().strip())
+                if new_track < 0:
+                    raise ValueError
+            except ValueError:
+                messagebox.showerror("错误", "请输入有效的轨道编号.", parent=edit_win)
+                return
+            values = self.read_command_fields(entries)
+            try:
+                cmd.update(opcode.parse(values))
+            except ValueError as e:
+                messagebox.showerror("错误", str(e), parent=edit_win)
+                return
+            if new_track:
+                cmd["track"] = new_track
+            else:
+                cmd.pop("track", None)
+            self.compiled_tracks = None
             self.listbox.delete(index)
             self.listbox.insert(index, self.get_display_text(cmd))
             self.log("命令已修改: " + self.get_display_text(cmd))
             edit_win.destroy()
-        if cmd["command"] == "key_tap":
-            tk.Label(edit_win, text="键:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_key = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_key.insert(0, cmd["key"])
-            entry_key.grid(row=0, column=1, padx=5, pady=5)
-            def on_key_press(event):
-                entry_key.delete(0, tk.END)
-                entry_key.insert(0, event.keysym)
-                return "break"
-            entry_key.bind("<Key>", on_key_press)
-            tk.Label(edit_win, text="重复次数:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=5)
-            entry_repeat = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_repeat.insert(0, str(cmd.get("repeat", 1)))
-            entry_repeat.grid(row=1, column=1, padx=5, pady=5)
-        elif cmd["command"] == "key_hold":
-            tk.Label(edit_win, text="键:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_key = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_key.insert(0, cmd["key"])
-            entry_key.grid(row=0, column=1, padx=5, pady=5)
-            def on_key_press(event):
-                entry_key.delete(0, tk.END)
-                entry_key.insert(0, event.keysym)
-                return "break"
-            entry_key.bind("<Key>", on_key_press)
-            tk.Label(edit_win, text="按住时间（秒）:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=5)
-            entry_duration = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, str(cmd.get("duration", 1)))
-            entry_duration.grid(row=1, column=1, padx=5, pady=5)
-        elif cmd["command"] == "wait":
-            tk.Label(edit_win, text="等待时间（秒）:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_duration = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, str(cmd["duration"]))
-            entry_duration.grid(row=0, column=1, padx=5, pady=5)
-        elif cmd["command"] == "mouse_click":
-            tk.Label(edit_win, text="X:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_x = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_x.insert(0, str(cmd["x"]))
-            entry_x.grid(row=0, column=1, padx=5, pady=5)
-            tk.Label(edit_win, text="Y:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=5)
-            entry_y = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_y.insert(0, str(cmd["y"]))
-            entry_y.grid(row=0, column=3, padx=5, pady=5)
-            tk.Label(edit_win, text="按钮:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=4, padx=5, pady=5)
-            var_button = tk.StringVar(value=cmd["button"])
-            option_button = tk.OptionMenu(edit_win, var_button, "left", "right", "middle")
-            option_button.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
-            option_button["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
-            option_button.grid(row=0, column=5, padx=5, pady=5)
-            def record_mouse_edit():
-                record_button_edit.config(text="单击左键记录鼠标位置完成", state=tk.DISABLED)
-                def on_click(x, y, button, pressed):
-                    if button == mouse.Button.left and pressed:
-                        entry_x.delete(0, tk.END)
-                        entry_x.insert(0, str(int(x)))
-                        entry_y.delete(0, tk.END)
-                        entry_y.insert(0, str(int(y)))
-                        edit_win.after(0, lambda: self.log(f"在编辑窗口中记录鼠标位置: ({int(x)}, {int(y)})"))
-                        record_button_edit.config(text="记录鼠标位置", state=tk.NORMAL)
-                        return False
-                listener = mouse.Listener(on_click=on_click)
-                listener.start()
-            record_button_edit = tk.Button(edit_win, text="记录鼠标位置", command=record_mouse_edit,
-                                           bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
-                                           activebackground=BUTTON_ACTIVE_BG)
-            record_button_edit.grid(row=1, column=0, columnspan=6, padx=5, pady=5, sticky="w")
-        elif cmd["command"] == "mouse_hold":
-            # 第一行: X, Y, 按钮
-            tk.Label(edit_win, text="X:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_x = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_x.insert(0, str(cmd["x"]))
-            entry_x.grid(row=0, column=1, padx=5, pady=5)
-            tk.Label(edit_win, text="Y:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=5)
-            entry_y = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_y.insert(0, str(cmd["y"]))
-            entry_y.grid(row=0, column=3, padx=5, pady=5)
-            tk.Label(edit_win, text="按钮:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=4, padx=5, pady=5)
-            var_button = tk.StringVar(value=cmd["button"])
-            option_button = tk.OptionMenu(edit_win, var_button, "left", "right", "middle")
-            option_button.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
-            option_button["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
-            option_button.grid(row=0, column=5, padx=5, pady=5)
-            tk.Label(edit_win, text="按住时间（秒）:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=5)
-            entry_duration = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, str(cmd.get("duration", 1)))
-            entry_duration.grid(row=1, column=1, padx=5, pady=5)
-            def record_mouse_edit():
-                record_button_edit.config(text="单击左键记录鼠标位置完成", state=tk.DISABLED)
-                def on_click(x, y, button, pressed):
-                    if button == mouse.Button.left and pressed:
-                        entry_x.delete(0, tk.END)
-                        entry_x.insert(0, str(int(x)))
-                        entry_y.delete(0, tk.END)
-                        entry_y.insert(0, str(int(y)))
-                        edit_win.after(0, lambda: self.log(f"在编辑窗口中记录鼠标位置: ({int(x)}, {int(y)})"))
-                        record_button_edit.config(text="记录鼠标位置", state=tk.NORMAL)
-                        return False
-                listener = mouse.Listener(on_click=on_click)
-                listener.start()
-            record_button_edit = tk.Button(edit_win, text="记录鼠标位置", command=record_mouse_edit,
-                                           bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
-                                           activebackground=BUTTON_ACTIVE_BG)
-            record_button_edit.grid(row=1, column=2, columnspan=4, padx=5, pady=5, sticky="w")
-        elif cmd["command"] == "mouse_scroll":
-            tk.Label(edit_win, text="水平滚动:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_dx = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_dx.insert(0, str(cmd["dx"]))
-            entry_dx.grid(row=0, column=1, padx=5, pady=5)
-            tk.Label(edit_win, text="垂直滚动:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=5)
-            entry_dy = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_dy.insert(0, str(cmd["dy"]))
-            entry_dy.grid(row=0, column=3, padx=5, pady=5)
+        entries = self.build_command_fields(edit_win, opcode, cmd, 5)
+        tk.Label(edit_win, text="轨道:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .grid(row=9, column=0, padx=5, pady=5)
+        entry_track = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        entry_track.insert(0, str(cmd.get("track", 0)))
+        entry_track.grid(row=9, column=1, padx=5, pady=5)
         tk.Button(edit_win, text="保存", command=save_changes,
                   bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG)\
             .grid(row=10, column=0, padx=5, pady=10)
@@ -968,6 +3145,7 @@ class ManualMacroGUI(tk.Tk):
                 if self.drop_index > self.drag_original_index:
                     self.drop_index -= 1
                 self.commands.insert(self.drop_index, cmd)
+                self.compiled_tracks = None
                 self.listbox.delete(0, tk.END)
                 for c in self.commands:
                     self.listbox.insert(tk.END, self.get_display_text(c))
@@ -996,7 +3174,278 @@ class ManualMacroGUI(tk.Tk):
                                          height=2, highlightthickness=0, bd=0, bg="red")
         self.drop_indicator.place(x=0, y=y)
 
+# 编辑表单的校验函数：values 按字段键保存输入文本
+def parse_key(values):
+    if not values["key"]:
+        raise ValueError("请输入键值.")
+    return values["key"]
+
+def parse_position(values, names=("x", "y")):
+    try:
+        return {name: int(values[name]) for name in names}
+    except ValueError:
+        raise ValueError("请输入有效的整数X, Y值.") from None
+
+def parse_duration(values, message, minimum=None):
+    try:
+        duration = float(values["duration"])
+        if minimum is not None and duration < minimum:
+            raise ValueError
+    except ValueError:
+        raise ValueError(message) from None
+    return duration
+
+def parse_template(values):
+    # 模板必须按输入的尺寸截取
+    try:
+        width = int(values["width"])
+        height = int(values["height"])
+        if len(base64.b64decode(values["template"])) != width * height * 3:
+            raise ValueError
+    except ValueError:
+        raise ValueError("请先截取模板.") from None
+    return {"width": width, "height": height, "template": values["template"]}
+
+def parse_key_tap(values):
+    key = parse_key(values)
+    try:
+        repeat = int(values["repeat"])
+    except ValueError:
+        raise ValueError("请输入有效的重复次数.") from None
+    return {"key": key, "repeat": repeat}
+
+def parse_type_text(values):
+    if not values["text"]:
+        raise ValueError("请输入要键入的文本.")
+    try:
+        cps = float(values["cps"])
+        if cps < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("请输入有效的输入速度.") from None
+    return {"text": values["text"], "cps": int(cps) if cps.is_integer() else cps}
+
+def preview_text(text):
+    return repr(text[:30]) + ("..." if len(text) > 30 else "")
+
+def parse_paste_text(values):
+    if not values["text"]:
+        raise ValueError("请输入要粘贴的文本.")
+    return {"text": values["text"]}
+
+def format_type_text(cmd):
+    preview = preview_text(cmd.get("text", ""))
+    cps = cmd.get("cps", TYPE_RATE)
+    return f"输入文本: {preview} ({cps} 字符/秒)" if cps else f"输入文本: {preview} (不限速)"
+
+def estimate_type_text(cmd):
+    cps = cmd.get("cps", TYPE_RATE)
+    return (len(cmd.get("text", "")) / cps if cps else 0), 0
+
+def parse_key_chord(values):
+    keys = [key.strip() for key in values["keys"].split("+")]
+    if not all(keys):
+        raise ValueError("请输入组合键，例如 ctrl+shift+s.")
+    return {"keys": "+".join(keys)}
+
+def parse_mouse_scroll(values):
+    try:
+        return {"dx": int(values["dx"]), "dy": int(values["dy"])}
+    except ValueError:
+        raise ValueError("请输入有效的滚动值.") from None
+
+def parse_wait_image(values):
+    cmd = {**parse_position(values), **parse_template(values)}
+    try:
+        cmd["tolerance"] = int(values["tolerance"])
+        cmd["poll_interval"] = float(values["poll_interval"])
+        cmd["timeout"] = float(values["timeout"])
+        if not 0 <= cmd["tolerance"] <= 255 or cmd["poll_interval"] <= 0 or cmd["timeout"] < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("请输入 0 到 255 的容差、正数的轮询间隔和超时.") from None
+    return cmd
+
+def parse_click_image(values):
+    cmd = {**parse_position(values), **parse_template(values)}
+    try:
+        for name in ("search_x", "search_y", "search_width", "search_height"):
+            cmd[name] = int(values[name])
+        cmd["threshold"] = float(values["threshold"])
+        if not 0 < cmd["threshold"] <= 1 or cmd["search_width"] < 0 or cmd["search_height"] < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("请输入 0 到 1 的阈值和有效的搜索区域.") from None
+    cmd["button"] = values["button"]
+    return cmd
+
+def parse_loop_start(values):
+    try:
+        count = int(values["count"])
+        if count < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("请输入有效的重复次数.") from None
+    return {"count": count}
+
+def parse_if_pixel(values):
+    cmd = parse_position(values)
+    try:
+        parse_color(values["color"])
+        cmd["color"] = "#" + values["color"].lstrip("#").lower()
+        cmd["tolerance"] = int(values["tolerance"])
+        if not 0 <= cmd["tolerance"] <= 255:
+            raise ValueError
+    except ValueError:
+        raise ValueError("请输入 #rrggbb 颜色和 0 到 255 的容差.") from None
+    return cmd
+
+def parse_variable(values):
+    # 如果变量 和 设置变量
+    if not values["name"]:
+        raise ValueError("请输入变量名.")
+    try:
+        value = float(values["value"])
+    except ValueError:
+        raise ValueError("请输入数值.") from None
+    return {"name": values["name"], "op": values["op"], "value": int(value) if value.is_integer() else value}
+
+def parse_label(values, key):
+    if not values[key]:
+        raise ValueError("请输入标签名.")
+    return {key: values[key]}
+
+def parse_call(values):
+    if not values["file"]:
+        raise ValueError("请选择宏文件.")
+    return {"file": values["file"]}
+
+def resolve_image_click(cmd):
+    if np is None:
+        return None
+    return (resolve_button(cmd["button"]), TemplateMatcher(decode_template(cmd), cmd["x"], cmd["y"]))
+
+X_FIELD = ("x", "X:", "")
+Y_FIELD = ("y", "Y:", "")
+BUTTON_FIELD = ("button", "按钮:", "left", tuple(MOUSE_BUTTONS))
+EASING_FIELD = ("easing", "缓动:", "ease-in-out", tuple(EASINGS))
+MOVE_DURATION_FIELD = ("duration", "持续时间 (秒):", "0.5")
+HOLD_DURATION_FIELD = ("duration", "按住时间（秒）:", "1")
+
+# 内置命令类型，按命令类型菜单的顺序；插件追加在其后
+for opcode in [
+    Opcode("key_tap", "键敲击", [("key", "键:", ""), ("repeat", "重复次数:", "1")], parse_key_tap,
+           lambda cmd: f"键敲击: {cmd.get('key', '')} x {cmd.get('repeat', 1)}次",
+           ManualMacroGUI.execute_key_tap, resolve=lambda cmd: resolve_key(cmd["key"]),
+           estimate=lambda cmd: (cmd.get("repeat", 1) * KEY_TAP_GAP, cmd.get("repeat", 1) * KEY_TAP_GAP)),
+    Opcode("wait", "等待", [("duration", "等待时间（秒）:", "")],
+           lambda values: {"duration": parse_duration(values, "请输入有效的等待时间.")},
+           lambda cmd: f"等待: {cmd.get('duration', 0)}秒",
+           ManualMacroGUI.execute_wait, estimate=estimate_duration),
+    Opcode("mouse_click", "鼠标点击", [X_FIELD, Y_FIELD, BUTTON_FIELD],
+           lambda values: {**parse_position(values), "button": values["button"]},
+           lambda cmd: f"鼠标点击: ({cmd.get('x', 0)}, {cmd.get('y', 0)}), 按钮: {cmd.get('button', '')}",
+           ManualMacroGUI.execute_mouse_click, resolve=lambda cmd: resolve_button(cmd["button"])),
+    Opcode("key_hold", "键长按", [("key", "键:", ""), HOLD_DURATION_FIELD],
+           lambda values: {"key": parse_key(values), "duration": parse_duration(values, "请输入有效的按住时间.")},
+           lambda cmd: f"键长按: {cmd.get('key', '')} (按住时间: {cmd.get('duration', 0)}秒)",
+           ManualMacroGUI.execute_key_hold, resolve=lambda cmd: resolve_key(cmd["key"]), estimate=estimate_duration),
+    Opcode("mouse_hold", "鼠标长按", [X_FIELD, Y_FIELD, BUTTON_FIELD, HOLD_DURATION_FIELD],
+           lambda values: {**parse_position(values), "button": values["button"],
+                           "duration": parse_duration(values, "请输入有效的按住时间.")},
+           lambda cmd: f"鼠标长按: ({cmd.get('x', 0)}, {cmd.get('y', 0)}), 按钮: {cmd.get('button', '')} (按住时间: {cmd.get('duration', 0)}秒)",
+           ManualMacroGUI.execute_mouse_hold, resolve=lambda cmd: resolve_button(cmd["button"]), estimate=estimate_duration),
+    Opcode("mouse_scroll", "鼠标滚动", [("dx", "水平滚动:", "0"), ("dy", "垂直滚动:", "0")], parse_mouse_scroll,
+           lambda cmd: f"鼠标滚动: 水平 {cmd.get('dx',0)}, 垂直 {cmd.get('dy',0)}",
+           ManualMacroGUI.execute_mouse_scroll),
+    Opcode("mouse_move", "鼠标移动", [X_FIELD, Y_FIELD, MOVE_DURATION_FIELD, EASING_FIELD],
+           lambda values: {**parse_position(values), "duration": parse_duration(values, "请输入有效的移动时间.", 0),
+                           "easing": values["easing"]},
+           lambda cmd: f"鼠标移动: ({cmd.get('x', 0)}, {cmd.get('y', 0)}) (时间: {cmd.get('duration', 0)}秒, {cmd.get('easing', 'ease-in-out')})",
+           ManualMacroGUI.execute_mouse_move, estimate=estimate_duration),
+    Opcode("mouse_drag", "鼠标拖动",
+           [("x", "起点 X:", ""), ("y", "起点 Y:", ""), ("to_x", "终点 X:", ""), ("to_y", "终点 Y:", ""),
+            MOVE_DURATION_FIELD, EASING_FIELD, BUTTON_FIELD],
+           lambda values: {**parse_position(values, ("x", "y", "to_x", "to_y")),
+                           "duration": parse_duration(values, "请输入有效的移动时间.", 0),
+                           "easing": values["easing"], "button": values["button"]},
+           lambda cmd: f"鼠标拖动: ({cmd.get('x', 0)}, {cmd.get('y', 0)}) -> ({cmd.get('to_x', 0)}, {cmd.get('to_y', 0)}), 按钮: {cmd.get('button', '')} (时间: {cmd.get('duration', 0)}秒, {cmd.get('easing', 'ease-in-out')})",
+           ManualMacroGUI.execute_mouse_drag, resolve=lambda cmd: resolve_button(cmd["button"]), estimate=estimate_duration),
+    Opcode("wait_image", "等待图像",
+           [X_FIELD, Y_FIELD, ("width", "宽度:", "1"), ("height", "高度:", "1"), ("tolerance", "容差:", "0"),
+            ("poll_interval", "轮询间隔(秒):", str(IMAGE_POLL_INTERVAL)), ("timeout", "超时(秒, 0 = 无):", "0")],
+           parse_wait_image,
+           lambda cmd: f"等待图像: ({cmd.get('x', 0)}, {cmd.get('y', 0)}) {cmd.get('width', 0)}x{cmd.get('height', 0)}, 容差: {cmd.get('tolerance', 0)}",
+           ManualMacroGUI.execute_wait_image, resolve=lambda cmd: decode_template(cmd) if np is not None else None,
+           estimate=lambda cmd: None),
+    Opcode("click_image", "点击图像",
+           [X_FIELD, Y_FIELD, ("width", "宽度:", ""), ("height", "高度:", ""),
+            ("search_x", "搜索 X:", "0"), ("search_y", "搜索 Y:", "0"),
+            ("search_width", "搜索宽度:", "0"), ("search_height", "搜索高度:", "0"),
+            ("threshold", "阈值 (0-1):", str(MATCH_THRESHOLD)), BUTTON_FIELD],
+           parse_click_image,
+           lambda cmd: f"点击图像: {cmd.get('width', 0)}x{cmd.get('height', 0)}, 阈值: {cmd.get('threshold', MATCH_THRESHOLD)}, 按钮: {cmd.get('button', '')}",
+           ManualMacroGUI.execute_click_image, resolve=resolve_image_click, estimate=lambda cmd: None),
+    Opcode("type_text", "输入文本", [("text", "文本:", ""), ("cps", "每秒字符数 (0 = 不限):", str(TYPE_RATE))],
+           parse_type_text, format_type_text,
+           ManualMacroGUI.execute_type_text, resolve=lambda cmd: [resolve_character(char) for char in cmd["text"]],
+           estimate=estimate_type_text),
+    Opcode("paste_text", "粘贴文本", [("text", "文本:", "")], parse_paste_text,
+           lambda cmd: f"粘贴文本: {preview_text(cmd.get('text', ''))} ({len(cmd.get('text', ''))} 个字符)",
+           ManualMacroGUI.execute_paste_text, resolve=lambda cmd: keyboard.KeyCode.from_char("v")),
+    Opcode("key_chord", "组合键", [("keys", "键 (例如 ctrl+shift+s):", "")], parse_key_chord,
+           lambda cmd: f"组合键: {cmd.get('keys', '')}",
+           ManualMacroGUI.execute_key_chord, resolve=lambda cmd: [resolve_key(key) for key in cmd["keys"].split("+")]),
+    # 流程控制，由 interpret_code 自己执行
+    Opcode("loop_start", "循环开始", [("count", "次数 (0 = 无限):", "2")], parse_loop_start,
+           lambda cmd: f"循环开始: {cmd.get('count', 0)} 次" if cmd.get("count", 0) else "循环开始: 无限"),
+    Opcode("loop_end", "循环结束", [], lambda values: {}, lambda cmd: "循环结束"),
+    Opcode("if_pixel", "如果像素",
+           [X_FIELD, Y_FIELD, ("color", "颜色 (#rrggbb):", "#000000"), ("tolerance", "容差:", "0")], parse_if_pixel,
+           lambda cmd: f"如果像素 ({cmd.get('x', 0)}, {cmd.get('y', 0)}) 为 {cmd.get('color', '')}，容差: {cmd.get('tolerance', 0)}",
+           resolve=lambda cmd: np.array([[parse_color(cmd["color"])]], dtype=np.int16) if np is not None else None),
+    Opcode("if_variable", "如果变量",
+           [("name", "变量:", ""), ("op", "运算符:", "==", tuple(COMPARISONS)), ("value", "值:", "0")], parse_variable,
+           lambda cmd: f"如果 {cmd.get('name', '')} {cmd.get('op', '==')} {cmd.get('value', 0)}"),
+    Opcode("else", "否则", [], lambda values: {}, lambda cmd: "否则"),
+    Opcode("end_if", "结束如果", [], lambda values: {}, lambda cmd: "结束如果"),
+    Opcode("set_variable", "设置变量",
+           [("name", "变量:", ""), ("op", "运算符:", "=", tuple(ASSIGNMENTS)), ("value", "值:", "0")], parse_variable,
+           lambda cmd: f"设置变量: {cmd.get('name', '')} {cmd.get('op', '=')} {cmd.get('value', 0)}"),
+    Opcode("label", "标签", [("name", "名称:", "")], lambda values: parse_label(values, "name"),
+           lambda cmd: f"标签: {cmd.get('name', '')}"),
+    Opcode("goto", "跳转", [("label", "标签:", "")], lambda values: parse_label(values, "label"),
+           lambda cmd: f"跳转到: {cmd.get('label', '')}"),
+    Opcode("call", "调用宏", [("file", "宏文件:", "")], parse_call,
+           lambda cmd: f"调用宏: {cmd.get('file', '')}"),
+    Opcode("return", "返回", [], lambda values: {}, lambda cmd: "返回"),
+]:
+    register_command(opcode)
+OP_LOOP_START = OPCODE_NUMBERS["loop_start"]
+OP_LOOP_END = OPCODE_NUMBERS["loop_end"]
+OP_IF_PIXEL = OPCODE_NUMBERS["if_pixel"]
+OP_IF_VARIABLE = OPCODE_NUMBERS["if_variable"]
+OP_ELSE = OPCODE_NUMBERS["else"]
+OP_SET_VARIABLE = OPCODE_NUMBERS["set_variable"]
+OP_GOTO = OPCODE_NUMBERS["goto"]
+OP_CALL = OPCODE_NUMBERS["call"]
+OP_RETURN = OPCODE_NUMBERS["return"]
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--analyze", metavar="MACRO_FILE", help="print the expected run time of a macro file and exit")
+    parser.add_argument("--loops", type=int, default=1, help="loop count of the main track for --analyze, 0 = forever (default: 1)")
+    args = parser.parse_args()
+    if args.analyze:
+        # 插件消息输出到 stderr，报告可以单独重定向
+        load_plugins(lambda message: print(message, file=sys.stderr))
+        try:
+            commands, track_loops = read_macro_commands(args.analyze)
+        except (OSError, ValueError) as e:
+            sys.exit(f"宏加载失败: {e}")
+        estimates = analyze_commands(commands, os.path.dirname(os.path.abspath(args.analyze)))
+        print("\n".join(describe_estimates(estimates, "1x", args.loops, track_loops)))
+        return
     app = ManualMacroGUI()
     app.mainloop()
 
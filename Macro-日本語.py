@@ -1,13 +1,76 @@
 #!/usr/bin/env python3
+import os
+import copy
 import time
+import datetime
+import collections
 import json
+import argparse
+import operator
+import math
+import array
+import mmap
+import asyncio
+import pickle
+import hashlib
+import base64
+import concurrent.futures
+import ctypes
+import ctypes.util
 import threading
+import signal
+import sys
+import importlib.util
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from pynput import keyboard, mouse
+# オプション: 画面系コマンドでのみ必要
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import mss
+except ImportError:
+    mss = None
 
 DRAG_THRESHOLD = 5  # ドラッグ開始前の最小移動ピクセル
 RECORD_WAIT_THRESHOLD = 0.1  # イベント間の最小待機時間 (秒)
+KEY_TAP_GAP = 0.05  # キータップ後の遅延(秒)
+COMMAND_GAP = 0.1  # 各コマンド後の遅延(秒)
+TYPE_RATE = 20  # テキスト入力コマンドの既定の速度（1 秒あたりの文字数）
+WATCH_POLL_INTERVAL = 0.5  # マクロファイル監視のポーリング間隔(秒)
+IMAGE_POLL_INTERVAL = 0.05  # 画像待機コマンドの既定の画面ポーリング間隔（秒）
+MATCH_THRESHOLD = 0.9      # 画像クリックに必要な正規化相互相関の既定の最小値
+PYRAMID_MIN_SIZE = 8       # テンプレートは短辺がこの大きさ以上である限り縮小する
+PYRAMID_CANDIDATES = 3     # フル解像度で絞り込む粗い一致の上位件数
+LOCAL_SEARCH_MARGIN = 32   # 領域全体より先に探索する、前回の一致位置周辺のピクセル数
+HUMAN_MOVE_TIME = 0.1      # 人間らしいポインター移動の基本時間（秒）
+HUMAN_MOVE_SPEED = 2500    # 長い移動で追加される毎秒ピクセル数
+HUMAN_CURVE = 0.15         # 移動の横方向の最大の曲がり（長さに対する割合）
+MOVE_RATE = 125            # 移動中の 1 秒あたりのポインター更新回数
+UI_FRAME_INTERVAL = 16  # キューに溜まったGUI更新を反映する間隔（ミリ秒）
+OVERLAP_POLICIES = ("queue", "restart", "ignore")  # マクロ実行中にトリガーされたときの動作
+RUN_LIMITS = ("none", "duration", "until")  # 繰り返し回数以外に実行を終わらせるもの
+SPEEDS = {"0.1x": 0.1, "0.25x": 0.25, "0.5x": 0.5, "1x": 1.0, "2x": 2.0, "5x": 5.0, "10x": 10.0, "max": 0}  # 再生速度。0 = できるだけ速く
+MAX_CALL_DEPTH = 16  # 実行を中止するまでのマクロ呼び出しの最大の深さ
+ENGINE_STOP_TIMEOUT = 2.0  # 終了時に停止した実行とエンジンスレッドを待つ時間（秒）
+WINDOW_WIDTH = 820  # ウィンドウのスクロールバーの横に、各行の 800 ピクセルを残す
+WINDOW_HEIGHT = 900  # 初期の高さ。ウィンドウは縦にサイズ変更でき、内容はスクロールする
+
+# セッション保存(ホットキー、最近のマクロ、ウィンドウ状態、最後のマクロのキャッシュ)
+SESSION_DIR = os.path.join(os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config"), "blouplanet-macro")
+SESSION_FILE = os.path.join(SESSION_DIR, "session.json")
+LAST_MACRO_CACHE_FILE = os.path.join(SESSION_DIR, "last_macro.pickle")
+MAX_RECENT_MACROS = 10
+# コマンドプラグイン: ここにある各 .py ファイルを起動時に読み込み、このモジュールを渡して register(macro) を呼ぶ。
+# プラグインは macro.register_command(macro.Opcode(...)) でコマンド種類を追加できる
+PLUGIN_DIR = os.path.join(SESSION_DIR, "plugins")
+
+# コンパイル済みマクロのキャッシュ(マクロファイル内容の SHA-256 がキー)
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "blouplanet-macro", "compiled")
+MACRO_CACHE_VERSION = 4  # コンパイル済みマクロの形式を変えたら上げる
+MAX_CACHED_MACROS = 50
 
 # 色とフォント設定
 BG_COLOR = "#2C2F33"
@@ -23,17 +86,948 @@ BUTTON_FG = "white"
 BUTTON_ACTIVE_BG = "#5b6eae"
 FONT = ("Helvetica", 12)
 
+MOUSE_BUTTONS = {
+    "left": mouse.Button.left,
+    "right": mouse.Button.right,
+    "middle": mouse.Button.middle,
+}
+
+# レコーダーが組み合わせキーの修飾キーとして扱うキー
+MODIFIER_NAMES = {
+    keyboard.Key.ctrl: "ctrl", keyboard.Key.ctrl_l: "ctrl", keyboard.Key.ctrl_r: "ctrl",
+    keyboard.Key.shift: "shift", keyboard.Key.shift_l: "shift", keyboard.Key.shift_r: "shift",
+    keyboard.Key.alt: "alt", keyboard.Key.alt_l: "alt", keyboard.Key.alt_r: "alt",
+    keyboard.Key.cmd: "cmd", keyboard.Key.cmd_l: "cmd", keyboard.Key.cmd_r: "cmd",
+}
+
+def resolve_key(key):
+    try:
+        return getattr(keyboard.Key, key.lower())
+    except AttributeError:
+        return key
+
+# これまでに入力した文字のキー: 文字 -> (キー, Shift 付きか)
+TYPED_KEYS = {}
+TYPED_SPECIAL_KEYS = {"\n": keyboard.Key.enter, "\t": keyboard.Key.tab, " ": keyboard.Key.space}
+
+def resolve_character(char):
+    keystroke = TYPED_KEYS.get(char)
+    if keystroke is None:
+        if char in TYPED_SPECIAL_KEYS:
+            keystroke = (TYPED_SPECIAL_KEYS[char], False)
+        elif char != char.lower() and len(char.lower()) == 1:
+            # 大文字は小文字のキーを Shift 段で押したもの
+            keystroke = (keyboard.KeyCode.from_char(char.lower()), True)
+        else:
+            keystroke = (keyboard.KeyCode.from_char(char), False)
+        TYPED_KEYS[char] = keystroke
+    return keystroke
+
+def key_name(key):
+    # リスナーのキー -> キーフィールドが受け付ける名前（例: "space" や "a"）
+    if isinstance(key, keyboard.Key):
+        return key.name
+    return key.char or str(key)
+
+def resolve_button(button_str):
+    return MOUSE_BUTTONS.get(button_str, mouse.Button.left)
+
+def parse_color(text):
+    # "#rrggbb" -> (r, g, b)
+    text = text.strip().lstrip("#")
+    if len(text) != 6:
+        raise ValueError("invalid color: " + text)
+    return tuple(int(text[i:i + 2], 16) for i in (0, 2, 4))
+
+# 変数条件と変数設定コマンドの演算子
+COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+ASSIGNMENTS = {
+    "=": lambda old, value: value,
+    "+=": operator.add,
+    "-=": operator.sub,
+}
+
+class Opcode:
+    # コマンド種類 1 つ分の情報: 編集フォーム、コマンド一覧での表示、実行方法
+    def __init__(self, name, label, fields, parse, format, execute=None, resolve=None, estimate=None):
+        self.name = name
+        self.label = label      # コマンド種類メニューの項目
+        self.fields = fields    # 編集フィールド: (key, label, default) または (key, label, default, choices)
+        self.parse = parse      # フィールドキーごとの入力テキスト -> コマンドのパラメータ。ValueError はユーザー向けメッセージを持つ
+        self.format = format    # cmd -> 表示テキスト
+        self.execute = execute  # コルーチン (gui, cmd, target, deadline, humanizer) -> deadline。制御フローは None
+        self.resolve = resolve  # cmd -> target。コンパイル時に一度だけ求める
+        self.estimate = estimate  # cmd -> (秒, うち固定の間隔) 分析用。時間がかからなければ None。
+                                  # 時間が画面次第なら関数は None を返す
+
+OPCODES = []           # 登録済みのコマンド種類。位置がそのままオペコード番号
+OPCODE_NUMBERS = {}    # コマンド名 -> オペコード番号
+OPCODE_EXECUTORS = []  # オペコード番号ごとの実行関数（ディスパッチループ用）
+COMMAND_TYPES = {}     # コマンド種類メニューの項目 -> Opcode
+
+def register_command(opcode):
+    # 組み込みのコマンド種類もプラグインもここを通る
+    if opcode.name in OPCODE_NUMBERS or opcode.label in COMMAND_TYPES:
+        raise ValueError("command type already registered: " + opcode.name)
+    OPCODE_NUMBERS[opcode.name] = len(OPCODES)
+    OPCODES.append(opcode)
+    OPCODE_EXECUTORS.append(opcode.execute)
+    COMMAND_TYPES[opcode.label] = opcode
+
+def load_plugins(log):
+    # 内蔵のコマンド種類を登録した後、ウィンドウと --analyze から一度だけ呼ばれる
+    try:
+        names = sorted(name for name in os.listdir(PLUGIN_DIR) if name.endswith(".py"))
+    except OSError:
+        return
+    for name in names:
+        try:
+            spec = importlib.util.spec_from_file_location("macro_plugin_" + name[:-3], os.path.join(PLUGIN_DIR, name))
+            plugin = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(plugin)
+            plugin.register(sys.modules[__name__])
+            log("プラグイン読み込み: " + name)
+        except Exception as e:
+            log(f"プラグイン {name} の読み込みに失敗しました: {e}")
+
+class Bytecode:
+    # コンパイル済みコマンドリスト: コマンドごとのオペコードと、オペコードが参照するオペランド表
+    def __init__(self, ops=None, args=None, cmds=None, targets=None):
+        self.ops = ops if ops is not None else array.array("i")
+        self.args = args if args is not None else array.array("i")  # ジャンプ先。無ければ -1
+        self.cmds = cmds if cmds is not None else []
+        self.targets = targets if targets is not None else []  # コンパイル時に解決したキー、ボタン、テンプレート
+        
+    def __len__(self):
+        return len(self.ops)
+        
+    def append(self, op, cmd, target=None, arg=-1):
+        self.ops.append(op)
+        self.args.append(arg)
+        self.cmds.append(cmd)
+        self.targets.append(target)
+        
+    def with_commands(self, cmds):
+        # オペランドだけ違う同じプログラム（例: この画面に合わせて拡縮した座標）
+        return Bytecode(self.ops, self.args, cmds, self.targets)
+        
+    def disassemble(self):
+        lines = []
+        for index, op in enumerate(self.ops):
+            opcode = OPCODES[op]
+            jump = f"-> {self.args[index]}" if self.args[index] >= 0 else ""
+            lines.append(f"{index:4}  {op:3} {opcode.name:<13} {jump:<8} {opcode.format(self.cmds[index])}")
+        return lines
+
+class MacroEstimate:
+    # コマンドリストを一巡する予想時間。実行せずに求める
+    def __init__(self):
+        self.seconds = collections.Counter()  # コマンド名 -> そのコマンドにかかる時間（間隔込み）
+        self.counts = collections.Counter()   # コマンド名 -> 実行回数
+        self.dead_time = 0.0                  # 固定の間隔 (COMMAND_GAP, KEY_TAP_GAP) にかかる時間
+        self.notes = []                       # 実際の時間がずれる理由
+
+    def total(self):
+        return sum(self.seconds.values())
+
+    def add(self, other, factor=1):
+        for name, seconds in other.seconds.items():
+            self.seconds[name] += seconds * factor
+        for name, count in other.counts.items():
+            self.counts[name] += count * factor
+        self.dead_time += other.dead_time * factor
+        self.notes.extend(note for note in other.notes if note not in self.notes)
+
+def read_macro_commands(path):
+    # マクロファイルのコマンド一覧とトラックごとの繰り返し回数
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return data.get("commands", []), {int(track): count for track, count in data.get("track_loops", {}).items()}
+    return data, {}
+
+def estimate_duration(cmd):
+    return cmd.get("duration", 0), 0
+
+def estimate_commands(commands, depth=0, folder=""):
+    # ループは回数分掛け、条件は長い方の分岐を取り、呼び出すマクロは読み込む
+    estimate, index = estimate_block(commands, 0, depth, folder)
+    while index < len(commands):
+        # 始まりのないループ終了・それ以外・条件終了。compile_code は拒否するが、見積もりはその後から続ける
+        cmd = commands[index]
+        estimate.notes.append(f"コマンド {index + 1} に対応する始まりがないため飛ばします: " + OPCODES[OPCODE_NUMBERS[cmd["command"]]].format(cmd))
+        rest, index = estimate_block(commands, index + 1, depth, folder)
+        estimate.add(rest)
+    return estimate
+
+def estimate_block(commands, index, depth, folder):
+    # ブロックを閉じるループ終了・それ以外・条件終了まで進み、(見積もり, そのコマンドの位置) を返す
+    estimate = MacroEstimate()
+    while index < len(commands):
+        cmd = commands[index]
+        name = cmd.get("command")
+        if name in ("loop_end", "else", "end_if"):
+            break
+        index += 1
+        number = OPCODE_NUMBERS.get(name)
+        if number is None:
+            estimate.notes.append(f"不明なコマンドは数えません: {name}")
+            continue
+        opcode = OPCODES[number]
+        if name == "loop_start":
+            body, index = estimate_block(commands, index, depth, folder)
+            if index >= len(commands) or commands[index].get("command") != "loop_end":
+                estimate.notes.append("ループ終了のないループ開始: " + opcode.format(cmd))
+            index += 1
+            count = cmd.get("count", 0)
+            if not count:
+                estimate.notes.append("無限ループは1回と数えます: " + opcode.format(cmd))
+            estimate.add(body, count or 1)
+        elif name in ("if_pixel", "if_variable"):
+            branch, index = estimate_block(commands, index, depth, folder)
+            other = MacroEstimate()
+            if index < len(commands) and commands[index].get("command") == "else":
+                other, index = estimate_block(commands, index + 1, depth, folder)
+            if index >= len(commands) or commands[index].get("command") != "end_if":
+                estimate.notes.append("条件終了のない条件: " + opcode.format(cmd))
+            index += 1
+            # 実行されるのは片方の分岐だけ。長い方を数える
+            estimate.add(max(branch, other, key=MacroEstimate.total))
+        elif name == "call":
+            estimate.add(estimate_call(cmd, depth, folder))
+        elif name in ("goto", "return"):
+            estimate.notes.append("ジャンプは追いません: " + opcode.format(cmd))
+        elif opcode.execute is not None:
+            seconds = dead = 0
+            if opcode.estimate is not None:
+                result = opcode.estimate(cmd)
+                if result is None:
+                    estimate.notes.append("画面次第のため即時として数えます: " + opcode.format(cmd))
+                else:
+                    seconds, dead = result
+            # エンジンは各コマンドの後に COMMAND_GAP 待つ
+            estimate.seconds[name] += seconds + COMMAND_GAP
+            estimate.counts[name] += 1
+            estimate.dead_time += dead + COMMAND_GAP
+    return estimate, index
+
+def estimate_call(cmd, depth, folder):
+    path = os.path.abspath(os.path.join(folder, cmd.get("file", "")))
+    if depth >= MAX_CALL_DEPTH:
+        estimate = MacroEstimate()
+        estimate.notes.append(f"マクロ呼び出しの入れ子が {MAX_CALL_DEPTH} を超えました: {path}")
+        return estimate
+    try:
+        commands, _ = read_macro_commands(path)
+    except (OSError, ValueError) as e:
+        estimate = MacroEstimate()
+        estimate.notes.append(f"呼び出すマクロを読めません: {path} ({e})")
+        return estimate
+    # 呼び出すファイルの全トラックのコマンドを順に実行する（call_macro と同じ）
+    return estimate_commands(commands, depth + 1, os.path.dirname(path))
+
+def analyze_commands(commands, folder=""):
+    # トラック番号 -> そのトラック1回分の MacroEstimate
+    grouped = {}
+    for cmd in commands:
+        grouped.setdefault(cmd.get("track", 0), []).append(cmd)
+    return {track: estimate_commands(track_commands, 0, folder) for track, track_commands in grouped.items()}
+
+def describe_estimates(estimates, speed="1x", loop_count=1, track_loops=None):
+    # 繰り返し回数は run_macro と同じ。メイントラックは loop_count 回、他のトラックはそれぞれの回数。0 = 無限
+    counts = {track: loop_count if track == 0 else (track_loops or {}).get(track, loop_count) for track in estimates}
+    lines = []
+    for track, estimate in sorted(estimates.items()):
+        total = estimate.total()
+        lines.append(f"トラック {track}: 1回あたり {total:.3f} 秒、コマンド {sum(estimate.counts.values())} 個")
+        if counts[track]:
+            lines.append(f"  繰り返し: {counts[track]} 回、合計 {total * counts[track]:.3f} 秒")
+        elif track == 0:
+            lines.append("  繰り返し: 無限")
+        else:
+            lines.append("  繰り返し: 無限、他のトラックが終わるまで")
+        for name, seconds in estimate.seconds.most_common():
+            share = seconds / total * 100 if total else 0
+            lines.append(f"  {OPCODES[OPCODE_NUMBERS[name]].label:<18} {estimate.counts[name]:>7} x {seconds:10.3f} 秒 {share:6.1f}%")
+        share = estimate.dead_time / total * 100 if total else 0
+        lines.append(f"  デッドタイム (コマンドとキー入力後の固定の間隔): {estimate.dead_time:.3f} 秒 ({share:.1f}%)")
+        for note in estimate.notes:
+            lines.append("  注: " + note)
+        lines.append("")
+    if estimates:
+        # トラックは並んで動き、実行は最後の有限トラックで終わる。無限に繰り返すメイントラック、
+        # または無限トラックだけの場合は終わらない
+        finite = [track for track in estimates if counts[track]]
+        if counts.get(0) == 0 or not finite:
+            lines.append("実行時間: 無限（停止または実行制限まで）")
+        else:
+            length = max(estimates[track].total() * counts[track] for track in finite)
+            lines.append(f"実行時間: {length:.3f} 秒")
+            if SPEEDS[speed] and SPEEDS[speed] != 1:
+                lines.append(f"速度 {speed} の場合: {length / SPEEDS[speed]:.3f} 秒")
+    return lines
+
+def get_track_loop_count(program, track):
+    # メイントラックはコントロールの繰り返し回数、他のトラックはファイルにあるそれぞれの回数。0 = 無限
+    loop_count = program["loop_count"]
+    return loop_count if track == 0 else program["track_loops"].get(track, loop_count)
+
+def get_file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+class HeldInputs:
+    # 再生が押してまだ離していないキーとボタン
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.held = set()  # (コントローラー, キーまたはボタン)
+
+    def add(self, controller, key):
+        with self.lock:
+            self.held.add((controller, key))
+
+    def discard(self, controller, key):
+        with self.lock:
+            self.held.discard((controller, key))
+
+    def release_all(self):
+        # 押した実行がどんな状態で終わっていても一括で離す
+        with self.lock:
+            held, self.held = self.held, set()
+        for controller, key in held:
+            try:
+                controller.release(key)
+            except Exception:
+                pass
+        return len(held)
+
+class TrackedInput:
+    # 押下を離されるまで HeldInputs に記録するコントローラーのミックスイン
+    def __init__(self, held):
+        super().__init__()
+        self.held = held
+
+    def press(self, key):
+        super().press(key)
+        self.held.add(self, key)
+
+    def release(self, key):
+        self.held.discard(self, key)
+        super().release(key)
+
+class TrackedKeyboardController(TrackedInput, keyboard.Controller):
+    pass
+
+class TrackedMouseController(TrackedInput, mouse.Controller):
+    pass
+
+class PlaybackEngine:
+    # すべてのマクロ実行・タイマー・ファイル監視で共有する asyncio イベントループのスレッド
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.held = HeldInputs()  # このエンジン上のいずれかの実行が押したもの
+        self.active_runs = 0
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        # スレッドセーフ。返された future をキャンセルするとコルーチンもキャンセルされる
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        # 別スレッドから呼ぶ。すべての実行を取り消し、その入力を離し、
+        # ループのスレッドが終わってから戻る
+        if not self.thread.is_alive():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(ENGINE_STOP_TIMEOUT)
+        except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError):
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(ENGINE_STOP_TIMEOUT)
+        # ここで入力がまだ押されているのは、実行が取り消しを無視したときだけ
+        self.held.release_all()
+
+    async def shutdown(self):
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # ループ上で離すので、その後どの実行も何も押せない
+        self.held.release_all()
+
+class PlaybackWorker:
+    # 1つのマクロの実行要求をキューから1つずつ処理する常駐タスク
+    def __init__(self, engine, get_policy, log, on_done=None):
+        self.engine = engine
+        self.get_policy = get_policy
+        self.log = log
+        self.on_done = on_done
+        self.pending = collections.deque()  # 実行待ちのコルーチンファクトリ
+        self.current = None
+        self.closed = False
+        self.wakeup = None  # run() がエンジンのループ上で作る。Python 3.10 より前は Event が作られたループに結び付くため
+        self.future = engine.submit(self.run())
+
+    def request(self, factory):
+        self.engine.loop.call_soon_threadsafe(self.enqueue, factory)
+
+    def cancel(self):
+        self.engine.loop.call_soon_threadsafe(self.cancel_all)
+
+    def close(self):
+        self.closed = True
+        self.cancel()
+        self.future.cancel()
+
+    def is_busy(self):
+        return bool(self.pending) or (self.current is not None and not self.current.done())
+
+    def enqueue(self, factory):
+        # キューに入ってまだ始まっていない要求も実行中とみなす
+        if self.is_busy():
+            policy = self.get_policy()
+            if policy == "ignore":
+                self.log("マクロは既に実行中のため、トリガーを無視しました。")
+                return
+            if policy == "restart":
+                self.cancel_all()
+        self.pending.append(factory)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def cancel_all(self):
+        self.pending.clear()
+        if self.current is not None:
+            self.current.cancel()
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            while not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            factory = self.pending.popleft()
+            if self.closed:
+                return
+            self.current = asyncio.ensure_future(factory())
+            self.engine.active_runs += 1
+            try:
+                # 実行自体がキャンセルされただけなら asyncio.wait は例外を送出しない
+                await asyncio.wait([self.current])
+            finally:
+                # close() が実行の途中でこのワーカーを取り消したときも
+                self.engine.active_runs -= 1
+            interrupted = self.current.cancelled()
+            if not interrupted and self.current.exception() is not None:
+                self.log("マクロの実行に失敗しました: " + str(self.current.exception()))
+                interrupted = True
+            if interrupted and not self.engine.active_runs:
+                # 他に何も実行中でないので、まだ押されているものはこの実行が残したもの
+                released = self.engine.held.release_all()
+                if released:
+                    self.log(f"押されたままのキーとボタンを {released} 個離しました。")
+            if self.on_done:
+                self.on_done()
+
+class UIDispatcher:
+    # 他スレッドからのGUI更新を集め、Tkメインループが1フレームに1回まとめて反映する
+    def __init__(self, root, write_log):
+        self.root = root
+        self.write_log = write_log
+        self.lock = threading.Lock()
+        self.lines = []
+        self.calls = {}  # キー -> コールバック。同じキーの新しい更新は保留中のものを置き換える
+        self.after_id = None
+
+    def start(self):
+        self.after_id = self.root.after(UI_FRAME_INTERVAL, self.drain)
+
+    def stop(self):
+        if self.after_id:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+    def log(self, message):
+        with self.lock:
+            self.lines.append(message)
+
+    def post(self, callback, key=None):
+        with self.lock:
+            self.calls[key or callback] = callback
+
+    def drain(self):
+        with self.lock:
+            lines, self.lines = self.lines, []
+            calls, self.calls = self.calls, {}
+        if lines:
+            self.write_log("\n".join(lines) + "\n")
+        for callback in calls.values():
+            try:
+                callback()
+            except Exception as e:
+                self.root.report_callback_exception(type(e), e, e.__traceback__)
+        self.after_id = self.root.after(UI_FRAME_INTERVAL, self.drain)
+
+class ClickCapture:
+    # 次の左クリック位置を要求元に渡す共有マウスリスナー
+    def __init__(self, post):
+        self.post = post  # コールバックはこれを通してTkスレッドで呼ばれる
+        self.lock = threading.Lock()
+        self.listener = None
+        self.waiting = None
+
+    def capture(self, callback):
+        with self.lock:
+            previous, self.waiting = self.waiting, callback
+            if self.listener is None:
+                # 初回使用時に起動して動かし続け、以降の取得を即座に行えるようにする
+                self.listener = mouse.Listener(on_click=self.on_click)
+                self.listener.start()
+        if previous:
+            # クリックを受け取るのは最新の要求だけ
+            self.post(lambda: previous(None))
+
+    def stop(self):
+        with self.lock:
+            self.waiting = None
+            if self.listener:
+                self.listener.stop()
+                self.listener = None
+
+    def on_click(self, x, y, button, pressed):
+        if button != mouse.Button.left or not pressed:
+            return
+        with self.lock:
+            callback, self.waiting = self.waiting, None
+        if callback:
+            self.post(lambda: callback((int(x), int(y))))
+
+# 画面サイズに合わせて変わる座標フィールド（コマンドごと）
+POSITION_COMMANDS = {
+    "mouse_click": (("x", "y"),),
+    "mouse_hold": (("x", "y"),),
+    "mouse_move": (("x", "y"),),
+    "mouse_drag": (("x", "y"), ("to_x", "to_y")),
+    "if_pixel": (("x", "y"),),
+}
+
+def screen_transform(reference, current):
+    # マクロを作成した画面から現在の画面への拡大率
+    return (current[0] / reference[0], current[1] / reference[1])
+
+def transform_tracks(tracks, transform):
+    # 実行ごとに一度だけ適用し、再生中は座標計算をしない
+    if transform == (1.0, 1.0):
+        return tracks
+    scale_x, scale_y = transform
+    def scale(cmd):
+        cmd = dict(cmd)
+        for field_x, field_y in POSITION_COMMANDS[cmd["command"]]:
+            cmd[field_x] = round(cmd[field_x] * scale_x)
+            cmd[field_y] = round(cmd[field_y] * scale_y)
+        return cmd
+    return {track: code.with_commands([scale(cmd) if cmd["command"] in POSITION_COMMANDS else cmd for cmd in code.cmds])
+            for track, code in tracks.items()}
+
+# それぞれ 0..1 の進行度をイージング後の進行度に変換し、浮動小数点数にも numpy 配列にも使える
+EASINGS = {
+    "linear": lambda t: t,
+    "ease-in": lambda t: t * t,
+    "ease-out": lambda t: t * (2 - t),
+    "ease-in-out": lambda t: t * t * (3 - 2 * t),
+}
+
+def interpolate_path(start, end, duration, easing):
+    # 直線移動のすべての点と点の間の時間を返す
+    count = max(2, int(duration * MOVE_RATE) + 1)
+    ease = EASINGS[easing]
+    if np is None:
+        steps = [ease(i / (count - 1)) for i in range(count)]
+        points = [(round(start[0] + (end[0] - start[0]) * t), round(start[1] + (end[1] - start[1]) * t)) for t in steps]
+    else:
+        steps = ease(np.linspace(0, 1, count))[:, None]
+        start = np.asarray(start, dtype=float)
+        points = np.rint(start + (np.asarray(end, dtype=float) - start) * steps).astype(int).tolist()
+        points = [tuple(point) for point in points]
+    return points, duration / (count - 1)
+
+class Humanizer:
+    # シード付きのタイミング揺らぎと曲線ポインター経路。各トラックは独自の乱数列を使う
+    def __init__(self, jitter, seed, stream=0):
+        self.jitter = jitter  # 待機時間の最大相対変化。例: 0.1 で +-10%
+        self.seed = seed
+        self.rng = np.random.default_rng([seed, stream])
+
+    def for_track(self, track):
+        return Humanizer(self.jitter, self.seed, track)
+
+    def vary(self, duration):
+        return duration * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+    def path(self, start, end, duration=0, easing="ease-in-out"):
+        # 移動全体を事前に 1 つの配列として計算するので、送出時は位置更新だけ
+        start = np.asarray(start, dtype=float)
+        end = np.asarray(end, dtype=float)
+        delta = end - start
+        if not duration:
+            duration = HUMAN_MOVE_TIME + float(np.hypot(*delta)) / HUMAN_MOVE_SPEED
+        duration = self.vary(duration)
+        count = max(2, int(duration * MOVE_RATE) + 1)
+        # 制御点をランダムに横へずらした 3 次ベジェ曲線
+        normal = np.array([-delta[1], delta[0]])
+        bends = self.rng.uniform(-HUMAN_CURVE, HUMAN_CURVE, 2)
+        control1 = start + delta * 0.3 + normal * bends[0]
+        control2 = start + delta * 0.7 + normal * bends[1]
+        t = EASINGS[easing](np.linspace(0, 1, count))[:, None]
+        points = ((1 - t) ** 3 * start + 3 * (1 - t) ** 2 * t * control1
+                  + 3 * (1 - t) * t ** 2 * control2 + t ** 3 * end)
+        return [tuple(point) for point in np.rint(points).astype(int).tolist()], duration / (count - 1)
+
+def encode_template(image):
+    return base64.b64encode(np.ascontiguousarray(image, dtype=np.uint8).tobytes()).decode("ascii")
+
+def decode_template(cmd):
+    # コンパイル時に一度だけデコード。差分が桁あふれしないよう int16 にする
+    data = np.frombuffer(base64.b64decode(cmd["template"]), dtype=np.uint8)
+    return data.reshape(cmd["height"], cmd["width"], 3).astype(np.int16)
+
+def to_gray(image):
+    return image.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+def downsample(image):
+    # 2x2 ブロックの平均で縦横を半分にする
+    height, width = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    image = image[:height, :width]
+    return (image[0::2, 0::2] + image[1::2, 0::2] + image[0::2, 1::2] + image[1::2, 1::2]) / 4
+
+def box_sums(image, height, width):
+    # 積分画像から求めた各 高さ x 幅 ウィンドウの合計
+    integral = np.pad(image.cumsum(0, dtype=np.float64).cumsum(1), ((1, 0), (1, 0)))
+    return (integral[height:, width:] - integral[:-height, width:]
+            - integral[height:, :-width] + integral[:-height, :-width])
+
+def match_template(image, template):
+    # 画像の各位置におけるテンプレートの正規化相互相関
+    height, width = template.shape
+    if image.shape[0] < height or image.shape[1] < width:
+        return np.zeros((0, 0))
+    shade = float(template.mean())
+    template = template - shade
+    energy = float(np.square(template, dtype=np.float64).sum())
+    sums = box_sums(image, height, width)
+    squares = box_sums(np.square(image, dtype=np.float64), height, width)
+    if energy < 1e-6 * template.size:
+        # 単色のテンプレートには相関を取る模様がないのでスコアは 0 のままになる。代わりに各ウィンドウが
+        # その一つの色調にどれだけ近いかで採点し、完全一致なら 1
+        distance = squares - 2 * shade * sums + shade * shade * (height * width)
+        return 1 - np.sqrt(np.maximum(distance, 0) / (height * width)) / 255
+    # FFT で相関を計算する。有効部分は巡回しない
+    spectrum = np.fft.rfft2(image) * np.fft.rfft2(template[::-1, ::-1], s=image.shape)
+    numerator = np.fft.irfft2(spectrum, s=image.shape)[height - 1:, width - 1:]
+    variance = squares - sums * sums / (height * width)
+    denominator = np.sqrt(np.maximum(variance, 0) * energy)
+    return np.where(denominator > 1e-6, numerator / np.maximum(denominator, 1e-6), 0.0)
+
+def best_match(image, template):
+    scores = match_template(image, template)
+    if scores.size == 0:
+        return 0, 0, -1.0
+    row, col = np.unravel_index(np.argmax(scores), scores.shape)
+    return int(row), int(col), float(scores[row, col])
+
+def refine_match(image, template, row, col, radius):
+    # (row, col) から radius ピクセル以内の最良一致
+    height, width = template.shape
+    top, left = max(row - radius, 0), max(col - radius, 0)
+    row, col, score = best_match(image[top:row + height + radius, left:col + width + radius], template)
+    return top + row, left + col, score
+
+class TemplateMatcher:
+    # テンプレートのグレースケールピラミッドと、最後に見つかった画面上の位置
+    def __init__(self, template, x, y):
+        self.height, self.width = template.shape[:2]
+        self.pyramid = [to_gray(template)]
+        while min(self.pyramid[-1].shape) >= 2 * PYRAMID_MIN_SIZE:
+            self.pyramid.append(downsample(self.pyramid[-1]))
+        self.last_hit = (x, y)  # 最初はテンプレートを取得した位置
+
+    def search(self, image):
+        # 全探索は最も粗い段だけで行い、上位候補を段ごとに絞り込む
+        levels = [image]
+        for _ in range(len(self.pyramid) - 1):
+            levels.append(downsample(levels[-1]))
+        top = len(self.pyramid) - 1
+        scores = match_template(levels[top], self.pyramid[top])
+        if scores.size == 0:
+            return None
+        count = min(PYRAMID_CANDIDATES, scores.size)
+        best = None
+        for index in np.argpartition(scores.ravel(), -count)[-count:]:
+            row, col = divmod(int(index), scores.shape[1])
+            score = float(scores[row, col])
+            for level in range(top - 1, -1, -1):
+                row, col, score = refine_match(levels[level], self.pyramid[level], row * 2, col * 2, 2)
+            if best is None or score > best[2]:
+                best = (col, row, score)
+        return best
+
+class ScreenSampler:
+    # 必要な画面領域だけを取得する。X サーバーが対応していれば mss は XShm を使う
+    def __init__(self):
+        # 1つのスレッドが全取得で同じグラバー（と共有メモリセグメント）を使い続ける
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.sct = None
+
+    @staticmethod
+    def available():
+        return np is not None and mss is not None
+
+    def get_grabber(self):
+        if self.sct is None:
+            self.sct = mss.mss()
+        return self.sct
+
+    def grab(self, x, y, width, height):
+        shot = self.get_grabber().grab({"left": x, "top": y, "width": width, "height": height})
+        # BGRA -> RGB
+        return np.frombuffer(shot.bgra, dtype=np.uint8).reshape(height, width, 4)[:, :, 2::-1]
+
+    def capture(self, x, y, width, height):
+        return self.executor.submit(self.grab, x, y, width, height).result()
+
+    def compare(self, x, y, template, tolerance):
+        region = self.grab(x, y, template.shape[1], template.shape[0])
+        return int(np.abs(region - template).max()) <= tolerance
+
+    async def matches(self, x, y, template, tolerance):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.compare, x, y, template, tolerance)
+
+    def locate(self, matcher, region, threshold):
+        x, y, width, height = region
+        if width <= 0 or height <= 0:
+            screen = self.get_grabber().monitors[0]  # 全モニターを囲む矩形
+            x, y, width, height = screen["left"], screen["top"], screen["width"], screen["height"]
+        # まず前回の一致位置周辺を探し、対象が移動したときだけ領域全体を探索する
+        last_x, last_y = matcher.last_hit
+        left = max(x, last_x - LOCAL_SEARCH_MARGIN)
+        top = max(y, last_y - LOCAL_SEARCH_MARGIN)
+        right = min(x + width, last_x + matcher.width + LOCAL_SEARCH_MARGIN)
+        bottom = min(y + height, last_y + matcher.height + LOCAL_SEARCH_MARGIN)
+        if right - left >= matcher.width and bottom - top >= matcher.height:
+            image = to_gray(self.grab(left, top, right - left, bottom - top))
+            row, col, score = best_match(image, matcher.pyramid[0])
+            if score >= threshold:
+                matcher.last_hit = (left + col, top + row)
+                return left + col, top + row, score
+        hit = matcher.search(to_gray(self.grab(x, y, width, height)))
+        if hit is None or hit[2] < threshold:
+            return None
+        matcher.last_hit = (x + hit[0], y + hit[1])
+        return x + hit[0], y + hit[1], hit[2]
+
+    async def find(self, matcher, region, threshold):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.locate, matcher, region, threshold)
+
+def wake_future(future):
+    if not future.done():
+        future.set_result(None)
+
+class PlaybackClock:
+    # マクロ時間: 再生速度で伸縮したループの時計 (time.monotonic())。
+    # 期限はマクロ時間のままなので、速度の変更は待機中と以後のすべての時間に効く
+    def __init__(self):
+        self.speed = 1.0      # SPEEDS のいずれか。0 = できるだけ速く
+        self.base = 0.0       # 最後に速度を変えたときのマクロ時間
+        self.loop_base = 0.0  # 最後に速度を変えたときのループ時間
+        self.sleepers = set()
+
+    def now(self):
+        # 最速でもマクロ時間は 1x で進めるので、後の速度は現在から続く
+        return self.base + (asyncio.get_running_loop().time() - self.loop_base) * (self.speed or 1)
+
+    def set_speed(self, speed):
+        # エンジンのスレッドで呼ばれる。待機中のものは起きて新しい速度で予定し直す
+        self.base = self.now()
+        self.loop_base = asyncio.get_running_loop().time()
+        self.speed = speed
+        for future in self.sleepers:
+            if not future.done():
+                future.set_result(True)
+
+    async def sleep_until(self, deadline):
+        # 呼び出し側が続きに使う期限を返す
+        loop = asyncio.get_running_loop()
+        while self.speed:
+            future = loop.create_future()
+            handle = loop.call_at(self.loop_base + (deadline - self.base) / self.speed, wake_future, future)
+            self.sleepers.add(future)
+            try:
+                if not await future:
+                    return deadline
+            finally:
+                handle.cancel()
+                self.sleepers.discard(future)
+        # 最速: 呼び出し側の期限は先走らせずに現在へ引き寄せる。
+        # 各トラックは自分の時間を保ち、次の速度で取り戻す遅れが残らない
+        await asyncio.sleep(0)
+        return self.now()
+
+CLOCK = PlaybackClock()  # すべての実行で共有するので、速度設定は 1 つで全部に効く
+sleep_until = CLOCK.sleep_until
+
+def parse_run_duration(text):
+    # "90"、"90s"、"45m"、"2h" または "1:30:00" -> 秒
+    text = text.strip().lower()
+    if ":" in text:
+        seconds = 0
+        for part in text.split(":"):
+            seconds = seconds * 60 + float(part)
+    else:
+        units = {"s": 1, "m": 60, "h": 3600}
+        scale = units.get(text[-1:])
+        seconds = float(text[:-1]) * scale if scale else float(text)
+    if not seconds > 0:
+        raise ValueError("invalid duration: " + text)
+    return seconds
+
+def next_clock_time(text):
+    # "17:00" または "17:00:30" -> ローカル時計が次にその時刻を示すときのエポック秒
+    text = text.strip()
+    clock = datetime.datetime.strptime(text, "%H:%M:%S" if text.count(":") == 2 else "%H:%M").time()
+    now = datetime.datetime.now()
+    target = datetime.datetime.combine(now.date(), clock)
+    if target <= now:
+        target += datetime.timedelta(days=1)
+    return target.timestamp()
+
+def run_stop_time(run_limit):
+    # 実行が終わるループ（単調）時間。制限なしなら None
+    if run_limit is None:
+        return None
+    mode, value = run_limit
+    now = asyncio.get_running_loop().time()
+    if mode == "duration":
+        return now + value
+    # 実時間の時計は一度だけ読むので、後で時計を変えても終了時刻は動かない
+    return now + value - time.time()
+
+class MacroFileWatcher:
+    # inotify でマクロファイルを監視し、使えない場合は mtime ポーリングに切り替え
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+
+    def __init__(self, path, on_change, engine):
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.engine = engine
+        self.signature = self.get_signature()
+        self.future = None
+
+    def start(self):
+        self.future = self.engine.submit(self.run())
+
+    def stop(self):
+        if self.future:
+            self.future.cancel()
+
+    def get_signature(self):
+        return get_file_signature(self.path)
+
+    def mark_current(self):
+        self.signature = self.get_signature()
+
+    async def check(self):
+        signature = self.get_signature()
+        if signature is not None and signature != self.signature:
+            self.signature = signature
+            # 実行中のマクロのタイミングを崩さないようイベントループの外で解析
+            await asyncio.get_running_loop().run_in_executor(None, self.on_change, self.path)
+
+    def open_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        # エディタは一時ファイルとリネームで保存することが多いため、ディレクトリを監視
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(os.path.dirname(self.path)), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    async def run(self):
+        fd = self.open_inotify()
+        if fd is None:
+            while True:
+                await asyncio.sleep(WATCH_POLL_INTERVAL)
+                await self.check()
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        def on_readable():
+            try:
+                os.read(fd, 65536)
+            except BlockingIOError:
+                pass
+            changed.set()
+        loop.add_reader(fd, on_readable)
+        try:
+            while True:
+                await changed.wait()
+                changed.clear()
+                await self.check()
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
+
 class ManualMacroGUI(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("BLOUplanet's Macro - キーボード/マウスマクロプログラム")
-        self.geometry("800x900")
-        self.resizable(False, False)
+        self.geometry(f"{WINDOW_WIDTH}x{WINDOW_HEIGHT}")
+        self.resizable(False, True)
         self.configure(bg=BG_COLOR)
+        # 他スレッドからの更新はすべてここを通る
+        self.ui = UIDispatcher(self, self.write_log)
+        self.click_capture = ClickCapture(self.ui.post)
+        self.screen = ScreenSampler()
+        load_plugins(self.log)
         
         # マクロコマンド関連変数
         self.commands = []  # マクロコマンドを保存するリスト
+        self.compiled_tracks = None      # キャッシュから読み込んだ self.commands のコンパイル結果
         self.macro_running = False
+        self.overlap_policy = "ignore"   # OVERLAP_POLICIES のいずれか
+        self.editor_program = None       # 実行中のエディタマクロのコンパイル済みプログラム
+        self.generated_code = {}         # 生成したトラック関数のファクトリ（コマンドリストのハッシュごと）
+        self.macro_path = None           # 最後に読み込み/保存したマクロファイルのパス
+        self.macro_watcher = None
+        self.recent_macros = []          # 最近使ったマクロファイル(新しい順)
+        self.screen_size = (self.winfo_screenwidth(), self.winfo_screenheight())  # 実行のたびに更新
+        self.macro_screen = self.screen_size  # エディタのマクロ座標の基準となる画面サイズ
         self.drag_original_index = None  # ドラッグ開始時の項目インデックス
         self.dragged_command = None      # ドラッグ開始時に選択されたコマンドオブジェクト
         self.ghost = None                # ドラッグ中に表示する半透明のゴースト
@@ -46,6 +1040,9 @@ class ManualMacroGUI(tk.Tk):
         self.action_recording = False
         self.recorded_commands = []      # 動作記録から生成されたコマンド
         self.last_record_time = 0
+        self.record_modifiers = []       # 押されている修飾キーの名前（押した順）
+        self.record_chord_modifiers = set()  # コード（同時押し）の一部として記録済みの修飾キー。離しても何も記録しない
+        self.record_chord_keys = set()       # 押した時点で記録したキーの名前。離しても何も記録しない
         self.action_keyboard_listener = None
         self.action_mouse_listener = None
 
@@ -53,11 +1050,29 @@ class ManualMacroGUI(tk.Tk):
         self.action_start_hotkey_var = tk.StringVar(value="f4")
         self.action_stop_hotkey_var = tk.StringVar(value="f5")
         
+        # マクロライブラリ: 名前 -> 専用のホットキーと実行を持つ読み込み済みマクロ
+        self.macro_library = {}
+        self.library_names = []          # リスト順のライブラリ名
+        
         # 背景クリック時のフォーカス解除
         self.bind_all("<Button-1>", self.clear_focus, add="+")
         
+        # 以下はすべてスクロールするキャンバスに入れるので、一番高いコマンドフォームでも低い画面に収まる
+        self.canvas_main = tk.Canvas(self, bg=BG_COLOR, highlightthickness=0)
+        self.scrollbar_main = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.canvas_main.yview)
+        self.canvas_main.config(yscrollcommand=self.scrollbar_main.set)
+        self.scrollbar_main.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas_main.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.frame_main = tk.Frame(self.canvas_main, bg=BG_COLOR)
+        main_window = self.canvas_main.create_window(0, 0, window=self.frame_main, anchor="nw")
+        self.frame_main.bind("<Configure>", lambda event: self.canvas_main.config(scrollregion=self.canvas_main.bbox("all")))
+        self.canvas_main.bind("<Configure>", lambda event: self.canvas_main.itemconfigure(main_window, width=event.width))
+        self.bind_all("<MouseWheel>", self.on_main_wheel, add="+")
+        self.bind_all("<Button-4>", self.on_main_wheel, add="+")
+        self.bind_all("<Button-5>", self.on_main_wheel, add="+")
+        
         # --- コマンド一覧領域 ---
-        self.frame_list = tk.Frame(self, bg=FRAME_BG)
+        self.frame_list = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_list.pack(padx=10, pady=5, fill=tk.BOTH, expand=True)
         
         self.listbox = tk.Listbox(self.frame_list, width=80, height=10, bg=LISTBOX_BG, fg=LISTBOX_FG,
@@ -74,28 +1089,34 @@ class ManualMacroGUI(tk.Tk):
         self.listbox.config(yscrollcommand=self.scrollbar.set)
         
         # --- コマンド追加用エディター領域 ---
-        self.frame_editor = tk.Frame(self, bg=FRAME_BG)
+        self.frame_editor = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_editor.pack(padx=10, pady=5, fill=tk.X)
         tk.Label(self.frame_editor, text="コマンド種類:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
             .grid(row=0, column=0, padx=5, pady=5)
-        self.command_type_var = tk.StringVar(value="キータップ")
+        self.command_type_var = tk.StringVar(value=OPCODES[0].label)
         self.option_menu = tk.OptionMenu(self.frame_editor, self.command_type_var,
-                                         "キータップ", "待機", "マウスクリック", "キー押下", "マウス押下", "マウススクロール",
-                                         command=self.update_param_fields)
+                                         *COMMAND_TYPES, command=self.update_param_fields)
         self.option_menu.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
         self.option_menu["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
         self.option_menu.grid(row=0, column=1, padx=5, pady=5)
+        # 入力欄はエディタ全幅の専用の行に置き、長いフォームが切れないようにする
+        self.frame_editor.columnconfigure(2, weight=1)
         self.frame_params = tk.Frame(self.frame_editor, bg=FRAME_BG)
-        self.frame_params.grid(row=0, column=2, padx=5, pady=5)
+        self.frame_params.grid(row=1, column=0, columnspan=3, padx=5, pady=5, sticky="w")
         self.param_entries = {}
-        self.update_param_fields("キータップ")
+        self.update_param_fields(OPCODES[0].label)
+        tk.Label(self.frame_editor, text="トラック:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .grid(row=2, column=0, padx=5, pady=5)
+        self.entry_track = tk.Entry(self.frame_editor, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_track.insert(0, "0")
+        self.entry_track.grid(row=2, column=1, padx=5, pady=5, sticky="w")
         self.button_add = tk.Button(self.frame_editor, text="コマンド追加", command=self.add_command,
                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
                                     activebackground=BUTTON_ACTIVE_BG)
-        self.button_add.grid(row=0, column=3, padx=5, pady=5)
+        self.button_add.grid(row=2, column=2, padx=5, pady=5, sticky="w")
         
         # --- 制御ボタン領域 ---
-        self.frame_controls = tk.Frame(self, bg=FRAME_BG)
+        self.frame_controls = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_controls.pack(padx=10, pady=5, fill=tk.X)
         # 上段: 選択したコマンド削除, マクロ実行, マクロ停止
         self.frame_controls_top = tk.Frame(self.frame_controls, bg=FRAME_BG)
@@ -112,6 +1133,14 @@ class ManualMacroGUI(tk.Tk):
                                      bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
                                      activebackground=BUTTON_ACTIVE_BG)
         self.button_stop.pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Label(self.frame_controls_top, text="実行中の再トリガー:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.overlap_policy_var = tk.StringVar(value=self.overlap_policy)
+        self.option_overlap_policy = tk.OptionMenu(self.frame_controls_top, self.overlap_policy_var, *OVERLAP_POLICIES,
+                                                   command=self.set_overlap_policy)
+        self.option_overlap_policy.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
+        self.option_overlap_policy["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+        self.option_overlap_policy.pack(side=tk.LEFT, padx=5, pady=5)
         # 下段: マクロ保存, マクロ読み込み, 繰り返し回数
         self.frame_controls_bottom = tk.Frame(self.frame_controls, bg=FRAME_BG)
         self.frame_controls_bottom.pack(fill=tk.X, pady=(5,0))
@@ -123,14 +1152,76 @@ class ManualMacroGUI(tk.Tk):
                                      bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
                                      activebackground=BUTTON_ACTIVE_BG)
         self.button_load.pack(side=tk.LEFT, padx=5, pady=5)
+        self.menubutton_recent = tk.Menubutton(self.frame_controls_bottom, text="最近", bg=BUTTON_BG, fg=BUTTON_FG,
+                                               font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG)
+        self.menu_recent = tk.Menu(self.menubutton_recent, tearoff=0, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+        self.menubutton_recent.config(menu=self.menu_recent)
+        self.menubutton_recent.pack(side=tk.LEFT, padx=5, pady=5)
+        self.watch_file_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.frame_controls_bottom, text="自動再読み込み", variable=self.watch_file_var,
+                       command=self.update_macro_watcher, bg=BG_COLOR, fg=LABEL_FG, font=FONT,
+                       selectcolor=ENTRY_BG, activebackground=BG_COLOR, activeforeground=LABEL_FG)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
         tk.Label(self.frame_controls_bottom, text="繰り返し回数 (0:無限):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
             .pack(side=tk.LEFT, padx=5, pady=5)
         self.entry_loop = tk.Entry(self.frame_controls_bottom, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
         self.entry_loop.insert(0, "1")
         self.entry_loop.pack(side=tk.LEFT, padx=5, pady=5)
+        self.frame_controls_run_limit = tk.Frame(self.frame_controls, bg=FRAME_BG)
+        self.frame_controls_run_limit.pack(fill=tk.X)
+        tk.Label(self.frame_controls_run_limit, text="実行制限:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.run_limit_var = tk.StringVar(value="none")
+        self.option_run_limit = tk.OptionMenu(self.frame_controls_run_limit, self.run_limit_var, *RUN_LIMITS)
+        self.option_run_limit.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
+        self.option_run_limit["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+        self.option_run_limit.pack(side=tk.LEFT, padx=5, pady=5)
+        # "2h" や "1:30:00" のような時間、または "17:00" のような時刻
+        self.entry_run_limit = tk.Entry(self.frame_controls_run_limit, width=8, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_run_limit.pack(side=tk.LEFT, padx=5, pady=5)
+        # トラックごとの繰り返し回数。例: "1:0, 2:3"(未指定のトラックは上の回数を使用)
+        self.frame_controls_tracks = tk.Frame(self.frame_controls, bg=FRAME_BG)
+        self.frame_controls_tracks.pack(fill=tk.X)
+        tk.Label(self.frame_controls_tracks, text="トラック別繰り返し (トラック:回数):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_track_loops = tk.Entry(self.frame_controls_tracks, width=20, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_track_loops.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_disassemble = tk.Button(self.frame_controls_tracks, text="バイトコード表示", command=self.show_disassembly,
+                                            bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                            activebackground=BUTTON_ACTIVE_BG)
+        self.button_disassemble.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_analyze = tk.Button(self.frame_controls_tracks, text="分析", command=self.show_analysis,
+                                        bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                        activebackground=BUTTON_ACTIVE_BG)
+        self.button_analyze.pack(side=tk.LEFT, padx=5, pady=5)
+        self.frame_controls_humanize = tk.Frame(self.frame_controls, bg=FRAME_BG)
+        self.frame_controls_humanize.pack(fill=tk.X)
+        self.humanize_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.frame_controls_humanize, text="人間らしく", variable=self.humanize_var,
+                       bg=BG_COLOR, fg=LABEL_FG, font=FONT,
+                       selectcolor=ENTRY_BG, activebackground=BG_COLOR, activeforeground=LABEL_FG)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Label(self.frame_controls_humanize, text="揺らぎ (%):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_jitter = tk.Entry(self.frame_controls_humanize, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_jitter.insert(0, "10")
+        self.entry_jitter.pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Label(self.frame_controls_humanize, text="シード (空 = ランダム):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_seed = tk.Entry(self.frame_controls_humanize, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_seed.pack(side=tk.LEFT, padx=5, pady=5)
+        self.frame_controls_speed = tk.Frame(self.frame_controls, bg=FRAME_BG)
+        self.frame_controls_speed.pack(fill=tk.X)
+        tk.Label(self.frame_controls_speed, text="速度:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.speed_var = tk.StringVar(value="1x")
+        self.option_speed = tk.OptionMenu(self.frame_controls_speed, self.speed_var, *SPEEDS, command=self.set_speed)
+        self.option_speed.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
+        self.option_speed["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+        self.option_speed.pack(side=tk.LEFT, padx=5, pady=5)
         
         # --- 既存ショートカットキー設定領域 ---
-        self.frame_hotkeys = tk.Frame(self, bg=FRAME_BG)
+        self.frame_hotkeys = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_hotkeys.pack(padx=10, pady=5, fill=tk.X)
         tk.Label(self.frame_hotkeys, text="マクロ実行ショートカットキー:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
             .pack(side=tk.LEFT, padx=5, pady=5)
@@ -148,9 +1239,22 @@ class ManualMacroGUI(tk.Tk):
                                               bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
                                               activebackground=BUTTON_ACTIVE_BG)
         self.button_apply_hotkeys.pack(side=tk.LEFT, padx=5, pady=5)
+        # 速度ホットキーは専用の行に置く。上のショートカットキー適用でこれらも適用される
+        self.frame_speed_hotkeys = tk.Frame(self.frame_main, bg=FRAME_BG)
+        self.frame_speed_hotkeys.pack(padx=10, pady=5, fill=tk.X)
+        tk.Label(self.frame_speed_hotkeys, text="速度ショートカットキー (遅く/速く):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.slower_hotkey_var = tk.StringVar(value="f6")
+        self.entry_slower_hotkey = tk.Entry(self.frame_speed_hotkeys, textvariable=self.slower_hotkey_var,
+                                            width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_slower_hotkey.pack(side=tk.LEFT, padx=5, pady=5)
+        self.faster_hotkey_var = tk.StringVar(value="f7")
+        self.entry_faster_hotkey = tk.Entry(self.frame_speed_hotkeys, textvariable=self.faster_hotkey_var,
+                                            width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_faster_hotkey.pack(side=tk.LEFT, padx=5, pady=5)
         
         # --- 動作記録領域 ---
-        self.frame_action_record = tk.Frame(self, bg=FRAME_BG)
+        self.frame_action_record = tk.Frame(self.frame_main, bg=FRAME_BG)
         self.frame_action_record.pack(padx=10, pady=5, fill=tk.X)
         tk.Label(self.frame_action_record, text="動作記録ショートカットキー (開始/終了):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
             .pack(side=tk.LEFT, padx=5, pady=5)
@@ -165,15 +1269,68 @@ class ManualMacroGUI(tk.Tk):
                                                  activebackground=BUTTON_ACTIVE_BG)
         self.button_toggle_recording.pack(side=tk.LEFT, padx=5, pady=5)
         
+        # --- マクロライブラリ領域 ---
+        self.frame_library = tk.Frame(self.frame_main, bg=FRAME_BG)
+        self.frame_library.pack(padx=10, pady=5, fill=tk.X)
+        self.listbox_library = tk.Listbox(self.frame_library, width=80, height=4, bg=LISTBOX_BG, fg=LISTBOX_FG,
+                                          font=FONT, selectbackground=BUTTON_BG, selectforeground="white", relief=tk.FLAT,
+                                          exportselection=False)
+        self.listbox_library.pack(fill=tk.X)
+        self.frame_library_add = tk.Frame(self.frame_library, bg=FRAME_BG)
+        self.frame_library_add.pack(fill=tk.X)
+        tk.Label(self.frame_library_add, text="ライブラリ名:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_library_name = tk.Entry(self.frame_library_add, width=12, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_library_name.pack(side=tk.LEFT, padx=5, pady=5)
+        tk.Label(self.frame_library_add, text="ホットキー:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .pack(side=tk.LEFT, padx=5, pady=5)
+        self.entry_library_hotkey = tk.Entry(self.frame_library_add, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        self.entry_library_hotkey.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_add = tk.Button(self.frame_library_add, text="現在のマクロを追加", command=self.add_library_macro,
+                                            bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                            activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_add.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_add_file = tk.Button(self.frame_library_add, text="ファイルから追加", command=self.add_library_file,
+                                                 bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                                 activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_add_file.pack(side=tk.LEFT, padx=5, pady=5)
+        self.frame_library_controls = tk.Frame(self.frame_library, bg=FRAME_BG)
+        self.frame_library_controls.pack(fill=tk.X)
+        self.button_library_run = tk.Button(self.frame_library_controls, text="実行", command=self.play_selected_library_macro,
+                                            bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                            activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_run.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_stop = tk.Button(self.frame_library_controls, text="停止", command=self.stop_selected_library_macro,
+                                             bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                             activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_stop.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_open = tk.Button(self.frame_library_controls, text="エディタで開く", command=self.open_library_macro,
+                                             bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                             activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_open.pack(side=tk.LEFT, padx=5, pady=5)
+        self.button_library_remove = tk.Button(self.frame_library_controls, text="削除", command=self.remove_library_macro,
+                                               bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                                               activebackground=BUTTON_ACTIVE_BG)
+        self.button_library_remove.pack(side=tk.LEFT, padx=5, pady=5)
+        
         # --- ログ出力領域 ---
-        self.text_log = tk.Text(self, height=10, width=90, state=tk.NORMAL, bg=LISTBOX_BG, fg=LISTBOX_FG,
+        self.text_log = tk.Text(self.frame_main, height=10, width=90, state=tk.NORMAL, bg=LISTBOX_BG, fg=LISTBOX_FG,
                                 font=FONT, relief=tk.FLAT)
         self.text_log.pack(padx=10, pady=5)
         
-        self.keyboard_controller = keyboard.Controller()
-        self.mouse_controller = mouse.Controller()
+        # 再生スレッドはここで一度だけ用意し、各実行はワーカーへの要求になる
+        self.engine = PlaybackEngine()
+        self.engine.start()
+        self.keyboard_controller = TrackedKeyboardController(self.engine.held)
+        self.mouse_controller = TrackedMouseController(self.engine.held)
+        self.editor_worker = PlaybackWorker(self.engine, self.get_overlap_policy, self.log,
+                                            lambda: self.ui.post(self.finish_macro_run))
         
         self.hotkey_listener = None
+        self.restore_session()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.on_close())
+        self.ui.start()
         self.after(100, self.start_hotkey_listener)
         
     # フォーカス解除
@@ -181,224 +1338,196 @@ class ManualMacroGUI(tk.Tk):
         if not isinstance(event.widget, (tk.Entry, tk.Text)):
             self.focus_set()
             
+    def on_main_wheel(self, event):
+        # リストとログは自分でスクロールし、他のウィンドウは自分のホイール操作を保つ
+        widget = event.widget
+        if not isinstance(widget, tk.Misc) or isinstance(widget, (tk.Listbox, tk.Text)) or widget.winfo_toplevel() is not self:
+            return
+        if event.num == 4 or event.delta > 0:
+            self.canvas_main.yview_scroll(-1, "units")
+        elif event.num == 5 or event.delta < 0:
+            self.canvas_main.yview_scroll(1, "units")
+            
     def log(self, message):
-        self.text_log.insert(tk.END, message + "\n")
-        self.text_log.see(tk.END)
+        # どのスレッドからでも呼び出せる
         print(message)
+        self.ui.log(message)
+        
+    def write_log(self, text):
+        self.text_log.insert(tk.END, text)
+        self.text_log.see(tk.END)
         
     def update_param_fields(self, command_type):
         for widget in self.frame_params.winfo_children():
             widget.destroy()
         self.param_entries.clear()
-        if command_type == "キータップ":
-            tk.Label(self.frame_params, text="キー:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_key = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_key.grid(row=0, column=1, padx=5, pady=2)
-            def on_key_press(event):
-                entry_key.delete(0, tk.END)
-                entry_key.insert(0, event.keysym)
-                return "break"
-            entry_key.bind("<Key>", on_key_press)
-            self.param_entries["key"] = entry_key
-            tk.Label(self.frame_params, text="繰り返し回数:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=2)
-            entry_repeat = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_repeat.insert(0, "1")
-            entry_repeat.grid(row=1, column=1, padx=5, pady=2)
-            self.param_entries["repeat"] = entry_repeat
-        elif command_type == "待機":
-            tk.Label(self.frame_params, text="待機時間(秒):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_duration = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.grid(row=0, column=1, padx=5, pady=2)
-            self.param_entries["duration"] = entry_duration
-        elif command_type == "マウスクリック":
-            tk.Label(self.frame_params, text="X:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_x = tk.Entry(self.frame_params, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_x.grid(row=0, column=1, padx=5, pady=2)
-            self.param_entries["x"] = entry_x
-            tk.Label(self.frame_params, text="Y:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=2)
-            entry_y = tk.Entry(self.frame_params, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_y.grid(row=0, column=3, padx=5, pady=2)
-            self.param_entries["y"] = entry_y
-            tk.Label(self.frame_params, text="ボタン:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=4, padx=5, pady=2)
-            self.mouse_button_var = tk.StringVar(value="left")
-            option_button = tk.OptionMenu(self.frame_params, self.mouse_button_var, "left", "right", "middle")
-            option_button.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
-            option_button["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
-            option_button.grid(row=0, column=5, padx=5, pady=2)
-            self.param_entries["button"] = self.mouse_button_var
-            # "マウス位置記録" ボタンを新しい行に配置
-            self.button_record_mouse = tk.Button(self.frame_params, text="マウス位置記録", command=self.record_mouse_position,
-                                                 bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
-                                                 activebackground=BUTTON_ACTIVE_BG)
-            self.button_record_mouse.grid(row=1, column=0, columnspan=6, padx=5, pady=2, sticky="w")
-        elif command_type == "キー押下":
-            tk.Label(self.frame_params, text="キー:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_key = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_key.grid(row=0, column=1, padx=5, pady=2)
-            def on_key_press(event):
-                entry_key.delete(0, tk.END)
-                entry_key.insert(0, event.keysym)
-                return "break"
-            entry_key.bind("<Key>", on_key_press)
-            self.param_entries["key"] = entry_key
-            tk.Label(self.frame_params, text="押下時間(秒):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=2)
-            entry_duration = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, "1")
-            entry_duration.grid(row=1, column=1, padx=5, pady=2)
-            self.param_entries["duration"] = entry_duration
-        elif command_type == "マウス押下":
-            # 1行目: X, Y, ボタン
-            tk.Label(self.frame_params, text="X:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_x = tk.Entry(self.frame_params, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_x.grid(row=0, column=1, padx=5, pady=2)
-            self.param_entries["x"] = entry_x
-            tk.Label(self.frame_params, text="Y:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=2)
-            entry_y = tk.Entry(self.frame_params, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_y.grid(row=0, column=3, padx=5, pady=2)
-            self.param_entries["y"] = entry_y
-            tk.Label(self.frame_params, text="ボタン:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=4, padx=5, pady=2)
-            self.mouse_button_var = tk.StringVar(value="left")
-            option_button = tk.OptionMenu(self.frame_params, self.mouse_button_var, "left", "right", "middle")
-            option_button.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
-            option_button["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
-            option_button.grid(row=0, column=5, padx=5, pady=2)
-            self.param_entries["button"] = self.mouse_button_var
-            # 2行目: 押下時間とマウス位置記録ボタン
-            tk.Label(self.frame_params, text="押下時間(秒):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=2)
-            entry_duration = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, "1")
-            entry_duration.grid(row=1, column=1, padx=5, pady=2)
-            self.param_entries["duration"] = entry_duration
-            self.button_record_mouse = tk.Button(self.frame_params, text="マウス位置記録", command=self.record_mouse_position,
-                                                 bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
-                                                 activebackground=BUTTON_ACTIVE_BG)
-            self.button_record_mouse.grid(row=1, column=2, columnspan=4, padx=5, pady=2, sticky="w")
-        elif command_type == "マウススクロール":
-            tk.Label(self.frame_params, text="水平スクロール:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=2)
-            entry_dx = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_dx.insert(0, "0")
-            entry_dx.grid(row=0, column=1, padx=5, pady=2)
-            self.param_entries["dx"] = entry_dx
-            tk.Label(self.frame_params, text="垂直スクロール:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=2)
-            entry_dy = tk.Entry(self.frame_params, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_dy.insert(0, "0")
-            entry_dy.grid(row=0, column=3, padx=5, pady=2)
-            self.param_entries["dy"] = entry_dy
-
-    def record_mouse_position(self):
-        self.button_record_mouse.config(text="左クリックしてマウス位置記録完了", state=tk.DISABLED)
+        self.param_entries.update(self.build_command_fields(self.frame_params, COMMAND_TYPES[command_type], {}, 2))
+            
+    def build_command_fields(self, parent, opcode, cmd, pady):
+        # エディター欄と編集ウィンドウで共用。フィールドキーごとの入力欄/変数を返す
+        entries = {}
+        for i, field in enumerate(opcode.fields):
+            key, text, default = field[:3]
+            # 1行にラベルと入力欄を2組までにして、最も幅の広いフォームもウィンドウに収める
+            row, column = divmod(i, 2)
+            tk.Label(parent, text=text, bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+                .grid(row=row, column=column * 2, padx=5, pady=pady)
+            value = str(cmd.get(key, default))
+            if len(field) > 3:
+                # 固定の選択肢（例: マウスボタンやイージング）
+                entries[key] = tk.StringVar(value=value)
+                option = tk.OptionMenu(parent, entries[key], *field[3])
+                option.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
+                option["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
+                option.grid(row=row, column=column * 2 + 1, padx=5, pady=pady)
+            else:
+                entries[key] = tk.Entry(parent, width=30 if key in ("file", "text") else 8, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+                entries[key].insert(0, value)
+                entries[key].grid(row=row, column=column * 2 + 1, padx=5, pady=pady)
+                if key == "key":
+                    entries[key].bind("<Key>", lambda event, entry=entries[key]: self.capture_key(entry, event))
+        # 補助ボタンはフィールドの下の行に置き、コマンドが持つフィールドで選ぶ
+        buttons = []
+        # 画面コマンドの位置はマクロの画面基準で保存し、画像領域はそのまま保存する
+        scale = opcode.name in POSITION_COMMANDS
+        pairs = POSITION_COMMANDS.get(opcode.name, (("x", "y"),) if "x" in entries else ())
+        for fields, text in zip(pairs, ("マウス位置記録", "終了位置を記録")):
+            button = tk.Button(parent, text=text, bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
+                               activebackground=BUTTON_ACTIVE_BG)
+            button.config(command=lambda button=button, fields=fields: self.record_position(button, entries, fields, scale))
+            buttons.append(button)
+        if "width" in entries and "height" in entries:
+            # 保存まで変数に保持し、キャンセル時はコマンドを変更しない
+            entries["template"] = tk.StringVar(value=cmd.get("template", ""))
+            buttons.append(tk.Button(parent, text="テンプレート取得", command=lambda: self.capture_template(entries, parent),
+                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG))
+        if "color" in entries:
+            buttons.append(tk.Button(parent, text="色を取得", command=lambda: self.capture_color(entries, parent),
+                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG))
+        if "file" in entries:
+            buttons.append(tk.Button(parent, text="参照", command=lambda: self.browse_macro_file(entries["file"]),
+                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG))
+        if "text" in entries:
+            # 長い文や複数行の文は入力欄に打つよりファイルから読み込む方が楽
+            buttons.append(tk.Button(parent, text="テキストファイル読込", command=lambda: self.load_text_file(entries["text"], parent),
+                                     bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG))
+        row = (len(opcode.fields) + 1) // 2
+        for i, button in enumerate(buttons):
+            button.grid(row=row, column=i * 2, columnspan=2, padx=5, pady=pady, sticky="w")
+        return entries
+        
+    def capture_key(self, entry, event):
+        # キーフィールドには入力文字ではなく押されたキーの名前が入る
+        entry.delete(0, tk.END)
+        entry.insert(0, event.keysym)
+        return "break"
+        
+    def record_position(self, button, entries, fields, scale):
+        text = button.cget("text")
+        button.config(text="左クリックしてマウス位置記録完了", state=tk.DISABLED)
         self.log("マウス位置記録待機中... 左クリックで記録完了します。")
-        def on_click(x, y, button, pressed):
-            if button == mouse.Button.left and pressed:
-                self.after(0, lambda: self.set_mouse_position(x, y))
-                return False
-        listener = mouse.Listener(on_click=on_click)
-        listener.start()
-        
-    def set_mouse_position(self, x, y):
-        if "x" in self.param_entries:
-            self.param_entries["x"].delete(0, tk.END)
-            self.param_entries["x"].insert(0, str(int(x)))
-        if "y" in self.param_entries:
-            self.param_entries["y"].delete(0, tk.END)
-            self.param_entries["y"].insert(0, str(int(y)))
-        self.log(f"マウス位置記録完了: ({int(x)}, {int(y)})")
-        self.button_record_mouse.config(text="マウス位置記録", state=tk.NORMAL)
+        def set_position(position):
+            # 別の取得要求に引き継がれた場合 position は None
+            if not button.winfo_exists():
+                return
+            if position is not None:
+                x, y = self.to_macro_position(*position) if scale else position
+                for name, value in zip(fields, (x, y)):
+                    entries[name].delete(0, tk.END)
+                    entries[name].insert(0, str(value))
+                self.log(f"マウス位置記録完了: ({x}, {y})")
+            button.config(text=text, state=tk.NORMAL)
+        self.click_capture.capture(set_position)
+        
+    def capture_color(self, entries, parent):
+        if not self.screen.available():
+            messagebox.showerror("エラー", "画像コマンドには numpy と mss パッケージが必要です。", parent=parent)
+            return
+        try:
+            x = int(entries["x"].get().strip())
+            y = int(entries["y"].get().strip())
+        except ValueError:
+            messagebox.showerror("エラー", "有効な整数のX, Y値を入力してください。", parent=parent)
+            return
+        try:
+            red, green, blue = (int(value) for value in self.screen.capture(x, y, 1, 1)[0, 0])
+        except Exception as e:
+            messagebox.showerror("エラー", "画面の取得に失敗しました: " + str(e), parent=parent)
+            return
+        color = f"#{red:02x}{green:02x}{blue:02x}"
+        entries["color"].delete(0, tk.END)
+        entries["color"].insert(0, color)
+        self.log(f"色を取得しました: {color} ({x}, {y})")
+        
+    def browse_macro_file(self, entry):
+        file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
+        if file_path:
+            entry.delete(0, tk.END)
+            entry.insert(0, file_path)
+            
+    def load_text_file(self, entry, parent):
+        file_path = filedialog.askopenfilename(filetypes=[("Text files", "*.txt"), ("All files", "*")])
+        if not file_path:
+            return
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror("エラー", "テキストファイルの読み込みに失敗しました: " + str(e), parent=parent)
+            return
+        entry.delete(0, tk.END)
+        entry.insert(0, text)
+        
+    def read_command_fields(self, entries):
+        # フィールドキーごとの入力文字列。入力・貼り付けする文は前後の空白を残す
+        return {key: widget.get() if key == "text" else widget.get().strip() for key, widget in entries.items()}
+        
+    def capture_template(self, entries, parent):
+        if not self.screen.available():
+            messagebox.showerror("エラー", "画像コマンドには numpy と mss パッケージが必要です。", parent=parent)
+            return
+        try:
+            x = int(entries["x"].get().strip())
+            y = int(entries["y"].get().strip())
+            width = int(entries["width"].get().strip())
+            height = int(entries["height"].get().strip())
+            if width <= 0 or height <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("エラー", "有効な整数の X, Y, 幅, 高さを入力してください。", parent=parent)
+            return
+        try:
+            image = self.screen.capture(x, y, width, height)
+        except Exception as e:
+            messagebox.showerror("エラー", "画面の取得に失敗しました: " + str(e), parent=parent)
+            return
+        entries["template"].set(encode_template(image))
+        self.log(f"テンプレート取得完了: {width}x{height} 位置 ({x}, {y})")
+        if np.ptp(to_gray(image)) == 0:
+            self.log("テンプレートは単色です。模様ではなく色調で探します。")
         
     def add_command(self):
         command_type = self.command_type_var.get()
-        if command_type == "キータップ":
-            key = self.param_entries["key"].get().strip()
-            if key == "":
-                messagebox.showerror("エラー", "キー値を入力してください。")
-                return
-            try:
-                repeat = int(self.param_entries["repeat"].get().strip())
-            except ValueError:
-                messagebox.showerror("エラー", "有効な繰り返し回数を入力してください。")
-                return
-            cmd = {"command": "key_tap", "key": key, "repeat": repeat}
-            display_text = f"キータップ: {key} x {repeat}回"
-        elif command_type == "待機":
-            try:
-                duration = float(self.param_entries["duration"].get().strip())
-            except ValueError:
-                messagebox.showerror("エラー", "有効な待機時間を入力してください。")
-                return
-            cmd = {"command": "wait", "duration": duration}
-            display_text = f"待機: {duration}秒"
-        elif command_type == "マウスクリック":
-            x_str = self.param_entries["x"].get().strip()
-            y_str = self.param_entries["y"].get().strip()
-            if not x_str or not y_str:
-                messagebox.showerror("エラー", "X, Y値を入力してください。")
-                return
-            try:
-                x = int(x_str)
-                y = int(y_str)
-            except ValueError:
-                messagebox.showerror("エラー", "有効な整数のX, Y値を入力してください。")
-                return
-            button = self.param_entries["button"].get()
-            cmd = {"command": "mouse_click", "x": x, "y": y, "button": button}
-            display_text = f"マウスクリック: ({x}, {y}), ボタン: {button}"
-        elif command_type == "キー押下":
-            key = self.param_entries["key"].get().strip()
-            if key == "":
-                messagebox.showerror("エラー", "キー値を入力してください。")
-                return
-            try:
-                duration = float(self.param_entries["duration"].get().strip())
-            except ValueError:
-                messagebox.showerror("エラー", "有効な押下時間を入力してください。")
-                return
-            cmd = {"command": "key_hold", "key": key, "duration": duration}
-            display_text = f"キー押下: {key} (押下時間: {duration}秒)"
-        elif command_type == "マウス押下":
-            x_str = self.param_entries["x"].get().strip()
-            y_str = self.param_entries["y"].get().strip()
-            if not x_str or not y_str:
-                messagebox.showerror("エラー", "X, Y値を入力してください。")
-                return
-            try:
-                x = int(x_str)
-                y = int(y_str)
-            except ValueError:
-                messagebox.showerror("エラー", "有効な整数のX, Y値を入力してください。")
-                return
-            button = self.param_entries["button"].get()
-            try:
-                duration = float(self.param_entries["duration"].get().strip())
-            except ValueError:
-                messagebox.showerror("エラー", "有効な押下時間を入力してください。")
-                return
-            cmd = {"command": "mouse_hold", "x": x, "y": y, "button": button, "duration": duration}
-            display_text = f"マウス押下: ({x}, {y}), ボタン: {button} (押下時間: {duration}秒)"
-        elif command_type == "マウススクロール":
-            try:
-                dx = int(self.param_entries["dx"].get().strip())
-                dy = int(self.param_entries["dy"].get().strip())
-            except ValueError:
-                messagebox.showerror("エラー", "有効なスクロール値を入力してください。")
-                return
-            cmd = {"command": "mouse_scroll", "dx": dx, "dy": dy}
-            display_text = f"マウススクロール: 水平 {dx}, 垂直 {dy}"
-        else:
+        try:
+            track = int(self.entry_track.get().strip())
+            if track < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("エラー", "有効なトラック番号を入力してください。")
+            return
+        opcode = COMMAND_TYPES.get(command_type)
+        if opcode is None:
+            return
+        values = self.read_command_fields(self.param_entries)
+        try:
+            cmd = {"command": opcode.name, **opcode.parse(values)}
+        except ValueError as e:
+            messagebox.showerror("エラー", str(e))
             return
+        display_text = self.format_command(cmd)
+        if track:
+            cmd["track"] = track
+            display_text = self.get_display_text(cmd)
         
         selected = self.listbox.curselection()
         if selected:
@@ -408,6 +1537,7 @@ class ManualMacroGUI(tk.Tk):
         else:
             self.commands.append(cmd)
             self.listbox.insert(tk.END, display_text)
+        self.compiled_tracks = None
         self.log("コマンド追加済み: " + display_text)
         
     def remove_command(self):
@@ -418,6 +1548,7 @@ class ManualMacroGUI(tk.Tk):
         index = selected[0]
         self.listbox.delete(index)
         removed = self.commands.pop(index)
+        self.compiled_tracks = None
         self.log("コマンド削除済み: " + str(removed))
         
     def play_macro(self):
@@ -429,98 +1560,764 @@ class ManualMacroGUI(tk.Tk):
         except ValueError:
             messagebox.showerror("エラー", "有効な繰り返し回数を入力してください。")
             return
-        self.log("マクロ実行開始.")
+        try:
+            track_loops = self.parse_track_loops(self.entry_track_loops.get())
+        except ValueError:
+            messagebox.showerror("エラー", "トラック別繰り返しを トラック:回数 の形式で入力してください。")
+            return
+        try:
+            run_limit = self.parse_run_limit()
+        except ValueError:
+            return
+        try:
+            humanizer = self.create_humanizer()
+        except ValueError:
+            return
+        try:
+            self.compiled_tracks = self.compiled_tracks or self.compile_commands(self.commands, self.get_macro_folder())
+        except ValueError as e:
+            messagebox.showerror("エラー", "マクロのコンパイルに失敗しました: " + str(e))
+            return
+        tracks = self.compiled_tracks
+        transform = screen_transform(self.macro_screen, self.update_screen_size())
         self.macro_running = True
-        self.button_stop.config(state=tk.NORMAL)
-        thread = threading.Thread(target=self.execute_macro, args=(loop_count,))
-        thread.daemon = True
-        thread.start()
+        self.refresh_run_state()
+        self.editor_worker.request(lambda: self.execute_macro(tracks, loop_count, track_loops, transform, humanizer, run_limit))
+        
+    def parse_run_limit(self):
+        # None、("duration", 秒) または ("until", エポック秒)。不正な制限は知らせてから ValueError
+        mode = self.run_limit_var.get()
+        text = self.entry_run_limit.get()
+        try:
+            if mode == "duration":
+                return ("duration", parse_run_duration(text))
+            if mode == "until":
+                return ("until", next_clock_time(text))
+        except ValueError:
+            messagebox.showerror("エラー", "実行制限を時間 (90, 45m, 2h, 1:30:00) または時刻 (17:00) で入力してください。")
+            raise
+        return None
+        
+    def create_humanizer(self):
+        # 人間らしくがオフなら None を返す。不正な設定は報告後に ValueError を送出
+        if not self.humanize_var.get():
+            return None
+        if np is None:
+            messagebox.showerror("エラー", "人間らしくには numpy パッケージが必要です。")
+            raise ValueError("numpy is missing")
+        try:
+            jitter = float(self.entry_jitter.get().strip()) / 100
+            seed_text = self.entry_seed.get().strip()
+            seed = int(seed_text) if seed_text else int(np.random.default_rng().integers(2 ** 31))
+            if not 0 <= jitter <= 1 or seed < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("エラー", "0〜100 の揺らぎと 0 以上の整数シードを入力してください。")
+            raise
+        # 同じシードを入力してランダムな実行を再現できるようにログに残す
+        self.log(f"人間らしくのシード: {seed}")
+        return Humanizer(jitter, seed)
+        
+    def update_screen_size(self):
+        self.screen_size = (self.winfo_screenwidth(), self.winfo_screenheight())
+        return self.screen_size
+        
+    def to_macro_position(self, x, y):
+        # 現在の画面上の位置をエディタのマクロ座標系に変換する
+        return (round(x * self.macro_screen[0] / self.screen_size[0]),
+                round(y * self.macro_screen[1] / self.screen_size[1]))
+        
+    def get_overlap_policy(self):
+        return self.overlap_policy
         
-    def execute_macro(self, loop_count):
+    def set_overlap_policy(self, policy):
+        self.overlap_policy = policy
+        self.log("重複時の動作: " + policy)
+        
+    def set_speed(self, speed):
+        # 実行中のマクロはすぐに新しい速度になる。再コンパイルはしない
+        self.speed_var.set(speed)
+        self.engine.loop.call_soon_threadsafe(CLOCK.set_speed, SPEEDS[speed])
+        self.log("再生速度: " + speed)
+        
+    def step_speed(self, step):
+        speeds = list(SPEEDS)
+        index = speeds.index(self.speed_var.get()) + step
+        if 0 <= index < len(speeds):
+            self.set_speed(speeds[index])
+        
+    def parse_track_loops(self, text):
+        track_loops = {}
+        for item in text.replace(";", ",").split(","):
+            if not item.strip():
+                continue
+            track, count = item.split(":")
+            track_loops[int(track)] = int(count)
+        if any(track < 0 or count < 0 for track, count in track_loops.items()):
+            raise ValueError("negative track or loop count")
+        return track_loops
+        
+    def format_track_loops(self, track_loops):
+        return ", ".join(f"{track}:{count}" for track, count in sorted(track_loops.items()))
+        
+    def show_disassembly(self):
+        if not self.commands:
+            messagebox.showinfo("情報", "実行するコマンドがありません。")
+            return
+        try:
+            self.compiled_tracks = self.compiled_tracks or self.compile_commands(self.commands, self.get_macro_folder())
+        except ValueError as e:
+            messagebox.showerror("エラー", "マクロのコンパイルに失敗しました: " + str(e))
+            return
+        win = tk.Toplevel(self)
+        win.title("バイトコード")
+        win.configure(bg=BG_COLOR)
+        text = tk.Text(win, width=100, height=30, bg=LISTBOX_BG, fg=LISTBOX_FG, font=("Courier", 11), relief=tk.FLAT)
+        for track, code in sorted(self.compiled_tracks.items()):
+            text.insert(tk.END, f"トラック {track}: {len(code)} 命令\n")
+            text.insert(tk.END, "\n".join(code.disassemble()) + "\n\n")
+        text.config(state=tk.DISABLED)
+        text.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+        
+    def show_analysis(self):
+        if not self.commands:
+            messagebox.showinfo("情報", "実行するコマンドがありません。")
+            return
+        try:
+            # 先にコンパイルして、見積もりが推測で済ませてしまう閉じていないブロックを見つける
+            self.compiled_tracks = self.compiled_tracks or self.compile_commands(self.commands, self.get_macro_folder())
+        except ValueError as e:
+            messagebox.showerror("エラー", "マクロのコンパイルに失敗しました: " + str(e))
+            return
+        try:
+            loop_count = int(self.entry_loop.get().strip())
+            track_loops = self.parse_track_loops(self.entry_track_loops.get())
+        except ValueError:
+            messagebox.showerror("エラー", "有効な繰り返し回数と、トラック:回数 の組でトラックの繰り返し回数を入力してください。")
+            return
+        lines = describe_estimates(analyze_commands(self.commands, self.get_macro_folder()), self.speed_var.get(),
+                                   loop_count, track_loops)
+        win = tk.Toplevel(self)
+        win.title("マクロ分析")
+        win.configure(bg=BG_COLOR)
+        text = tk.Text(win, width=100, height=30, bg=LISTBOX_BG, fg=LISTBOX_FG, font=("Courier", 11), relief=tk.FLAT)
+        text.insert(tk.END, "\n".join(lines) + "\n")
+        text.config(state=tk.DISABLED)
+        text.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+        
+    def compile_commands(self, commands, folder=""):
+        # コマンドをトラックごとにまとめ、トラックごとにコンパイルする
+        grouped = {}
+        for cmd in commands:
+            grouped.setdefault(cmd.get("track", 0), []).append(cmd)
+        tracks = {}
+        for track, track_commands in grouped.items():
+            try:
+                tracks[track] = self.compile_code(track_commands, folder)
+            except ValueError as e:
+                raise ValueError(f"トラック {track}: {e}") from None
+        return tracks
+        
+    def compile_code(self, commands, folder=""):
+        # キー/ボタンを一度だけ解決し、ブロックを絶対インデックスへのジャンプに変える。
+        # ブロックの入れ子がどれだけ深くてもジャンプのコストは同じ。
+        # 相対パスの Call ファイルは folder（呼び出し元マクロのフォルダ）で探す。"" は作業ディレクトリ
+        code = Bytecode()
+        blocks = []  # 閉じていないループ開始/条件/それ以外コマンドのインデックス
+        labels = {}
+        gotos = []
+        for index, cmd in enumerate(commands):
+            name = cmd["command"]
+            number = OPCODE_NUMBERS.get(name)
+            if number is None:
+                raise ValueError(f"不明なコマンド {name} (コマンド {index + 1})")
+            resolve = OPCODES[number].resolve
+            target = resolve(cmd) if resolve else None
+            jump = -1
+            if name == "if_pixel":
+                # ブロックの後ろへのジャンプ先は それ以外 / 条件終了 で埋める
+                blocks.append(index)
+            elif name in ("loop_start", "if_variable"):
+                blocks.append(index)
+            elif name == "loop_end":
+                if not blocks or commands[blocks[-1]]["command"] != "loop_start":
+                    raise ValueError(f"ループ開始のないループ終了 (コマンド {index + 1})")
+                jump = blocks.pop()  # ループ開始へ戻る（ループ開始自体は飛ばす）
+            elif name in ("else", "end_if"):
+                opener = commands[blocks[-1]]["command"] if blocks else None
+                if opener not in (("if_pixel", "if_variable") if name == "else" else ("if_pixel", "if_variable", "else")):
+                    raise ValueError(f"条件のない{'それ以外' if name == 'else' else '条件終了'} (コマンド {index + 1})")
+                # 条件が偽ならこのコマンドの後ろへジャンプし、条件部分の終わりがそれ以外部分に入るときも同じ
+                code.args[blocks.pop()] = index + 1
+                if name == "else":
+                    blocks.append(index)
+            elif name == "label":
+                if cmd["name"] in labels:
+                    raise ValueError(f"ラベル {cmd['name']} が重複しています (コマンド {index + 1})")
+                labels[cmd["name"]] = index
+            elif name == "goto":
+                gotos.append(index)
+            elif name == "call":
+                target = os.path.abspath(os.path.join(folder, cmd["file"]))
+            code.append(number, cmd, target, jump)
+        if blocks:
+            start_name = commands[blocks[-1]]["command"]
+            raise ValueError(f"終わりのない{'ループ開始' if start_name == 'loop_start' else '条件'} (コマンド {blocks[-1] + 1})")
+        for index in gotos:
+            cmd = code.cmds[index]
+            if cmd["label"] not in labels:
+                raise ValueError(f"不明なラベル {cmd['label']} へのジャンプ (コマンド {index + 1})")
+            code.args[index] = labels[cmd["label"]]
+        return code
+        
+    async def execute_macro(self, tracks, loop_count, track_loops, transform, humanizer=None, run_limit=None):
+        self.log("マクロ実行開始.")
+        self.editor_program = {"tracks": transform_tracks(tracks, transform), "screen": self.screen_size,
+                               "humanizer": humanizer, "variables": {}, "subroutines": {},
+                               "stop_at": run_stop_time(run_limit),
+                               "loop_count": loop_count, "track_loops": track_loops}
+        try:
+            await self.run_macro(self.editor_program)
+        finally:
+            self.editor_program = None
+            self.log("マクロ実行完了.")
+                
+    def finish_macro_run(self):
+        # エディタの実行ごとに呼ばれる（停止で取り消された実行も）。その間にキューに入った要求があれば停止は有効のまま
+        if not self.editor_worker.is_busy():
+            self.macro_running = False
+            self.refresh_run_state()
+        
+    def refresh_run_state(self):
+        self.button_stop.config(state=tk.NORMAL if self.macro_running else tk.DISABLED)
+        
+    async def run_macro(self, program):
+        # 全トラックは同じ開始時刻を基準にスケジュール
+        start_time = CLOCK.now()
+        tasks = []
+        awaited = []
+        for track in sorted(program["tracks"]):
+            task = asyncio.ensure_future(self.execute_track(track, program, start_time))
+            tasks.append(task)
+            if track == 0 or get_track_loop_count(program, track) != 0:
+                awaited.append(task)
+        try:
+            # 無限トラックはメインと有限トラックと並行して動き、それらと一緒に終了
+            await asyncio.gather(*(awaited or tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+    async def execute_track(self, track, program, start_time):
+        deadline = start_time
         iteration = 0
-        while self.macro_running and (loop_count == 0 or iteration < loop_count):
-            self.log(f"繰り返し {iteration+1} 開始.")
-            for cmd in self.commands:
-                if not self.macro_running:
+        humanizer = program.get("humanizer")
+        if humanizer:
+            humanizer = humanizer.for_track(track)
+        stop_at = program.get("stop_at")
+        loop = asyncio.get_running_loop()
+        while True:
+            # 再読み込みしたマクロファイルは繰り返し回数を変えることがあり、ここで反映される
+            loop_count = get_track_loop_count(program, track)
+            if loop_count and iteration >= loop_count:
+                break
+            if stop_at is not None and loop.time() >= stop_at:
+                break
+            if track == 0:
+                self.log(f"繰り返し {iteration+1} 開始.")
+            else:
+                self.log(f"トラック {track}: 繰り返し {iteration+1} 開始.")
+            # 再読み込みしたマクロファイルは program["tracks"] を置き換え、ここで反映される
+            run = self.run_code(program["tracks"].get(track) or Bytecode(), program, deadline, humanizer)
+            if stop_at is None:
+                deadline = await run
+            else:
+                finished, deadline = await self.run_until(run, stop_at)
+                if not finished:
                     break
-                if cmd["command"] == "key_tap":
-                    key = cmd["key"]
-                    repeat = cmd.get("repeat", 1)
-                    for _ in range(repeat):
-                        if not self.macro_running:
-                            break
-                        try:
-                            key_obj = getattr(keyboard.Key, key.lower())
-                        except AttributeError:
-                            key_obj = key
-                        self.keyboard_controller.press(key_obj)
-                        self.keyboard_controller.release(key_obj)
-                        self.log(f"キータップ実行: {key}")
-                        time.sleep(0.05)
-                elif cmd["command"] == "key_hold":
+            iteration += 1
+            if track == 0:
+                self.log(f"繰り返し {iteration} 完了.")
+            else:
+                self.log(f"トラック {track}: 繰り返し {iteration} 完了.")
+            # 制御フローだけの繰り返しは待たないので、ここでエンジンスレッドを
+            # 停止や他のマクロに譲る
+            await asyncio.sleep(0)
+        if loop_count == 0 or iteration < loop_count:
+            # 繰り返し回数より前にトラックを終わらせるのは実行制限だけ
+            if track == 0:
+                self.log(f"実行制限に達しました。完了した繰り返し: {iteration} 回.")
+            else:
+                self.log(f"トラック {track}: 実行制限に達しました。完了した繰り返し: {iteration} 回.")
+        return iteration
+        
+    async def run_until(self, coro, stop_at):
+        # coro を最後まで実行するか、長い待機の途中でも stop_at（ループ時間）で取り消す。
+        # (True, 結果) または (False, None) を返す
+        task = asyncio.ensure_future(coro)
+        try:
+            await asyncio.wait([task], timeout=stop_at - asyncio.get_running_loop().time())
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.wait([task])
+        if task.cancelled():
+            return False, None
+        return True, task.result()
+        
+    async def run_code(self, code, program, deadline, humanizer, depth=0):
+        # 生成コードが高速経路。人間らしい実行とジャンプはインタプリタが担当する
+        if humanizer is None:
+            run = self.get_generated_code(code, program)
+            if run is not None:
+                return await run(deadline, depth)
+        return await self.interpret_code(code, program, deadline, humanizer, depth)
+        
+    def get_generated_code(self, code, program):
+        # コマンドリストと実行ごとに関数は 1 つなので、ハッシュはトラック再読み込み時にだけ計算される
+        generated = program.setdefault("generated", {})
+        entry = generated.get(id(code))
+        if entry is None or entry[0] is not code:
+            digest = hashlib.sha256(json.dumps(code.cmds, sort_keys=True).encode("utf-8")).hexdigest()
+            if digest not in self.generated_code:
+                if len(self.generated_code) >= MAX_CACHED_MACROS:
+                    self.generated_code.clear()
+                source = self.generate_source(code)
+                if source is None:
+                    self.generated_code[digest] = None
+                else:
+                    namespace = {"asyncio": asyncio, "sleep_until": sleep_until}
+                    exec(compile(source, f"<macro {digest[:12]}>", "exec"), namespace)
+                    self.generated_code[digest] = namespace["make"]
+            make = self.generated_code[digest]
+            run = None if make is None else make(self, program, code.targets, code.cmds)
+            entry = generated[id(code)] = (code, run)
+        return entry[1]
+        
+    def generate_source(self, code):
+        # コンパイル済みコマンドリスト 1 つ分の直線的な Python。ジャンプを使う場合は None。
+        # マクロの値は必ず repr() で書き出し、コードとしては書かない
+        head = ["def make(gui, program, targets, cmds):",
+                "    press = gui.keyboard_controller.press",
+                "    release = gui.keyboard_controller.release",
+                "    mouse = gui.mouse_controller",
+                "    click = mouse.click",
+                "    mouse_press = mouse.press",
+                "    mouse_release = mouse.release",
+                "    scroll = mouse.scroll",
+                "    log = gui.log",
+                "    execute_command = gui.execute_command",
+                "    call_macro = gui.call_macro",
+                "    set_variable = gui.set_variable",
+                "    matches = gui.screen.matches",
+                "    variables = program['variables']"]
+        body = ["    async def run(deadline, depth):"]
+        indent = "        "
+        def emit(*statements):
+            body.extend(indent + statement for statement in statements)
+        def close_block():
+            if body[-1].endswith(":"):
+                emit("pass")
+        def number(value):
+            # inf と nan の repr() は裸の名前なので、make() で一度だけ束縛する
+            if isinstance(value, float) and not math.isfinite(value):
+                constant = f"n{len(head)}"
+                head.append(f"    {constant} = float({str(value)!r})")
+                return constant
+            return repr(value)
+        for index, op in enumerate(code.ops):
+            name = OPCODES[op].name
+            cmd = code.cmds[index]
+            target = code.targets[index]
+            if target is not None:
+                head.append(f"    t{index} = targets[{index}]")
+            if name == "key_tap":
+                key = cmd["key"]
+                message = f"キータップ実行: {key}"
+                repeat = int(cmd.get("repeat", 1))
+                if repeat != 1:
+                    emit(f"for _ in range({repeat}):")
+                    indent += "    "
+                emit(f"press(t{index})", f"release(t{index})", f"log({message!r})",
+                     f"deadline += {KEY_TAP_GAP!r}", "deadline = await sleep_until(deadline)")
+                if repeat != 1:
+                    close_block()
+                    indent = indent[:-4]
+            elif name == "key_chord":
+                message = f"キーの組み合わせ実行: {cmd['keys']}"
+                emit(*(f"press(t{index}[{i}])" for i in range(len(target))),
+                     *(f"release(t{index}[{i}])" for i in reversed(range(len(target)))), f"log({message!r})")
+            elif name in ("key_hold", "mouse_hold"):
+                if name == "key_hold":
                     key = cmd["key"]
-                    duration = cmd["duration"]
-                    try:
-                        key_obj = getattr(keyboard.Key, key.lower())
-                    except AttributeError:
-                        key_obj = key
-                    self.keyboard_controller.press(key_obj)
-                    self.log(f"キー押下開始: {key}")
-                    time.sleep(duration)
-                    self.keyboard_controller.release(key_obj)
-                    self.log(f"キー押下終了: {key}")
-                elif cmd["command"] == "wait":
-                    duration = cmd["duration"]
-                    self.log(f"待機開始: {duration}秒")
-                    time.sleep(duration)
-                    self.log("待機終了")
-                elif cmd["command"] == "mouse_click":
-                    x = cmd["x"]
-                    y = cmd["y"]
-                    button_str = cmd["button"]
-                    if button_str == "left":
-                        btn = mouse.Button.left
-                    elif button_str == "right":
-                        btn = mouse.Button.right
-                    elif button_str == "middle":
-                        btn = mouse.Button.middle
-                    else:
-                        btn = mouse.Button.left
-                    self.mouse_controller.position = (x, y)
-                    self.mouse_controller.click(btn)
-                    self.log(f"マウスクリック実行: ({x}, {y}), ボタン: {button_str}")
-                elif cmd["command"] == "mouse_hold":
-                    x = cmd["x"]
-                    y = cmd["y"]
+                    start = f"キー押下開始: {key}"
+                    end = f"キー押下終了: {key}"
+                    emit(f"press(t{index})", f"log({start!r})")
+                else:
+                    x = int(cmd["x"])
+                    y = int(cmd["y"])
                     button_str = cmd["button"]
-                    if button_str == "left":
-                        btn = mouse.Button.left
-                    elif button_str == "right":
-                        btn = mouse.Button.right
-                    elif button_str == "middle":
-                        btn = mouse.Button.middle
+                    start = f"マウス押下開始: ({x}, {y}), ボタン: {button_str}"
+                    end = f"マウス押下終了: ({x}, {y}), ボタン: {button_str}"
+                    emit(f"mouse.position = ({x}, {y})", f"mouse_press(t{index})", f"log({start!r})")
+                release = "release" if name == "key_hold" else "mouse_release"
+                emit(f"deadline += {number(float(cmd['duration']))}", "try:", "    deadline = await sleep_until(deadline)",
+                     "finally:", f"    {release}(t{index})", f"    log({end!r})")
+            elif name == "wait":
+                duration = cmd["duration"]
+                start = f"待機開始: {duration}秒"
+                end = "待機終了"
+                emit(f"log({start!r})", f"deadline += {number(float(duration))}", "deadline = await sleep_until(deadline)", f"log({end!r})")
+            elif name == "mouse_click":
+                x = int(cmd["x"])
+                y = int(cmd["y"])
+                button_str = cmd["button"]
+                message = f"マウスクリック実行: ({x}, {y}), ボタン: {button_str}"
+                emit(f"mouse.position = ({x}, {y})", f"click(t{index})", f"log({message!r})")
+            elif name == "mouse_scroll":
+                dx = int(cmd["dx"])
+                dy = int(cmd["dy"])
+                message = f"マウススクロール: 水平 {dx}, 垂直 {dy}"
+                emit(f"scroll({dx}, {dy})", f"log({message!r})")
+            elif name == "loop_start":
+                emit(f"for _ in range({int(cmd['count'])}):" if cmd["count"] else "while True:")
+                indent += "    "
+            elif name == "loop_end":
+                # ループ本体が待たなくても停止を通す
+                emit("await asyncio.sleep(0)")
+                indent = indent[:-4]
+            elif name == "if_pixel":
+                if target is None or not self.screen.available():
+                    message = "画像コマンドには numpy と mss パッケージが必要です。"
+                    emit(f"raise RuntimeError({message!r})")
+                emit(f"if await matches({int(cmd['x'])}, {int(cmd['y'])}, t{index}, {int(cmd.get('tolerance', 0))}):")
+                indent += "    "
+            elif name == "if_variable":
+                if cmd["op"] not in COMPARISONS or not isinstance(cmd["value"], (int, float)):
+                    raise ValueError(f"invalid condition: {cmd['op']} {cmd['value']!r}")
+                emit(f"if variables.get({str(cmd['name'])!r}, 0) {cmd['op']} {number(cmd['value'])}:")
+                indent += "    "
+            elif name == "else":
+                close_block()
+                indent = indent[:-4]
+                emit("else:")
+                indent += "    "
+            elif name == "end_if":
+                close_block()
+                indent = indent[:-4]
+            elif name == "set_variable":
+                head.append(f"    c{index} = cmds[{index}]")
+                emit(f"set_variable(c{index}, variables)")
+            elif name == "call":
+                emit(f"deadline = await call_macro(t{index}, program, deadline, None, depth)")
+            elif name == "return":
+                emit("return deadline")
+            elif name == "goto":
+                return None
+            elif OPCODES[op].execute is not None:
+                # Label と実行関数のないプラグインコマンドは、interpret_code と同じく何もしない
+                head.append(f"    c{index} = cmds[{index}]")
+                emit(f"deadline = await execute_command({name!r}, c{index}, {f't{index}' if target is not None else 'None'}, deadline)")
+            if OPCODES[op].execute is not None:
+                emit(f"deadline += {COMMAND_GAP!r}", "deadline = await sleep_until(deadline)")
+        emit("return deadline")
+        return "\n".join(head + body + ["    return run", ""])
+        
+    async def interpret_code(self, code, program, deadline, humanizer, depth=0):
+        # バイトコード VM: コマンドはオペコードの実行関数へ渡し、制御フローはここで処理する
+        # ジャンプは compile_code が保存したインデックスへ直接進む
+        ops, args, cmds, targets = code.ops, code.args, code.cmds, code.targets
+        executors = OPCODE_EXECUTORS
+        counters = {}  # 実行中の各ループの残り回数（ループ開始のインデックスごと）
+        variables = program["variables"]
+        pc = 0
+        end = len(ops)
+        while pc < end:
+            op = ops[pc]
+            execute = executors[op]
+            if execute is not None:
+                deadline = await execute(self, cmds[pc], targets[pc], deadline, humanizer)
+                deadline += humanizer.vary(COMMAND_GAP) if humanizer else COMMAND_GAP
+                deadline = await sleep_until(deadline)
+            elif op == OP_LOOP_START:
+                counters[pc] = cmds[pc]["count"]
+            elif op == OP_LOOP_END:
+                # 無限ループ（回数 0）は負になり、0 に達しない
+                start = args[pc]
+                left = counters.get(start, 1) - 1
+                if left != 0:
+                    counters[start] = left
+                    pc = start + 1
+                    # ループ本体が待たなくても停止を通す
+                    await asyncio.sleep(0)
+                    continue
+            elif op == OP_IF_PIXEL:
+                cmd = cmds[pc]
+                if targets[pc] is None or not self.screen.available():
+                    raise RuntimeError("画像コマンドには numpy と mss パッケージが必要です。")
+                if not await self.screen.matches(cmd["x"], cmd["y"], targets[pc], cmd.get("tolerance", 0)):
+                    pc = args[pc]
+                    continue
+            elif op == OP_IF_VARIABLE:
+                cmd = cmds[pc]
+                if not COMPARISONS[cmd["op"]](variables.get(cmd["name"], 0), cmd["value"]):
+                    pc = args[pc]
+                    continue
+            elif op == OP_ELSE:
+                pc = args[pc]
+                continue
+            elif op == OP_GOTO:
+                pc = args[pc]
+                await asyncio.sleep(0)
+                continue
+            elif op == OP_SET_VARIABLE:
+                self.set_variable(cmds[pc], variables)
+            elif op == OP_CALL:
+                deadline = await self.call_macro(targets[pc], program, deadline, humanizer, depth)
+            elif op == OP_RETURN:
+                break
+            pc += 1
+        return deadline
+        
+    def set_variable(self, cmd, variables):
+        variables[cmd["name"]] = ASSIGNMENTS[cmd["op"]](variables.get(cmd["name"], 0), cmd["value"])
+        self.log(f"変数設定: {cmd['name']} = {variables[cmd['name']]}")
+        
+    async def call_macro(self, path, program, deadline, humanizer, depth):
+        if depth >= MAX_CALL_DEPTH:
+            raise RuntimeError(f"マクロ呼び出しの入れ子が {MAX_CALL_DEPTH} を超えました: {path}")
+        code = program["subroutines"].get(path)
+        if code is None:
+            # 実行ごとに一度だけ、エンジンのループの外でコンパイルするので、その間も他のトラックはタイミングを保つ
+            loop = asyncio.get_running_loop()
+            code = await loop.run_in_executor(None, self.compile_subroutine, path, program["screen"])
+            program["subroutines"][path] = code
+        self.log("マクロ呼び出し: " + path)
+        deadline = await self.run_code(code, program, deadline, humanizer, depth + 1)
+        self.log("マクロ呼び出しから戻りました: " + path)
+        return deadline
+        
+    def compile_subroutine(self, path, screen):
+        # 呼び出したファイルの全トラックのコマンドを順に実行する。その中の呼び出しはそのファイルのフォルダからの相対パス
+        commands, _, file_screen = self.read_macro_file(path)
+        transform = screen_transform(file_screen or screen, screen)
+        return transform_tracks({0: self.compile_code(commands, os.path.dirname(path))}, transform)[0]
+        
+    async def execute_command(self, name, cmd, target, deadline, humanizer=None):
+        # deadline から1つのコマンドを実行し、終了時刻を返す
+        return await OPCODES[OPCODE_NUMBERS[name]].execute(self, cmd, target, deadline, humanizer)
+        
+    async def execute_key_tap(self, cmd, target, deadline, humanizer):
+        key = cmd["key"]
+        repeat = cmd.get("repeat", 1)
+        for _ in range(repeat):
+            self.keyboard_controller.press(target)
+            self.keyboard_controller.release(target)
+            self.log(f"キータップ実行: {key}")
+            deadline += KEY_TAP_GAP
+            deadline = await sleep_until(deadline)
+        return deadline
+        
+    async def execute_key_chord(self, cmd, target, deadline, humanizer):
+        # 順に押して逆順に離し、間には何も挟まない
+        for key in target:
+            self.keyboard_controller.press(key)
+        for key in reversed(target):
+            self.keyboard_controller.release(key)
+        self.log(f"キーの組み合わせ実行: {cmd['keys']}")
+        return deadline
+        
+    async def execute_key_hold(self, cmd, target, deadline, humanizer):
+        key = cmd["key"]
+        self.keyboard_controller.press(target)
+        self.log(f"キー押下開始: {key}")
+        deadline += cmd["duration"]
+        try:
+            deadline = await sleep_until(deadline)
+        finally:
+            self.keyboard_controller.release(target)
+            self.log(f"キー押下終了: {key}")
+        return deadline
+        
+    async def execute_wait(self, cmd, target, deadline, humanizer):
+        duration = cmd["duration"]
+        if humanizer:
+            duration = round(humanizer.vary(duration), 3)
+        self.log(f"待機開始: {duration}秒")
+        deadline += duration
+        deadline = await sleep_until(deadline)
+        self.log("待機終了")
+        return deadline
+        
+    async def execute_mouse_click(self, cmd, target, deadline, humanizer):
+        x = cmd["x"]
+        y = cmd["y"]
+        button_str = cmd["button"]
+        deadline = await self.move_pointer(x, y, deadline, humanizer)
+        self.mouse_controller.click(target)
+        self.log(f"マウスクリック実行: ({x}, {y}), ボタン: {button_str}")
+        return deadline
+        
+    async def execute_mouse_hold(self, cmd, target, deadline, humanizer):
+        x = cmd["x"]
+        y = cmd["y"]
+        button_str = cmd["button"]
+        deadline = await self.move_pointer(x, y, deadline, humanizer)
+        self.mouse_controller.press(target)
+        self.log(f"マウス押下開始: ({x}, {y}), ボタン: {button_str}")
+        deadline += cmd["duration"]
+        try:
+            deadline = await sleep_until(deadline)
+        finally:
+            self.mouse_controller.release(target)
+            self.log(f"マウス押下終了: ({x}, {y}), ボタン: {button_str}")
+        return deadline
+        
+    async def execute_type_text(self, cmd, target, deadline, humanizer):
+        # 1 文字につき 1 打鍵を一定間隔で送る。速度 0 ならテキスト全体を一度に送る
+        cps = cmd.get("cps", TYPE_RATE)
+        interval = 1 / cps if cps else 0
+        shifted = False
+        try:
+            for key, shift in target:
+                # 大文字が続く間は Shift を押したままにする
+                if shift != shifted:
+                    if shift:
+                        self.keyboard_controller.press(keyboard.Key.shift)
                     else:
-                        btn = mouse.Button.left
-                    self.mouse_controller.position = (x, y)
-                    self.mouse_controller.press(btn)
-                    self.log(f"マウス押下開始: ({x}, {y}), ボタン: {button_str}")
-                    time.sleep(cmd["duration"])
-                    self.mouse_controller.release(btn)
-                    self.log(f"マウス押下終了: ({x}, {y}), ボタン: {button_str}")
-                elif cmd["command"] == "mouse_scroll":
-                    dx = cmd["dx"]
-                    dy = cmd["dy"]
-                    self.mouse_controller.scroll(dx, dy)
-                    self.log(f"マウススクロール: 水平 {dx}, 垂直 {dy}")
-                time.sleep(0.1)
-            iteration += 1
-            self.log(f"繰り返し {iteration} 完了.")
-        self.log("マクロ実行完了.")
-        self.macro_running = False
-        self.button_stop.config(state=tk.DISABLED)
+                        self.keyboard_controller.release(keyboard.Key.shift)
+                    shifted = shift
+                self.keyboard_controller.press(key)
+                self.keyboard_controller.release(key)
+                if interval:
+                    deadline += humanizer.vary(interval) if humanizer else interval
+                    deadline = await sleep_until(deadline)
+        finally:
+            if shifted:
+                self.keyboard_controller.release(keyboard.Key.shift)
+        self.log(f"テキスト入力: {len(target)} 文字")
+        return deadline
+        
+    async def execute_paste_text(self, cmd, target, deadline, humanizer):
+        # クリップボードは Tk スレッドのもの。テキストはそこで設定し、貼り付けはそれを待つ
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        def set_clipboard():
+            self.clipboard_clear()
+            self.clipboard_append(cmd["text"])
+            loop.call_soon_threadsafe(wake_future, ready)
+        self.ui.post(set_clipboard)
+        await ready
+        self.keyboard_controller.press(keyboard.Key.ctrl)
+        try:
+            self.keyboard_controller.press(target)
+            self.keyboard_controller.release(target)
+        finally:
+            self.keyboard_controller.release(keyboard.Key.ctrl)
+        self.log(f"テキスト貼り付け: {len(cmd['text'])} 文字")
+        # マクロの残りは貼り付けた時点から計時する
+        deadline = CLOCK.now()
+        return deadline
+        
+    async def execute_mouse_scroll(self, cmd, target, deadline, humanizer):
+        dx = cmd["dx"]
+        dy = cmd["dy"]
+        self.mouse_controller.scroll(dx, dy)
+        self.log(f"マウススクロール: 水平 {dx}, 垂直 {dy}")
+        return deadline
+        
+    async def execute_mouse_move(self, cmd, target, deadline, humanizer):
+        x = cmd["x"]
+        y = cmd["y"]
+        deadline = await self.move_pointer(x, y, deadline, humanizer, cmd.get("duration", 0), cmd.get("easing", "ease-in-out"))
+        self.log(f"マウス移動: ({x}, {y})")
+        return deadline
+        
+    async def execute_mouse_drag(self, cmd, target, deadline, humanizer):
+        x = cmd["x"]
+        y = cmd["y"]
+        to_x = cmd["to_x"]
+        to_y = cmd["to_y"]
+        button_str = cmd["button"]
+        deadline = await self.move_pointer(x, y, deadline, humanizer)
+        self.mouse_controller.press(target)
+        self.log(f"マウスドラッグ開始: ({x}, {y}), ボタン: {button_str}")
+        try:
+            deadline = await self.move_pointer(to_x, to_y, deadline, humanizer,
+                                               cmd.get("duration", 0), cmd.get("easing", "ease-in-out"))
+        finally:
+            # ドラッグ途中で実行を止めてもボタンは離される
+            self.mouse_controller.release(target)
+            self.log(f"マウスドラッグ終了: ({to_x}, {to_y}), ボタン: {button_str}")
+        return deadline
+        
+    async def execute_wait_image(self, cmd, target, deadline, humanizer):
+        if target is None or not self.screen.available():
+            raise RuntimeError("画像コマンドには numpy と mss パッケージが必要です。")
+        x = cmd["x"]
+        y = cmd["y"]
+        tolerance = cmd.get("tolerance", 0)
+        poll_interval = cmd.get("poll_interval", IMAGE_POLL_INTERVAL)
+        timeout = cmd.get("timeout", 0)
+        self.log(f"画像待機開始: ({x}, {y})")
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        poll_time = start
+        matched = await self.screen.matches(x, y, target, tolerance)
+        while not matched:
+            if timeout and loop.time() - start >= timeout:
+                break
+            # ポーリングは固定の時間格子に乗せ、取得時間で周期がずれないようにする
+            poll_time += poll_interval
+            await asyncio.sleep(poll_time - loop.time())
+            matched = await self.screen.matches(x, y, target, tolerance)
+        if matched:
+            self.log(f"{loop.time() - start:.2f}秒後に画像一致")
+        else:
+            self.log(f"画像待機が{timeout}秒でタイムアウト")
+        # マクロの残りは画面が準備できた時点から計時する
+        deadline = CLOCK.now()
+        return deadline
+        
+    async def execute_click_image(self, cmd, target, deadline, humanizer):
+        if target is None or not self.screen.available():
+            raise RuntimeError("画像コマンドには numpy と mss パッケージが必要です。")
+        button, matcher = target
+        button_str = cmd["button"]
+        region = (cmd.get("search_x", 0), cmd.get("search_y", 0), cmd.get("search_width", 0), cmd.get("search_height", 0))
+        hit = await self.screen.find(matcher, region, cmd.get("threshold", MATCH_THRESHOLD))
+        if hit is None:
+            self.log("画像が見つからないためクリックをスキップ")
+        else:
+            # 一致した領域の中心をクリック
+            x = hit[0] + matcher.width // 2
+            y = hit[1] + matcher.height // 2
+            self.mouse_controller.position = (x, y)
+            self.mouse_controller.click(button)
+            self.log(f"画像クリック実行: ({x}, {y}), 一致度: {hit[2]:.2f}, ボタン: {button_str}")
+        deadline = max(deadline, CLOCK.now())
+        return deadline
+        
+    async def move_pointer(self, x, y, deadline, humanizer, duration=0, easing="ease-in-out"):
+        if humanizer is not None:
+            points, interval = humanizer.path(self.mouse_controller.position, (x, y), duration, easing)
+        elif duration > 0:
+            points, interval = interpolate_path(self.mouse_controller.position, (x, y), duration, easing)
+        else:
+            self.mouse_controller.position = (x, y)
+            return deadline
+        # 点は固定の締め切り間隔で送出し、その間は何も計算しない
+        for point in points[1:]:
+            deadline += interval
+            deadline = await sleep_until(deadline)
+            self.mouse_controller.position = point
+        return deadline
         
     def stop_macro(self):
         self.macro_running = False
+        self.refresh_run_state()
+        self.editor_worker.cancel()
         self.log("マクロ実行停止要求済み.")
         
     def save_macro(self):
@@ -529,9 +2326,23 @@ class ManualMacroGUI(tk.Tk):
         if not file_path:
             return
         try:
-            with open(file_path, "w") as f:
-                json.dump(self.commands, f, indent=4)
+            track_loops = self.parse_track_loops(self.entry_track_loops.get())
+            # 画面サイズを保存することで座標を他の解像度でも使える
+            data = {"screen": list(self.macro_screen), "commands": self.commands}
+            if track_loops:
+                data["track_loops"] = track_loops
+            content = json.dumps(data, indent=4).encode("utf-8")
+            with open(file_path, "wb") as f:
+                f.write(content)
             self.log("マクロ保存完了: " + file_path)
+            digest = hashlib.sha256(content).hexdigest()
+            folder = os.path.dirname(os.path.abspath(file_path))
+            if self.load_compiled_macro(digest, folder) is None:
+                self.save_compiled_macro(digest, folder, self.compile_macro(self.commands, track_loops, self.macro_screen, folder))
+            self.save_last_macro_cache(file_path, get_file_signature(file_path), digest)
+            # 相対パスの Call ファイルは保存先のフォルダを基準に解決し直す
+            self.compiled_tracks = None
+            self.set_macro_path(file_path)
         except Exception as e:
             messagebox.showerror("エラー", "マクロ保存失敗: " + str(e))
         
@@ -539,51 +2350,362 @@ class ManualMacroGUI(tk.Tk):
         file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
         if not file_path:
             return
+        self.load_macro_file(file_path)
+        
+    def load_macro_file(self, file_path):
         try:
-            with open(file_path, "r") as f:
-                self.commands = json.load(f)
+            compiled = self.read_macro_file_cached(file_path)
+            self.commands = compiled["commands"]
+            self.compiled_tracks = compiled["tracks"]
+            self.macro_screen = self.get_macro_screen(compiled["screen"])
+            self.entry_track_loops.delete(0, tk.END)
+            self.entry_track_loops.insert(0, self.format_track_loops(compiled["track_loops"]))
             self.listbox.delete(0, tk.END)
-            for cmd in self.commands:
-                disp = self.get_display_text(cmd)
+            for disp in compiled["display"]:
                 self.listbox.insert(tk.END, disp)
                 self.log("読み込んだコマンド: " + disp)
             self.log("マクロ読み込み完了: " + file_path)
+            self.set_macro_path(file_path)
         except Exception as e:
             messagebox.showerror("エラー", "マクロ読み込み失敗: " + str(e))
             
+    def read_macro_file_cached(self, file_path):
+        # 最後のマクロのキャッシュは変更のないファイル(mtime とサイズが同じ)を内容ハッシュに対応付けるため、
+        # ファイルを読み直してハッシュを計算する必要すらない
+        signature = get_file_signature(file_path)
+        content = None
+        digest = None
+        try:
+            with open(LAST_MACRO_CACHE_FILE, "rb") as f:
+                cache = pickle.load(f)
+            if cache["path"] == os.path.abspath(file_path) and cache["signature"] == signature:
+                digest = cache["digest"]
+        except Exception:
+            pass
+        if digest is None:
+            with open(file_path, "rb") as f:
+                content = f.read()
+            digest = hashlib.sha256(content).hexdigest()
+        folder = os.path.dirname(os.path.abspath(file_path))
+        compiled = self.load_compiled_macro(digest, folder)
+        if compiled is None:
+            if content is None:
+                with open(file_path, "rb") as f:
+                    content = f.read()
+            commands, track_loops, screen = self.parse_macro_data(json.loads(content))
+            compiled = self.compile_macro(commands, track_loops, screen, folder)
+            self.save_compiled_macro(digest, folder, compiled)
+        self.save_last_macro_cache(file_path, signature, digest)
+        return compiled
+        
+    def compile_macro(self, commands, track_loops, screen, folder):
+        # 再解析せずにマクロを表示・実行するのに必要なもの一式
+        try:
+            tracks = self.compile_commands(commands, folder)
+        except ValueError:
+            tracks = None  # 閉じていないブロックはマクロ再生時に報告する
+        return {
+            "commands": commands,
+            "track_loops": track_loops,
+            "screen": screen,
+            "display": [self.get_display_text(cmd) for cmd in commands],
+            "tracks": tracks,
+        }
+        
+    def get_compiled_cache_path(self, digest, folder):
+        # 表示テキストはこのスクリプトの言語に、オペコード番号は読み込んだプラグインに依存する
+        # Call のターゲットはファイルのフォルダに依存する
+        tag = os.path.splitext(os.path.basename(__file__))[0]
+        opcodes = hashlib.sha256(" ".join(OPCODE_NUMBERS).encode("utf-8")).hexdigest()[:8]
+        location = hashlib.sha256(folder.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(CACHE_DIR, f"{digest}.v{MACRO_CACHE_VERSION}.{tag}.{opcodes}.{location}.pickle")
+        
+    def load_compiled_macro(self, digest, folder):
+        try:
+            with open(self.get_compiled_cache_path(digest, folder), "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return pickle.loads(data)
+        except Exception:
+            return None
+        
+    def save_compiled_macro(self, digest, folder, compiled):
+        path = self.get_compiled_cache_path(digest, folder)
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(compiled, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+            # 最近書き込んだエントリだけを残す。フォルダ内のその他のファイルには触れない
+            entries = sorted((os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR) if name.endswith(".pickle")),
+                             key=os.path.getmtime, reverse=True)
+            for old_path in entries[MAX_CACHED_MACROS:]:
+                os.remove(old_path)
+        except Exception as e:
+            # プラグインのターゲットは pickle できないことがあり、PicklingError 以外も発生する
+            self.log("マクロキャッシュの保存失敗: " + str(e))
+            try:
+                os.remove(path + ".tmp")
+            except OSError:
+                pass
+        
+    def save_last_macro_cache(self, file_path, signature, digest):
+        try:
+            os.makedirs(SESSION_DIR, exist_ok=True)
+            with open(LAST_MACRO_CACHE_FILE + ".tmp", "wb") as f:
+                pickle.dump({"path": os.path.abspath(file_path), "signature": signature, "digest": digest},
+                            f, pickle.HIGHEST_PROTOCOL)
+            os.replace(LAST_MACRO_CACHE_FILE + ".tmp", LAST_MACRO_CACHE_FILE)
+        except OSError as e:
+            self.log("マクロキャッシュの保存失敗: " + str(e))
+            
+    def get_macro_folder(self):
+        # 相対パスの Call ファイルはマクロと同じ場所で探す。未保存のマクロは作業ディレクトリを使う
+        return os.path.dirname(os.path.abspath(self.macro_path)) if self.macro_path else ""
+        
+    def set_macro_path(self, file_path):
+        self.add_recent_macro(file_path)
+        if self.macro_watcher and self.macro_watcher.path == os.path.abspath(file_path):
+            # 自分自身の保存を外部変更として扱わない
+            self.macro_watcher.mark_current()
+            return
+        self.macro_path = file_path
+        self.update_macro_watcher()
+        
+    def update_macro_watcher(self):
+        if self.macro_watcher:
+            self.macro_watcher.stop()
+            self.macro_watcher = None
+        if self.watch_file_var.get() and self.macro_path:
+            self.macro_watcher = MacroFileWatcher(self.macro_path, self.on_macro_file_changed, self.engine)
+            self.macro_watcher.start()
+            self.log("マクロファイル監視中: " + self.macro_path)
+        
+    def on_macro_file_changed(self, file_path):
+        # 監視スレッドから呼ばれる
+        try:
+            commands, track_loops, screen = self.read_macro_file(file_path)
+            program = self.editor_program
+            if program is not None:
+                # 実行中のマクロは次の繰り返しの境目で切り替わる
+                transform = screen_transform(screen or program["screen"], program["screen"])
+                tracks = transform_tracks(self.compile_commands(commands, os.path.dirname(os.path.abspath(file_path))), transform)
+                # 実行のタスクは開始時に作られるので、変更を反映するのは既にあるトラックだけ
+                added = sorted(set(tracks) - set(program["tracks"]))
+                program["track_loops"] = track_loops
+                program["tracks"] = tracks
+                if added:
+                    self.log("再読み込みで追加されたトラックは次の実行から始まります: " + ", ".join(map(str, added)))
+        except Exception as e:
+            self.log("マクロ再読み込み失敗: " + str(e))
+            return
+        self.ui.post(lambda: self.apply_reloaded_macro(file_path, commands, track_loops, screen), key=self.apply_reloaded_macro)
+        
+    def apply_reloaded_macro(self, file_path, commands, track_loops, screen):
+        self.commands = commands
+        self.compiled_tracks = None
+        self.macro_screen = self.get_macro_screen(screen)
+        self.listbox.delete(0, tk.END)
+        for cmd in self.commands:
+            self.listbox.insert(tk.END, self.get_display_text(cmd))
+        self.entry_track_loops.delete(0, tk.END)
+        self.entry_track_loops.insert(0, self.format_track_loops(track_loops))
+        self.log("マクロ再読み込み済み: " + file_path)
+        
+    def add_recent_macro(self, file_path):
+        file_path = os.path.abspath(file_path)
+        if file_path in self.recent_macros:
+            self.recent_macros.remove(file_path)
+        self.recent_macros.insert(0, file_path)
+        del self.recent_macros[MAX_RECENT_MACROS:]
+        self.refresh_recent_menu()
+        
+    def refresh_recent_menu(self):
+        self.menu_recent.delete(0, tk.END)
+        for file_path in self.recent_macros:
+            self.menu_recent.add_command(label=file_path, command=lambda file_path=file_path: self.load_macro_file(file_path))
+        
+    def restore_session(self):
+        try:
+            with open(SESSION_FILE, "r") as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            return
+        hotkeys = session.get("hotkeys", {})
+        self.start_hotkey_var.set(hotkeys.get("start", "f2"))
+        self.stop_hotkey_var.set(hotkeys.get("stop", "f3"))
+        self.action_start_hotkey_var.set(hotkeys.get("action_start", "f4"))
+        self.action_stop_hotkey_var.set(hotkeys.get("action_stop", "f5"))
+        self.slower_hotkey_var.set(hotkeys.get("slower", "f6"))
+        self.faster_hotkey_var.set(hotkeys.get("faster", "f7"))
+        self.entry_loop.delete(0, tk.END)
+        self.entry_loop.insert(0, session.get("loop_count", "1"))
+        run_limit = session.get("run_limit", {})
+        if run_limit.get("mode") in RUN_LIMITS:
+            self.run_limit_var.set(run_limit["mode"])
+        self.entry_run_limit.delete(0, tk.END)
+        self.entry_run_limit.insert(0, run_limit.get("value", ""))
+        self.watch_file_var.set(session.get("auto_reload", False))
+        humanize = session.get("humanize", {})
+        self.humanize_var.set(humanize.get("enabled", False))
+        self.entry_jitter.delete(0, tk.END)
+        self.entry_jitter.insert(0, humanize.get("jitter", "10"))
+        self.entry_seed.delete(0, tk.END)
+        self.entry_seed.insert(0, humanize.get("seed", ""))
+        if session.get("overlap_policy") in OVERLAP_POLICIES:
+            self.overlap_policy = session["overlap_policy"]
+            self.overlap_policy_var.set(self.overlap_policy)
+        if session.get("speed") in SPEEDS:
+            self.set_speed(session["speed"])
+        if session.get("geometry"):
+            # 高さと位置だけを復元する。幅はこのバージョンのレイアウトのもの
+            self.geometry(f"{WINDOW_WIDTH}x" + session["geometry"].split("x", 1)[-1])
+        self.recent_macros = [p for p in session.get("recent_macros", []) if os.path.exists(p)]
+        self.refresh_recent_menu()
+        for item in session.get("library", []):
+            name = item["name"]
+            if name not in self.macro_library:
+                self.library_names.append(name)
+            track_loops = {int(track): count for track, count in item["track_loops"].items()}
+            screen = tuple(item["screen"]) if "screen" in item else self.screen_size
+            self.macro_library[name] = self.create_library_entry(item["commands"], item["loop"], track_loops,
+                                                                 item["hotkey"], screen, item.get("folder", ""))
+        self.refresh_library_list()
+        last_macro = session.get("last_macro")
+        if last_macro and os.path.exists(last_macro):
+            self.load_macro_file(last_macro)
+        self.log("セッション復元済み: " + SESSION_FILE)
+        
+    def save_session(self):
+        session = {
+            "hotkeys": {
+                "start": self.start_hotkey_var.get(),
+                "stop": self.stop_hotkey_var.get(),
+                "action_start": self.action_start_hotkey_var.get(),
+                "action_stop": self.action_stop_hotkey_var.get(),
+                "slower": self.slower_hotkey_var.get(),
+                "faster": self.faster_hotkey_var.get(),
+            },
+            "loop_count": self.entry_loop.get().strip(),
+            "run_limit": {"mode": self.run_limit_var.get(), "value": self.entry_run_limit.get().strip()},
+            "auto_reload": self.watch_file_var.get(),
+            "overlap_policy": self.overlap_policy,
+            "speed": self.speed_var.get(),
+            "humanize": {
+                "enabled": self.humanize_var.get(),
+                "jitter": self.entry_jitter.get().strip(),
+                "seed": self.entry_seed.get().strip(),
+            },
+            "geometry": self.geometry(),
+            "recent_macros": self.recent_macros,
+            "last_macro": self.macro_path and os.path.abspath(self.macro_path),
+            "library": [{
+                "name": name,
+                "commands": self.macro_library[name]["commands"],
+                "loop": self.macro_library[name]["loop"],
+                "track_loops": self.macro_library[name]["track_loops"],
+                "hotkey": self.macro_library[name]["hotkey"],
+                "screen": list(self.macro_library[name]["screen"]),
+                "folder": self.macro_library[name]["folder"],
+            } for name in self.library_names],
+        }
+        try:
+            os.makedirs(SESSION_DIR, exist_ok=True)
+            with open(SESSION_FILE + ".tmp", "w") as f:
+                json.dump(session, f, indent=4)
+            os.replace(SESSION_FILE + ".tmp", SESSION_FILE)
+        except OSError as e:
+            self.log("セッション保存失敗: " + str(e))
+        
+    def on_close(self):
+        self.save_session()
+        self.stop_macro()
+        for name in self.macro_library:
+            self.stop_library_macro(name)
+        if self.macro_watcher:
+            self.macro_watcher.stop()
+        self.click_capture.stop()
+        self.stop_hotkey_listener()
+        self.engine.stop()
+        self.ui.stop()
+        self.destroy()
+            
+    def read_macro_file(self, file_path):
+        with open(file_path, "r") as f:
+            data = json.load(f)
+        return self.parse_macro_data(data)
+        
+    def parse_macro_data(self, data):
+        # マルチトラックファイルはコマンド一覧と一緒にトラック別繰り返しを保存
+        if isinstance(data, dict):
+            commands = data.get("commands", [])
+            track_loops = {int(track): count for track, count in data.get("track_loops", {}).items()}
+            screen = tuple(data["screen"]) if "screen" in data else None
+        else:
+            commands = data
+            track_loops = {}
+            screen = None
+        # 絶対座標しかない古いファイルでは screen は None
+        return commands, track_loops, screen
+        
+    def get_macro_screen(self, screen):
+        if screen is None:
+            # 古い絶対座標ファイルはこの画面で作られたものとみなし、再保存時にそのサイズを書き込む
+            self.log(f"マクロに画面サイズがないため、現在の画面 {self.screen_size[0]}x{self.screen_size[1]} を使用します")
+            return self.screen_size
+        return screen
+        
     def get_display_text(self, cmd):
+        text = self.format_command(cmd)
+        track = cmd.get("track", 0)
+        if track:
+            return f"[トラック {track}] " + text
+        return text
+            
+    def format_command(self, cmd):
+        number = OPCODE_NUMBERS.get(cmd.get("command"))
+        if number is None:
+            return str(cmd)
         try:
-            if cmd.get("command") == "key_tap":
-                return f"キータップ: {cmd.get('key', '')} x {cmd.get('repeat', 1)}回"
-            elif cmd.get("command") == "key_hold":
-                return f"キー押下: {cmd.get('key', '')} (押下時間: {cmd.get('duration', 0)}秒)"
-            elif cmd.get("command") == "wait":
-                return f"待機: {cmd.get('duration', 0)}秒"
-            elif cmd.get("command") == "mouse_click":
-                return f"マウスクリック: ({cmd.get('x', 0)}, {cmd.get('y', 0)}), ボタン: {cmd.get('button', '')}"
-            elif cmd.get("command") == "mouse_hold":
-                return f"マウス押下: ({cmd.get('x', 0)}, {cmd.get('y', 0)}), ボタン: {cmd.get('button', '')} (押下時間: {cmd.get('duration', 0)}秒)"
-            elif cmd.get("command") == "mouse_scroll":
-                return f"マウススクロール: 水平 {cmd.get('dx',0)}, 垂直 {cmd.get('dy',0)}"
-            else:
-                return str(cmd)
+            return OPCODES[number].format(cmd)
         except Exception as e:
             self.log("コマンド表示エラー: " + str(e))
             return str(cmd)
         
     def format_hotkey(self, key_str):
-        key_str = key_str.strip().lower()
-        if not key_str.startswith("<") and not key_str.endswith(">"):
-            key_str = f"<{key_str}>"
-        return key_str
+        # 単一キー("f2")と組み合わせ("ctrl+alt+1")の両方に対応
+        parts = []
+        for part in key_str.strip().lower().split("+"):
+            part = part.strip()
+            if len(part) > 1 and not part.startswith("<") and not part.endswith(">"):
+                part = f"<{part}>"
+            parts.append(part)
+        return "+".join(parts)
+        
+    def is_valid_hotkey(self, key_str):
+        try:
+            keyboard.HotKey.parse(self.format_hotkey(key_str))
+        except ValueError:
+            return False
+        return True
         
     def start_hotkey_listener(self):
         mapping = {
             self.format_hotkey(self.start_hotkey_var.get()): self.on_hotkey_start,
             self.format_hotkey(self.stop_hotkey_var.get()): self.on_hotkey_stop,
             self.format_hotkey(self.action_start_hotkey_var.get()): self.start_action_recording,
-            self.format_hotkey(self.action_stop_hotkey_var.get()): self.stop_action_recording
+            self.format_hotkey(self.action_stop_hotkey_var.get()): self.stop_action_recording,
+            self.format_hotkey(self.slower_hotkey_var.get()): lambda: self.step_speed(-1),
+            self.format_hotkey(self.faster_hotkey_var.get()): lambda: self.step_speed(1)
         }
+        for name, entry in self.macro_library.items():
+            if entry["hotkey"]:
+                mapping[self.format_hotkey(entry["hotkey"])] = lambda name=name: self.on_hotkey_library(name)
+        # 無効なショートカットキー（古いセッションファイル由来など）が他を巻き込んではいけない
+        for hotkey in [hotkey for hotkey in mapping if not self.is_valid_hotkey(hotkey)]:
+            self.log(f"無効なショートカットキーをスキップ: {hotkey}")
+            del mapping[hotkey]
+        # ホットキーはリスナースレッドで発火するので、ハンドラはTkスレッドで実行する
+        mapping = {hotkey: lambda callback=callback: self.ui.post(callback) for hotkey, callback in mapping.items()}
         self.hotkey_listener = keyboard.GlobalHotKeys(mapping)
         self.hotkey_thread = threading.Thread(target=self.hotkey_listener.run, daemon=True)
         self.hotkey_thread.start()
@@ -607,21 +2729,206 @@ class ManualMacroGUI(tk.Tk):
         
     def on_hotkey_start(self):
         self.log("ショートカットキーでマクロ実行要求.")
-        if not self.macro_running:
-            self.play_macro()
+        self.play_macro()
         
     def on_hotkey_stop(self):
         self.log("ショートカットキーでマクロ停止要求.")
         self.stop_macro()
+        for name in self.macro_library:
+            self.stop_library_macro(name)
+        
+    def on_hotkey_library(self, name):
+        self.log(f"ホットキーでライブラリマクロを切替: {name}")
+        self.toggle_library_macro(name)
+        
+    def add_library_macro(self):
+        name = self.entry_library_name.get().strip()
+        if name == "":
+            messagebox.showerror("エラー", "ライブラリマクロの名前を入力してください。")
+            return
+        if not self.commands:
+            messagebox.showinfo("情報", "追加するコマンドがありません。")
+            return
+        try:
+            loop_count = int(self.entry_loop.get().strip())
+            track_loops = self.parse_track_loops(self.entry_track_loops.get())
+        except ValueError:
+            messagebox.showerror("エラー", "有効な繰り返し回数を入力してください。")
+            return
+        self.store_library_macro(name, copy.deepcopy(self.commands), loop_count, track_loops, self.macro_screen,
+                                 self.get_macro_folder())
+        
+    def add_library_file(self):
+        file_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
+        if not file_path:
+            return
+        try:
+            loop_count = int(self.entry_loop.get().strip())
+        except ValueError:
+            messagebox.showerror("エラー", "有効な繰り返し回数を入力してください。")
+            return
+        try:
+            commands, track_loops, screen = self.read_macro_file(file_path)
+        except Exception as e:
+            messagebox.showerror("エラー", "マクロ読み込み失敗: " + str(e))
+            return
+        name = self.entry_library_name.get().strip() or os.path.splitext(os.path.basename(file_path))[0]
+        self.store_library_macro(name, commands, loop_count, track_loops, self.get_macro_screen(screen),
+                                 os.path.dirname(os.path.abspath(file_path)))
+        
+    def store_library_macro(self, name, commands, loop_count, track_loops, screen, folder):
+        hotkey = self.entry_library_hotkey.get().strip()
+        if hotkey and not self.is_valid_hotkey(hotkey):
+            messagebox.showerror("エラー", "有効なショートカットキーを入力してください（例: f8、ctrl+alt+1）。")
+            return
+        if name in self.macro_library:
+            self.macro_library[name]["worker"].close()
+        else:
+            self.library_names.append(name)
+        self.macro_library[name] = self.create_library_entry(commands, loop_count, track_loops, hotkey, screen, folder)
+        self.refresh_library_list()
+        self.log(f"ライブラリマクロ追加済み: {name} ({len(commands)} コマンド)")
+        self.apply_hotkeys()
+        
+    def create_library_entry(self, commands, loop_count, track_loops, hotkey, screen, folder):
+        return {
+            "commands": commands,
+            "loop": loop_count,
+            "track_loops": track_loops,
+            "hotkey": hotkey,
+            "screen": screen,
+            "folder": folder,  # 相対パスの Call ファイルを探す場所
+            # ライブラリマクロごとに常駐ワーカーを持つ
+            "worker": PlaybackWorker(self.engine, self.get_overlap_policy, self.log,
+                                     lambda: self.ui.post(self.refresh_library_list)),
+        }
+        
+    def remove_library_macro(self):
+        name = self.get_selected_library_name()
+        if name is None:
+            return
+        self.macro_library[name]["worker"].close()
+        del self.macro_library[name]
+        self.library_names.remove(name)
+        self.refresh_library_list()
+        self.log(f"ライブラリマクロ削除済み: {name}")
+        self.apply_hotkeys()
+        
+    def open_library_macro(self):
+        name = self.get_selected_library_name()
+        if name is None:
+            return
+        entry = self.macro_library[name]
+        self.commands = copy.deepcopy(entry["commands"])
+        self.compiled_tracks = None
+        self.macro_screen = entry["screen"]
+        self.listbox.delete(0, tk.END)
+        for cmd in self.commands:
+            self.listbox.insert(tk.END, self.get_display_text(cmd))
+        self.entry_loop.delete(0, tk.END)
+        self.entry_loop.insert(0, str(entry["loop"]))
+        self.entry_track_loops.delete(0, tk.END)
+        self.entry_track_loops.insert(0, self.format_track_loops(entry["track_loops"]))
+        self.log(f"ライブラリマクロをエディタで開きました: {name}")
+        
+    def get_selected_library_name(self):
+        selected = self.listbox_library.curselection()
+        if not selected:
+            messagebox.showerror("エラー", "ライブラリマクロを選択してください。")
+            return None
+        return self.library_names[selected[0]]
+        
+    def refresh_library_list(self):
+        selected = self.listbox_library.curselection()
+        self.listbox_library.delete(0, tk.END)
+        for name in self.library_names:
+            entry = self.macro_library[name]
+            text = name
+            if entry["hotkey"]:
+                text += f" [{self.format_hotkey(entry['hotkey'])}]"
+            if self.is_library_macro_running(entry):
+                text += " - 実行中"
+            self.listbox_library.insert(tk.END, text)
+        if selected and selected[0] < len(self.library_names):
+            self.listbox_library.selection_set(selected[0])
+        
+    def is_library_macro_running(self, entry):
+        return entry["worker"].is_busy()
+        
+    def play_selected_library_macro(self):
+        name = self.get_selected_library_name()
+        if name is not None:
+            self.play_library_macro(name)
+        
+    def stop_selected_library_macro(self):
+        name = self.get_selected_library_name()
+        if name is not None:
+            self.stop_library_macro(name)
+        
+    def toggle_library_macro(self, name):
+        entry = self.macro_library.get(name)
+        if entry is None:
+            return
+        if self.is_library_macro_running(entry):
+            self.stop_library_macro(name)
+        else:
+            self.play_library_macro(name)
+        
+    def play_library_macro(self, name):
+        entry = self.macro_library.get(name)
+        if entry is None:
+            return
+        try:
+            run_limit = self.parse_run_limit()
+            humanizer = self.create_humanizer()
+        except ValueError:
+            return
+        try:
+            tracks = self.compile_commands(entry["commands"], entry["folder"])
+        except ValueError as e:
+            messagebox.showerror("エラー", "マクロのコンパイルに失敗しました: " + str(e))
+            return
+        transform = screen_transform(entry["screen"], self.update_screen_size())
+        entry["worker"].request(lambda: self.execute_library_macro(name, entry, tracks, transform, humanizer, run_limit))
+        
+    async def execute_library_macro(self, name, entry, tracks, transform, humanizer=None, run_limit=None):
+        self.log(f"ライブラリマクロ開始: {name}")
+        self.ui.post(self.refresh_library_list)
+        # ライブラリのマクロも人間らしさの設定と同じく、コントロールの実行制限を使う
+        program = {"tracks": transform_tracks(tracks, transform), "screen": self.screen_size,
+                   "humanizer": humanizer, "variables": {}, "subroutines": {},
+                   "stop_at": run_stop_time(run_limit),
+                   "loop_count": entry["loop"], "track_loops": entry["track_loops"]}
+        try:
+            await self.run_macro(program)
+        finally:
+            self.log(f"ライブラリマクロ完了: {name}")
+        
+    def stop_library_macro(self, name):
+        entry = self.macro_library.get(name)
+        if entry is None or not self.is_library_macro_running(entry):
+            return
+        entry["worker"].cancel()
+        self.log(f"ライブラリマクロ停止要求済み: {name}")
         
     def start_action_recording(self):
         if self.action_recording:
             return
         self.action_recording = True
         self.recorded_commands = []
+        self.record_modifiers = []
+        self.record_chord_modifiers = set()
+        self.record_chord_keys = set()
         self.last_record_time = time.time()
+        self.update_screen_size()
+        # リスナースレッドはTk変数を読めないので、ここでホットキーを解決しておく
+        self.record_ignored_keys = {
+            getattr(keyboard.Key, self.action_start_hotkey_var.get().strip().lower(), None),
+            getattr(keyboard.Key, self.action_stop_hotkey_var.get().strip().lower(), None),
+        }
         self.log("動作記録開始.")
-        self.action_keyboard_listener = keyboard.Listener(on_release=self.action_on_key_release)
+        self.action_keyboard_listener = keyboard.Listener(on_press=self.action_on_key_press,
+                                                          on_release=self.action_on_key_release)
         self.action_mouse_listener = mouse.Listener(on_click=self.action_on_mouse_click)
         self.action_keyboard_listener.start()
         self.action_mouse_listener.start()
@@ -641,29 +2948,62 @@ class ManualMacroGUI(tk.Tk):
         for cmd in self.recorded_commands:
             self.commands.append(cmd)
             self.listbox.insert(tk.END, self.get_display_text(cmd))
+        self.compiled_tracks = None
         self.button_toggle_recording.config(text="動作記録開始")
         
+    def action_on_key_press(self, key):
+        if not self.action_recording:
+            return
+        modifier = MODIFIER_NAMES.get(key)
+        if modifier:
+            if modifier not in self.record_modifiers:
+                self.record_modifiers.append(modifier)
+            return
+        if self.record_modifiers and key not in self.record_ignored_keys:
+            # 修飾キーを押したまま押されたキーは、修飾キーの状態が分かる今のうちに記録する。
+            # 修飾キーはそのキーより先に離されることが多いため
+            self.record_chord_keys.add(key_name(key).lower())
+            self.record_chord_modifiers.update(self.record_modifiers)
+            self.record_key(key, list(self.record_modifiers))
+        
     def action_on_key_release(self, key):
         if not self.action_recording:
             return
+        modifier = MODIFIER_NAMES.get(key)
+        if modifier:
+            if modifier in self.record_modifiers:
+                self.record_modifiers.remove(modifier)
+            if modifier in self.record_chord_modifiers:
+                # 単独で押した修飾キーだけをキータップとして記録する
+                self.record_chord_modifiers.discard(modifier)
+                return
+        elif key_name(key).lower() in self.record_chord_keys:
+            self.record_chord_keys.discard(key_name(key).lower())
+            return
+        self.record_key(key, [])
+        
+    def record_key(self, key, modifiers):
         now = time.time()
         dt = now - self.last_record_time
         if dt > RECORD_WAIT_THRESHOLD:
             wait_cmd = {"command": "wait", "duration": round(dt, 2)}
             self.recorded_commands.append(wait_cmd)
             self.log("記録された待機: {}秒".format(round(dt, 2)))
-        start_key = getattr(keyboard.Key, self.action_start_hotkey_var.get().strip().lower(), None)
-        stop_key  = getattr(keyboard.Key, self.action_stop_hotkey_var.get().strip().lower(), None)
-        if key == start_key or key == stop_key:
+        if key in self.record_ignored_keys:
             self.last_record_time = now
             return
-        try:
-            k = key.char
-        except AttributeError:
-            k = str(key)
-        key_cmd = {"command": "key_tap", "key": k, "repeat": 1}
+        k = key_name(key)
+        if modifiers == ["shift"] and not isinstance(key, keyboard.Key):
+            # Shift だけなら入力された文字にすでに含まれている
+            modifiers = []
+        if modifiers:
+            keys = "+".join(modifiers + [k.lower() if "shift" in modifiers else k])
+            key_cmd = {"command": "key_chord", "keys": keys}
+            self.log("記録したキーの組み合わせ: {}".format(keys))
+        else:
+            key_cmd = {"command": "key_tap", "key": k, "repeat": 1}
+            self.log("記録されたキータップ: {}".format(k))
         self.recorded_commands.append(key_cmd)
-        self.log("記録されたキータップ: {}".format(k))
         self.last_record_time = now
         
     def action_on_mouse_click(self, x, y, button, pressed):
@@ -677,9 +3017,10 @@ class ManualMacroGUI(tk.Tk):
             wait_cmd = {"command": "wait", "duration": round(dt, 2)}
             self.recorded_commands.append(wait_cmd)
             self.log("記録された待機: {}秒".format(round(dt, 2)))
-        mouse_cmd = {"command": "mouse_click", "x": int(x), "y": int(y), "button": "left"}
+        x, y = self.to_macro_position(x, y)
+        mouse_cmd = {"command": "mouse_click", "x": x, "y": y, "button": "left"}
         self.recorded_commands.append(mouse_cmd)
-        self.log("記録されたマウスクリック: ({}, {})".format(int(x), int(y)))
+        self.log("記録されたマウスクリック: ({}, {})".format(x, y))
         self.last_record_time = now
         
     def toggle_action_recording(self):
@@ -695,209 +3036,45 @@ class ManualMacroGUI(tk.Tk):
             
     def edit_command(self, index):
         cmd = self.commands[index]
+        number = OPCODE_NUMBERS.get(cmd["command"])
+        if number is None:
+            messagebox.showerror("エラー", "不明なコマンド: " + cmd["command"])
+            return
+        opcode = OPCODES[number]
         edit_win = tk.Toplevel(self)
         edit_win.title("コマンド修正")
         edit_win.configure(bg=BG_COLOR)
         edit_win.wait_visibility()
         edit_win.grab_set()
         def save_changes():
-            if cmd["command"] == "key_tap":
-                new_key = entry_key.get().strip()
-                try:
-                    new_repeat = int(entry_repeat.get().strip())
-                except ValueError:
-                    messagebox.showerror("エラー", "有効な繰り返し回数を入力してください。", parent=edit_win)
-                    return
-                if new_key == "":
-                    messagebox.showerror("エラー", "キー値を入力してください。", parent=edit_win)
-                    return
-                cmd["key"] = new_key
-                cmd["repeat"] = new_repeat
-            elif cmd["command"] == "key_hold":
-                new_key = entry_key.get().strip()
-                try:
-                    new_duration = float(entry_duration.get().strip())
-                except ValueError:
-                    messagebox.showerror("エラー", "有効な押下時間を入力してください。", parent=edit_win)
-                    return
-                if new_key == "":
-                    messagebox.showerror("エラー", "キー値を入力してください。", parent=edit_win)
-                    return
-                cmd["key"] = new_key
-                cmd["duration"] = new_duration
-            elif cmd["command"] == "wait":
-                try:
-                    new_duration = float(entry_duration.get().strip())
-                except ValueError:
-                    messagebox.showerror("エラー", "有効な待機時間を入力してください。", parent=edit_win)
-                    return
-                cmd["duration"] = new_duration
-            elif cmd["command"] == "mouse_click":
-                try:
-                    new_x = int(entry_x.get().strip())
-                    new_y = int(entry_y.get().strip())
-                except ValueError:
-                    messagebox.showerror("エラー", "有効な整数のX, Y値を入力してください。", parent=edit_win)
-                    return
-                new_button = var_button.get()
-                cmd["x"] = new_x
-                cmd["y"] = new_y
-                cmd["button"] = new_button
-            elif cmd["command"] == "mouse_hold":
-                try:
-                    new_x = int(entry_x.get().strip())
-                    new_y = int(entry_y.get().strip())
-                except ValueError:
-                    messagebox.showerror("エラー", "有効な整数のX, Y値を入力してください。", parent=edit_win)
-                    return
-                try:
-                    new_duration = float(entry_duration.get().strip())
-                except ValueError:
-                    messagebox.showerror("エラー", "有効な押下時間を入力してください。", parent=edit_win)
-                    return
-                new_button = var_button.get()
-                cmd["x"] = new_x
-                cmd["y"] = new_y
-                cmd["button"] = new_button
-                cmd["duration"] = new_duration
-            elif cmd["command"] == "mouse_scroll":
-                try:
-                    new_dx = int(entry_dx.get().strip())
-                    new_dy = int(entry_dy.get().strip())
-                except ValueError:
-                    messagebox.showerror("エラー", "有効なスクロール値を入力してください。", parent=edit_win)
-                    return
-                cmd["dx"] = new_dx
-                cmd["dy"] = new_dy
+            try:
+                new_track = int(entry_track.get().strip())
+                if new_track < 0:
+                    raise ValueError
+            except ValueError:
+                messagebox.showerror("エラー", "有効なトラック番号を入力してください。", parent=edit_win)
+                return
+            values = self.read_command_fields(entries)
+            try:
+                cmd.update(opcode.parse(values))
+            except ValueError as e:
+                messagebox.showerror("エラー", str(e), parent=edit_win)
+                return
+            if new_track:
+                cmd["track"] = new_track
+            else:
+                cmd.pop("track", None)
+            self.compiled_tracks = None
             self.listbox.delete(index)
             self.listbox.insert(index, self.get_display_text(cmd))
             self.log("コマンド修正済み: " + self.get_display_text(cmd))
             edit_win.destroy()
-        if cmd["command"] == "key_tap":
-            tk.Label(edit_win, text="キー:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_key = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_key.insert(0, cmd["key"])
-            entry_key.grid(row=0, column=1, padx=5, pady=5)
-            def on_key_press(event):
-                entry_key.delete(0, tk.END)
-                entry_key.insert(0, event.keysym)
-                return "break"
-            entry_key.bind("<Key>", on_key_press)
-            tk.Label(edit_win, text="繰り返し回数:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=5)
-            entry_repeat = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_repeat.insert(0, str(cmd.get("repeat", 1)))
-            entry_repeat.grid(row=1, column=1, padx=5, pady=5)
-        elif cmd["command"] == "key_hold":
-            tk.Label(edit_win, text="キー:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_key = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_key.insert(0, cmd["key"])
-            entry_key.grid(row=0, column=1, padx=5, pady=5)
-            def on_key_press(event):
-                entry_key.delete(0, tk.END)
-                entry_key.insert(0, event.keysym)
-                return "break"
-            entry_key.bind("<Key>", on_key_press)
-            tk.Label(edit_win, text="押下時間(秒):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=5)
-            entry_duration = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, str(cmd.get("duration", 1)))
-            entry_duration.grid(row=1, column=1, padx=5, pady=5)
-        elif cmd["command"] == "wait":
-            tk.Label(edit_win, text="待機時間(秒):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_duration = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, str(cmd["duration"]))
-            entry_duration.grid(row=0, column=1, padx=5, pady=5)
-        elif cmd["command"] == "mouse_click":
-            tk.Label(edit_win, text="X:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_x = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_x.insert(0, str(cmd["x"]))
-            entry_x.grid(row=0, column=1, padx=5, pady=5)
-            tk.Label(edit_win, text="Y:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=5)
-            entry_y = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_y.insert(0, str(cmd["y"]))
-            entry_y.grid(row=0, column=3, padx=5, pady=5)
-            tk.Label(edit_win, text="ボタン:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=4, padx=5, pady=5)
-            var_button = tk.StringVar(value=cmd["button"])
-            option_button = tk.OptionMenu(edit_win, var_button, "left", "right", "middle")
-            option_button.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
-            option_button["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
-            option_button.grid(row=0, column=5, padx=5, pady=5)
-            def record_mouse_edit():
-                record_button_edit.config(text="左クリックしてマウス位置記録完了", state=tk.DISABLED)
-                def on_click(x, y, button, pressed):
-                    if button == mouse.Button.left and pressed:
-                        entry_x.delete(0, tk.END)
-                        entry_x.insert(0, str(int(x)))
-                        entry_y.delete(0, tk.END)
-                        entry_y.insert(0, str(int(y)))
-                        edit_win.after(0, lambda: self.log(f"修正ウィンドウでマウス位置記録完了: ({int(x)}, {int(y)})"))
-                        record_button_edit.config(text="マウス位置記録", state=tk.NORMAL)
-                        return False
-                listener = mouse.Listener(on_click=on_click)
-                listener.start()
-            record_button_edit = tk.Button(edit_win, text="マウス位置記録", command=record_mouse_edit,
-                                           bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
-                                           activebackground=BUTTON_ACTIVE_BG)
-            record_button_edit.grid(row=1, column=0, columnspan=6, padx=5, pady=5, sticky="w")
-        elif cmd["command"] == "mouse_hold":
-            # 1行目: X, Y, ボタン
-            tk.Label(edit_win, text="X:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_x = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_x.insert(0, str(cmd["x"]))
-            entry_x.grid(row=0, column=1, padx=5, pady=5)
-            tk.Label(edit_win, text="Y:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=5)
-            entry_y = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_y.insert(0, str(cmd["y"]))
-            entry_y.grid(row=0, column=3, padx=5, pady=5)
-            tk.Label(edit_win, text="ボタン:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=4, padx=5, pady=5)
-            var_button = tk.StringVar(value=cmd["button"])
-            option_button = tk.OptionMenu(edit_win, var_button, "left", "right", "middle")
-            option_button.config(bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT)
-            option_button["menu"].config(bg=ENTRY_BG, fg=ENTRY_FG, font=FONT)
-            option_button.grid(row=0, column=5, padx=5, pady=5)
-            tk.Label(edit_win, text="押下時間(秒):", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=1, column=0, padx=5, pady=5)
-            entry_duration = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_duration.insert(0, str(cmd.get("duration", 1)))
-            entry_duration.grid(row=1, column=1, padx=5, pady=5)
-            def record_mouse_edit():
-                record_button_edit.config(text="左クリックしてマウス位置記録完了", state=tk.DISABLED)
-                def on_click(x, y, button, pressed):
-                    if button == mouse.Button.left and pressed:
-                        entry_x.delete(0, tk.END)
-                        entry_x.insert(0, str(int(x)))
-                        entry_y.delete(0, tk.END)
-                        entry_y.insert(0, str(int(y)))
-                        edit_win.after(0, lambda: self.log(f"修正ウィンドウでマウス位置記録完了: ({int(x)}, {int(y)})"))
-                        record_button_edit.config(text="マウス位置記録", state=tk.NORMAL)
-                        return False
-                listener = mouse.Listener(on_click=on_click)
-                listener.start()
-            record_button_edit = tk.Button(edit_win, text="マウス位置記録", command=record_mouse_edit,
-                                           bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT,
-                                           activebackground=BUTTON_ACTIVE_BG)
-            record_button_edit.grid(row=1, column=2, columnspan=4, padx=5, pady=5, sticky="w")
-        elif cmd["command"] == "mouse_scroll":
-            tk.Label(edit_win, text="水平スクロール:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=0, padx=5, pady=5)
-            entry_dx = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_dx.insert(0, str(cmd["dx"]))
-            entry_dx.grid(row=0, column=1, padx=5, pady=5)
-            tk.Label(edit_win, text="垂直スクロール:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
-                .grid(row=0, column=2, padx=5, pady=5)
-            entry_dy = tk.Entry(edit_win, width=10, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
-            entry_dy.insert(0, str(cmd["dy"]))
-            entry_dy.grid(row=0, column=3, padx=5, pady=5)
+        entries = self.build_command_fields(edit_win, opcode, cmd, 5)
+        tk.Label(edit_win, text="トラック:", bg=LABEL_BG, fg=LABEL_FG, font=FONT)\
+            .grid(row=9, column=0, padx=5, pady=5)
+        entry_track = tk.Entry(edit_win, width=5, bg=ENTRY_BG, fg=ENTRY_FG, font=FONT, relief=tk.FLAT)
+        entry_track.insert(0, str(cmd.get("track", 0)))
+        entry_track.grid(row=9, column=1, padx=5, pady=5)
         tk.Button(edit_win, text="保存", command=save_changes,
                   bg=BUTTON_BG, fg=BUTTON_FG, font=FONT, relief=tk.FLAT, activebackground=BUTTON_ACTIVE_BG)\
             .grid(row=10, column=0, padx=5, pady=10)
@@ -970,6 +3147,7 @@ class ManualMacroGUI(tk.Tk):
                 if self.drop_index > self.drag_original_index:
                     self.drop_index -= 1
                 self.commands.insert(self.drop_index, cmd)
+                self.compiled_tracks = None
                 self.listbox.delete(0, tk.END)
                 for c in self.commands:
                     self.listbox.insert(tk.END, self.get_display_text(c))
@@ -998,7 +3176,278 @@ class ManualMacroGUI(tk.Tk):
                                          height=2, highlightthickness=0, bd=0, bg="red")
         self.drop_indicator.place(x=0, y=y)
 
+# 編集フォームの検証関数: values はフィールドキーごとの入力テキスト
+def parse_key(values):
+    if not values["key"]:
+        raise ValueError("キー値を入力してください。")
+    return values["key"]
+
+def parse_position(values, names=("x", "y")):
+    try:
+        return {name: int(values[name]) for name in names}
+    except ValueError:
+        raise ValueError("有効な整数のX, Y値を入力してください。") from None
+
+def parse_duration(values, message, minimum=None):
+    try:
+        duration = float(values["duration"])
+        if minimum is not None and duration < minimum:
+            raise ValueError
+    except ValueError:
+        raise ValueError(message) from None
+    return duration
+
+def parse_template(values):
+    # テンプレートは入力したサイズで取得されている必要がある
+    try:
+        width = int(values["width"])
+        height = int(values["height"])
+        if len(base64.b64decode(values["template"])) != width * height * 3:
+            raise ValueError
+    except ValueError:
+        raise ValueError("先にテンプレートを取得してください。") from None
+    return {"width": width, "height": height, "template": values["template"]}
+
+def parse_key_tap(values):
+    key = parse_key(values)
+    try:
+        repeat = int(values["repeat"])
+    except ValueError:
+        raise ValueError("有効な繰り返し回数を入力してください。") from None
+    return {"key": key, "repeat": repeat}
+
+def parse_type_text(values):
+    if not values["text"]:
+        raise ValueError("入力するテキストを入力してください。")
+    try:
+        cps = float(values["cps"])
+        if cps < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("有効な入力速度を入力してください。") from None
+    return {"text": values["text"], "cps": int(cps) if cps.is_integer() else cps}
+
+def preview_text(text):
+    return repr(text[:30]) + ("..." if len(text) > 30 else "")
+
+def parse_paste_text(values):
+    if not values["text"]:
+        raise ValueError("貼り付けるテキストを入力してください。")
+    return {"text": values["text"]}
+
+def format_type_text(cmd):
+    preview = preview_text(cmd.get("text", ""))
+    cps = cmd.get("cps", TYPE_RATE)
+    return f"テキスト入力: {preview} ({cps} 文字/秒)" if cps else f"テキスト入力: {preview} (無制限)"
+
+def estimate_type_text(cmd):
+    cps = cmd.get("cps", TYPE_RATE)
+    return (len(cmd.get("text", "")) / cps if cps else 0), 0
+
+def parse_key_chord(values):
+    keys = [key.strip() for key in values["keys"].split("+")]
+    if not all(keys):
+        raise ValueError("ctrl+shift+s のようなキーの組み合わせを入力してください。")
+    return {"keys": "+".join(keys)}
+
+def parse_mouse_scroll(values):
+    try:
+        return {"dx": int(values["dx"]), "dy": int(values["dy"])}
+    except ValueError:
+        raise ValueError("有効なスクロール値を入力してください。") from None
+
+def parse_wait_image(values):
+    cmd = {**parse_position(values), **parse_template(values)}
+    try:
+        cmd["tolerance"] = int(values["tolerance"])
+        cmd["poll_interval"] = float(values["poll_interval"])
+        cmd["timeout"] = float(values["timeout"])
+        if not 0 <= cmd["tolerance"] <= 255 or cmd["poll_interval"] <= 0 or cmd["timeout"] < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("0〜255 の許容差、正のポーリング間隔、タイムアウトを入力してください。") from None
+    return cmd
+
+def parse_click_image(values):
+    cmd = {**parse_position(values), **parse_template(values)}
+    try:
+        for name in ("search_x", "search_y", "search_width", "search_height"):
+            cmd[name] = int(values[name])
+        cmd["threshold"] = float(values["threshold"])
+        if not 0 < cmd["threshold"] <= 1 or cmd["search_width"] < 0 or cmd["search_height"] < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("0〜1 のしきい値と有効な探索範囲を入力してください。") from None
+    cmd["button"] = values["button"]
+    return cmd
+
+def parse_loop_start(values):
+    try:
+        count = int(values["count"])
+        if count < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError("有効な繰り返し回数を入力してください。") from None
+    return {"count": count}
+
+def parse_if_pixel(values):
+    cmd = parse_position(values)
+    try:
+        parse_color(values["color"])
+        cmd["color"] = "#" + values["color"].lstrip("#").lower()
+        cmd["tolerance"] = int(values["tolerance"])
+        if not 0 <= cmd["tolerance"] <= 255:
+            raise ValueError
+    except ValueError:
+        raise ValueError("#rrggbb 形式の色と 0〜255 の許容差を入力してください。") from None
+    return cmd
+
+def parse_variable(values):
+    # 変数条件と変数設定
+    if not values["name"]:
+        raise ValueError("変数名を入力してください。")
+    try:
+        value = float(values["value"])
+    except ValueError:
+        raise ValueError("数値を入力してください。") from None
+    return {"name": values["name"], "op": values["op"], "value": int(value) if value.is_integer() else value}
+
+def parse_label(values, key):
+    if not values[key]:
+        raise ValueError("ラベル名を入力してください。")
+    return {key: values[key]}
+
+def parse_call(values):
+    if not values["file"]:
+        raise ValueError("マクロファイルを選択してください。")
+    return {"file": values["file"]}
+
+def resolve_image_click(cmd):
+    if np is None:
+        return None
+    return (resolve_button(cmd["button"]), TemplateMatcher(decode_template(cmd), cmd["x"], cmd["y"]))
+
+X_FIELD = ("x", "X:", "")
+Y_FIELD = ("y", "Y:", "")
+BUTTON_FIELD = ("button", "ボタン:", "left", tuple(MOUSE_BUTTONS))
+EASING_FIELD = ("easing", "イージング:", "ease-in-out", tuple(EASINGS))
+MOVE_DURATION_FIELD = ("duration", "時間 (秒):", "0.5")
+HOLD_DURATION_FIELD = ("duration", "押下時間(秒):", "1")
+
+# 組み込みのコマンド種類（コマンド種類メニューの順）。プラグインはその後ろに追加される
+for opcode in [
+    Opcode("key_tap", "キータップ", [("key", "キー:", ""), ("repeat", "繰り返し回数:", "1")], parse_key_tap,
+           lambda cmd: f"キータップ: {cmd.get('key', '')} x {cmd.get('repeat', 1)}回",
+           ManualMacroGUI.execute_key_tap, resolve=lambda cmd: resolve_key(cmd["key"]),
+           estimate=lambda cmd: (cmd.get("repeat", 1) * KEY_TAP_GAP, cmd.get("repeat", 1) * KEY_TAP_GAP)),
+    Opcode("wait", "待機", [("duration", "待機時間(秒):", "")],
+           lambda values: {"duration": parse_duration(values, "有効な待機時間を入力してください。")},
+           lambda cmd: f"待機: {cmd.get('duration', 0)}秒",
+           ManualMacroGUI.execute_wait, estimate=estimate_duration),
+    Opcode("mouse_click", "マウスクリック", [X_FIELD, Y_FIELD, BUTTON_FIELD],
+           lambda values: {**parse_position(values), "button": values["button"]},
+           lambda cmd: f"マウスクリック: ({cmd.get('x', 0)}, {cmd.get('y', 0)}), ボタン: {cmd.get('button', '')}",
+           ManualMacroGUI.execute_mouse_click, resolve=lambda cmd: resolve_button(cmd["button"])),
+    Opcode("key_hold", "キー押下", [("key", "キー:", ""), HOLD_DURATION_FIELD],
+           lambda values: {"key": parse_key(values), "duration": parse_duration(values, "有効な押下時間を入力してください。")},
+           lambda cmd: f"キー押下: {cmd.get('key', '')} (押下時間: {cmd.get('duration', 0)}秒)",
+           ManualMacroGUI.execute_key_hold, resolve=lambda cmd: resolve_key(cmd["key"]), estimate=estimate_duration),
+    Opcode("mouse_hold", "マウス押下", [X_FIELD, Y_FIELD, BUTTON_FIELD, HOLD_DURATION_FIELD],
+           lambda values: {**parse_position(values), "button": values["button"],
+                           "duration": parse_duration(values, "有効な押下時間を入力してください。")},
+           lambda cmd: f"マウス押下: ({cmd.get('x', 0)}, {cmd.get('y', 0)}), ボタン: {cmd.get('button', '')} (押下時間: {cmd.get('duration', 0)}秒)",
+           ManualMacroGUI.execute_mouse_hold, resolve=lambda cmd: resolve_button(cmd["button"]), estimate=estimate_duration),
+    Opcode("mouse_scroll", "マウススクロール", [("dx", "水平スクロール:", "0"), ("dy", "垂直スクロール:", "0")], parse_mouse_scroll,
+           lambda cmd: f"マウススクロール: 水平 {cmd.get('dx',0)}, 垂直 {cmd.get('dy',0)}",
+           ManualMacroGUI.execute_mouse_scroll),
+    Opcode("mouse_move", "マウス移動", [X_FIELD, Y_FIELD, MOVE_DURATION_FIELD, EASING_FIELD],
+           lambda values: {**parse_position(values), "duration": parse_duration(values, "有効な移動時間を入力してください。", 0),
+                           "easing": values["easing"]},
+           lambda cmd: f"マウス移動: ({cmd.get('x', 0)}, {cmd.get('y', 0)}) (時間: {cmd.get('duration', 0)}秒, {cmd.get('easing', 'ease-in-out')})",
+           ManualMacroGUI.execute_mouse_move, estimate=estimate_duration),
+    Opcode("mouse_drag", "マウスドラッグ",
+           [("x", "開始 X:", ""), ("y", "開始 Y:", ""), ("to_x", "終了 X:", ""), ("to_y", "終了 Y:", ""),
+            MOVE_DURATION_FIELD, EASING_FIELD, BUTTON_FIELD],
+           lambda values: {**parse_position(values, ("x", "y", "to_x", "to_y")),
+                           "duration": parse_duration(values, "有効な移動時間を入力してください。", 0),
+                           "easing": values["easing"], "button": values["button"]},
+           lambda cmd: f"マウスドラッグ: ({cmd.get('x', 0)}, {cmd.get('y', 0)}) -> ({cmd.get('to_x', 0)}, {cmd.get('to_y', 0)}), ボタン: {cmd.get('button', '')} (時間: {cmd.get('duration', 0)}秒, {cmd.get('easing', 'ease-in-out')})",
+           ManualMacroGUI.execute_mouse_drag, resolve=lambda cmd: resolve_button(cmd["button"]), estimate=estimate_duration),
+    Opcode("wait_image", "画像待機",
+           [X_FIELD, Y_FIELD, ("width", "幅:", "1"), ("height", "高さ:", "1"), ("tolerance", "許容差:", "0"),
+            ("poll_interval", "ポーリング間隔(秒):", str(IMAGE_POLL_INTERVAL)), ("timeout", "タイムアウト(秒, 0 = なし):", "0")],
+           parse_wait_image,
+           lambda cmd: f"画像待機: ({cmd.get('x', 0)}, {cmd.get('y', 0)}) {cmd.get('width', 0)}x{cmd.get('height', 0)}, 許容差: {cmd.get('tolerance', 0)}",
+           ManualMacroGUI.execute_wait_image, resolve=lambda cmd: decode_template(cmd) if np is not None else None,
+           estimate=lambda cmd: None),
+    Opcode("click_image", "画像クリック",
+           [X_FIELD, Y_FIELD, ("width", "幅:", ""), ("height", "高さ:", ""),
+            ("search_x", "探索 X:", "0"), ("search_y", "探索 Y:", "0"),
+            ("search_width", "探索幅:", "0"), ("search_height", "探索高さ:", "0"),
+            ("threshold", "しきい値 (0-1):", str(MATCH_THRESHOLD)), BUTTON_FIELD],
+           parse_click_image,
+           lambda cmd: f"画像クリック: {cmd.get('width', 0)}x{cmd.get('height', 0)}, しきい値: {cmd.get('threshold', MATCH_THRESHOLD)}, ボタン: {cmd.get('button', '')}",
+           ManualMacroGUI.execute_click_image, resolve=resolve_image_click, estimate=lambda cmd: None),
+    Opcode("type_text", "テキスト入力", [("text", "テキスト:", ""), ("cps", "1 秒あたりの文字数 (0 = 無制限):", str(TYPE_RATE))],
+           parse_type_text, format_type_text,
+           ManualMacroGUI.execute_type_text, resolve=lambda cmd: [resolve_character(char) for char in cmd["text"]],
+           estimate=estimate_type_text),
+    Opcode("paste_text", "テキスト貼り付け", [("text", "テキスト:", "")], parse_paste_text,
+           lambda cmd: f"テキスト貼り付け: {preview_text(cmd.get('text', ''))} ({len(cmd.get('text', ''))} 文字)",
+           ManualMacroGUI.execute_paste_text, resolve=lambda cmd: keyboard.KeyCode.from_char("v")),
+    Opcode("key_chord", "キーの組み合わせ", [("keys", "キー (例: ctrl+shift+s):", "")], parse_key_chord,
+           lambda cmd: f"キーの組み合わせ: {cmd.get('keys', '')}",
+           ManualMacroGUI.execute_key_chord, resolve=lambda cmd: [resolve_key(key) for key in cmd["keys"].split("+")]),
+    # 制御フロー。interpret_code 自身が実行する
+    Opcode("loop_start", "ループ開始", [("count", "回数 (0 = 無限):", "2")], parse_loop_start,
+           lambda cmd: f"ループ開始: {cmd.get('count', 0)} 回" if cmd.get("count", 0) else "ループ開始: 無限"),
+    Opcode("loop_end", "ループ終了", [], lambda values: {}, lambda cmd: "ループ終了"),
+    Opcode("if_pixel", "ピクセル条件",
+           [X_FIELD, Y_FIELD, ("color", "色 (#rrggbb):", "#000000"), ("tolerance", "許容差:", "0")], parse_if_pixel,
+           lambda cmd: f"ピクセル ({cmd.get('x', 0)}, {cmd.get('y', 0)}) が {cmd.get('color', '')} なら, 許容差: {cmd.get('tolerance', 0)}",
+           resolve=lambda cmd: np.array([[parse_color(cmd["color"])]], dtype=np.int16) if np is not None else None),
+    Opcode("if_variable", "変数条件",
+           [("name", "変数:", ""), ("op", "演算子:", "==", tuple(COMPARISONS)), ("value", "値:", "0")], parse_variable,
+           lambda cmd: f"条件: {cmd.get('name', '')} {cmd.get('op', '==')} {cmd.get('value', 0)}"),
+    Opcode("else", "それ以外", [], lambda values: {}, lambda cmd: "それ以外"),
+    Opcode("end_if", "条件終了", [], lambda values: {}, lambda cmd: "条件終了"),
+    Opcode("set_variable", "変数設定",
+           [("name", "変数:", ""), ("op", "演算子:", "=", tuple(ASSIGNMENTS)), ("value", "値:", "0")], parse_variable,
+           lambda cmd: f"変数設定: {cmd.get('name', '')} {cmd.get('op', '=')} {cmd.get('value', 0)}"),
+    Opcode("label", "ラベル", [("name", "名前:", "")], lambda values: parse_label(values, "name"),
+           lambda cmd: f"ラベル: {cmd.get('name', '')}"),
+    Opcode("goto", "ジャンプ", [("label", "ラベル:", "")], lambda values: parse_label(values, "label"),
+           lambda cmd: f"ジャンプ: {cmd.get('label', '')}"),
+    Opcode("call", "マクロ呼び出し", [("file", "マクロファイル:", "")], parse_call,
+           lambda cmd: f"マクロ呼び出し: {cmd.get('file', '')}"),
+    Opcode("return", "リターン", [], lambda values: {}, lambda cmd: "リターン"),
+]:
+    register_command(opcode)
+OP_LOOP_START = OPCODE_NUMBERS["loop_start"]
+OP_LOOP_END = OPCODE_NUMBERS["loop_end"]
+OP_IF_PIXEL = OPCODE_NUMBERS["if_pixel"]
+OP_IF_VARIABLE = OPCODE_NUMBERS["if_variable"]
+OP_ELSE = OPCODE_NUMBERS["else"]
+OP_SET_VARIABLE = OPCODE_NUMBERS["set_variable"]
+OP_GOTO = OPCODE_NUMBERS["goto"]
+OP_CALL = OPCODE_NUMBERS["call"]
+OP_RETURN = OPCODE_NUMBERS["return"]
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--analyze", metavar="MACRO_FILE", help="print the expected run time of a macro file and exit")
+    parser.add_argument("--loops", type=int, default=1, help="loop count of the main track for --analyze, 0 = forever (default: 1)")
+    args = parser.parse_args()
+    if args.analyze:
+        # プラグインのメッセージは stderr に出し、レポートだけをリダイレクトできるようにする
+        load_plugins(lambda message: print(message, file=sys.stderr))
+        try:
+            commands, track_loops = read_macro_commands(args.analyze)
+        except (OSError, ValueError) as e:
+            sys.exit(f"マクロの読み込みに失敗しました: {e}")
+        estimates = analyze_commands(commands, os.path.dirname(os.path.abspath(args.analyze)))
+        print("\n".join(describe_estimates(estimates, "1x", args.loops, track_loops)))
+        return
     app = ManualMacroGUI()
     app.mainloop()
 